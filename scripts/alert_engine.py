@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+"""
+价格告警引擎
+常驻进程（broker / alerts watch）中逐笔评估告警规则，取代 Agent 循环调用 ./ibkr quote（每次轮询都要完整连接网关）：
+  • 规则来源：Watchlist 的 target_buy / target_sell（自动生成）+ ~/.ibkr_alerts.json 中的自定义规则
+  • 指标：price 最新价 / pct 相对昨收涨跌幅 / rsi 日线 RSI14 / score 技术评分（-100~+100）
+  • 每个 (代码, 指标) 一个阈值索引：above / below 两个有序数组，每笔推送用 bisect 找出被穿越的阈值，O(log n + 命中数)
+  • rsi / score 由增量指标状态（indicator_state.py）维护：日线预热，盘中以最新价作为当日未收盘 K 线估算，
+    RSI 逐笔 O(1) 估算，技术评分按间隔重算
+  • 边沿触发：指标穿越阈值时才告警；同一阈值上的多条规则合并为一条告警，同一规则冷却期内不重复
+  • 告警逐行追加到 ~/trading/alerts/alerts.jsonl（每行一个 JSON），`alerts log` 查看，也可由任意程序 tail 消费
+规则文件 / Watchlist 变化后自动重新加载。
+
+用法:
+    python ibkr_cli.py alerts add AAPL price below 180
+    python ibkr_cli.py alerts add NVDA pct above 5
+    python ibkr_cli.py alerts add TSLA rsi below 30 --cooldown 240
+    python ibkr_cli.py alerts add MSFT score above 40 --note "趋势转强"
+    python ibkr_cli.py alerts [list|remove ID|log|status|watch]
+    python alert_engine.py bench      # 阈值索引评估耗时基准（离线）
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+ALERTS_FILE = os.path.join(os.path.expanduser("~"), ".ibkr_alerts.json")
+ALERT_DIR = os.path.join(os.path.expanduser("~"), "trading", "alerts")
+ALERT_LOG = os.path.join(ALERT_DIR, "alerts.jsonl")
+# 告警日志超过该大小时轮转为 alerts.jsonl.1（只保留一份）
+ALERT_LOG_MAX_BYTES = 5 * 1024 * 1024
+
+METRICS = {
+    "price": "最新价",
+    "pct": "涨跌幅%",
+    "rsi": "RSI14",
+    "score": "技术评分",
+}
+# 需要日线增量指标的指标
+INDICATOR_METRICS = ("rsi", "score")
+OPS = ("above", "below")
+
+DEFAULT_COOLDOWN_MIN = 30.0
+# 技术评分的盘中重算间隔（RSI 逐笔估算）
+SCORE_EVAL_SEC = 60.0
+# 规则文件 / Watchlist 变更检查间隔
+RULE_CHECK_SEC = 5.0
+# 指标预热的日线窗口（SMA250 需要约一年）
+WARM_DURATION = "1 Y"
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class AlertRule:
+    id: str
+    symbol: str
+    metric: str                     # price / pct / rsi / score
+    op: str                         # above: 指标升至 ≥ value；below: 指标降至 ≤ value
+    value: float
+    cooldown_min: float = DEFAULT_COOLDOWN_MIN
+    note: str = ""
+    source: str = "custom"          # custom / watchlist
+
+    def describe(self) -> str:
+        sign = "≥" if self.op == "above" else "≤"
+        return f"{self.symbol} {METRICS[self.metric]} {sign} {self.value:g}"
+
+
+@dataclass
+class Alert:
+    ts: float
+    time: str
+    symbol: str
+    metric: str
+    op: str
+    threshold: float
+    value: float                    # 触发时的指标值
+    price: float                    # 触发时的最新价
+    rule_ids: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class EngineStats:
+    rules: int
+    symbols: int
+    thresholds: int
+    ticks: int
+    alerts: int
+    suppressed: int                 # 冷却期内被合并掉的穿越
+    indicator_symbols: int
+    unstreamed: List[str]           # 有规则但未能建立流式订阅（超出行情线）的代码
+    last_alert_age_sec: Optional[float]
+
+
+# ─── 规则存储 ─────────────────────────────────────────────────
+
+def load_alert_rules() -> List[AlertRule]:
+    """加载自定义告警规则"""
+    if not os.path.exists(ALERTS_FILE):
+        return []
+    try:
+        with open(ALERTS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return [AlertRule(**item) for item in data.get("rules", [])]
+    except (json.JSONDecodeError, IOError, TypeError):
+        return []
+
+
+@contextmanager
+def _rules_locked():
+    """规则文件的读-改-写锁（ALERTS_FILE.lock 上的 flock），batch / serve 的并发线程与多个进程之间互斥"""
+    import fcntl
+
+    fd = os.open(ALERTS_FILE + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def save_alert_rules(rules: List[AlertRule]):
+    """保存自定义告警规则：先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+    data = {"rules": [asdict(r) for r in rules], "updated": datetime.now().isoformat()}
+    tmp = f"{ALERTS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, ALERTS_FILE)
+
+
+def add_alert_rule(symbol: str, metric: str, op: str, value: float,
+                   cooldown_min: float = DEFAULT_COOLDOWN_MIN, note: str = "") -> AlertRule:
+    """添加一条自定义规则；指标或方向不合法时抛出 ValueError"""
+    if metric not in METRICS:
+        raise ValueError(f"未知指标: {metric}（可用: {', '.join(METRICS)}）")
+    if op not in OPS:
+        raise ValueError(f"未知方向: {op}（可用: above, below）")
+    with _rules_locked():
+        rules = load_alert_rules()
+        next_id = max((int(r.id[1:]) for r in rules if r.id[1:].isdigit()), default=0) + 1
+        rule = AlertRule(id=f"a{next_id}", symbol=symbol.upper(), metric=metric, op=op, value=float(value),
+                         cooldown_min=float(cooldown_min), note=note)
+        rules.append(rule)
+        save_alert_rules(rules)
+    return rule
+
+
+def remove_alert_rule(rule_id: str) -> bool:
+    """删除一条自定义规则（Watchlist 规则请通过 watchlist 命令修改目标价）"""
+    with _rules_locked():
+        rules = load_alert_rules()
+        kept = [r for r in rules if r.id != rule_id]
+        if len(kept) == len(rules):
+            return False
+        save_alert_rules(kept)
+    return True
+
+
+def watchlist_rules() -> List[AlertRule]:
+    """Watchlist 目标价对应的规则：跌至 target_buy / 涨至 target_sell"""
+    from scanner_enhanced import load_watchlist
+
+    rules = []
+    for item in load_watchlist().get("items", []):
+        symbol = item["symbol"].upper()
+        if item.get("target_buy"):
+            rules.append(AlertRule(id=f"wl:{symbol}:buy", symbol=symbol, metric="price", op="below",
+                                   value=float(item["target_buy"]), note="Watchlist 目标买入价",
+                                   source="watchlist"))
+        if item.get("target_sell"):
+            rules.append(AlertRule(id=f"wl:{symbol}:sell", symbol=symbol, metric="price", op="above",
+                                   value=float(item["target_sell"]), note="Watchlist 目标卖出价",
+                                   source="watchlist"))
+    return rules
+
+
+def all_rules() -> List[AlertRule]:
+    return watchlist_rules() + load_alert_rules()
+
+
+# ─── 告警日志 ─────────────────────────────────────────────────
+
+class AlertLog:
+    """JSONL 告警队列：逐行追加并立即 flush，超过大小上限时轮转"""
+
+    def __init__(self, path: str = ALERT_LOG, max_bytes: int = ALERT_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def append(self, alert: Alert):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(alert), ensure_ascii=False) + "\n")
+
+    def read(self, since: float = 0.0, limit: Optional[int] = None) -> List[Alert]:
+        """按时间顺序返回 ts > since 的告警（limit 取最新的若干条）"""
+        alerts = []
+        for path in (self.path + ".1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        alert = Alert(**json.loads(line))
+                    except (ValueError, TypeError):
+                        continue  # 写入中途被截断的行
+                    if alert.ts > since:
+                        alerts.append(alert)
+        return alerts[-limit:] if limit else alerts
+
+
+# ─── 阈值索引 ─────────────────────────────────────────────────
+
+class ThresholdIndex:
+    """
+    单个 (代码, 指标) 的阈值索引：above / below 各一个升序阈值数组，同一阈值上的规则挂在同一项下。
+    指标从 prev 变为 value 时，被穿越的阈值是 above 中 (prev, value] 与 below 中 [value, prev) 的区间，
+    两次 bisect 即可定位；prev 未知（首笔推送）时视为所有已满足的条件都刚刚触发。
+    """
+
+    __slots__ = ("above", "above_rules", "below", "below_rules", "prev")
+
+    def __init__(self, rules: Iterable[AlertRule], prev: Optional[float] = None):
+        groups: Dict[Tuple[str, float], List[AlertRule]] = {}
+        for rule in rules:
+            groups.setdefault((rule.op, rule.value), []).append(rule)
+        above = sorted(v for op, v in groups if op == "above")
+        below = sorted(v for op, v in groups if op == "below")
+        self.above = above
+        self.above_rules = [groups[("above", v)] for v in above]
+        self.below = below
+        self.below_rules = [groups[("below", v)] for v in below]
+        self.prev = prev
+
+    def __len__(self) -> int:
+        return len(self.above) + len(self.below)
+
+    def crossed(self, value: float) -> List[Tuple[str, float, List[AlertRule]]]:
+        """更新指标值，返回被穿越的 (方向, 阈值, 规则)"""
+        prev, self.prev = self.prev, value
+        hits = []
+        if self.above:
+            lo = 0 if prev is None else bisect_right(self.above, prev)
+            for i in range(lo, bisect_right(self.above, value)):
+                hits.append(("above", self.above[i], self.above_rules[i]))
+        if self.below:
+            hi = len(self.below) if prev is None else bisect_left(self.below, prev)
+            for i in range(bisect_left(self.below, value), hi):
+                hits.append(("below", self.below[i], self.below_rules[i]))
+        return hits
+
+
+# ─── 增量指标 ─────────────────────────────────────────────────
+
+def _trading_day() -> str:
+    """美东交易日（日线 K 线的日期口径）"""
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo("America/New_York")).strftime("%Y-%m-%d")
+    except Exception:
+        return datetime.now().strftime("%Y-%m-%d")
+
+
+class IndicatorFeed:
+    """单只标的：已收盘日线的增量指标状态 + 由逐笔价格维护的当日未收盘 K 线"""
+
+    def __init__(self, symbol: str, bars: List[dict], today: str):
+        from indicator_state import IndicatorState
+
+        self.state = IndicatorState(symbol=symbol)
+        self.day = today
+        self.bar: Optional[dict] = None
+        for bar in bars:
+            if bar["date"][:10].replace("-", "") == today.replace("-", ""):
+                self.bar = dict(bar)  # 历史数据中已包含今天的盘中 K 线
+            else:
+                self.state.update(bar)
+        self.score: Optional[float] = None
+        self.score_at = 0.0
+
+    def on_price(self, price: float, volume: float, today: str):
+        if today != self.day:
+            # 跨日：前一日 K 线收盘并入状态（无成交量的视为盘前报价，不计入）
+            if self.bar is not None and self.bar.get("volume"):
+                self.state.update(self.bar)
+            self.day, self.bar, self.score_at = today, None, 0.0
+        if self.bar is None:
+            self.bar = {"open": price, "high": price, "low": price, "close": price, "volume": volume}
+        else:
+            self.bar["close"] = price
+            self.bar["high"] = max(self.bar["high"], price)
+            self.bar["low"] = min(self.bar["low"], price)
+            self.bar["volume"] = max(self.bar.get("volume") or 0, volume)
+
+    def rsi(self, price: float) -> Optional[float]:
+        r = self.state.rsi.peek(price)
+        return r.rsi_14 if r.signal else None
+
+    def technical_score(self, now: float) -> Optional[float]:
+        """当日 K 线按最新价估算后的技术评分（拷贝状态推进一根，SCORE_EVAL_SEC 内复用上次结果）"""
+        if now - self.score_at >= SCORE_EVAL_SEC:
+            state = self.state
+            if self.bar is not None:
+                state = copy.deepcopy(self.state)
+                state.update(self.bar)
+            summary = state.summary()
+            self.score = summary.score if summary else None
+            self.score_at = now
+        return self.score
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+class AlertEngine:
+    """
+    告警引擎：on_tick 逐笔评估；bind() 后挂在 QuoteStream 上，由流式行情推送驱动。
+    与 QuoteStream 相同，所有方法都在 ib_async 事件循环所在的线程调用。
+    """
+
+    def __init__(self, log: Optional[AlertLog] = None, verbose: bool = True):
+        self.log = log or AlertLog()
+        self.verbose = verbose
+        self.client = None
+        self.rules: Dict[str, AlertRule] = {}
+        self.index: Dict[Tuple[str, str], ThresholdIndex] = {}
+        self.by_symbol: Dict[str, List[Tuple[str, ThresholdIndex]]] = {}
+        self.feeds: Dict[str, IndicatorFeed] = {}
+        self.last_fired: Dict[str, float] = {}
+        self._mtimes: Tuple = ()
+        self._checked_at = 0.0
+        self._unstreamed: List[str] = []
+        self.ticks = 0
+        self.alerts = 0
+        self.suppressed = 0
+        self.last_alert_at = 0.0
+        # 重启后沿用日志中的触发时间，冷却期内不重复告警
+        for alert in self.log.read(since=time.time() - 86400):
+            for rule_id in alert.rule_ids:
+                self.last_fired[rule_id] = alert.ts
+
+    # ─── 规则 ───
+
+    def load_rules(self, rules: List[AlertRule]):
+        """重建阈值索引；已有指标值沿用，新增且已满足条件的规则立即告警一次"""
+        old_rules = self.rules
+        prev = {key: idx.prev for key, idx in self.index.items()}
+        grouped: Dict[Tuple[str, str], List[AlertRule]] = {}
+        for rule in rules:
+            grouped.setdefault((rule.symbol, rule.metric), []).append(rule)
+
+        self.rules = {r.id: r for r in rules}
+        self.index = {key: ThresholdIndex(group, prev.get(key)) for key, group in grouped.items()}
+        self.by_symbol = {}
+        for (symbol, metric), idx in self.index.items():
+            self.by_symbol.setdefault(symbol, []).append((metric, idx))
+
+        for key, group in grouped.items():
+            value = prev.get(key)
+            fresh = [r for r in group if r.id not in old_rules or old_rules[r.id] != r]
+            if value is None or not fresh:
+                continue
+            for rule in fresh:
+                if (rule.op == "above" and value >= rule.value) or (rule.op == "below" and value <= rule.value):
+                    self._fire(rule.symbol, rule.metric, rule.op, rule.value, [rule], value, value, time.time())
+
+    def indicator_symbols(self) -> List[str]:
+        return sorted({symbol for symbol, metric in self.index if metric in INDICATOR_METRICS})
+
+    def warm(self, bars_by_symbol: Dict[str, List[dict]]):
+        """用日线历史预热 rsi / score 所需的增量指标"""
+        today = _trading_day()
+        for symbol, bars in bars_by_symbol.items():
+            if bars:
+                self.feeds[symbol] = IndicatorFeed(symbol, bars, today)
+
+    # ─── 评估 ───
+
+    def _metric_value(self, metric: str, symbol: str, price: float, close: float, now: float) -> Optional[float]:
+        if metric == "price":
+            return price
+        if metric == "pct":
+            return (price - close) / close * 100 if close > 0 else None
+        feed = self.feeds.get(symbol)
+        if feed is None:
+            return None
+        if metric == "rsi":
+            return feed.rsi(price)
+        return feed.technical_score(now)
+
+    def on_tick(self, symbol: str, last: float, close: float, volume: float = 0.0,
+                now: Optional[float] = None) -> List[Alert]:
+        """评估一笔行情，返回本次触发的告警"""
+        entries = self.by_symbol.get(symbol)
+        price = last or close
+        if not entries or price <= 0:
+            return []
+        now = now or time.time()
+        self.ticks += 1
+        feed = self.feeds.get(symbol)
+        if feed is not None:
+            feed.on_price(price, volume, _trading_day())
+
+        fired = []
+        for metric, idx in entries:
+            value = self._metric_value(metric, symbol, price, close, now)
+            if value is None:
+                continue
+            for op, threshold, rules in idx.crossed(value):
+                alert = self._fire(symbol, metric, op, threshold, rules, value, price, now)
+                if alert is not None:
+                    fired.append(alert)
+        return fired
+
+    def _fire(self, symbol: str, metric: str, op: str, threshold: float, rules: List[AlertRule],
+              value: float, price: float, now: float) -> Optional[Alert]:
+        active = [r for r in rules
+                  if r.id not in self.last_fired or now - self.last_fired[r.id] >= r.cooldown_min * 60]
+        if not active:
+            self.suppressed += 1
+            return None
+        for rule in active:
+            self.last_fired[rule.id] = now
+        alert = Alert(
+            ts=round(now, 3),
+            time=datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            symbol=symbol,
+            metric=metric,
+            op=op,
+            threshold=threshold,
+            value=round(value, 4),
+            price=price,
+            rule_ids=[r.id for r in active],
+            notes=[r.note for r in active if r.note],
+        )
+        self.log.append(alert)
+        self.alerts += 1
+        self.last_alert_at = now
+        if self.verbose:
+            print(f"[{datetime.now():%H:%M:%S}] {format_alert(alert)}")
+        return alert
+
+    # ─── 挂接流式行情 ───
+
+    def _on_quote(self, symbol, table, slot):
+        self.on_tick(symbol, table.last[slot], table.close[slot], table.volume[slot], table.updated[slot])
+
+    def bind(self, client):
+        """挂到已启用流式行情的客户端上：规则涉及的代码加入常驻订阅，推送逐笔进入 on_tick"""
+        self.client = client
+        client.quote_stream.listeners.append(self._on_quote)
+        self.reload()
+
+    def unbind(self):
+        if self.client is not None and self.client.quote_stream is not None:
+            stream = self.client.quote_stream
+            if self._on_quote in stream.listeners:
+                stream.listeners.remove(self._on_quote)
+            stream.pinned = set()
+        self.client = None
+
+    def _file_mtimes(self) -> Tuple:
+        from scanner_enhanced import WATCHLIST_FILE
+        return tuple(os.path.getmtime(p) if os.path.exists(p) else 0 for p in (ALERTS_FILE, WATCHLIST_FILE))
+
+    def reload(self):
+        """重新读取规则；新的 rsi / score 标的拉日线预热，规则涉及的代码同步为常驻订阅"""
+        self._mtimes = self._file_mtimes()
+        self.load_rules(all_rules())
+        if self.client is None:
+            return
+
+        need = [s for s in self.indicator_symbols() if s not in self.feeds]
+        if need:
+            try:
+                self.warm(self.client.get_historical_data_batch(need, WARM_DURATION, "1 day"))
+            except Exception as e:
+                print(f"⚠️ 告警指标预热失败: {e}")
+
+        stream = self.client.quote_stream
+        symbols = set(self.by_symbol)
+        if symbols != stream.pinned:
+            stream.pinned = symbols
+            stream.sync_core()
+        self._unstreamed = sorted(symbols - set(stream.table.slot_of))
+
+    def maybe_reload(self):
+        """空闲时调用：规则文件或 Watchlist 变化后重新加载"""
+        now = time.time()
+        if now - self._checked_at < RULE_CHECK_SEC:
+            return
+        self._checked_at = now
+        if self._file_mtimes() != self._mtimes:
+            self.reload()
+
+    def stats(self) -> EngineStats:
+        return EngineStats(
+            rules=len(self.rules),
+            symbols=len(self.by_symbol),
+            thresholds=sum(len(idx) for idx in self.index.values()),
+            ticks=self.ticks,
+            alerts=self.alerts,
+            suppressed=self.suppressed,
+            indicator_symbols=len(self.feeds),
+            unstreamed=self._unstreamed,
+            last_alert_age_sec=round(time.time() - self.last_alert_at, 1) if self.last_alert_at else None,
+        )
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_alert(alert: Alert) -> str:
+    sign = "≥" if alert.op == "above" else "≤"
+    icon = "📈" if alert.op == "above" else "📉"
+    line = (f"🔔 {icon} {alert.symbol} {METRICS[alert.metric]} {alert.value:g} {sign} {alert.threshold:g}"
+            f"  (价格 ${alert.price:.2f}，规则 {', '.join(alert.rule_ids)})")
+    if alert.notes:
+        line += f"  {'; '.join(alert.notes)}"
+    return line
+
+
+def format_rules(rules: List[AlertRule]) -> str:
+    if not rules:
+        return ("🔔 告警规则: 空\n"
+                "使用 alerts add AAPL price below 180 添加，或 watchlist add AAPL --buy 180 --sell 250")
+    lines = [f"🔔 告警规则 ({len(rules)} 条)", "=" * 60]
+    for r in rules:
+        extra = f"  冷却 {r.cooldown_min:g}min" if r.cooldown_min != DEFAULT_COOLDOWN_MIN else ""
+        note = f"  {r.note}" if r.note else ""
+        lines.append(f"  {r.id:16s} {r.describe()}{extra}{note}")
+    return "\n".join(lines)
+
+
+def format_alerts(alerts: List[Alert]) -> str:
+    if not alerts:
+        return f"🔔 暂无告警（{ALERT_LOG}）"
+    lines = [f"🔔 最近告警 ({len(alerts)} 条)", "=" * 60]
+    for a in alerts:
+        lines.append(f"  {a.time}  {format_alert(a)}")
+    return "\n".join(lines)
+
+
+def format_engine_stats(stats: dict) -> str:
+    text = (f"规则 {stats['rules']} 条 / {stats['symbols']} 个代码（阈值 {stats['thresholds']}）  "
+            f"评估 {stats['ticks']} 笔  告警 {stats['alerts']}  冷却合并 {stats['suppressed']}")
+    if stats.get("unstreamed"):
+        text += f"\n  ⚠️ 超出行情线未订阅: {', '.join(stats['unstreamed'])}"
+    return text
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _bench(symbols: int = 200, rules_per_symbol: int = 25, ticks: int = 200000):
+    import tempfile
+
+    rng = random.Random(7)
+    names = [f"S{i:03d}" for i in range(symbols)]
+    base = {s: rng.uniform(20, 500) for s in names}
+    rules = []
+    for s in names:
+        for j in range(rules_per_symbol):
+            metric = "price" if j % 2 else "pct"
+            value = base[s] * rng.uniform(0.9, 1.1) if metric == "price" else rng.uniform(-8, 8)
+            rules.append(AlertRule(id=f"r{len(rules)}", symbol=s, metric=metric, op=rng.choice(OPS),
+                                   value=round(value, 2), cooldown_min=0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = AlertEngine(AlertLog(os.path.join(tmp, "alerts.jsonl")), verbose=False)
+        engine.load_rules(rules)
+        prices = dict(base)
+        stream = []
+        for _ in range(ticks):
+            s = rng.choice(names)
+            prices[s] *= 1 + rng.gauss(0, 0.002)
+            stream.append((s, prices[s]))
+
+        t0 = time.perf_counter()
+        for s, p in stream:
+            engine.on_tick(s, p, base[s], now=1.0)
+        elapsed = time.perf_counter() - t0
+
+    print(f"🧪 {len(rules)} 条规则 / {symbols} 个代码，{ticks} 笔推送")
+    print(f"   索引评估: {elapsed / ticks * 1e6:8.2f} µs/笔（含触发 {engine.alerts} 条告警的写日志开销）")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if action == "bench":
+        _bench()
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+本地增量 K 线存储
+按 (conId, bar_size, whatToShow, useRTH) 把 OHLCV 以列式数组存入 ~/trading/cache/bars.db（SQLite）。
+每次请求只向网关补拉最后一根已存 K 线之后的尾部数据并合并，窗口内的历史直接本地读取，
+重复运行 analyze / portfolio / mtf / vix / sectors 时基本不再消耗 IBKR 历史数据配额。
+  • "N D" / "N W" 与网关一致按交易日计（N 个 / 5N 个交易时段），不按日历天截取；M / Y 按日历截取
+  • 全量请求直接返回网关给出的 K 线，不再按本地窗口二次截取
+  • 补拉的尾部与已存的已收盘 K 线价格不一致（拆股 / 分红复权改写了历史）时丢弃整条序列重新全量拉取
+
+用法:
+    python bar_store.py stats    # 查看已缓存序列
+    python bar_store.py clear    # 清空 K 线缓存
+
+设置 IBKR_NO_BAR_CACHE=1 可跳过本地存储，始终全量请求网关。
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contract_cache import CACHE_DIR
+from pacing import get_scheduler, historical_kind
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+BAR_DB = os.path.join(CACHE_DIR, "bars.db")
+
+BAR_CACHE_DISABLED = os.getenv("IBKR_NO_BAR_CACHE", "") == "1"
+
+# 补拉尾部与已存 K 线收盘价的相对偏差超过该值，视为历史被复权改写
+_ADJUST_TOL = 1e-4
+
+# 距上次补拉不足该秒数时直接读本地（日内 K 线要求更新鲜）
+_FRESH_SEC_INTRADAY = 60
+_FRESH_SEC_DAILY = 300
+
+_COLUMNS = ("ts", "open", "high", "low", "close", "volume")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bar_series (
+    key          TEXT PRIMARY KEY,
+    con_id       INTEGER NOT NULL,
+    symbol       TEXT NOT NULL,
+    bar_size     TEXT NOT NULL,
+    what_to_show TEXT NOT NULL,
+    use_rth      INTEGER NOT NULL,
+    covered_from REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    dates        TEXT NOT NULL,
+    ts           BLOB NOT NULL,
+    open         BLOB NOT NULL,
+    high         BLOB NOT NULL,
+    low          BLOB NOT NULL,
+    close        BLOB NOT NULL,
+    volume       BLOB NOT NULL
+)
+"""
+
+
+# ─── 时间工具 ─────────────────────────────────────────────────
+
+def _is_intraday(bar_size: str) -> bool:
+    return not any(unit in bar_size for unit in ("day", "week", "month"))
+
+
+def _bar_ts(value) -> float:
+    """BarData.date（date 或 datetime）转 epoch 秒；日线按本地零点"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).timestamp()
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def _minus_months(dt: datetime, months: int) -> datetime:
+    year, month = divmod(dt.year * 12 + dt.month - 1 - months, 12)
+    month += 1
+    # 月末对齐：3 月 31 日往前 1 个月 → 2 月最后一天
+    day = dt.day
+    while day > 28:
+        try:
+            return dt.replace(year=year, month=month, day=day)
+        except ValueError:
+            day -= 1
+    return dt.replace(year=year, month=month, day=day)
+
+
+def duration_start(duration: str, bar_size: str, now: Optional[datetime] = None) -> float:
+    """
+    IBKR durationStr（"30 D" / "3 M" / "1 Y" …）对应的窗口起点 epoch 秒。
+    按交易日计的 D / W（见 session_count）往回数工作日并对齐到零点（未扣节假日，实际窗口可能更早），
+    日线及以上对齐到当天零点，保证与网关返回的首根 K 线一致。
+    """
+    now = now or datetime.now()
+    amount, unit = duration.split()
+    amount = int(amount)
+    unit = unit.upper()
+    sessions = session_count(duration, bar_size)
+    if sessions is not None:
+        start = now
+        while start.weekday() >= 5:
+            start -= timedelta(days=1)
+        for _ in range(sessions - 1):
+            start -= timedelta(days=3 if start.weekday() == 0 else 1)
+    elif unit == "S":
+        start = now - timedelta(seconds=amount)
+    elif unit == "D":
+        start = now - timedelta(days=amount)
+    elif unit == "W":
+        start = now - timedelta(weeks=amount)
+    elif unit == "M":
+        start = _minus_months(now, amount)
+    elif unit == "Y":
+        start = _minus_months(now, amount * 12)
+    else:
+        raise ValueError(f"无法识别的 duration: {duration}")
+    if sessions is not None or not _is_intraday(bar_size):
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.timestamp()
+
+
+def session_count(duration: str, bar_size: str) -> Optional[int]:
+    """
+    IBKR 的 "N D" 指 N 个交易时段、"N W" 按 5N 个交易时段返回（周末 / 节假日不计）。
+    日线及日内周期按交易日截取窗口，返回交易日数；其余单位（S / M / Y）或周线、月线返回 None，按日历截取。
+    """
+    amount, unit = duration.split()
+    unit = unit.upper()
+    if unit not in ("D", "W") or "week" in bar_size or "month" in bar_size:
+        return None
+    return int(amount) * (5 if unit == "W" else 1)
+
+
+def _tail_duration(last_ts: float, bar_size: str) -> str:
+    """补拉尾部所需的 durationStr：覆盖最后一根已存 K 线（可能未收盘）到现在"""
+    days = int((time.time() - last_ts) // 86400) + 1
+    if "week" in bar_size:
+        return f"{days // 7 + 2} W"
+    if "month" in bar_size:
+        return f"{days // 30 + 2} M"
+    # 跨周末 / 节假日时多拉一天保证衔接
+    return f"{days + 1} D"
+
+
+# ─── 列式序列 ─────────────────────────────────────────────────
+
+class BarSeries:
+    """单个合约单一周期的 OHLCV 列式序列（ts 升序）"""
+
+    def __init__(self):
+        self.dates: List[str] = []
+        self.cols: Dict[str, array] = {name: array("d") for name in _COLUMNS}
+        self.covered_from = float("inf")
+        self.updated_at = 0.0
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def last_ts(self) -> Optional[float]:
+        ts = self.cols["ts"]
+        return ts[-1] if ts else None
+
+    def merge(self, bars) -> None:
+        """用新拉取的 bars 覆盖同时间段的已存 K 线（尾部未收盘 K 线会被更新）"""
+        if not bars:
+            return
+        incoming = [(_bar_ts(b.date), str(b.date), b) for b in bars]
+        incoming.sort(key=lambda x: x[0])
+        lo, hi = incoming[0][0], incoming[-1][0]
+
+        ts = self.cols["ts"]
+        keep = [i for i in range(len(ts)) if ts[i] < lo or ts[i] > hi]
+        merged = [(ts[i], self.dates[i], tuple(self.cols[c][i] for c in _COLUMNS[1:])) for i in keep]
+        merged += [(t, d, (b.open, b.high, b.low, b.close, float(b.volume))) for t, d, b in incoming]
+        merged.sort(key=lambda x: x[0])
+
+        cols = {"ts": array("d", (m[0] for m in merged))}
+        for j, name in enumerate(_COLUMNS[1:]):
+            cols[name] = array("d", (m[2][j] for m in merged))
+        self.dates, self.cols = [m[1] for m in merged], cols
+
+    def session_start(self, sessions: int) -> Optional[float]:
+        """最近 sessions 个交易日中第一根 K 线的时间；已存交易日不足时返回 None"""
+        seen = set()
+        for i in range(len(self.dates) - 1, -1, -1):
+            day = self.dates[i][:10]
+            if day not in seen:
+                if len(seen) == sessions:
+                    return self.cols["ts"][i + 1]
+                seen.add(day)
+        return self.cols["ts"][0] if len(seen) == sessions else None
+
+    def conflicts(self, bars) -> bool:
+        """新拉取的 bars 与已存的已收盘 K 线收盘价不一致（拆股 / 分红复权改写了历史）"""
+        ts, closes = self.cols["ts"], self.cols["close"]
+        if len(ts) < 2:
+            return False
+        for b in bars:
+            t = _bar_ts(b.date)
+            if t >= ts[-1]:
+                continue  # 最后一根已存 K 线可能未收盘
+            i = bisect_left(ts, t)
+            if i < len(ts) and ts[i] == t and not math.isclose(closes[i], b.close, rel_tol=_ADJUST_TOL):
+                return True
+        return False
+
+    def window(self, start_ts: float) -> List[dict]:
+        """返回 start_ts 之后的 K 线，格式与 get_historical_data 一致"""
+        ts = self.cols["ts"]
+        first = bisect_left(ts, start_ts)
+        o, h, l, c, v = (self.cols[name] for name in _COLUMNS[1:])
+        return [
+            {
+                "date": self.dates[i],
+                "open": o[i],
+                "high": h[i],
+                "low": l[i],
+                "close": c[i],
+                "volume": v[i],
+            }
+            for i in range(first, len(ts))
+        ]
+
+
+# ─── 存储 ─────────────────────────────────────────────────────
+
+class BarStore:
+    """
+    SQLite 持久化的 BarSeries 集合，进程内同时保留一份内存副本。
+    连接与内存中的序列由 _lock 保护（batch 模式下多线程共用）。
+    """
+
+    def __init__(self, db_path: str = BAR_DB):
+        self.db_path = db_path
+        self._memory: Dict[str, BarSeries] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        with self._lock:
+            if self._conn is None:
+                try:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(_SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠️ K 线缓存不可用，本次仅使用内存缓存: {e}")
+                    self._conn = False
+            return self._conn or None
+
+    @staticmethod
+    def series_key(contract, bar_size: str, what_to_show: str, use_rth: bool) -> str:
+        return f"{contract.conId}/{bar_size}/{what_to_show}/{int(bool(use_rth))}"
+
+    def load(self, key: str) -> BarSeries:
+        with self._lock:
+            return self._load_locked(key)
+
+    def _load_locked(self, key: str) -> BarSeries:
+        if key in self._memory:
+            return self._memory[key]
+        series = BarSeries()
+        db = self._db()
+        if db:
+            try:
+                row = db.execute(
+                    "SELECT covered_from, updated_at, dates, ts, open, high, low, close, volume "
+                    "FROM bar_series WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row:
+                series.covered_from, series.updated_at = row[0], row[1]
+                series.dates = row[2].split("\n") if row[2] else []
+                for name, blob in zip(_COLUMNS, row[3:]):
+                    col = array("d")
+                    col.frombytes(blob)
+                    series.cols[name] = col
+                if any(len(col) != len(series.dates) for col in series.cols.values()):
+                    series = BarSeries()  # 数据损坏，丢弃重拉
+        self._memory[key] = series
+        return series
+
+    def save(self, key: str, contract, bar_size: str, what_to_show: str, use_rth: bool, series: BarSeries):
+        with self._lock:
+            self._save_locked(key, contract, bar_size, what_to_show, use_rth, series)
+
+    def _save_locked(self, key: str, contract, bar_size: str, what_to_show: str, use_rth: bool,
+                     series: BarSeries):
+        self._memory[key] = series
+        db = self._db()
+        if not db:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO bar_series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, contract.conId, contract.symbol, bar_size, what_to_show, int(bool(use_rth)),
+                 series.covered_from, series.updated_at, "\n".join(series.dates),
+                 *(series.cols[name].tobytes() for name in _COLUMNS)),
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ K 线缓存写入失败: {e}")
+
+    def plan(self, series: BarSeries, start_ts: float, duration: str, bar_size: str,
+             sessions: Optional[int] = None) -> Tuple[Optional[str], bool]:
+        """
+        决定需要向网关请求的 durationStr。
+        sessions 不为 None 时按交易日判断覆盖：已存序列自首次全量请求起连续，含足够交易日
+        （或 covered_from 为 0，即网关已无更早数据）即可只补尾部。
+        返回 (duration 或 None 表示纯本地读取, 是否为覆盖窗口起点的全量请求)
+        """
+        if sessions is not None:
+            covered = len(series) and (series.covered_from <= 0 or series.session_start(sessions) is not None)
+        else:
+            covered = len(series) and series.covered_from <= start_ts
+        if not covered:
+            return duration, True
+        fresh_sec = _FRESH_SEC_INTRADAY if _is_intraday(bar_size) else _FRESH_SEC_DAILY
+        if time.time() - series.updated_at < fresh_sec:
+            return None, False
+        return _tail_duration(series.last_ts, bar_size), False
+
+    def apply(self, series: BarSeries, bars, covered_from: float, full: bool) -> BarSeries:
+        """合并网关返回的 bars；仅在确实拿到数据时刷新 updated_at"""
+        with self._lock:
+            series.merge(bars)
+            if full:
+                series.covered_from = min(series.covered_from, covered_from)
+            if bars:
+                series.updated_at = time.time()
+        return series
+
+    def conflicts(self, series: BarSeries, bars) -> bool:
+        with self._lock:
+            return series.conflicts(bars)
+
+    def reset(self, key: str) -> BarSeries:
+        """丢弃整条已存序列（历史被复权改写），返回新的空序列"""
+        with self._lock:
+            self._memory[key] = BarSeries()
+            db = self._db()
+            if db:
+                try:
+                    db.execute("DELETE FROM bar_series WHERE key = ?", (key,))
+                    db.commit()
+                except sqlite3.Error:
+                    pass
+            return self._memory[key]
+
+    def window(self, series: BarSeries, start_ts: float, sessions: Optional[int] = None) -> List[dict]:
+        """加锁读取窗口（按日历起点，或 sessions 不为 None 时按最近交易日数），避免与其他线程的 merge 交错"""
+        with self._lock:
+            if sessions is not None:
+                start_ts = series.session_start(sessions) or 0.0
+            return series.window(start_ts)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            if db:
+                db.execute("DELETE FROM bar_series")
+                db.commit()
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            db = self._db()
+            if not db:
+                return []
+            rows = db.execute(
+                "SELECT symbol, bar_size, length(ts) / 8, covered_from, updated_at "
+                "FROM bar_series ORDER BY symbol, bar_size"
+            ).fetchall()
+        return [
+            {"symbol": r[0], "bar_size": r[1], "bars": r[2],
+             "from": datetime.fromtimestamp(r[3]).strftime("%Y-%m-%d") if r[3] > 0 else "最早",
+             "updated": datetime.fromtimestamp(r[4]).strftime("%Y-%m-%d %H:%M")}
+            for r in rows
+        ]
+
+
+_default_store: Optional[BarStore] = None
+
+
+def get_bar_store() -> BarStore:
+    """进程级共享的存储实例"""
+    global _default_store
+    if _default_store is None:
+        _default_store = BarStore()
+    return _default_store
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def _format_bars(bars) -> List[dict]:
+    return [
+        {
+            "date": str(bar.date),
+            "open": bar.open,
+            "high": bar.high,
+            "low": bar.low,
+            "close": bar.close,
+            "volume": bar.volume
+        }
+        for bar in bars
+    ]
+
+
+class _SeriesRequest:
+    """get_bars / get_bars_async 共用的缓存读取、合并与写回逻辑"""
+
+    def __init__(self, contract, duration: str, bar_size: str, what_to_show: str, use_rth: bool):
+        self.contract = contract
+        self.duration, self.bar_size, self.what_to_show, self.use_rth = duration, bar_size, what_to_show, use_rth
+        self.store = get_bar_store()
+        self.key = self.store.series_key(contract, bar_size, what_to_show, use_rth)
+        self.start_ts = duration_start(duration, bar_size)
+        self.sessions = session_count(duration, bar_size)
+        self.series = self.store.load(self.key)
+        self.fetch_duration, self.full = self.store.plan(
+            self.series, self.start_ts, duration, bar_size, self.sessions
+        )
+
+    def window(self) -> List[dict]:
+        return self.store.window(self.series, self.start_ts, self.sessions)
+
+    def needs_refetch(self, bars) -> bool:
+        """补拉的尾部改写了已存历史时丢弃序列，改为全量请求；返回是否需要重新请求"""
+        if self.full or not bars or not self.store.conflicts(self.series, bars):
+            return False
+        print(f"🔄 {self.contract.symbol} 历史 K 线已复权调整，重新全量拉取")
+        self.series = self.store.reset(self.key)
+        self.fetch_duration, self.full = self.duration, True
+        return True
+
+    def finish(self, bars) -> List[dict]:
+        """合并拉取结果：全量请求原样返回网关的 K 线，尾部补拉返回本地窗口；空结果不写回，下次调用会重新拉取"""
+        if bars:
+            covered_from = self.start_ts
+            if self.sessions is not None:
+                # 按交易日的全量请求：覆盖起点取首根 K 线；返回的交易日不足说明网关已无更早数据
+                short = len({str(b.date)[:10] for b in bars}) < self.sessions
+                covered_from = 0.0 if short else min(_bar_ts(b.date) for b in bars)
+            self.store.save(self.key, self.contract, self.bar_size, self.what_to_show, self.use_rth,
+                            self.store.apply(self.series, bars, covered_from, self.full))
+            if self.full:
+                return _format_bars(bars)
+        elif self.full:
+            return []
+        return self.window()
+
+
+def get_bars(ib, contract, duration: str, bar_size: str,
+             what_to_show: str = "TRADES", use_rth: bool = True) -> List[dict]:
+    """带增量缓存的 reqHistoricalData，返回 get_historical_data 格式的 K 线列表"""
+    def request(durationStr):
+        return get_scheduler(ib).call(
+            historical_kind(bar_size),
+            lambda: ib.reqHistoricalData(
+                contract, endDateTime='', durationStr=durationStr, barSizeSetting=bar_size,
+                whatToShow=what_to_show, useRTH=use_rth
+            ),
+            key=(contract.conId, durationStr, bar_size, what_to_show, use_rth),
+            group=(contract.conId, what_to_show),
+            label=f"{contract.symbol} 历史数据",
+            contracts=(contract,),
+        )
+
+    if BAR_CACHE_DISABLED or not contract.conId:
+        return _format_bars(request(duration))
+
+    req = _SeriesRequest(contract, duration, bar_size, what_to_show, use_rth)
+    if not req.fetch_duration:
+        return req.window()
+    bars = request(req.fetch_duration)
+    if req.needs_refetch(bars):
+        bars = request(req.fetch_duration)
+    return req.finish(bars)
+
+
+async def get_bars_async(ib, contract, duration: str, bar_size: str,
+                         what_to_show: str = "TRADES", use_rth: bool = True) -> List[dict]:
+    """get_bars 的异步版本，供 get_historical_data_batch 并发使用"""
+    async def request(durationStr):
+        return await get_scheduler(ib).call_async(
+            historical_kind(bar_size),
+            lambda: ib.reqHistoricalDataAsync(
+                contract, endDateTime='', durationStr=durationStr, barSizeSetting=bar_size,
+                whatToShow=what_to_show, useRTH=use_rth
+            ),
+            key=(contract.conId, durationStr, bar_size, what_to_show, use_rth),
+            group=(contract.conId, what_to_show),
+            label=f"{contract.symbol} 历史数据",
+            contracts=(contract,),
+        )
+
+    if BAR_CACHE_DISABLED or not contract.conId:
+        return _format_bars(await request(duration))
+
+    req = _SeriesRequest(contract, duration, bar_size, what_to_show, use_rth)
+    if not req.fetch_duration:
+        return req.window()
+    bars = await request(req.fetch_duration)
+    if req.needs_refetch(bars):
+        bars = await request(req.fetch_duration)
+    return req.finish(bars)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = get_bar_store()
+
+    if action == "stats":
+        rows = store.stats()
+        print(f"🗄️ K 线缓存: {store.db_path}")
+        if not rows:
+            print("   (空)")
+        for r in rows:
+            print(f"   {r['symbol']:<8} {r['bar_size']:<8} {r['bars']:>5} 根  "
+                  f"自 {r['from']}  更新于 {r['updated']}")
+    elif action == "clear":
+        store.clear()
+        print("🧹 K 线缓存已清空")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
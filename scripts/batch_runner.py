@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+CLI 批处理执行器
+一个进程、一个网关连接内执行多条 ibkr_cli 命令（JSONL 输入），每条命令完成即输出一行 JSON 信封：
+  • 相互独立的命令在线程池中并发执行，共享进程内的合约 / Finviz / 财报等缓存
+  • ib_async 不可跨线程使用：网关客户端由主线程独占，工作线程的客户端调用经 MainThreadRelay 转交主线程串行执行，
+    Finviz 抓取、指标计算、限速等待等其余工作仍然并行
+  • 有副作用的命令（watchlist add/remove、snapshot save 等）独占执行：等前面的命令全部完成后单独运行
+  • 每个工作线程的普通 print 输出被单独截获，命令没有 JSON 输出时作为 data.text 返回，出错时附在 error.output 中
+
+输入格式（每行一条，# 开头为注释）:
+    {"id": "spy", "cmd": "analyze", "args": ["SPY"]}
+    {"cmd": "insider market"}
+    news market
+
+独占判定自检（核对各命令默认子命令是否有副作用）:
+    python3 batch_runner.py check
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import io
+import json
+import queue
+import shlex
+import threading
+import time
+import inspect
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+DEFAULT_WORKERS = 4
+
+# 批处理 / 查询服务中不允许的命令（递归批处理 / 进程级 broker 管理 / 嵌套服务）
+FORBIDDEN_COMMANDS = frozenset({"batch", "broker", "serve"})
+
+# 有副作用、需独占执行的 (命令, 子命令)
+EXCLUSIVE_COMMANDS = frozenset({
+    ("watchlist", "add"), ("watchlist", "remove"),
+    ("alerts", "add"), ("alerts", "remove"),
+    ("snapshot", "save"), ("snapshot", "migrate"),
+    ("fvcache", "purge"), ("fvcache", "clear"),
+    ("contracts", "warm"), ("contracts", "purge"), ("contracts", "clear"),
+    ("export", None),
+})
+
+# 不带子命令时各 cmd_* 实际执行的默认动作（与 ibkr_commands 保持一致，check 会核对）
+DEFAULT_SUBCOMMANDS = {
+    "watchlist": "list",
+    "alerts": "list",
+    "snapshot": "save",
+    "fvcache": "stats",
+    "contracts": "stats",
+    "export": "all",
+}
+
+_OUTPUT_TAIL = 2000
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class BatchItem:
+    id: str
+    command: str
+    args: List[str] = field(default_factory=list)
+    line: int = 0
+
+    @property
+    def exclusive(self) -> bool:
+        sub = next((a for a in self.args if not a.startswith("--")), DEFAULT_SUBCOMMANDS.get(self.command))
+        return (self.command, sub) in EXCLUSIVE_COMMANDS or (self.command, None) in EXCLUSIVE_COMMANDS
+
+
+@dataclass
+class BatchSummary:
+    total: int
+    succeeded: int
+    failed: int
+    invalid: int
+    workers: int
+    elapsed_sec: float
+
+
+# ─── 输入解析 ─────────────────────────────────────────────────
+
+def parse_batch_lines(lines: Iterable[str]) -> Tuple[List[BatchItem], List[Tuple[int, str]]]:
+    """解析 JSONL 命令列表，返回 (有效命令, [(行号, 错误原因)])"""
+    items, errors = [], []
+    for lineno, raw in enumerate(lines, 1):
+        text = raw.strip()
+        if not text or text.startswith("#"):
+            continue
+        try:
+            if text.startswith("{"):
+                spec = json.loads(text)
+                parts = shlex.split(spec["cmd"]) if isinstance(spec.get("cmd"), str) else []
+                parts += [str(a) for a in spec.get("args", [])]
+                request_id = str(spec.get("id", lineno))
+            else:
+                parts = shlex.split(text)
+                request_id = str(lineno)
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append((lineno, f"无法解析: {e}"))
+            continue
+        if not parts:
+            errors.append((lineno, "缺少命令"))
+            continue
+        if parts[0] in FORBIDDEN_COMMANDS:
+            errors.append((lineno, f"批处理中不支持 {parts[0]} 命令"))
+            continue
+        items.append(BatchItem(id=request_id, command=parts[0], args=parts[1:], line=lineno))
+    return items, errors
+
+
+# ─── 主线程转发 ───────────────────────────────────────────────
+
+class MainThreadRelay:
+    """工作线程提交的调用在主线程中依次执行（ib_async 的事件循环绑定在主线程）"""
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._main = threading.get_ident()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        if threading.get_ident() == self._main:
+            return fn(*args, **kwargs)
+        future = concurrent.futures.Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future.result()
+
+    def serve_until(self, done: threading.Event, idle: float = 0.05,
+                    on_idle: Optional[Callable[[], None]] = None):
+        """主线程循环：执行转交过来的调用，直到 done 被置位；空闲时调用 on_idle（如泵 ib 事件循环）"""
+        while not done.is_set():
+            try:
+                future, fn, args, kwargs = self._queue.get(timeout=idle)
+            except queue.Empty:
+                if on_idle is not None:
+                    on_idle()
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except KeyboardInterrupt:
+                future.set_exception(RuntimeError("已中断"))
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class RelayProxy:
+    """
+    对象代理：公有方法调用转交主线程执行，client.ib 这类对象属性再包一层代理。
+    私有属性（如 pacing 调度器挂在 ib 上的 _pacing_scheduler）保存在代理自身，
+    避免工作线程拿到绑定真实事件循环的对象。
+    """
+
+    def __init__(self, target, relay: MainThreadRelay, nested: Tuple[str, ...] = ("ib",)):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_relay", relay)
+        object.__setattr__(self, "_nested", nested)
+        object.__setattr__(self, "_children", {})
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._nested:
+            child = self._children.get(name)
+            if child is None:
+                child = self._children[name] = RelayProxy(getattr(self._target, name), self._relay, ())
+            return child
+        value = getattr(self._target, name)
+        if not inspect.isroutine(value):
+            return value
+        relay = self._relay
+
+        def relayed(*args, **kwargs):
+            return relay.call(value, *args, **kwargs)
+        relayed.__name__ = name
+        return relayed
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._target, name, value)
+
+
+class SharedClient:
+    """
+    批处理内共享的网关客户端：首次使用时在主线程连接，失败后其余命令直接复用同一错误。
+    retry_sec 不为空时（常驻查询服务），失败超过该秒数后下一次使用会重新连接。
+    """
+
+    def __init__(self, relay: MainThreadRelay, connect: Callable[[], object],
+                 retry_sec: Optional[float] = None):
+        self._relay = relay
+        self._connect = connect
+        self._retry_sec = retry_sec
+        self._lock = threading.Lock()
+        self._client = None
+        self._proxy: Optional[RelayProxy] = None
+        self._error: Optional[BaseException] = None
+        self._failed_at = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    @property
+    def client(self):
+        """底层真实客户端（未连接时为 None），仅限主线程使用"""
+        return self._client
+
+    def get(self) -> RelayProxy:
+        with self._lock:
+            if self._error is not None:
+                if self._retry_sec is None or time.time() - self._failed_at < self._retry_sec:
+                    raise RuntimeError(f"网关连接失败: {self._error!r}")
+                self._error = None
+            if self._proxy is None:
+                try:
+                    self._client = self._relay.call(self._connect)
+                except BaseException as e:
+                    self._error = e
+                    self._failed_at = time.time()
+                    raise
+                self._proxy = RelayProxy(self._client, self._relay)
+                object.__setattr__(self._proxy, "_batch_shared", True)
+            return self._proxy
+
+    def close(self):
+        """在主线程调用：断开真实连接"""
+        if self._client is not None:
+            try:
+                self._client.disconnect()
+            except Exception:
+                pass
+            self._client = None
+
+
+# ─── 输出截获 ─────────────────────────────────────────────────
+
+class ThreadOutputRouter(io.TextIOBase):
+    """按线程分流的 stdout：登记过的线程写入各自缓冲区，其余写入 fallback"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._buffers: Dict[int, io.StringIO] = {}
+
+    def capture(self):
+        self._buffers[threading.get_ident()] = io.StringIO()
+
+    def release(self) -> str:
+        buf = self._buffers.pop(threading.get_ident(), None)
+        return buf.getvalue() if buf is not None else ""
+
+    def write(self, s):
+        (self._buffers.get(threading.get_ident()) or self.fallback).write(s)
+        return len(s)
+
+    def flush(self):
+        self.fallback.flush()
+
+
+# ─── 执行器 ───────────────────────────────────────────────────
+
+def make_envelope(command: str, data, status: str = "success") -> dict:
+    """与 ibkr_cli.print_json_resp 相同结构的信封"""
+    return {
+        "status": status,
+        "command": command,
+        "timestamp": int(time.time()),
+        "data": data if status == "success" else None,
+        "error": data if status != "success" else None,
+    }
+
+
+def run_captured(item: BatchItem, execute: Callable[[BatchItem, Callable[[dict], None]], None],
+                 router: ThreadOutputRouter, emit: Callable[[dict], None]) -> bool:
+    """
+    在当前线程执行单条命令并截获普通输出，信封（附带请求 id）逐个交给 emit；
+    命令没有 JSON 输出时补一个错误或 data.text 信封。返回命令是否成功。
+    """
+    statuses = []
+
+    def tracked(envelope: dict):
+        envelope["id"] = item.id
+        statuses.append(envelope["status"])
+        emit(envelope)
+
+    router.capture()
+    error = None
+    try:
+        execute(item, tracked)
+    except SystemExit as e:
+        if e.code not in (0, None):
+            error = e
+    except BaseException as e:
+        error = e
+    finally:
+        text = router.release()
+
+    if error is not None and not statuses:
+        tracked(make_envelope(item.command, {
+            "message": str(error) or type(error).__name__,
+            "type": type(error).__name__,
+            "output": text[-_OUTPUT_TAIL:],
+        }, "error"))
+    elif not statuses:
+        tracked(make_envelope(item.command, {"text": text}))
+
+    return error is None and all(status == "success" for status in statuses)
+
+
+class BatchRunner:
+    """
+    execute(item, emit) 负责执行单条命令，命令内部的 JSON 输出通过 emit(envelope) 交回；
+    其余调度、截获、错误信封与汇总由本类完成。
+    """
+
+    def __init__(self, execute: Callable[[BatchItem, Callable[[dict], None]], None],
+                 out, router: ThreadOutputRouter, relay: MainThreadRelay,
+                 workers: int = DEFAULT_WORKERS):
+        self.execute = execute
+        self.out = out
+        self.router = router
+        self.relay = relay
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+
+    def _write(self, envelope: dict):
+        line = json.dumps(envelope, ensure_ascii=False, default=str)
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def _run_item(self, item: BatchItem):
+        ok = run_captured(item, self.execute, self.router, self._write)
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def _dispatch(self, items: List[BatchItem], done: threading.Event):
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                       thread_name_prefix="batch") as pool:
+                pending = []
+                for item in items:
+                    if item.exclusive:
+                        concurrent.futures.wait(pending)
+                        pending = []
+                        pool.submit(self._run_item, item).result()
+                    else:
+                        pending.append(pool.submit(self._run_item, item))
+                concurrent.futures.wait(pending)
+        finally:
+            done.set()
+
+    def run(self, items: List[BatchItem], invalid: List[Tuple[int, str]] = ()) -> BatchSummary:
+        """在主线程调用：派发线程调度命令，主线程负责执行网关调用"""
+        t0 = time.time()
+        for lineno, reason in invalid:
+            self._write({**make_envelope("batch", {"line": lineno, "message": reason}, "error"),
+                         "id": str(lineno)})
+
+        done = threading.Event()
+        dispatcher = threading.Thread(target=self._dispatch, args=(items, done), daemon=True)
+        dispatcher.start()
+        self.relay.serve_until(done)
+        dispatcher.join()
+
+        return BatchSummary(
+            total=len(items) + len(invalid),
+            succeeded=self.succeeded,
+            failed=self.failed,
+            invalid=len(invalid),
+            workers=self.workers,
+            elapsed_sec=round(time.time() - t0, 2),
+        )
+
+
+# ─── 一致性检查 ───────────────────────────────────────────────
+
+def _command_defaults() -> Dict[str, str]:
+    """从 ibkr_commands 源码读取各命令不带子命令时的默认动作（subcommand = ... if ... else "xxx"）"""
+    import ast
+    import os
+    from ibkr_cli import COMMANDS
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ibkr_commands.py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    funcs = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+
+    defaults = {}
+    for name, (_, target) in COMMANDS.items():
+        module_name, func_name = target.split(":")
+        if module_name != "ibkr_commands" or func_name not in funcs:
+            continue
+        for node in ast.walk(funcs[func_name]):
+            if (isinstance(node, ast.Assign)
+                    and any(isinstance(t, ast.Name) and t.id == "subcommand" for t in node.targets)
+                    and isinstance(node.value, ast.IfExp)
+                    and isinstance(node.value.orelse, ast.Constant)):
+                defaults[name] = node.value.orelse.value
+                break
+    return defaults
+
+
+def check_exclusive_defaults() -> List[str]:
+    """核对独占判定：默认动作有副作用的命令，不带子命令（或只带 --json）时也必须独占执行，返回问题列表"""
+    problems = []
+    defaults = _command_defaults()
+    for command, default in sorted(defaults.items()):
+        if DEFAULT_SUBCOMMANDS.get(command, default) != default:
+            problems.append(f"{command}: DEFAULT_SUBCOMMANDS 为 {DEFAULT_SUBCOMMANDS[command]}，命令实际默认 {default}")
+        writes = (command, default) in EXCLUSIVE_COMMANDS or (command, None) in EXCLUSIVE_COMMANDS
+        for args in ([], ["--json"]):
+            if BatchItem("", command, args).exclusive != writes:
+                problems.append(f"{' '.join([command, *args])}: 默认动作 {default} 的独占判定错误")
+    for command, sub in sorted(EXCLUSIVE_COMMANDS, key=str):
+        if sub is not None and not BatchItem("", command, [sub, "--json"]).exclusive:
+            problems.append(f"{command} {sub}: 未判定为独占")
+    return problems
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    import sys
+    action = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if action != "check":
+        print("用法: batch_runner.py [check]")
+        sys.exit(2)
+    problems = check_exclusive_defaults()
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"✅ 独占判定一致: {len(EXCLUSIVE_COMMANDS)} 个写操作，{len(_command_defaults())} 个命令默认动作已核对")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+合约解析本地缓存
+把 qualifyContracts 的结果（conId 等）持久化到 ~/trading/cache/contracts.db（SQLite），
+后续 search_symbol / 批量行情 / 历史K线 / 期权链直接本地命中，只把未命中的合约一次性批量发给网关。
+
+用法:
+    python contract_cache.py stats              # 查看缓存条目
+    python contract_cache.py warm AAPL MSFT ... # 预热指定股票（不带参数则预热持仓 + 自选股）
+    python contract_cache.py purge              # 清理过期条目
+    python contract_cache.py clear              # 清空缓存
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+CACHE_DIR = os.getenv("IBKR_CACHE_DIR", os.path.join(os.path.expanduser("~"), "trading", "cache"))
+CONTRACT_DB = os.path.join(CACHE_DIR, "contracts.db")
+
+# conId 极少变化，默认 7 天后重新校验一次；期权合约最晚在到期日后失效
+CONTRACT_TTL_SEC = float(os.getenv("IBKR_CONTRACT_TTL_DAYS", "7")) * 86400
+
+# 重建合约只需要这些标量字段
+_CONTRACT_FIELDS = (
+    "secType", "conId", "symbol", "lastTradeDateOrContractMonth", "strike", "right",
+    "multiplier", "exchange", "primaryExchange", "currency", "localSymbol", "tradingClass",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    key        TEXT PRIMARY KEY,
+    sec_type   TEXT NOT NULL,
+    symbol     TEXT NOT NULL,
+    con_id     INTEGER NOT NULL,
+    payload    TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+
+# ─── 缓存键 ───────────────────────────────────────────────────
+
+def contract_key(contract) -> str:
+    """由请求参数（而非网关返回值）生成缓存键：secType/symbol/exchange/currency[/expiry/strike/right]"""
+    parts = [
+        contract.secType or "STK",
+        (contract.symbol or "").upper(),
+        contract.exchange or "SMART",
+        contract.currency or "USD",
+    ]
+    if contract.secType in ("OPT", "FOP"):
+        parts += [
+            contract.lastTradeDateOrContractMonth or "",
+            f"{float(contract.strike or 0):g}",
+            (contract.right or "")[:1].upper(),
+        ]
+    return "/".join(parts)
+
+
+def _expires_at(contract, now: float) -> float:
+    expires = now + CONTRACT_TTL_SEC
+    expiry = getattr(contract, "lastTradeDateOrContractMonth", "") or ""
+    if contract.secType in ("OPT", "FOP") and len(expiry) >= 8:
+        try:
+            end_of_expiry = datetime.strptime(expiry[:8], "%Y%m%d").timestamp() + 86400
+            expires = min(expires, end_of_expiry)
+        except ValueError:
+            pass
+    return expires
+
+
+def _to_payload(contract) -> str:
+    return json.dumps({f: getattr(contract, f) for f in _CONTRACT_FIELDS
+                       if getattr(contract, f, None) not in (None, "", 0, 0.0)})
+
+
+def _from_payload(payload: str):
+    from ib_async import Contract
+    return Contract.create(**json.loads(payload))
+
+
+# ─── 缓存存储 ─────────────────────────────────────────────────
+
+class ContractCache:
+    """
+    conId 持久化缓存：内存字典 + SQLite 两级。
+    多个进程（CLI / broker）可同时读写同一个数据库文件；进程内的共享连接加锁（batch 模式下多线程共用）。
+    """
+
+    def __init__(self, db_path: str = CONTRACT_DB):
+        self.db_path = db_path
+        self._memory: Dict[str, Tuple[float, object]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库；磁盘不可写时退化为纯内存缓存。返回的连接只能在持有 _lock 时使用"""
+        with self._lock:
+            if self._conn is None:
+                try:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(_SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠️ 合约缓存不可用，本次仅使用内存缓存: {e}")
+                    self._conn = False
+            return self._conn or None
+
+    def get_many(self, keys: List[str]) -> Dict[str, object]:
+        """批量查询，返回 {key: Contract}，过期条目视为未命中"""
+        with self._lock:
+            return self._get_many_locked(keys)
+
+    def _get_many_locked(self, keys: List[str]) -> Dict[str, object]:
+        now = time.time()
+        found = {}
+        pending = []
+        for key in keys:
+            cached = self._memory.get(key)
+            if cached and cached[0] > now:
+                found[key] = cached[1]
+            else:
+                pending.append(key)
+
+        db = self._db()
+        if pending and db:
+            for start in range(0, len(pending), 500):
+                chunk = pending[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                try:
+                    rows = db.execute(
+                        f"SELECT key, payload, expires_at FROM contracts "
+                        f"WHERE key IN ({placeholders}) AND expires_at > ?",
+                        (*chunk, now),
+                    ).fetchall()
+                except sqlite3.Error:
+                    rows = []
+                for key, payload, expires_at in rows:
+                    try:
+                        contract = _from_payload(payload)
+                    except Exception:
+                        continue
+                    self._memory[key] = (expires_at, contract)
+                    found[key] = contract
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, object]):
+        """写入已 qualify 的合约（conId 为 0 的不缓存）"""
+        with self._lock:
+            self._put_many_locked(items)
+
+    def _put_many_locked(self, items: Dict[str, object]):
+        now = time.time()
+        rows = []
+        for key, contract in items.items():
+            if not contract or not getattr(contract, "conId", 0):
+                continue
+            expires_at = _expires_at(contract, now)
+            self._memory[key] = (expires_at, contract)
+            rows.append((key, contract.secType, contract.symbol, contract.conId,
+                         _to_payload(contract), now, expires_at))
+
+        db = self._db()
+        if rows and db:
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO contracts VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ 合约缓存写入失败: {e}")
+
+    def purge_expired(self) -> int:
+        """删除过期条目，返回删除数量"""
+        now = time.time()
+        with self._lock:
+            self._memory = {k: v for k, v in self._memory.items() if v[0] > now}
+            db = self._db()
+            if not db:
+                return 0
+            cur = db.execute("DELETE FROM contracts WHERE expires_at <= ?", (now,))
+            db.commit()
+            return cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            if db:
+                db.execute("DELETE FROM contracts")
+                db.commit()
+
+    def stats(self) -> dict:
+        """缓存概况：按 secType 统计的有效条目数 + 本进程命中率"""
+        result = {"db_path": self.db_path, "by_type": {}, "expired": 0,
+                  "hits": self.hits, "misses": self.misses}
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            if not db:
+                return result
+            for sec_type, count in db.execute(
+                "SELECT sec_type, COUNT(*) FROM contracts WHERE expires_at > ? GROUP BY sec_type", (now,)
+            ):
+                result["by_type"][sec_type] = count
+            result["expired"] = db.execute(
+                "SELECT COUNT(*) FROM contracts WHERE expires_at <= ?", (now,)
+            ).fetchone()[0]
+        return result
+
+
+_default_cache: Optional[ContractCache] = None
+
+
+def get_contract_cache() -> ContractCache:
+    """进程级共享的缓存实例"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ContractCache()
+    return _default_cache
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def _split_hits(contracts, cache: ContractCache):
+    keys = [contract_key(c) for c in contracts]
+    found = cache.get_many(list(dict.fromkeys(keys)))
+    results = [found.get(k) for k in keys]
+    miss_index: Dict[str, List[int]] = {}
+    for i, (key, hit) in enumerate(zip(keys, results)):
+        if hit is None:
+            miss_index.setdefault(key, []).append(i)
+    return results, miss_index
+
+
+def _merge_misses(results, miss_index, miss_contracts, qualified, cache: ContractCache):
+    fresh = {}
+    for key, contract in zip(miss_index, qualified or []):
+        # 歧义合约在 returnAll 模式下会返回列表，这里一律视为失败
+        if contract is None or isinstance(contract, list) or not getattr(contract, "conId", 0):
+            continue
+        fresh[key] = contract
+        for i in miss_index[key]:
+            results[i] = contract
+    cache.put_many(fresh)
+    return results
+
+
+def qualify_cached(ib, *contracts, cache: Optional[ContractCache] = None) -> list:
+    """
+    带缓存的 qualifyContracts。
+    返回与输入等长的列表，无法解析的位置为 None；只有未命中的合约才会发给网关（一次批量请求）。
+    """
+    if not contracts:
+        return []
+    cache = cache or get_contract_cache()
+    results, miss_index = _split_hits(contracts, cache)
+    if not miss_index:
+        return results
+
+    miss_contracts = [contracts[idx[0]] for idx in miss_index.values()]
+    try:
+        qualified = ib.qualifyContracts(*miss_contracts)
+    except Exception as e:
+        print(f"⚠️ 合约验证失败: {e}")
+        qualified = []
+    return _merge_misses(results, miss_index, miss_contracts, qualified, cache)
+
+
+async def qualify_cached_async(ib, *contracts, cache: Optional[ContractCache] = None) -> list:
+    """qualify_cached 的异步版本，供 get_historical_data_batch 等协程使用"""
+    if not contracts:
+        return []
+    cache = cache or get_contract_cache()
+    results, miss_index = _split_hits(contracts, cache)
+    if not miss_index:
+        return results
+
+    miss_contracts = [contracts[idx[0]] for idx in miss_index.values()]
+    try:
+        qualified = await ib.qualifyContractsAsync(*miss_contracts)
+    except Exception as e:
+        print(f"⚠️ 合约验证失败: {e}")
+        qualified = []
+    return _merge_misses(results, miss_index, miss_contracts, qualified, cache)
+
+
+def warm_contracts(client, symbols: List[str] = None) -> dict:
+    """
+    预热股票合约缓存。
+    symbols 为空时使用当前股票持仓 + 自选股列表。
+    """
+    from ib_async import Stock
+
+    if not symbols:
+        symbols = [p.symbol for p in client.get_positions() if p.sec_type == "STK"]
+        try:
+            from scanner_enhanced import load_watchlist
+            symbols += [item["symbol"] for item in load_watchlist().get("items", [])]
+        except Exception:
+            pass
+
+    symbols = list(dict.fromkeys(s.upper() for s in symbols if s))
+    if not symbols:
+        return {"requested": 0, "resolved": 0, "failed": []}
+
+    qualified = client.qualify_contracts(*[Stock(s, "SMART", "USD") for s in symbols])
+    failed = [s for s, c in zip(symbols, qualified) if c is None]
+    return {"requested": len(symbols), "resolved": len(symbols) - len(failed), "failed": failed}
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_cache_stats(stats: dict) -> str:
+    lines = [f"🗂️ 合约缓存: {stats['db_path']}"]
+    if not stats["by_type"]:
+        lines.append("   (空)")
+    for sec_type, count in sorted(stats["by_type"].items()):
+        lines.append(f"   {sec_type:<4} {count} 个")
+    if stats["expired"]:
+        lines.append(f"   已过期待清理: {stats['expired']} 个")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = get_contract_cache()
+
+    if action == "stats":
+        print(format_cache_stats(cache.stats()))
+    elif action == "purge":
+        print(f"🧹 已清理 {cache.purge_expired()} 个过期条目")
+    elif action == "clear":
+        cache.clear()
+        print("🧹 合约缓存已清空")
+    elif action == "warm":
+        from ibkr_readonly import IBKRReadOnlyClient
+
+        client = IBKRReadOnlyClient()
+        if not client.connect():
+            print("❌ 无法连接 IB Gateway")
+            return
+        try:
+            result = warm_contracts(client, sys.argv[2:])
+        finally:
+            client.disconnect()
+        print(f"🔥 预热完成: {result['resolved']}/{result['requested']} 个合约")
+        if result["failed"]:
+            print(f"   ⚠️ 无法解析: {', '.join(result['failed'])}")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
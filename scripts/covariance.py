@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+协方差 / 相关性引擎 (NumPy)
+在按日期对齐的收益率矩阵上一次性计算全部持仓的协方差与相关性：
+  • 样本估计（成对完整观测）或 EWMA 指数加权（近期交易日权重更高）
+  • 可选 Ledoit-Wolf 收缩（向常数方差单位阵收缩，持仓数接近样本天数时更稳定）
+  • 对相关性矩阵做层次聚类（平均连接），找出彼此高度相关的"拥挤"持仓组
+
+用法:
+    python covariance.py bench [N]    # N 只标的 (默认 200) 的计算耗时
+
+⚠️ 纯计算模块，不访问网关。
+"""
+
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# 聚类阈值：组内平均相关系数 ≥ 0.7 视为拥挤
+CROWDED_CORRELATION = 0.7
+# EWMA 默认半衰期（交易日）
+DEFAULT_HALFLIFE = 30
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class CorrelationCluster:
+    """一组彼此高度相关的持仓"""
+    symbols: List[str]
+    avg_correlation: float
+    weight_pct: float = 0.0       # 组内持仓合计权重
+
+
+@dataclass
+class CovarianceEstimate:
+    symbols: List[str]
+    covariance: np.ndarray
+    correlation: np.ndarray
+    method: str = "sample"        # "sample" / "ewma"
+    shrinkage: float = 0.0        # Ledoit-Wolf 收缩强度 (0 = 未收缩)
+    observations: int = 0
+    clusters: List[CorrelationCluster] = field(default_factory=list)
+
+
+# ─── 估计量 ───────────────────────────────────────────────────
+
+def complete_rows(returns: np.ndarray, min_rows: int = 20) -> np.ndarray:
+    """
+    取所有列都有收益率的交易日；完整观测不足 min_rows 时改为按列均值填补缺失值
+    （填补值不贡献协方差，只是让较晚上市的标的可以参与计算）。
+    """
+    returns = returns[~np.isnan(returns).all(axis=1)]
+    full = ~np.isnan(returns).any(axis=1)
+    if np.count_nonzero(full) >= min_rows:
+        return returns[full]
+    col_mean = np.nanmean(returns, axis=0)
+    return np.where(np.isnan(returns), col_mean, returns)
+
+
+def ewma_weights(n: int, halflife: float = DEFAULT_HALFLIFE) -> np.ndarray:
+    """最近一行权重最大、按半衰期指数衰减，归一化到和为 1"""
+    decay = 0.5 ** (1.0 / halflife)
+    w = decay ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    return w / w.sum()
+
+
+def weighted_covariance(x: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """加权（默认等权）无偏协方差：Σ w·(x-μ)(x-μ)ᵀ / (1 - Σw²)"""
+    n = len(x)
+    if weights is None:
+        weights = np.full(n, 1.0 / n)
+    mean = weights @ x
+    xc = x - mean
+    return (xc * weights[:, None]).T @ xc / (1.0 - np.dot(weights, weights))
+
+
+def pairwise_covariance(returns: np.ndarray) -> np.ndarray:
+    """成对完整观测下的样本协方差（与按对逐一计算的结果一致）"""
+    mask = (~np.isnan(returns)).astype(np.float64)
+    x0 = np.where(mask > 0, returns, 0.0)
+    n = mask.T @ mask
+    sx = x0.T @ mask
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = (x0.T @ x0 - sx * sx.T / n) / (n - 1)
+        # 对角线用各列自身的全部观测
+        diag_n = np.diag(n)
+        diag = (np.einsum("ij,ij->j", x0, x0) - np.diag(sx) ** 2 / diag_n) / (diag_n - 1)
+    np.fill_diagonal(cov, diag)
+    cov[n < 2] = np.nan
+    return cov
+
+
+def pairwise_correlation(returns: np.ndarray) -> np.ndarray:
+    """
+    成对完整观测下的 Pearson 相关系数（两列都有收益率的日期参与计算）。
+    n·Σxy - Σx·Σy / √[(n·Σx² - (Σx)²)(n·Σy² - (Σy)²)]，全部由矩阵乘法得到。
+    """
+    mask = (~np.isnan(returns)).astype(np.float64)
+    x0 = np.where(mask > 0, returns, 0.0)
+    n = mask.T @ mask
+    sx = x0.T @ mask                   # sx[i, j] = 列 i 在与列 j 共同有效日期上的和
+    sxx = (x0 * x0).T @ mask
+    sxy = x0.T @ x0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        num = n * sxy - sx * sx.T
+        den = np.sqrt((n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2))
+        corr = num / den
+    corr[n < 2] = np.nan
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def ledoit_wolf_intensity(x: np.ndarray) -> float:
+    """
+    Ledoit-Wolf (2004) 收缩强度，目标为 μ·I（μ 为平均方差）。
+    δ² = ‖S - μI‖² / p，β² = (Σ‖x_k‖⁴ / n - ‖S‖²) / (n·p)，强度 = min(β², δ²) / δ²
+    """
+    n, p = x.shape
+    xc = x - x.mean(axis=0)
+    s = xc.T @ xc / n
+    mu = np.trace(s) / p
+    delta2 = (np.sum(s * s) - 2 * mu * np.trace(s) + mu * mu * p) / p
+    if delta2 <= 0:
+        return 0.0
+    row_norms = np.einsum("ij,ij->i", xc, xc)
+    beta2 = (np.sum(row_norms ** 2) / n - np.sum(s * s)) / (n * p)
+    return float(min(max(beta2, 0.0), delta2) / delta2)
+
+
+def shrink(cov: np.ndarray, intensity: float) -> np.ndarray:
+    mu = np.trace(cov) / len(cov)
+    return (1 - intensity) * cov + intensity * mu * np.eye(len(cov))
+
+
+def to_correlation(cov: np.ndarray) -> np.ndarray:
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.outer(std, std)
+    np.fill_diagonal(corr, 1.0)
+    return np.clip(corr, -1.0, 1.0)
+
+
+# ─── 层次聚类 ─────────────────────────────────────────────────
+
+def cluster_correlations(corr: np.ndarray, threshold: float = CROWDED_CORRELATION) -> List[List[int]]:
+    """
+    平均连接层次聚类：反复合并平均相关系数最高的两簇，直到最高值低于 threshold。
+    簇间相关按 Lance-Williams 公式以簇大小加权更新，整体 O(n³) 的矩阵运算，200 只标的毫秒级。
+    返回成员数 ≥ 2 的簇（下标列表，按簇大小降序）。
+    """
+    n = len(corr)
+    sim = np.where(np.isnan(corr), -np.inf, corr).astype(np.float64)
+    np.fill_diagonal(sim, -np.inf)
+    members = {i: [i] for i in range(n)}
+    active = np.ones(n, dtype=bool)
+
+    while True:
+        flat = int(np.argmax(sim))
+        a, b = divmod(flat, n)
+        if not np.isfinite(sim[a, b]) or sim[a, b] < threshold:
+            break
+        na, nb = len(members[a]), len(members[b])
+        merged = (na * sim[a] + nb * sim[b]) / (na + nb)
+        merged[~active] = -np.inf
+        sim[a, :] = merged
+        sim[:, a] = merged
+        sim[a, a] = -np.inf
+        sim[b, :] = -np.inf
+        sim[:, b] = -np.inf
+        active[b] = False
+        members[a] += members.pop(b)
+
+    groups = [sorted(m) for m in members.values() if len(m) >= 2]
+    groups.sort(key=len, reverse=True)
+    return groups
+
+
+# ─── 组合入口 ─────────────────────────────────────────────────
+
+def estimate_covariance(returns: np.ndarray, symbols: List[str], method: str = "sample",
+                        shrinkage: bool = False, halflife: float = DEFAULT_HALFLIFE,
+                        weights: Optional[Dict[str, float]] = None,
+                        cluster_threshold: float = CROWDED_CORRELATION) -> CovarianceEstimate:
+    """
+    returns: (T, N) 日收益率，允许 NaN；symbols 与列一一对应。
+    method="sample" 且不收缩时使用成对完整观测，其余情况使用完整行（见 complete_rows）。
+    """
+    if method not in ("sample", "ewma"):
+        raise ValueError(f"未知的估计方法: {method}")
+
+    intensity = 0.0
+    if method == "sample" and not shrinkage:
+        cov = pairwise_covariance(returns)
+        corr = pairwise_correlation(returns)
+        observations = int(np.count_nonzero(~np.isnan(returns).all(axis=1)))
+    else:
+        x = complete_rows(returns)
+        observations = len(x)
+        w = ewma_weights(len(x), halflife) if method == "ewma" else None
+        cov = weighted_covariance(x, w)
+        if shrinkage:
+            intensity = ledoit_wolf_intensity(x)
+            cov = shrink(cov, intensity)
+        corr = to_correlation(cov)
+
+    clusters = []
+    for group in cluster_correlations(corr, cluster_threshold):
+        sub = corr[np.ix_(group, group)]
+        k = len(group)
+        avg = (np.nansum(sub) - k) / (k * (k - 1))
+        clusters.append(CorrelationCluster(
+            symbols=[symbols[i] for i in group],
+            avg_correlation=round(float(avg), 3),
+            weight_pct=round(sum((weights or {}).get(symbols[i], 0.0) for i in group) * 100, 2),
+        ))
+
+    return CovarianceEstimate(
+        symbols=list(symbols), covariance=cov, correlation=corr, method=method,
+        shrinkage=round(intensity, 4), observations=observations, clusters=clusters,
+    )
+
+
+def high_correlation_pairs(corr: np.ndarray, symbols: List[str], threshold: float = 0.7) -> List[dict]:
+    """|ρ| ≥ threshold 的持仓对（上三角，一次向量化筛选），按 |ρ| 降序"""
+    rows, cols = np.triu_indices(len(symbols), k=1)
+    values = np.round(corr[rows, cols], 3)
+    hit = np.abs(values) >= threshold
+    pairs = [
+        {"pair": f"{symbols[i]} - {symbols[j]}", "correlation": float(v),
+         "warning": "高度正相关" if v > 0 else "高度负相关"}
+        for i, j, v in zip(rows[hit], cols[hit], values[hit])
+    ]
+    pairs.sort(key=lambda p: abs(p["correlation"]), reverse=True)
+    return pairs
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_clusters(clusters: List[dict]) -> str:
+    """clusters 为 CorrelationCluster 的字典形式（get_correlation_matrix 的输出）"""
+    if not clusters:
+        return "   ✅ 未发现高度相关的拥挤持仓组"
+    lines = []
+    for i, c in enumerate(clusters, 1):
+        weight = f"  合计权重 {c['weight_pct']:.1f}%" if c["weight_pct"] else ""
+        lines.append(f"   {i}. [{len(c['symbols'])}只] 平均相关 {c['avg_correlation']:+.2f}{weight}")
+        lines.append(f"      {', '.join(c['symbols'])}")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if action != "bench":
+        print(__doc__)
+        return
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.default_rng(0)
+
+    # 5 个行业因子 + 个股噪声，252 个交易日；部分标的缺少前 60 天数据
+    factors = rng.normal(0, 0.01, (252, 5))
+    loadings = np.zeros((n, 5))
+    loadings[np.arange(n), np.arange(n) % 5] = rng.uniform(0.5, 1.5, n)
+    returns = factors @ loadings.T + rng.normal(0, 0.01, (252, n))
+    returns[:60, ::7] = np.nan
+    symbols = [f"S{i:03d}" for i in range(n)]
+
+    print(f"⏱️ {n} 只标的 × 252 交易日")
+    for method, shrinkage in (("sample", False), ("sample", True), ("ewma", False), ("ewma", True)):
+        t0 = time.perf_counter()
+        est = estimate_covariance(returns, symbols, method=method, shrinkage=shrinkage)
+        pairs = high_correlation_pairs(est.correlation, symbols)
+        elapsed = time.perf_counter() - t0
+        label = f"{method}{' + Ledoit-Wolf' if shrinkage else ''}"
+        print(f"   {label:22s} {elapsed * 1000:7.1f}ms  收缩 {est.shrinkage:.3f}  "
+              f"拥挤组 {len(est.clusters)}  高相关对 {len(pairs)}")
+
+
+if __name__ == "__main__":
+    main()
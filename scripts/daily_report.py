@@ -6,6 +6,7 @@
 """
 
 import json
+import time
 import dataclasses
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -56,6 +57,61 @@ class DailyReport:
     vix_signal: str
     # 建议
     action_items: List[str] = field(default_factory=list)
+    # 各阶段耗时（秒）
+    stage_timings: Dict[str, float] = field(default_factory=dict)
+
+
+# 日报所需的全部 K 线序列：持仓与 SPY 共用 3 个月日线，VIX 需要 1 年做百分位
+_HOLDING_SERIES = ("3 M", "1 day")
+_VIX_SERIES = ("VIX", "1 Y", "1 day")
+_VIX_KEY = "^VIX"
+
+
+# ─── 工具函数 ─────────────────────────────────────────────────
+
+class _stage:
+    """累计某阶段耗时到 timings[name]（同名阶段可多次进入）"""
+
+    def __init__(self, timings: Dict[str, float], name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def _fetch_report_series(client, symbols: List[str]) -> Dict[str, List[dict]]:
+    """持仓 + SPY + VIX 一次并发拉取；客户端不支持多序列批量时逐个获取"""
+    requests = {sym: (sym, *_HOLDING_SERIES) for sym in list(symbols) + ["SPY"]}
+    requests[_VIX_KEY] = _VIX_SERIES
+
+    fetch_multi = getattr(client, "get_historical_data_multi", None)
+    if fetch_multi:
+        try:
+            return fetch_multi(requests)
+        except Exception:
+            pass
+
+    series = {}
+    for key, (sym, duration, bar_size) in requests.items():
+        try:
+            series[key] = client.get_historical_data(sym, duration=duration, bar_size=bar_size)
+        except Exception:
+            series[key] = []
+    return series
+
+
+def _day_change_pct(bars: Optional[List[dict]]) -> float:
+    """最近两根日线的涨跌幅 (%)"""
+    if not bars or len(bars) < 2:
+        return 0
+    prev = bars[-2]["close"]
+    curr = bars[-1]["close"]
+    return ((curr - prev) / prev * 100) if prev > 0 else 0
 
 
 # ─── 核心函数 ─────────────────────────────────────────────────
@@ -65,50 +121,49 @@ def generate_daily_report(client) -> Optional[DailyReport]:
     生成持仓日报
     """
     now = datetime.now()
-    positions = client.get_positions()
+    timings: Dict[str, float] = {}
+    with _stage(timings, "account"):
+        positions = client.get_positions()
     if not positions:
         return None
 
     stock_positions = [p for p in positions if p.sec_type == "STK"]
+    symbols = [p.symbol for p in stock_positions]
 
     # 组合概况
     total_invested = sum(abs(p.market_value) for p in positions)
-    try:
-        account_summary = client.get_account_summary()
-        total_nav = float(account_summary.get("NetLiquidation", total_invested))
-        cash_value = float(account_summary.get("TotalCashValue", 0))
-    except Exception:
-        total_nav = total_invested
-        cash_value = 0
+    with _stage(timings, "account"):
+        try:
+            account_summary = client.get_account_summary()
+            total_nav = float(account_summary.get("NetLiquidation", total_invested))
+            cash_value = float(account_summary.get("TotalCashValue", 0))
+        except Exception:
+            total_nav = total_invested
+            cash_value = 0
 
     cash_pct = (cash_value / total_nav * 100) if total_nav > 0 else 0
     total_pnl = sum(p.unrealized_pnl for p in positions if hasattr(p, "unrealized_pnl"))
     total_pnl_pct = (total_pnl / (total_invested - total_pnl) * 100) if total_invested > total_pnl else 0
 
+    # 一次并发拉取全部序列，供技术面 / 日涨跌 / 基准 / VIX 各阶段共用
+    with _stage(timings, "fetch"):
+        series = _fetch_report_series(client, symbols)
+
     # 技术面批量分析
     from technical_analysis import analyze_symbols_batch
-    symbols = [p.symbol for p in stock_positions]
 
     tech_batch = {}
-    if symbols:
-        try:
-            tech_batch = analyze_symbols_batch(client, symbols, period="3 M", bar_size="1 day")
-        except Exception:
-            pass
-
-    # 当日涨跌幅 (从 1D 历史数据推算)
-    day_changes = {}
-    for p in stock_positions:
-        try:
-            bars = client.get_historical_data(p.symbol, duration="5 D", bar_size="1 day")
-            if bars and len(bars) >= 2:
-                prev = bars[-2]["close"]
-                curr = bars[-1]["close"]
-                day_changes[p.symbol] = ((curr - prev) / prev * 100) if prev > 0 else 0
-            elif bars:
-                day_changes[p.symbol] = 0
-        except Exception:
-            day_changes[p.symbol] = 0
+    with _stage(timings, "technical"):
+        if symbols:
+            try:
+                tech_batch = analyze_symbols_batch(client, symbols, period=_HOLDING_SERIES[0],
+                                                   bar_size=_HOLDING_SERIES[1], prefetched=series)
+            except Exception:
+                pass
+
+    # 当日涨跌幅 (最近两根日线推算)
+    with _stage(timings, "day_change"):
+        day_changes = {p.symbol: _day_change_pct(series.get(p.symbol)) for p in stock_positions}
 
     # 构建持仓简报
     pos_briefs = []
@@ -171,21 +226,18 @@ def generate_daily_report(client) -> Optional[DailyReport]:
     spy_change = 0
     vix_level = 0
     vix_signal = "N/A"
-    try:
-        spy_bars = client.get_historical_data("SPY", duration="5 D", bar_size="1 day")
-        if spy_bars and len(spy_bars) >= 2:
-            spy_change = (spy_bars[-1]["close"] - spy_bars[-2]["close"]) / spy_bars[-2]["close"] * 100
-    except Exception:
-        pass
-
-    try:
-        from vix_dashboard import analyze_vix
-        vix_data = analyze_vix(client)
-        if vix_data:
-            vix_level = vix_data.current_vix
-            vix_signal = vix_data.fear_greed_signal
-    except Exception:
-        pass
+    with _stage(timings, "benchmark"):
+        spy_change = _day_change_pct(series.get("SPY"))
+
+    with _stage(timings, "vix"):
+        try:
+            from vix_dashboard import analyze_vix
+            vix_data = analyze_vix(client, bars=series.get(_VIX_KEY) or [])
+            if vix_data:
+                vix_level = vix_data.current_vix
+                vix_signal = vix_data.fear_greed_signal
+        except Exception:
+            pass
 
     # 行动建议
     action_items = []
@@ -200,15 +252,13 @@ def generate_daily_report(client) -> Optional[DailyReport]:
         action_items.append("😱 VIX 偏高，市场波动加剧，注意风险管理")
 
     # 财报预警
-    try:
-        from earnings_calendar import get_portfolio_earnings
-        events = get_portfolio_earnings(client)
-        upcoming = [e for e in events if e.get("days_until", 99) <= 7]
-        if upcoming:
-            for e in upcoming:
-                action_items.append(f"📅 {e.get('symbol', '?')} 将于 {e.get('days_until', '?')} 天后发财报，注意波动风险")
-    except Exception:
-        pass
+    with _stage(timings, "earnings"):
+        try:
+            from earnings_calendar import get_upcoming_earnings
+            for e in get_upcoming_earnings(client, days=7, include_watchlist=False):
+                action_items.append(f"📅 {e.symbol} 将于 {e.days_until} 天后发财报，注意波动风险")
+        except Exception:
+            pass
 
     return DailyReport(
         report_date=now.strftime("%Y-%m-%d"),
@@ -228,7 +278,8 @@ def generate_daily_report(client) -> Optional[DailyReport]:
         spy_change_pct=round(spy_change, 2),
         vix_level=round(vix_level, 2),
         vix_signal=vix_signal,
-        action_items=action_items
+        action_items=action_items,
+        stage_timings={k: round(v, 2) for k, v in timings.items()},
     )
 
 
@@ -278,6 +329,13 @@ def format_daily_report(r: DailyReport) -> str:
         for item in r.action_items:
             lines.append(f"     {item}")
 
+    if r.stage_timings:
+        labels = {"account": "账户", "fetch": "行情拉取", "technical": "技术面", "day_change": "日涨跌",
+                  "benchmark": "基准", "vix": "VIX", "earnings": "财报"}
+        parts = [f"{labels.get(k, k)} {v:.1f}s" for k, v in r.stage_timings.items()]
+        lines.append("")
+        lines.append(f"  ⏱️ 耗时: {' | '.join(parts)}  (合计 {sum(r.stage_timings.values()):.1f}s)")
+
     return "\n".join(lines)
 
 
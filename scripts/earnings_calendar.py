@@ -2,14 +2,15 @@
 """
 财报日历模块
 提供：个股及组合级财报日期查询、财报事件风险评估。
-数据源：Finviz fundamentals（Earnings Date 字段）。
+数据源：Finviz fundamentals（Earnings Date 字段），经本地财报索引（earnings_index.py）缓存，
+组合 / 自选股只批量抓取索引中缺失或过期的代码。
 所有函数接收 IBKRReadOnlyClient 实例（仅用于获取持仓），纯只读操作。
 """
 
 import json
 import dataclasses
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import date
 from typing import List, Optional, Dict
 
 
@@ -36,36 +37,11 @@ def _parse_earnings_date(raw: str) -> tuple:
     格式示例: "Jan 30 AMC", "Feb 05 BMO", "Apr 23", "-"
     返回 (days_until, timing)
     """
-    if not raw or raw == "-":
-        return -1, "Unknown"
-
-    raw = raw.strip()
-    timing = "Unknown"
-
-    # 提取 AMC/BMO 标记
-    if "AMC" in raw:
-        timing = "AMC"
-        raw = raw.replace("AMC", "").strip()
-    elif "BMO" in raw:
-        timing = "BMO"
-        raw = raw.replace("BMO", "").strip()
-
-    # 尝试解析日期
-    now = datetime.now()
-    for year in [now.year, now.year + 1]:
-        for fmt in ["%b %d", "%m/%d/%Y", "%Y-%m-%d"]:
-            try:
-                parsed = datetime.strptime(raw, fmt)
-                parsed = parsed.replace(year=year)
-                # 如果解析出的日期已经过了 30 天以上，可能是明年的
-                delta = (parsed - now).days
-                if delta < -30 and year == now.year:
-                    continue
-                return delta, timing
-            except ValueError:
-                continue
-
-    return -1, timing
+    from earnings_index import parse_earnings_field
+    parsed, timing = parse_earnings_field(raw)
+    if parsed is None:
+        return -1, timing
+    return (parsed - date.today()).days, timing
 
 
 def _classify_urgency(days: int) -> str:
@@ -80,38 +56,59 @@ def _classify_urgency(days: int) -> str:
         return "🟢 较远"
 
 
+def _event_from_entry(entry, today: Optional[date] = None) -> EarningsEvent:
+    """索引条目 → 财报事件（距今天数按查询当天计算）"""
+    days = entry.days_until(today)
+    return EarningsEvent(
+        symbol=entry.symbol,
+        earnings_date=entry.raw if entry.raw != "-" else "N/A",
+        days_until=days,
+        timing=entry.timing,
+        urgency=_classify_urgency(days),
+    )
+
+
+def _sort_events(events: List[EarningsEvent]) -> List[EarningsEvent]:
+    # 按距财报天数排序（未知日期放最后）
+    events.sort(key=lambda e: e.days_until if e.days_until >= 0 else 99999)
+    return events
+
+
+def _mark_held(event: EarningsEvent, position):
+    event.is_held = True
+    event.held_quantity = position.quantity
+    event.market_value = position.market_value
+
+
 def get_earnings_date(symbol: str) -> Optional[EarningsEvent]:
     """
-    获取单只股票的财报日期，数据源为 Finviz。
+    获取单只股票的财报日期，数据源为 Finviz（索引未过期时直接本地返回）。
     """
     try:
-        from finviz_data import get_finviz_fundamentals
-        data = get_finviz_fundamentals(symbol)
-        if not data:
-            return None
-
-        raw_date = data.get("Earnings Date", data.get("Earnings", ""))
-        if not raw_date or raw_date == "-":
-            return EarningsEvent(
-                symbol=symbol, earnings_date="N/A",
-                days_until=-1, timing="Unknown", urgency="❓ 未知"
-            )
-
-        days, timing = _parse_earnings_date(raw_date)
-        urgency = _classify_urgency(days)
-
-        return EarningsEvent(
-            symbol=symbol,
-            earnings_date=raw_date.strip(),
-            days_until=days,
-            timing=timing,
-            urgency=urgency
-        )
+        from earnings_index import get_earnings_index
+        index = get_earnings_index()
+        index.refresh([symbol])
+        entry = index.get(symbol)
+        return _event_from_entry(entry) if entry else None
     except Exception as e:
         print(f"⚠️ 获取 {symbol} 财报日期失败: {e}")
         return None
 
 
+def get_earnings_events(symbols: List[str]) -> Dict[str, EarningsEvent]:
+    """批量获取财报日期：一次性并发刷新过期代码，其余直接读索引"""
+    from earnings_index import get_earnings_index
+    index = get_earnings_index()
+    index.refresh(symbols)
+    today = date.today()
+    events = {}
+    for sym in symbols:
+        entry = index.get(sym)
+        if entry:
+            events[sym.upper()] = _event_from_entry(entry, today)
+    return events
+
+
 def get_portfolio_earnings(client) -> List[EarningsEvent]:
     """
     获取所有持仓的财报日历，按距财报日期排序。
@@ -122,17 +119,50 @@ def get_portfolio_earnings(client) -> List[EarningsEvent]:
     if not stock_positions:
         return []
 
+    by_symbol = get_earnings_events([p.symbol for p in stock_positions])
     events = []
     for p in stock_positions:
-        event = get_earnings_date(p.symbol)
+        event = by_symbol.get(p.symbol.upper())
         if event:
-            event.is_held = True
-            event.held_quantity = p.quantity
-            event.market_value = p.market_value
+            _mark_held(event, p)
             events.append(event)
 
-    # 按距财报天数排序（未知日期放最后）
-    events.sort(key=lambda e: e.days_until if e.days_until >= 0 else 99999)
+    return _sort_events(events)
+
+
+def _watchlist_symbols() -> List[str]:
+    try:
+        from scanner_enhanced import load_watchlist
+        return [item["symbol"] for item in load_watchlist().get("items", [])]
+    except Exception:
+        return []
+
+
+def get_upcoming_earnings(client=None, days: int = 14, include_watchlist: bool = True,
+                          symbols: Optional[List[str]] = None) -> List[EarningsEvent]:
+    """
+    持仓 + 自选股（+ 额外代码）中未来 days 天内发布财报的股票，按日期排序。
+    先增量刷新这些代码，再在索引上做日期区间查询。
+    """
+    from earnings_index import get_earnings_index
+
+    held = {}
+    if client is not None:
+        held = {p.symbol.upper(): p for p in client.get_positions() if p.sec_type == "STK"}
+    universe = list(held) + (_watchlist_symbols() if include_watchlist else []) + (symbols or [])
+    universe = list(dict.fromkeys(s.upper() for s in universe if s))
+    if not universe:
+        return []
+
+    index = get_earnings_index()
+    index.refresh(universe)
+    today = date.today()
+    events = []
+    for entry in index.upcoming(days, symbols=universe, today=today):
+        event = _event_from_entry(entry, today)
+        if entry.symbol in held:
+            _mark_held(event, held[entry.symbol])
+        events.append(event)
     return events
 
 
@@ -214,6 +244,31 @@ def format_portfolio_earnings(events: List[EarningsEvent]) -> str:
     return "\n".join(lines)
 
 
+def format_upcoming_earnings(events: List[EarningsEvent], days: int) -> str:
+    """格式化未来 N 天财报（持仓 + 自选股）"""
+    if not events:
+        return f"📅 未来 {days} 天: 持仓与自选股均无财报"
+
+    held = [e for e in events if e.is_held]
+    lines = [
+        f"📅 未来 {days} 天财报（持仓 + 自选股）",
+        "=" * 60,
+        f"  共 {len(events)} 只，其中持仓 {len(held)} 只，"
+        f"涉及市值 ${sum(abs(e.market_value) for e in held):,.0f}",
+        "",
+        f"{'标的':8s} {'财报日期':16s} {'距今':8s} {'时段':6s} {'来源':6s} {'持仓市值':>12s}",
+    ]
+    for e in events:
+        timing_short = {"AMC": "盘后", "BMO": "盘前", "Unknown": "待定"}.get(e.timing, "?")
+        source = "持仓" if e.is_held else "自选"
+        value = f"${e.market_value:>11,.0f}" if e.is_held else f"{'-':>12s}"
+        lines.append(
+            f"  {e.symbol:8s} {e.earnings_date:16s} {str(e.days_until) + '天':8s} "
+            f"{timing_short:6s} {source:6s} {value}"
+        )
+    return "\n".join(lines)
+
+
 # ─── 独立运行入口 ─────────────────────────────────────────────
 
 def main():
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+财报日期本地索引
+把 Finviz 基本面中的 Earnings 字段解析为具体日期，存入 ~/trading/cache/earnings.db（SQLite），
+并在内存中维护按日期排序的 (日期, 代码) 列表：
+  • "未来 N 天谁发财报" 通过二分查找定位区间，O(log n + k)
+  • 增量刷新：只重新抓取缺失或过期的代码，过期时间随财报远近而定
+    （日期已过 → 立即；两周内 → 12 小时；更远 → 3 天；日期未知 → 1 天）
+  • 需要刷新的代码经 get_finviz_fundamentals_batch 并发抓取（受 Finviz 限速器节流）
+
+用法:
+    python earnings_index.py stats                 # 索引条目与日期覆盖范围
+    python earnings_index.py refresh [SYMBOL...]   # 刷新指定代码（不带参数则刷新全部已索引代码）
+    python earnings_index.py upcoming [DAYS]       # 索引内未来 N 天（默认 14）的财报
+    python earnings_index.py bench                 # 对比二分区间查询与线性扫描
+    python earnings_index.py clear                 # 清空索引
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contract_cache import CACHE_DIR
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+EARNINGS_DB = os.path.join(CACHE_DIR, "earnings.db")
+
+_HOUR = 3600
+_DAY = 86400
+
+NEAR_DAYS = 14                 # 两周内的财报日期可能被公司调整，刷新更频繁
+NEAR_MAX_AGE = 12 * _HOUR
+FAR_MAX_AGE = 3 * _DAY
+UNKNOWN_MAX_AGE = 1 * _DAY
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS earnings (
+    symbol      TEXT PRIMARY KEY,
+    report_date TEXT,
+    timing      TEXT NOT NULL,
+    raw         TEXT NOT NULL,
+    fetched_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_earnings_date ON earnings (report_date);
+"""
+
+_MONTHS = {m: i for i, m in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+_MONTH_DAY_RE = re.compile(r"^([A-Z][a-z]{2})\s+(\d{1,2})(?:\s*,?\s*'?(\d{2,4}))?$")
+_FALLBACK_FORMATS = ("%m/%d/%Y", "%Y-%m-%d")
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class EarningsEntry:
+    symbol: str
+    report_date: Optional[str]   # ISO 日期，无法解析为 None
+    timing: str                  # "BMO" / "AMC" / "Unknown"
+    raw: str                     # Finviz 原始字段，如 "Jan 30 AMC"
+    fetched_at: float
+
+    def days_until(self, today: Optional[date] = None) -> int:
+        """距今天数，日期未知返回 -1"""
+        if not self.report_date:
+            return -1
+        today = today or date.today()
+        return (date.fromisoformat(self.report_date) - today).days
+
+
+# ─── 解析 ─────────────────────────────────────────────────────
+
+def parse_earnings_field(raw: str, today: Optional[date] = None) -> Tuple[Optional[date], str]:
+    """
+    解析 Finviz 的 Earnings 字段，返回 (财报日期, 时段)。
+    格式示例: "Jan 30 AMC", "Feb 05 BMO", "Apr 23", "-"。
+    "月 日" 格式没有年份：落在 30 天以前的视为明年。
+    """
+    if not raw or raw.strip() == "-":
+        return None, "Unknown"
+
+    text = raw.strip()
+    timing = "Unknown"
+    for tag in ("AMC", "BMO"):
+        if text.endswith(tag) or f" {tag}" in text:
+            timing = tag
+            text = text.replace(tag, "").strip()
+            break
+
+    today = today or date.today()
+    m = _MONTH_DAY_RE.match(text)
+    if m and m.group(1) in _MONTHS:
+        month, day = _MONTHS[m.group(1)], int(m.group(2))
+        year_text = m.group(3)
+        try:
+            if year_text:
+                year = int(year_text) + (2000 if len(year_text) == 2 else 0)
+                return date(year, month, day), timing
+            parsed = date(today.year, month, day)
+            if (parsed - today).days < -30:
+                parsed = date(today.year + 1, month, day)
+            return parsed, timing
+        except ValueError:
+            return None, timing
+
+    for fmt in _FALLBACK_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date(), timing
+        except ValueError:
+            continue
+    return None, timing
+
+
+def _max_age(entry: EarningsEntry, today: date) -> float:
+    """条目的有效期：财报越近越需要确认日期是否调整"""
+    days = entry.days_until(today)
+    if days < 0:
+        # 日期未知或已过（等待 Finviz 公布下一次日期）
+        return UNKNOWN_MAX_AGE if not entry.report_date else 0
+    return NEAR_MAX_AGE if days <= NEAR_DAYS else FAR_MAX_AGE
+
+
+# ─── 索引 ─────────────────────────────────────────────────────
+
+class EarningsIndex:
+    """
+    财报日期索引：SQLite 持久化 + 内存中按日期排序的列表。
+    首次访问时一次性从数据库加载，之后查询不再访问磁盘；刷新与写入加锁（batch 模式下多线程共用）。
+    """
+
+    def __init__(self, db_path: Optional[str] = EARNINGS_DB):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._entries: Optional[Dict[str, EarningsEntry]] = None
+        self._by_date: List[Tuple[str, str]] = []
+        self._lock = threading.RLock()
+        self.fetched = 0
+        self.fetch_failed = 0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库；磁盘不可写时退化为纯内存索引。返回的连接只能在持有 _lock 时使用"""
+        with self._lock:
+            if self._conn is None:
+                if not self.db_path:
+                    self._conn = False
+                    return None
+                try:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠️ 财报索引不可用，本次仅使用内存索引: {e}")
+                    self._conn = False
+            return self._conn or None
+
+    def _load(self) -> Dict[str, EarningsEntry]:
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self) -> Dict[str, EarningsEntry]:
+        if self._entries is None:
+            self._entries = {}
+            db = self._db()
+            if db:
+                for row in db.execute("SELECT symbol, report_date, timing, raw, fetched_at FROM earnings"):
+                    self._entries[row[0]] = EarningsEntry(*row)
+            self._by_date = sorted(
+                (e.report_date, e.symbol) for e in self._entries.values() if e.report_date
+            )
+        return self._entries
+
+    def _upsert(self, entries: List[EarningsEntry]):
+        with self._lock:
+            self._upsert_locked(entries)
+
+    def _upsert_locked(self, entries: List[EarningsEntry]):
+        current = self._load()
+        for entry in entries:
+            old = current.get(entry.symbol)
+            if old and old.report_date:
+                i = bisect_left(self._by_date, (old.report_date, old.symbol))
+                if i < len(self._by_date) and self._by_date[i] == (old.report_date, old.symbol):
+                    del self._by_date[i]
+            if entry.report_date:
+                insort(self._by_date, (entry.report_date, entry.symbol))
+            current[entry.symbol] = entry
+        db = self._db()
+        if db and entries:
+            db.executemany(
+                "INSERT OR REPLACE INTO earnings (symbol, report_date, timing, raw, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(e.symbol, e.report_date, e.timing, e.raw, e.fetched_at) for e in entries],
+            )
+            db.commit()
+
+    # ── 查询 ──
+
+    def get(self, symbol: str) -> Optional[EarningsEntry]:
+        return self._load().get(symbol.upper())
+
+    def upcoming(self, days: int, symbols: Optional[Iterable[str]] = None,
+                 today: Optional[date] = None) -> List[EarningsEntry]:
+        """未来 days 天内（含今天）发布财报的条目，按日期排序；symbols 限定范围"""
+        today = today or date.today()
+        wanted = {s.upper() for s in symbols} if symbols is not None else None
+        with self._lock:
+            entries = self._load_locked()
+            lo = bisect_left(self._by_date, (today.isoformat(), ""))
+            hi = bisect_right(self._by_date, ((today + timedelta(days=days)).isoformat(), "\uffff"))
+            return [entries[sym] for _, sym in self._by_date[lo:hi] if wanted is None or sym in wanted]
+
+    def stale_symbols(self, symbols: Iterable[str], today: Optional[date] = None) -> List[str]:
+        """缺失或超过有效期、需要重新抓取的代码"""
+        entries = self._load()
+        today = today or date.today()
+        now = time.time()
+        stale = []
+        for sym in dict.fromkeys(s.upper() for s in symbols if s):
+            entry = entries.get(sym)
+            if entry is None or now - entry.fetched_at > _max_age(entry, today):
+                stale.append(sym)
+        return stale
+
+    # ── 刷新 ──
+
+    def refresh(self, symbols: Iterable[str], force: bool = False) -> int:
+        """
+        增量刷新：只并发抓取缺失 / 过期的代码，返回实际更新的条目数。
+        网络抓取在锁外进行，结果再加锁写入；抓取失败（Finviz 返回空）时保留旧条目，下次调用再试。
+        """
+        symbols = list(dict.fromkeys(s.upper() for s in symbols if s))
+        with self._lock:
+            targets = symbols if force else self.stale_symbols(symbols)
+        if not targets:
+            return 0
+
+        today = date.today()
+        fetched = _fetch_fundamentals(targets)
+        updated = []
+        for sym in targets:
+            fetched_at, data = fetched.get(sym, (0.0, {}))
+            if not data:
+                continue
+            raw = (data.get("Earnings Date") or data.get("Earnings") or "").strip()
+            report_date, timing = parse_earnings_field(raw, today)
+            updated.append(EarningsEntry(
+                symbol=sym,
+                report_date=report_date.isoformat() if report_date else None,
+                timing=timing,
+                raw=raw or "-",
+                fetched_at=fetched_at,
+            ))
+
+        with self._lock:
+            current = self._load_locked()
+            # 并发刷新时不让较旧的抓取结果覆盖较新的条目
+            updated = [e for e in updated
+                       if e.symbol not in current or current[e.symbol].fetched_at <= e.fetched_at]
+            self.fetched += len(updated)
+            self.fetch_failed += len(targets) - len(updated)
+            self._upsert_locked(updated)
+        return len(updated)
+
+    # ── 维护 ──
+
+    def symbols(self) -> List[str]:
+        return sorted(self._load())
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._by_date = []
+            db = self._db()
+            if db:
+                db.execute("DELETE FROM earnings")
+                db.commit()
+
+    def stats(self) -> dict:
+        entries = self._load()
+        today = date.today()
+        return {
+            "db_path": self.db_path,
+            "symbols": len(entries),
+            "dated": len(self._by_date),
+            "first_date": self._by_date[0][0] if self._by_date else None,
+            "last_date": self._by_date[-1][0] if self._by_date else None,
+            "within_14d": len(self.upcoming(14, today=today)),
+            "stale": len(self.stale_symbols(entries, today)),
+        }
+
+
+def _fetch_fundamentals(symbols: List[str]) -> Dict[str, Tuple[float, dict]]:
+    """
+    返回 {代码: (抓取时刻, 基本面)}。
+    Finviz 缓存中仍在有效期内的条目直接复用，并沿用缓存条目自己的抓取时刻；
+    其余代码绕过缓存实时抓取（不使用陈旧窗口中的旧值），成功后回写缓存。
+    """
+    from finviz_cache import FINVIZ_CACHE_DISABLED, TTL, cache_key, get_finviz_cache
+    from finviz_data import get_finviz_fundamentals_batch
+
+    result: Dict[str, Tuple[float, dict]] = {}
+    cache = None if FINVIZ_CACHE_DISABLED else get_finviz_cache()
+    pending = []
+    for sym in symbols:
+        entry = cache.get("fundamentals", cache_key(sym)) if cache else None
+        if entry and entry[1] and time.time() - entry[0] <= TTL["fundamentals"][0]:
+            result[sym] = entry
+        else:
+            pending.append(sym)
+
+    now = time.time()
+    for sym, data in get_finviz_fundamentals_batch(pending, cached=False).items():
+        result[sym] = (now, data)
+        if cache and data:
+            cache.put("fundamentals", cache_key(sym), data)
+    return result
+
+
+_default_index: Optional[EarningsIndex] = None
+
+
+def get_earnings_index() -> EarningsIndex:
+    """进程级共享的索引实例"""
+    global _default_index
+    if _default_index is None:
+        _default_index = EarningsIndex()
+    return _default_index
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_index_stats(stats: dict) -> str:
+    lines = [f"📇 财报索引: {stats['db_path']}"]
+    if not stats["symbols"]:
+        lines.append("   (空)")
+        return "\n".join(lines)
+    lines.append(f"   代码 {stats['symbols']} 个，其中有日期 {stats['dated']} 个，待刷新 {stats['stale']} 个")
+    if stats["first_date"]:
+        lines.append(f"   日期范围: {stats['first_date']} ~ {stats['last_date']}，两周内 {stats['within_14d']} 个")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _bench(n: int = 5000, queries: int = 2000):
+    import random
+
+    today = date.today()
+    index = EarningsIndex(db_path=None)
+    index._upsert([
+        EarningsEntry(f"S{i:05d}", (today + timedelta(days=random.randint(-60, 120))).isoformat(),
+                      "AMC", "-", time.time())
+        for i in range(n)
+    ])
+    windows = [random.randint(1, 30) for _ in range(queries)]
+
+    t0 = time.perf_counter()
+    fast = [len(index.upcoming(d, today=today)) for d in windows]
+    t_bisect = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    slow = [sum(1 for e in index._entries.values() if 0 <= e.days_until(today) <= d) for d in windows]
+    t_linear = time.perf_counter() - t0
+
+    print(f"🧪 {n} 个代码，{queries} 次区间查询")
+    print(f"   二分区间: {t_bisect / queries * 1e6:8.1f} µs/次")
+    print(f"   线性扫描: {t_linear / queries * 1e6:8.1f} µs/次")
+    print(f"   结果一致: {'✅' if fast == slow else '❌'}")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    index = get_earnings_index()
+
+    if action == "stats":
+        print(format_index_stats(index.stats()))
+    elif action == "refresh":
+        symbols = [s.upper() for s in sys.argv[2:]] or index.symbols()
+        n = index.refresh(symbols, force=bool(sys.argv[2:]))
+        print(f"🔄 已更新 {n}/{len(symbols)} 个代码")
+    elif action == "upcoming":
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else 14
+        for e in index.upcoming(days):
+            print(f"   {e.report_date}  {e.symbol:8s} {e.timing:8s} {e.days_until()}天后")
+    elif action == "bench":
+        _bench()
+    elif action == "clear":
+        index.clear()
+        print("🧹 财报索引已清空")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
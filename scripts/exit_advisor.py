@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 """
 智能止盈止损建议器
-基于 ATR 波动、支撑阻力、持仓盈亏状态，给出个性化的止盈止损价位建议。
+基于 ATR 波动、支撑阻力、持仓盈亏状态，给出个性化的止盈止损价位建议；
+本地有该股的 IV 曲面（见 iv_surface.py）时，附加 30 天隐含波动 1σ 区间，不额外拉取期权链。
 所有函数接收 IBKRReadOnlyClient 实例，纯只读操作。
 """
 
 import json
+import math
 import dataclasses
 from dataclasses import dataclass, field
 from typing import Optional, List
@@ -18,7 +20,7 @@ class ExitLevel:
     """单个止损/止盈价位"""
     price: float
     label: str           # "ATR 2x止损" / "支撑位止损" / "目标价止盈" 等
-    method: str          # "atr" / "support" / "trailing" / "target"
+    method: str          # "atr" / "support" / "trailing" / "target" / "iv"
     distance_pct: float  # 距当前价的百分比 (负=止损, 正=止盈)
     rationale: str       # 设定原因
 
@@ -152,6 +154,34 @@ def calc_exit_levels(client, symbol: str) -> Optional[ExitAdvice]:
                 rationale=f"基于 ATR 的 {mult} 倍上行空间"
             ))
 
+    # ── 隐含波动区间（仅读本地曲面） ──
+    from iv_surface import cached_surface
+    surface = cached_surface(symbol)
+    if surface:
+        tenor = 30 / 365
+        iv_30 = surface.atm_iv(tenor)
+        if iv_30 > 0:
+            move = iv_30 * math.sqrt(tenor)
+            iv_low, iv_high = current * math.exp(-move), current * math.exp(move)
+            stop_losses.append(ExitLevel(
+                price=round(iv_low, 2),
+                label="隐含波动 1σ 下沿 (30天)",
+                method="iv",
+                distance_pct=round((iv_low - current) / current * 100, 2),
+                rationale=f"期权市场定价的 30 天平值 IV {iv_30:.1%}，约 68% 概率不跌破"
+            ))
+            take_profits.append(ExitLevel(
+                price=round(iv_high, 2),
+                label="隐含波动 1σ 上沿 (30天)",
+                method="iv",
+                distance_pct=round((iv_high - current) / current * 100, 2),
+                rationale=f"30 天平值 IV {iv_30:.1%} 对应的 1 倍标准差上行"
+            ))
+            if atr > 0:
+                realized = atr / current * math.sqrt(252)
+                if iv_30 > realized * 1.3:
+                    observations.append(f"🌋 30 天隐含波动 {iv_30:.0%} 明显高于 ATR 折算波动 {realized:.0%}，市场预期有事件性波动")
+
     # ── 持仓信息 ──
     avg_cost = None
     pnl_pct = None
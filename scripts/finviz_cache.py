@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Finviz 抓取结果本地缓存
+按数据类型设置有效期，把 finviz_data 的抓取结果以 JSON 存入 ~/trading/cache/finviz.db（SQLite）：
+  • 有效期内直接返回本地结果（毫秒级）
+  • 过期但仍在“可陈旧”窗口内：先返回旧值，后台线程重新抓取（stale-while-revalidate）
+  • 超出窗口或无缓存：同步抓取；抓取出错时退回旧值，不写入缓存
+  • 抓取成功但结果为空（无内部人交易、无同行等）也会缓存，但只在较短的负缓存有效期内有效
+进程内统计命中 / 陈旧命中 / 未命中 / 失败次数，退出时累加到数据库。
+
+用法:
+    python finviz_cache.py stats             # 各类型条目数、最老条目与累计命中率
+    python finviz_cache.py purge             # 清理超出陈旧窗口的条目
+    python finviz_cache.py clear [KIND]      # 清空全部或指定类型
+
+设置 IBKR_NO_FINVIZ_CACHE=1 可跳过缓存，始终实时抓取。
+"""
+
+import os
+import sys
+import json
+import atexit
+import sqlite3
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contract_cache import CACHE_DIR
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+FINVIZ_DB = os.path.join(CACHE_DIR, "finviz.db")
+FINVIZ_CACHE_DISABLED = os.getenv("IBKR_NO_FINVIZ_CACHE", "") == "1"
+
+_MIN = 60
+_HOUR = 3600
+_DAY = 86400
+
+# 数据类型 → (有效期, 过期后仍可先返回旧值的窗口)
+TTL: Dict[str, Tuple[float, float]] = {
+    "fundamentals":   (6 * _HOUR, 2 * _DAY),
+    "ratings":        (12 * _HOUR, 3 * _DAY),
+    "insider":        (6 * _HOUR, 2 * _DAY),
+    "insider_market": (30 * _MIN, 6 * _HOUR),
+    "peers":          (7 * _DAY, 30 * _DAY),
+    "news":           (15 * _MIN, 6 * _HOUR),
+    "market_news":    (10 * _MIN, 2 * _HOUR),
+}
+
+# 空结果（负缓存）的有效期，不超过该类型自身有效期，过期后同步重新抓取
+NEGATIVE_TTL = 30 * _MIN
+
+# 进程退出时最多等待后台刷新的秒数
+_REVALIDATE_JOIN_SEC = 3.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS finviz_entries (
+    kind       TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS finviz_metrics (
+    kind    TEXT PRIMARY KEY,
+    hits    INTEGER NOT NULL DEFAULT 0,
+    stale   INTEGER NOT NULL DEFAULT 0,
+    misses  INTEGER NOT NULL DEFAULT 0,
+    errors  INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_METRIC_FIELDS = ("hits", "stale", "misses", "errors")
+
+
+# ─── 缓存存储 ─────────────────────────────────────────────────
+
+def _is_empty(value) -> bool:
+    """空结果（市场新闻为各分类都为空的 dict）"""
+    if isinstance(value, dict) and value and all(isinstance(v, list) for v in value.values()):
+        return not any(value.values())
+    return not value
+
+
+_scrape = threading.local()
+
+
+def mark_scrape_failed():
+    """finviz_data 抓取出错（返回空值兜底）时调用：本线程这次抓取的结果不写入缓存"""
+    _scrape.failed = True
+
+
+def _run_loader(loader: Callable[[], object]) -> Tuple[object, bool]:
+    """调用 loader，返回 (结果, 抓取是否出错)"""
+    _scrape.failed = False
+    try:
+        value = loader()
+    finally:
+        failed, _scrape.failed = _scrape.failed, False
+    return value, failed
+
+
+class FinvizCache:
+    """
+    Finviz 结果缓存：内存字典 + SQLite 两级，线程安全（批量抓取在线程池中并发读写）。
+    内存中保存 JSON 文本，每次读取都解析出新对象，调用方修改返回值不会污染缓存。
+    """
+
+    def __init__(self, db_path: str = FINVIZ_DB):
+        self.db_path = db_path
+        self._memory: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._inflight: Dict[Tuple[str, str], threading.Thread] = {}
+        self.metrics: Dict[str, Dict[str, int]] = {}
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库；磁盘不可写时退化为纯内存缓存。返回的连接只能在持有 _lock 时使用"""
+        with self._lock:
+            if self._conn is None:
+                try:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠️ Finviz 缓存不可用，本次仅使用内存缓存: {e}")
+                    self._conn = False
+            return self._conn or None
+
+    def _count(self, kind: str, field: str):
+        with self._lock:
+            counters = self.metrics.setdefault(kind, dict.fromkeys(_METRIC_FIELDS, 0))
+            counters[field] += 1
+
+    def get(self, kind: str, key: str) -> Optional[Tuple[float, object]]:
+        """返回 (fetched_at, value)，value 为调用方独占的副本；无记录返回 None（不判断是否过期）"""
+        with self._lock:
+            cached = self._memory.get((kind, key))
+            if cached is None:
+                cached = self._load_row(kind, key)
+        return (cached[0], json.loads(cached[1])) if cached else None
+
+    def _load_row(self, kind: str, key: str) -> Optional[Tuple[float, str]]:
+        """从数据库读入内存（调用方持有 _lock）"""
+        db = self._db()
+        if not db:
+            return None
+        try:
+            row = db.execute(
+                "SELECT fetched_at, payload FROM finviz_entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row:
+            return None
+        self._memory[(kind, key)] = (row[0], row[1])
+        return self._memory[(kind, key)]
+
+    def put(self, kind: str, key: str, value):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            self._memory[(kind, key)] = (now, payload)
+            db = self._db()
+            if db:
+                try:
+                    db.execute("INSERT OR REPLACE INTO finviz_entries VALUES (?, ?, ?, ?)",
+                               (kind, key, payload, now))
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Finviz 缓存写入失败: {e}")
+
+    def fetch(self, kind: str, key: str, loader: Callable[[], object]):
+        """
+        按有效期 / 陈旧窗口返回缓存值或调用 loader 抓取。
+        抓取出错（loader 内调用了 mark_scrape_failed）时不写缓存，有旧值则退回旧值；
+        成功抓到的空结果照常写入，按 NEGATIVE_TTL 过期且不走陈旧窗口。
+        """
+        ttl, stale_window = TTL[kind]
+        entry = self.get(kind, key)
+        age = time.time() - entry[0] if entry else None
+        if entry and _is_empty(entry[1]):
+            ttl, stale_window = min(ttl, NEGATIVE_TTL), 0.0
+
+        if entry and age <= ttl:
+            self._count(kind, "hits")
+            return entry[1]
+        if entry and age <= ttl + stale_window:
+            self._count(kind, "stale")
+            self._revalidate(kind, key, loader)
+            return entry[1]
+
+        self._count(kind, "misses")
+        value, failed = _run_loader(loader)
+        if not failed:
+            self.put(kind, key, value)
+            return value
+        self._count(kind, "errors")
+        return entry[1] if entry else value
+
+    def _revalidate(self, kind: str, key: str, loader: Callable[[], object]):
+        """后台刷新过期条目；同一条目同时只有一个刷新线程"""
+        with self._lock:
+            running = self._inflight.get((kind, key))
+            if running and running.is_alive():
+                return
+
+            def refresh():
+                try:
+                    value, failed = _run_loader(loader)
+                    if not failed:
+                        self.put(kind, key, value)
+                    else:
+                        self._count(kind, "errors")
+                finally:
+                    with self._lock:
+                        self._inflight.pop((kind, key), None)
+
+            thread = threading.Thread(target=refresh, name=f"finviz-refresh-{kind}-{key}", daemon=True)
+            self._inflight[(kind, key)] = thread
+        thread.start()
+
+    def wait_refreshes(self, timeout: float = _REVALIDATE_JOIN_SEC):
+        """等待进行中的后台刷新（最多 timeout 秒），CLI 进程退出前调用"""
+        deadline = time.time() + timeout
+        with self._lock:
+            threads = list(self._inflight.values())
+        for t in threads:
+            t.join(max(0.0, deadline - time.time()))
+
+    def flush_metrics(self):
+        """把本进程的计数累加到数据库"""
+        with self._lock:
+            pending, self.metrics = self.metrics, {}
+            db = self._db()
+            if not db or not pending:
+                return
+            try:
+                for kind, c in pending.items():
+                    db.execute("INSERT OR IGNORE INTO finviz_metrics (kind) VALUES (?)", (kind,))
+                    db.execute(
+                        "UPDATE finviz_metrics SET hits = hits + ?, stale = stale + ?, misses = misses + ?, "
+                        "errors = errors + ? WHERE kind = ?",
+                        (c["hits"], c["stale"], c["misses"], c["errors"], kind),
+                    )
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def purge(self) -> int:
+        """删除超出陈旧窗口的条目，返回删除数量"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            db = self._db()
+            if not db:
+                return 0
+            for kind, (ttl, stale_window) in TTL.items():
+                cur = db.execute("DELETE FROM finviz_entries WHERE kind = ? AND fetched_at < ?",
+                                 (kind, now - ttl - stale_window))
+                removed += cur.rowcount
+            # 过期的空结果不会再被返回，提前清理
+            empty = ("[]", "{}", json.dumps({"news": [], "blogs": []}))
+            cur = db.execute("DELETE FROM finviz_entries WHERE fetched_at < ? AND payload IN (?, ?, ?)",
+                             (now - NEGATIVE_TTL, *empty))
+            removed += cur.rowcount
+            # 已取消缓存的类型（如旧版本写入的 screen）一并清理
+            cur = db.execute(f"DELETE FROM finviz_entries WHERE kind NOT IN ({','.join('?' * len(TTL))})",
+                             tuple(TTL))
+            removed += cur.rowcount
+            db.commit()
+            self._memory = {k: v for k, v in self._memory.items()
+                            if k[0] in TTL and now - v[0] <= sum(TTL[k[0]])
+                            and not (v[1] in empty and now - v[0] > NEGATIVE_TTL)}
+        return removed
+
+    def clear(self, kind: Optional[str] = None):
+        with self._lock:
+            db = self._db()
+            self._memory = {k: v for k, v in self._memory.items() if kind and k[0] != kind}
+            if db:
+                if kind:
+                    db.execute("DELETE FROM finviz_entries WHERE kind = ?", (kind,))
+                else:
+                    db.execute("DELETE FROM finviz_entries")
+                db.commit()
+
+    def stats(self) -> dict:
+        """各类型条目数 / 新鲜条目数 / 最老条目年龄，以及累计命中统计（含本进程未落盘部分）"""
+        result = {"db_path": self.db_path, "kinds": {}}
+        now = time.time()
+        totals = {k: dict.fromkeys(_METRIC_FIELDS, 0) for k in TTL}
+        with self._lock:
+            db = self._db()
+            if db:
+                for kind, *counts in db.execute("SELECT kind, hits, stale, misses, errors FROM finviz_metrics"):
+                    totals.setdefault(kind, dict.fromkeys(_METRIC_FIELDS, 0))
+                    for f, n in zip(_METRIC_FIELDS, counts):
+                        totals[kind][f] += n
+            for kind, c in self.metrics.items():
+                totals.setdefault(kind, dict.fromkeys(_METRIC_FIELDS, 0))
+                for f in _METRIC_FIELDS:
+                    totals[kind][f] += c[f]
+
+            for kind, (ttl, _) in TTL.items():
+                entries = fresh = 0
+                oldest = 0.0
+                if db:
+                    entries, fresh, oldest_ts = db.execute(
+                        "SELECT COUNT(*), SUM(fetched_at >= ?), MIN(fetched_at) FROM finviz_entries WHERE kind = ?",
+                        (now - ttl, kind),
+                    ).fetchone()
+                    oldest = now - oldest_ts if oldest_ts else 0.0
+                result["kinds"][kind] = {"entries": entries or 0, "fresh": fresh or 0,
+                                         "oldest_sec": oldest, "ttl_sec": ttl, **totals[kind]}
+        return result
+
+
+_default_cache: Optional[FinvizCache] = None
+
+
+def get_finviz_cache() -> FinvizCache:
+    """进程级共享的缓存实例；首次创建时注册退出钩子（等待后台刷新、落盘统计）"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FinvizCache()
+
+        def _on_exit(cache=_default_cache):
+            cache.wait_refreshes()
+            cache.flush_metrics()
+
+        atexit.register(_on_exit)
+    return _default_cache
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def cache_key(*args) -> str:
+    """缓存键：位置参数统一大写后以 | 连接"""
+    return "|".join(str(a).upper() for a in args)
+
+
+def finviz_cached(kind: str):
+    """
+    finviz_data 抓取函数的缓存装饰器：以位置参数（股票代码统一大写）作为缓存键。
+    被装饰函数仍可通过 .uncached 直接实时抓取。
+    """
+    if kind not in TTL:
+        raise ValueError(f"未知的 Finviz 缓存类型: {kind}")
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            if FINVIZ_CACHE_DISABLED:
+                return func(*args)
+            return get_finviz_cache().fetch(kind, cache_key(*args), lambda: func(*args))
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def _fmt_age(sec: float) -> str:
+    if sec >= _DAY:
+        return f"{sec / _DAY:.1f}天"
+    if sec >= _HOUR:
+        return f"{sec / _HOUR:.1f}小时"
+    return f"{sec / _MIN:.0f}分钟"
+
+
+def format_cache_stats(stats: dict) -> str:
+    lines = [
+        f"🗂️ Finviz 缓存: {stats['db_path']}",
+        f"   {'类型':<16}{'条目':>6}{'新鲜':>6}{'有效期':>10}{'最老':>10}{'命中':>8}{'陈旧':>6}{'未命中':>8}{'失败':>6}{'命中率':>8}",
+    ]
+    for kind, s in stats["kinds"].items():
+        lookups = s["hits"] + s["stale"] + s["misses"]
+        rate = f"{(s['hits'] + s['stale']) / lookups:.0%}" if lookups else "-"
+        oldest = _fmt_age(s["oldest_sec"]) if s["entries"] else "-"
+        lines.append(
+            f"   {kind:<16}{s['entries']:>6}{s['fresh']:>6}{_fmt_age(s['ttl_sec']):>10}{oldest:>10}"
+            f"{s['hits']:>8}{s['stale']:>6}{s['misses']:>8}{s['errors']:>6}{rate:>8}"
+        )
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    args = sys.argv[1:]
+    action = args[0] if args else "stats"
+    cache = get_finviz_cache()
+    if action == "stats":
+        print(format_cache_stats(cache.stats()))
+    elif action == "purge":
+        print(f"🧹 已清理 {cache.purge()} 条过期条目")
+    elif action == "clear":
+        kind = args[1] if len(args) > 1 else None
+        if kind and kind not in TTL:
+            print(f"❌ 未知类型 {kind}，可选: {', '.join(TTL)}")
+            return
+        cache.clear(kind)
+        print(f"🗑️ 已清空 {kind or '全部'} Finviz 缓存")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
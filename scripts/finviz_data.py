@@ -3,16 +3,26 @@
 Finviz 数据模块
 从 finviz.com 获取补充数据：基本面、分析师评级、内部人交易、同行公司、新闻。
 所有函数均为独立 try/except，失败返回空值，不影响 IBKR 核心功能。
+抓取结果按数据类型缓存在本地（见 finviz_cache.py），重复查询同一股票直接命中缓存。
+所有实际请求经过共享的自适应限速器（见 finviz_limiter.py），不再手动 sleep。
 
 ⚠️ 数据来源为 HTML 爬虫，Finviz 网站改版可能导致功能失效。
 """
 
-import time
+import os
+import sys
 from typing import List, Dict, Optional
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from finviz_cache import finviz_cached, mark_scrape_failed
+from finviz_limiter import finviz_limited, get_finviz_limiter, format_limiter_stats
+
 
 # ─── 基本面 ──────────────────────────────────────────────────
 
+@finviz_cached("fundamentals")
+@finviz_limited
 def get_finviz_fundamentals(symbol: str) -> Dict[str, str]:
     """
     获取 Finviz 60+ 字段基本面数据。
@@ -28,18 +38,26 @@ def get_finviz_fundamentals(symbol: str) -> Dict[str, str]:
         return data if data else {}
     except Exception as e:
         print(f"⚠️ Finviz 基本面获取失败 ({symbol}): {e}")
+        mark_scrape_failed()
         return {}
 
-def get_finviz_fundamentals_batch(symbols: List[str], max_workers: int = 5) -> Dict[str, Dict[str, str]]:
-    """并发批量获取多只股票的基本面，极大提升效率"""
+def get_finviz_fundamentals_batch(symbols: List[str], max_workers: Optional[int] = None,
+                                  cached: bool = True) -> Dict[str, Dict[str, str]]:
+    """
+    并发批量获取多只股票的基本面。
+    线程数只是上限，实际在途请求数与速率由限速器按 Finviz 的限流反馈自适应调整。
+    cached=False 时绕过本地缓存实时抓取（仍经过限速器）。
+    """
     import concurrent.futures
     results = {}
     
     if not symbols:
         return results
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_symbol = {executor.submit(get_finviz_fundamentals, sym): sym for sym in symbols}
+    workers = min(max_workers or get_finviz_limiter().max_concurrency, len(symbols))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        fetch = get_finviz_fundamentals if cached else get_finviz_fundamentals.uncached
+        future_to_symbol = {executor.submit(fetch, sym): sym for sym in symbols}
         for future in concurrent.futures.as_completed(future_to_symbol):
             sym = future_to_symbol[future]
             try:
@@ -120,6 +138,8 @@ def format_finviz_fundamentals(data: Dict[str, str], symbol: str) -> str:
 
 # ─── 分析师评级 ───────────────────────────────────────────────
 
+@finviz_cached("ratings")
+@finviz_limited
 def get_finviz_ratings(symbol: str) -> List[Dict]:
     """
     获取分析师评级历史。
@@ -143,6 +163,7 @@ def get_finviz_ratings(symbol: str) -> List[Dict]:
         return records
     except Exception as e:
         print(f"⚠️ Finviz 评级获取失败 ({symbol}): {e}")
+        mark_scrape_failed()
         return []
 
 
@@ -168,6 +189,8 @@ def format_ratings(ratings: List[Dict], symbol: str) -> str:
 
 # ─── 内部人交易 ───────────────────────────────────────────────
 
+@finviz_cached("insider")
+@finviz_limited
 def get_finviz_insider(symbol: str) -> List[Dict]:
     """
     获取个股内部人交易记录。
@@ -184,9 +207,12 @@ def get_finviz_insider(symbol: str) -> List[Dict]:
         return df.to_dict("records")
     except Exception as e:
         print(f"⚠️ Finviz 内部人交易获取失败 ({symbol}): {e}")
+        mark_scrape_failed()
         return []
 
 
+@finviz_cached("insider_market")
+@finviz_limited
 def get_finviz_insider_market(option: str = "latest") -> List[Dict]:
     """
     获取全市场内部人交易。
@@ -203,6 +229,7 @@ def get_finviz_insider_market(option: str = "latest") -> List[Dict]:
         return df.to_dict("records")
     except Exception as e:
         print(f"⚠️ Finviz 全市场内部人数据获取失败: {e}")
+        mark_scrape_failed()
         return []
 
 
@@ -240,6 +267,8 @@ def format_insider(records: List[Dict], title: str) -> str:
 
 # ─── 同行公司 ────────────────────────────────────────────────
 
+@finviz_cached("peers")
+@finviz_limited
 def get_finviz_peers(symbol: str) -> List[str]:
     """获取同行业竞品公司列表"""
     try:
@@ -251,6 +280,7 @@ def get_finviz_peers(symbol: str) -> List[str]:
         return peers if peers else []
     except Exception as e:
         print(f"⚠️ Finviz 同行公司获取失败 ({symbol}): {e}")
+        mark_scrape_failed()
         return []
 
 
@@ -268,6 +298,8 @@ def format_peers(peers: List[str], symbol: str) -> str:
 
 # ─── 新闻 ────────────────────────────────────────────────────
 
+@finviz_cached("news")
+@finviz_limited
 def get_finviz_news(symbol: str) -> List[Dict]:
     """获取个股新闻"""
     try:
@@ -288,9 +320,12 @@ def get_finviz_news(symbol: str) -> List[Dict]:
         return records
     except Exception as e:
         print(f"⚠️ Finviz 新闻获取失败 ({symbol}): {e}")
+        mark_scrape_failed()
         return []
 
 
+@finviz_cached("market_news")
+@finviz_limited
 def get_finviz_market_news() -> Dict[str, List[Dict]]:
     """
     获取全市场新闻。
@@ -310,6 +345,7 @@ def get_finviz_market_news() -> Dict[str, List[Dict]]:
         return result
     except Exception as e:
         print(f"⚠️ Finviz 市场新闻获取失败: {e}")
+        mark_scrape_failed()
         return {"news": [], "blogs": []}
 
 
@@ -353,30 +389,24 @@ def main():
     else:
         print("   ❌ 失败")
 
-    time.sleep(0.5)
-
     print("\n2. 分析师评级...")
     ratings = get_finviz_ratings(symbol)
     print(f"   ✅ {len(ratings)} 条评级" if ratings else "   ❌ 失败")
 
-    time.sleep(0.5)
-
     print("\n3. 内部人交易...")
     insider = get_finviz_insider(symbol)
     print(f"   ✅ {len(insider)} 条记录" if insider else "   ❌ 失败")
 
-    time.sleep(0.5)
-
     print("\n4. 同行公司...")
     peers = get_finviz_peers(symbol)
     print(f"   ✅ {peers}" if peers else "   ❌ 失败")
 
-    time.sleep(0.5)
-
     print("\n5. 个股新闻...")
     news = get_finviz_news(symbol)
     print(f"   ✅ {len(news)} 条新闻" if news else "   ❌ 失败")
 
+    print()
+    print(format_limiter_stats(get_finviz_limiter().stats()))
     print("\n✅ 测试完成")
 
 
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Finviz 自适应限速器
+所有 finviz.com 请求（个股页、全市场内部人、新闻、选股分页）统一经过一个共享的限速 session：
+  • 令牌桶控制请求速率，允许少量突发
+  • 并发槽位按 AIMD 调整：请求成功时加性增长，遇到 HTTP 429 / Cloudflare 拦截 / 超时时速率与并发减半
+  • 失败请求按带抖动的指数退避重试（优先遵循 Retry-After）
+  • 连续拥塞达到阈值时熔断，冷却期内直接失败（由缓存退回旧值），冷却后放行单个探测请求
+学到的速率与并发上限在进程退出时写入 ~/trading/cache/finviz_limiter.json，下次从该值起步。
+
+用法:
+    python finviz_limiter.py stats     # 上次保存的速率、并发与累计计数
+    python finviz_limiter.py reset     # 清除学到的状态，恢复默认起步值
+    python finviz_limiter.py bench     # 用模拟限流服务器验证收敛行为
+
+设置 IBKR_NO_FINVIZ_LIMITER=1 可关闭（退回 finvizfinance 自带的重试逻辑）。
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import threading
+from collections import deque
+from functools import wraps
+from typing import Callable, Deque, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contract_cache import CACHE_DIR
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+LIMITER_STATE = os.path.join(CACHE_DIR, "finviz_limiter.json")
+LIMITER_DISABLED = os.getenv("IBKR_NO_FINVIZ_LIMITER", "") == "1"
+
+INITIAL_RATE = float(os.getenv("IBKR_FINVIZ_RATE", "2.0"))       # 请求/秒
+MIN_RATE = 0.2
+MAX_RATE = float(os.getenv("IBKR_FINVIZ_MAX_RATE", "10.0"))
+RATE_STEP = 0.1                                                  # 每次成功的加性增量
+BURST = 3                                                        # 令牌桶容量
+
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = int(os.getenv("IBKR_FINVIZ_MAX_CONCURRENCY", "8"))
+DECREASE_FACTOR = 0.5
+DECREASE_HOLD_SEC = 1.0        # 同一波并发请求一起被限流时只减半一次
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_CAP_SEC = 16.0
+RETRY_AFTER_CAP_SEC = 30.0
+
+BREAKER_THRESHOLD = 5          # 连续这么多个请求重试耗尽仍失败即熔断
+BREAKER_COOLDOWN_SEC = 60.0
+BREAKER_COOLDOWN_CAP_SEC = 600.0
+
+STATE_MAX_AGE_SEC = 86400      # 超过一天的学习结果不再沿用
+
+_THROTTLE_STATUS = (429, 503)
+_LATENCY_SAMPLES = 200
+
+
+class FinvizCircuitOpen(Exception):
+    """熔断期间拒绝发出的请求"""
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+# NamedTuple 而非 dataclass：本模块在每条 Finviz 命令的启动路径上，避免导入 dataclasses / inspect
+class LimiterStats(NamedTuple):
+    state: str                   # closed / open / half_open
+    rate: float                  # 当前令牌桶速率（请求/秒）
+    concurrency: int             # 当前并发上限
+    inflight: int
+    max_inflight: int
+    requests: int
+    successes: int
+    throttled: int               # 429 / 503 / Cloudflare 拦截
+    timeouts: int
+    errors: int                  # 连接错误等其他异常
+    retries: int
+    rejected: int                # 熔断期间直接拒绝
+    breaker_trips: int
+    wait_sec: float              # 等待令牌与并发槽位的累计时间
+    avg_latency_ms: float
+    p95_latency_ms: float
+    throughput: float            # 本进程成功请求数 / 运行秒数
+
+
+# ─── 限速器 ───────────────────────────────────────────────────
+
+def _is_blocked(response) -> bool:
+    """429 / 503 或 Cloudflare 质询页都视为拥塞信号"""
+    status = getattr(response, "status_code", 200)
+    if status in _THROTTLE_STATUS:
+        return True
+    if status == 403:
+        headers = getattr(response, "headers", None) or {}
+        if headers.get("cf-mitigated") == "challenge":
+            return True
+        body = getattr(response, "text", "") or ""
+        return "Just a moment" in body or "cf-chl" in body
+    return False
+
+
+def _retry_after(response) -> float:
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if value and value.replace(".", "", 1).isdigit():
+        return min(float(value), RETRY_AFTER_CAP_SEC)
+    return 0.0
+
+
+class FinvizLimiter:
+    """
+    实现 requests.Session 的 get 接口，作为 finvizfinance.util 的共享 session。
+    线程安全：批量抓取的线程池与缓存的后台刷新线程共用同一个实例。
+    """
+
+    def __init__(self, session=None, state_path: str = LIMITER_STATE):
+        self.session = session
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+
+        self.rate = INITIAL_RATE
+        self.concurrency = float(INITIAL_CONCURRENCY)
+        self._tokens = float(BURST)
+        self._refilled_at = time.monotonic()
+        self._last_decrease = 0.0
+        self.inflight = 0
+
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._cooldown = BREAKER_COOLDOWN_SEC
+        self._probing = False
+
+        self.started_at = time.monotonic()
+        self.counters = dict.fromkeys(
+            ("requests", "successes", "throttled", "timeouts", "errors",
+             "retries", "rejected", "breaker_trips"), 0)
+        self.max_inflight = 0
+        self.wait_sec = 0.0
+        self._latencies: Deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._load_state()
+
+    @property
+    def max_concurrency(self) -> int:
+        return MAX_CONCURRENCY
+
+    # ── 持久化 ──
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if time.time() - saved.get("saved_at", 0) > STATE_MAX_AGE_SEC:
+            return
+        self.rate = min(max(float(saved.get("rate", INITIAL_RATE)), MIN_RATE), MAX_RATE)
+        self.concurrency = min(max(float(saved.get("concurrency", INITIAL_CONCURRENCY)), 1.0),
+                               MAX_CONCURRENCY)
+
+    def save_state(self):
+        """保存学到的速率与并发，并累加本进程计数"""
+        if not self.counters["requests"]:
+            return
+        try:
+            with open(self.state_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        totals = saved.get("totals", {})
+        for name, value in self.counters.items():
+            totals[name] = totals.get(name, 0) + value
+        payload = {
+            "saved_at": time.time(),
+            "rate": round(self.rate, 3),
+            "concurrency": round(self.concurrency, 2),
+            "totals": totals,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+        for name in self.counters:
+            self.counters[name] = 0
+
+    # ── 熔断 ──
+
+    def _admit(self):
+        """熔断打开时拒绝；冷却结束后只放行一个探测请求"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self._cooldown:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.counters["rejected"] += 1
+        remaining = max(0.0, self._cooldown - (time.monotonic() - self._opened_at))
+        raise FinvizCircuitOpen(f"Finviz 请求熔断中，{remaining:.0f}s 后重试")
+
+    # ── 令牌与并发槽位 ──
+
+    def _acquire(self):
+        t0 = time.monotonic()
+        with self._slots:
+            while self.inflight >= max(1, int(self.concurrency)):
+                self._slots.wait()
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(BURST, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.wait_sec += now - t0
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def _release(self):
+        with self._slots:
+            self.inflight -= 1
+            self._slots.notify_all()
+
+    # ── AIMD ──
+
+    def _on_success(self, latency: float):
+        with self._slots:
+            self.counters["successes"] += 1
+            self._latencies.append(latency)
+            self._consecutive = 0
+            if self.state != "closed":
+                self.state = "closed"
+                self._cooldown = BREAKER_COOLDOWN_SEC
+            self.rate = min(MAX_RATE, self.rate + RATE_STEP)
+            self.concurrency = min(MAX_CONCURRENCY, self.concurrency + 1 / self.concurrency)
+            self._slots.notify_all()
+
+    def _on_congestion(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_HOLD_SEC:
+                self._last_decrease = now
+                self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                self.concurrency = max(1.0, self.concurrency * DECREASE_FACTOR)
+                self._tokens = min(self._tokens, 0.0)
+            if self.state == "half_open":
+                # 探测失败：重新熔断，冷却时间翻倍
+                self._cooldown = min(self._cooldown * 2, BREAKER_COOLDOWN_CAP_SEC)
+                self._trip(now)
+
+    def _on_failure(self):
+        """重试耗尽仍失败的请求计入熔断计数"""
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "closed" and self._consecutive >= BREAKER_THRESHOLD:
+                self._trip(time.monotonic())
+
+    def _trip(self, now: float):
+        self.state = "open"
+        self._opened_at = now
+        self._probing = False
+        self.counters["breaker_trips"] += 1
+
+    # ── session 接口 ──
+
+    def _session(self):
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        return self.session
+
+    def get(self, url, **kwargs):
+        """
+        限速后发出 GET。拥塞响应按抖动退避重试，重试耗尽后原样返回最后一次响应
+        （或抛出最后一次超时），由 finvizfinance 照常转换为异常。
+        """
+        import requests
+
+        session = self._session()
+        last_response = None
+        for attempt in range(MAX_ATTEMPTS):
+            self._admit()
+            self._acquire()
+            with self._lock:
+                self.counters["requests"] += 1
+                if attempt:
+                    self.counters["retries"] += 1
+            t0 = time.monotonic()
+            error = None
+            try:
+                last_response = session.get(url, **kwargs)
+            except requests.exceptions.Timeout as e:
+                error, counter = e, "timeouts"
+            except requests.exceptions.ConnectionError as e:
+                error, counter = e, "errors"
+            finally:
+                self._release()
+
+            if error is None and not _is_blocked(last_response):
+                self._on_success(time.monotonic() - t0)
+                return last_response
+
+            self._on_congestion(counter if error is not None else "throttled")
+            if attempt == MAX_ATTEMPTS - 1:
+                self._on_failure()
+                break
+            backoff = random.uniform(0, min(BACKOFF_CAP_SEC, BACKOFF_BASE_SEC * 2 ** attempt))
+            time.sleep(max(backoff, _retry_after(last_response) if error is None else 0.0))
+
+        if error is not None:
+            raise error
+        return last_response
+
+    # ── 指标 ──
+
+    def stats(self) -> LimiterStats:
+        with self._lock:
+            lat = sorted(self._latencies)
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            return LimiterStats(
+                state=self.state,
+                rate=round(self.rate, 2),
+                concurrency=max(1, int(self.concurrency)),
+                inflight=self.inflight,
+                max_inflight=self.max_inflight,
+                wait_sec=round(self.wait_sec, 2),
+                avg_latency_ms=round(sum(lat) / len(lat) * 1000, 1) if lat else 0.0,
+                p95_latency_ms=round(lat[int(0.95 * (len(lat) - 1))] * 1000, 1) if lat else 0.0,
+                throughput=round(self.counters["successes"] / elapsed, 2),
+                **self.counters,
+            )
+
+
+# ─── 全局实例 ─────────────────────────────────────────────────
+
+_limiter: Optional[FinvizLimiter] = None
+_installed = False
+
+
+def get_finviz_limiter() -> FinvizLimiter:
+    """进程级单例，退出时保存学到的速率"""
+    global _limiter
+    if _limiter is None:
+        _limiter = FinvizLimiter()
+        atexit.register(_limiter.save_state)
+    return _limiter
+
+
+def install_finviz_limiter() -> Optional[FinvizLimiter]:
+    """
+    把限速器注册为 finvizfinance 的共享 session（幂等）。
+    重试交给限速器负责，因此关闭 finvizfinance 自带的重试，避免双重退避。
+    旧版 finvizfinance 没有 set_session 时不做任何事。
+    """
+    global _installed
+    if _installed:
+        return _limiter
+    _installed = True
+    if LIMITER_DISABLED:
+        return None
+    try:
+        from finvizfinance import util
+    except ImportError:
+        return None
+    if not hasattr(util, "set_session"):
+        print("⚠️ finvizfinance 版本过旧（无 set_session），Finviz 限速器未启用")
+        return None
+    limiter = get_finviz_limiter()
+    current = util.get_session()
+    if current is not limiter:
+        limiter.session = current
+        util.set_session(limiter)
+    util.MAX_RETRIES = 0
+    return limiter
+
+
+def finviz_limited(fn: Callable) -> Callable:
+    """finviz_data 抓取函数的装饰器：首次调用时安装限速器"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        install_finviz_limiter()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_limiter_stats(stats: LimiterStats) -> str:
+    state_label = {"closed": "🟢 正常", "open": "🔴 熔断", "half_open": "🟡 探测"}[stats.state]
+    lines = [
+        "🚦 Finviz 限速器",
+        "=" * 55,
+        f"  状态: {state_label}   速率: {stats.rate:.2f} 次/秒   并发上限: {stats.concurrency}",
+        f"  请求 {stats.requests}  成功 {stats.successes}  重试 {stats.retries}  "
+        f"限流 {stats.throttled}  超时 {stats.timeouts}  错误 {stats.errors}",
+        f"  熔断 {stats.breaker_trips} 次，拒绝 {stats.rejected} 次   最大在途 {stats.max_inflight}",
+    ]
+    if stats.successes:
+        lines.append(
+            f"  延迟 平均 {stats.avg_latency_ms:.0f}ms / P95 {stats.p95_latency_ms:.0f}ms   "
+            f"排队 {stats.wait_sec:.1f}s   吞吐 {stats.throughput:.2f} 次/秒"
+        )
+    return "\n".join(lines)
+
+
+def load_limiter_state(path: str = LIMITER_STATE) -> dict:
+    """读取上次保存的学习状态，无记录返回空 dict"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def format_saved_state(saved: dict) -> str:
+    if not saved:
+        return f"🚦 Finviz 限速器: 暂无学习记录，起步速率 {INITIAL_RATE:.2f} 次/秒，并发 {INITIAL_CONCURRENCY}"
+    age_h = (time.time() - saved.get("saved_at", 0)) / 3600
+    totals = saved.get("totals", {})
+    stale = "（已过期，下次按默认值起步）" if age_h * 3600 > STATE_MAX_AGE_SEC else ""
+    return "\n".join([
+        "🚦 Finviz 限速器（已保存状态）",
+        "=" * 55,
+        f"  学到的速率: {saved.get('rate', 0):.2f} 次/秒   并发: {saved.get('concurrency', 0):.1f}   "
+        f"保存于 {age_h:.1f} 小时前{stale}",
+        f"  累计 请求 {totals.get('requests', 0)}  成功 {totals.get('successes', 0)}  "
+        f"限流 {totals.get('throttled', 0)}  超时 {totals.get('timeouts', 0)}  "
+        f"熔断 {totals.get('breaker_trips', 0)}",
+    ])
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+class _SimulatedFinviz:
+    """模拟服务端：滑动 1 秒窗口内超过 capacity 次请求即返回 429"""
+
+    class _Response:
+        def __init__(self, status):
+            self.status_code = status
+            self.headers = {}
+            self.text = ""
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self._hits: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            now = time.monotonic()
+            while self._hits and self._hits[0] < now - 1:
+                self._hits.popleft()
+            self._hits.append(now)
+            return self._Response(429 if len(self._hits) > self.capacity else 200)
+
+
+def _bench(n: int = 200, capacity: int = 5, latency: float = 0.15):
+    import concurrent.futures
+
+    server = _SimulatedFinviz(capacity, latency)
+    limiter = FinvizLimiter(session=server, state_path=os.devnull)
+    print(f"🧪 模拟服务端: 每秒最多 {capacity} 次，单次延迟 {latency * 1000:.0f}ms，共 {n} 个请求")
+    t0 = time.monotonic()
+    def one(i):
+        try:
+            return limiter.get(f"sim://{i}").status_code
+        except FinvizCircuitOpen:
+            return 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+        codes = list(pool.map(one, range(n)))
+    elapsed = time.monotonic() - t0
+    print(format_limiter_stats(limiter.stats()))
+    print(f"\n  完成 {codes.count(200)}/{n}，耗时 {elapsed:.1f}s，"
+          f"有效吞吐 {codes.count(200) / elapsed:.2f} 次/秒（服务端上限 {capacity}）")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if action == "stats":
+        print(format_saved_state(load_limiter_state()))
+    elif action == "reset":
+        try:
+            os.remove(LIMITER_STATE)
+        except OSError:
+            pass
+        print("🗑️ 已清除 Finviz 限速器学习状态")
+    elif action == "bench":
+        _bench()
+    else:
+        print(f"❌ 未知操作: {action}（可用: stats / reset / bench）")
+
+
+if __name__ == "__main__":
+    main()
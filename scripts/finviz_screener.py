@@ -127,7 +127,10 @@ def run_finviz_screen(
     """
     try:
         from finvizfinance.screener.overview import Overview
+        from finviz_limiter import install_finviz_limiter
 
+        # 分页请求由共享限速器节流，不再按固定间隔 sleep
+        install_finviz_limiter()
         foverview = Overview()
         foverview.set_filter(
             signal=signal,
@@ -138,7 +141,7 @@ def run_finviz_screen(
             limit=limit,
             verbose=0,
             ascend=ascend,
-            sleep_sec=0.5,
+            sleep_sec=0,
         )
 
         if df is None or df.empty:
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+IB Gateway 常驻连接代理 (Broker)
+长期持有一个 IB() 连接，通过本地 Unix Socket 向 ibkr_cli 等短命进程暴露
+IBKRReadOnlyClient 的只读方法，省去每条命令的握手 / reqMarketDataType / 断开开销。
+持仓与自选股保持流式行情订阅（见 quote_stream.py），报价查询直接读内存行情表。
+告警引擎挂在流式行情上逐笔评估 Watchlist 目标价与自定义规则（见 alert_engine.py）。
+
+用法:
+    python ibkr_broker.py            # 前台运行（建议用 launchd / systemd / nohup 常驻）
+    python ibkr_cli.py broker status # 查看代理状态
+    python ibkr_cli.py broker stop   # 停止代理
+
+协议：长度前缀 (4 字节大端) + pickle 帧，仅监听本机 Unix Socket（权限 0600）。
+⚠️ 安全模式：只转发 IBKRReadOnlyClient 公有方法与白名单内的只读 ib 方法，不包含任何下单功能。
+"""
+
+import os
+import sys
+import time
+import pickle
+import select
+import socket
+import struct
+from datetime import datetime
+from typing import Optional
+
+# 确保能找到同目录的模块
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+BROKER_SOCKET = os.getenv(
+    "IBKR_BROKER_SOCKET",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ibkr_broker.sock")
+)
+
+# 设为 1 时 CLI 跳过代理，始终直连 IB Gateway
+BROKER_DISABLED = os.getenv("IBKR_NO_BROKER", "") == "1"
+
+# 事件循环泵间隔：两次 accept/recv 检查之间让 ib_async 处理网关推送
+_PUMP_INTERVAL = 0.01
+
+# 允许透传的 ib 只读方法（options_analytics / scanner_enhanced 会直接使用 client.ib）
+# 不含 reqMktData / cancelMktData（订阅会留在 broker 里占用行情线路）和 sleep（会阻塞 broker 服务循环）
+_IB_READONLY_METHODS = frozenset({
+    "isConnected", "managedAccounts", "accountSummary", "portfolio", "positions",
+    "qualifyContracts", "reqContractDetails", "reqSecDefOptParams",
+    "reqTickers", "reqMarketDataType",
+    "reqHistoricalData", "reqHeadTimeStamp", "reqScannerData",
+    "reqFundamentalData", "reqExecutions", "fills",
+})
+
+_HEADER = struct.Struct("!I")
+
+
+# ─── 帧编解码 ─────────────────────────────────────────────────
+
+def _send_msg(sock: socket.socket, obj) -> None:
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("broker 连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_msg(sock: socket.socket):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return pickle.loads(_recv_exact(sock, size))
+
+
+# ─── 服务端 ───────────────────────────────────────────────────
+
+class GatewayBroker:
+    """
+    持有唯一的 IBKRReadOnlyClient，在单线程内轮流服务多个本地连接。
+    ib_async 不可重入，因此请求逐个执行；空闲时通过 ib.sleep 泵事件循环，保持连接状态新鲜。
+    """
+
+    def __init__(self, socket_path: str = BROKER_SOCKET):
+        from ibkr_readonly import IBKRReadOnlyClient
+
+        self.socket_path = socket_path
+        self.client = IBKRReadOnlyClient()
+        self.started_at = 0.0
+        self.request_count = 0
+        self._running = False
+
+    def _log(self, msg: str):
+        print(f"[{datetime.now():%H:%M:%S}] {msg}", flush=True)
+
+    def _bind(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            if ping_broker(self.socket_path):
+                raise RuntimeError(f"broker 已在运行: {self.socket_path}")
+            os.unlink(self.socket_path)  # 上次异常退出遗留的 socket 文件
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # bind 时即以 0600 创建，避免 chmod 之前的短暂窗口内其他用户可以连接
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(16)
+        server.setblocking(False)
+        return server
+
+    def _dispatch(self, request):
+        kind, name, args, kwargs = request
+        if kind == "ping":
+            from pacing import get_scheduler
+            return {
+                "pid": os.getpid(),
+                "connected": self.client.is_connected(),
+                "host": self.client.host,
+                "port": self.client.port,
+                "client_id": self.client.client_id,
+                "uptime_sec": round(time.time() - self.started_at, 1),
+                "requests": self.request_count,
+                "pacing": get_scheduler(self.client.ib).stats(),
+                "quote_stream": self.client.quote_stream_stats(),
+                "alerts": self.client.alert_engine_stats(),
+            }
+        if kind == "shutdown":
+            self._running = False
+            return True
+        if kind == "client":
+            if name.startswith("_") or name in ("connect", "disconnect"):
+                raise AttributeError(f"broker 不转发方法: {name}")
+            return getattr(self.client, name)(*args, **kwargs)
+        if kind == "ib":
+            if name not in _IB_READONLY_METHODS:
+                raise AttributeError(f"broker 不转发 ib.{name}（非只读白名单）")
+            return getattr(self.client.ib, name)(*args, **kwargs)
+        raise ValueError(f"未知请求类型: {kind}")
+
+    def _serve_one(self, conn: socket.socket) -> bool:
+        """处理一条请求，返回 False 表示连接已关闭"""
+        try:
+            request = _recv_msg(conn)
+        except (ConnectionError, OSError, EOFError, pickle.UnpicklingError):
+            return False
+
+        self.request_count += 1
+        try:
+            result = self._dispatch(request)
+            payload = ("ok", result)
+            try:
+                _send_msg(conn, payload)
+                return True
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                payload = ("error", RuntimeError(f"结果无法序列化: {type(e).__name__}: {e}"))
+        except Exception as e:
+            payload = ("error", e)
+
+        try:
+            _send_msg(conn, payload)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            _send_msg(conn, ("error", RuntimeError(f"{type(payload[1]).__name__}: {payload[1]}")))
+        except OSError:
+            return False
+        return True
+
+    def serve_forever(self):
+        """连接 IB Gateway 并进入服务循环"""
+        if not self.client.connect():
+            self._log("❌ 无法连接 IB Gateway，broker 未启动")
+            sys.exit(1)
+
+        server = self._bind()
+        self.started_at = time.time()
+        if self.client.enable_quote_stream():
+            self._log(f"📡 流式行情: {len(self.client.quote_stream.table)} 个持仓 / 自选股订阅")
+            if self.client.enable_alert_engine():
+                stats = self.client.alert_engine.stats()
+                self._log(f"🔔 告警引擎: {stats.rules} 条规则 / {stats.symbols} 个代码")
+        self._running = True
+        self._log(f"✅ broker 已启动: {self.socket_path} → {self.client.host}:{self.client.port} "
+                  f"(clientId={self.client.client_id})")
+
+        conns = []
+        try:
+            while self._running:
+                readable, _, _ = select.select([server] + conns, [], [], 0)
+                if not readable:
+                    self.client.pump_events(_PUMP_INTERVAL)
+                    continue
+                for sock in readable:
+                    if sock is server:
+                        try:
+                            conn, _ = server.accept()
+                            conn.setblocking(True)
+                            conns.append(conn)
+                        except BlockingIOError:
+                            pass
+                    elif not self._serve_one(sock):
+                        conns.remove(sock)
+                        sock.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for conn in conns:
+                conn.close()
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.client.disconnect()
+            self._log(f"⏹️ broker 已停止 (共处理 {self.request_count} 个请求)")
+
+
+# ─── 客户端代理 ───────────────────────────────────────────────
+
+class _BrokerChannel:
+    """单个 Unix Socket 连接上的请求/响应通道"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+
+    def call(self, kind: str, name: str = "", args=(), kwargs=None):
+        _send_msg(self.sock, (kind, name, tuple(args), kwargs or {}))
+        status, value = _recv_msg(self.sock)
+        if status == "ok":
+            return value
+        raise value
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _RemoteIB:
+    """client.ib 的远程代理，仅暴露只读白名单方法"""
+
+    def __init__(self, channel: _BrokerChannel):
+        self._channel = channel
+
+    def __getattr__(self, name):
+        if name not in _IB_READONLY_METHODS:
+            raise AttributeError(f"broker 模式下不可用: ib.{name}")
+
+        def remote(*args, **kwargs):
+            return self._channel.call("ib", name, args, kwargs)
+        remote.__name__ = name
+        return remote
+
+
+class BrokerClient:
+    """
+    与 IBKRReadOnlyClient 接口兼容的瘦客户端。
+    所有方法调用经 Unix Socket 转发给 broker 中已连接的客户端执行。
+    """
+
+    def __init__(self, socket_path: str = BROKER_SOCKET):
+        self.socket_path = socket_path
+        self._channel = _BrokerChannel(socket_path)
+        info = self._channel.call("ping")
+        self.host = info["host"]
+        self.port = info["port"]
+        self.client_id = info["client_id"]
+        self.ib = _RemoteIB(self._channel)
+
+    def connect(self) -> bool:
+        return True
+
+    def disconnect(self):
+        """仅关闭到 broker 的本地连接，IB Gateway 连接由 broker 保持"""
+        self._channel.close()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def remote(*args, **kwargs):
+            return self._channel.call("client", name, args, kwargs)
+        remote.__name__ = name
+        return remote
+
+
+def ping_broker(socket_path: str = BROKER_SOCKET, timeout: float = 2.0) -> Optional[dict]:
+    """探测 broker 是否在运行，返回状态信息或 None"""
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        channel = _BrokerChannel(socket_path, timeout=timeout)
+    except OSError:
+        return None
+    try:
+        return channel.call("ping")
+    except Exception:
+        return None
+    finally:
+        channel.close()
+
+
+def connect_broker(socket_path: str = BROKER_SOCKET) -> Optional[BrokerClient]:
+    """broker 可用且已连上网关时返回 BrokerClient，否则返回 None（调用方回退直连）"""
+    if BROKER_DISABLED or not os.path.exists(socket_path):
+        return None
+    try:
+        client = BrokerClient(socket_path)
+    except Exception:
+        return None
+    try:
+        if client.is_connected():
+            return client
+    except Exception:
+        pass
+    client.disconnect()
+    return None
+
+
+def stop_broker(socket_path: str = BROKER_SOCKET) -> bool:
+    """请求 broker 退出"""
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        channel = _BrokerChannel(socket_path, timeout=5.0)
+        channel.call("shutdown")
+        channel.close()
+        return True
+    except Exception:
+        return False
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    """前台运行 broker"""
+    print("🔌 IB Gateway 常驻连接代理")
+    print("⚠️  安全模式：仅转发只读查询，无法执行任何交易操作")
+    try:
+        GatewayBroker().serve_forever()
+    except RuntimeError as e:
+        print(f"⚠️ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,1570 +12,84 @@ IBKR CLI 统一入口
     python ibkr_cli.py insider AAPL
     python ibkr_cli.py peers AAPL
     python ibkr_cli.py screen --sector Technology --pe "Under 20" --json
-    python ibkr_cli.py portfolio [allocation|concentration|beta|benchmark|attribution|drawdown|all]
+    python ibkr_cli.py portfolio [allocation|concentration|beta|benchmark|attribution|drawdown|correlation|all] [--ewma] [--shrink]
     python ibkr_cli.py options [calendar|greeks|summary|seller|all]
     python ibkr_cli.py trades [history|stats|all]
     python ibkr_cli.py scanner --code TOP_PERC_GAIN [--size 10]
     python ibkr_cli.py watchlist [list|add|remove] [SYMBOL] [--buy PRICE] [--sell PRICE] [--notes TEXT]
+    python ibkr_cli.py alerts add AAPL price below 180   (alerts [list|remove|log|status|watch])
     python ibkr_cli.py news AAPL
     python ibkr_cli.py export [portfolio|allocation|report|all]
     python ibkr_cli.py status
+    python ibkr_cli.py broker [start|stop|status]
+    python ibkr_cli.py contracts [stats|warm|purge|clear] [SYMBOL...]
+    python ibkr_cli.py batch commands.jsonl   (或从标准输入读取)
+    python ibkr_cli.py serve [--port 8765]    (本地 HTTP / JSON-RPC 查询服务)
+
+启动路径保持轻量：本文件只包含命令注册表，子命令实现（ibkr_commands.py）在执行时才导入，
+ib_async / finvizfinance / pandas 等重依赖只在命令真正用到时加载（启动耗时基准见 startup_bench.py）。
 
 ⚠️ 安全模式：此脚本不包含任何下单、修改订单、取消订单的功能。
 """
 
 import os
 import sys
-import traceback
-import json
-import dataclasses
-import time
+import importlib
+from typing import Callable
 
 # 确保能找到同目录的模块
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# ─── 全局 JSON 旗标与防污染劫持 ──────────────────────────────────────────────
-IS_JSON_MODE = "--json" in sys.argv
-ORIGINAL_STDOUT = sys.stdout
-
-if IS_JSON_MODE:
-    # 彻底劫持常规的 print 到 stderr，防止 `⏳ 正在分析...` 等噪音破坏 JSON 管道
-    sys.stdout = sys.stderr
-
-def print_cli(*args, **kwargs):
-    """
-    终端输出专用打印，如果在 JSON 模式下则不会被打印到标准输出
-    但上面 sys.stdout = sys.stderr 已经做了拦截，这里主要是语义化的保留
-    """
-    print(*args, **kwargs)
-
-def print_json_resp(command: str, data: dict, status: str = "success"):
-    """专用的干净 JSON 输出通道，直通原生 stdout"""
-    if not IS_JSON_MODE:
-        return
-    envelope = {
-        "status": status,
-        "command": command,
-        "timestamp": int(time.time()),
-        "data": data if status == "success" else None,
-        "error": data if status != "success" else None,
-    }
-    ORIGINAL_STDOUT.write(json.dumps(envelope, ensure_ascii=False, indent=2, default=str) + "\n")
-    ORIGINAL_STDOUT.flush()
-# ──────────────────────────────────────────────────────────────────────────
-
-
-def _connect_client():
-    """创建并连接 IBKR 客户端，失败时输出诊断信息并退出"""
-    from ibkr_readonly import IBKRReadOnlyClient
-
-    client = IBKRReadOnlyClient()
-    if not client.connect():
-        print_cli("❌ 无法连接 IB Gateway。")
-        print_cli("   诊断信息:")
-        print_cli(f"   • 目标地址: {client.host}:{client.port}")
-        print_cli(f"   • Client ID: {client.client_id}")
-        print_cli("   可能原因:")
-        print_cli("   1. IB Gateway 未启动（桌面上看不到 IB Gateway 窗口）")
-        print_cli("   2. IB Gateway 未登录（需要手机 2FA 确认）")
-        print_cli("   3. API Settings 中未启用 Socket Clients")
-        print_cli(f"   4. 端口不是 {client.port}（检查 API Settings）")
-        print_cli("   5. Trusted IPs 中未包含 127.0.0.1")
-        if IS_JSON_MODE:
-            print_json_resp("connect", {"message": "无法连接 IB Gateway"}, "error")
-        sys.exit(1)
-
-    return client
-
-
-def _safe_disconnect(client):
-    """安全断开连接"""
-    try:
-        client.disconnect()
-    except Exception:
-        pass
-
-
-# ─── 子命令 ────────────────────────────────────────────────────
-
-def cmd_status(args):
-    """检查 IB Gateway 连接状态"""
-    import socket
-    from ibkr_readonly import IB_HOST, IB_PORT
-
-    print("🔍 IB Gateway 连接状态检查")
-    print("=" * 50)
-    print(f"  目标: {IB_HOST}:{IB_PORT}")
-
-    # 端口检查
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        result = sock.connect_ex((IB_HOST, IB_PORT))
-        sock.close()
-        if result == 0:
-            print("  端口: ✅ 可达")
-        else:
-            print("  端口: ❌ 不可达")
-            print("  → IB Gateway 可能未启动或未登录")
-            return
-    except Exception as e:
-        print(f"  端口: ❌ 检查失败 ({e})")
-        return
-
-    # 完整连接测试
-    client = _connect_client()
-    accounts = client.get_accounts()
-    print(f"  连接: ✅ 成功")
-    print(f"  账户: {', '.join(accounts) if accounts else '(未获取到)'}")
-    _safe_disconnect(client)
-    print("✅ IB Gateway 连接正常")
-
-
-def cmd_quote(args):
-    """查询实时行情"""
-    json_output = "--json" in args
-    symbols = [a.upper() for a in args if a != "--json"]
-
-    client = _connect_client()
-    from ibkr_readonly import format_currency
-
-    if not symbols:
-        # 获取股票持仓作为默认代码
-        positions = client.get_positions()
-        symbols = [p.symbol for p in positions if p.sec_type == "STK"]
-        if not symbols:
-            if json_output:
-                import json
-                print_json_resp("quote", {"error": "未指定股票，且未找到股票持仓"})
-            else:
-                print("⚠️ 未指定股票代码，且当前无股票持仓。用法: python ibkr_cli.py quote SYMBOL")
-            _safe_disconnect(client)
-            sys.exit(1)
-
-    # 批量获取行情
-    quotes_map = client.get_quotes_batch(symbols)
-
-    json_results = {}
-    for symbol in symbols:
-        quote = quotes_map.get(symbol)
-        if json_output:
-            if quote:
-                import dataclasses
-                json_results[symbol] = dataclasses.asdict(quote)
-            else:
-                json_results[symbol] = {"error": "获取行情失败"}
-        else:
-            if quote:
-                emoji = "📈" if quote.change_pct > 0 else "📉" if quote.change_pct < 0 else "➖"
-                print(f"{emoji} {quote.symbol}: ${quote.last_price:.2f} ({quote.change_pct:+.2f}%) "
-                      f"| Bid: ${quote.bid:.2f} Ask: ${quote.ask:.2f} | Vol: {quote.volume:,}")
-            else:
-                print(f"⚠️ {symbol}: 未找到该股票或获取行情失败（请检查股票代码是否正确）")
-
-    if json_output:
-        import json
-        print_json_resp("quote", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_analyze(args):
-    """技术分析"""
-    if not args:
-        print("用法: python ibkr_cli.py analyze SYMBOL [SYMBOL2 ...] [--period '1 Y'] [--bar '1 day'] [--json]")
-        sys.exit(1)
-
-    period = "1 Y"
-    bar_size = "1 day"
-    json_output = False
-    symbols = []
-    i = 0
-    while i < len(args):
-        if args[i] == "--period" and i + 1 < len(args):
-            period = args[i + 1]
-            i += 2
-        elif args[i] == "--bar" and i + 1 < len(args):
-            bar_size = args[i + 1]
-            i += 2
-        elif args[i] == "--json":
-            json_output = True
-            i += 1
-        else:
-            symbols.append(args[i].upper())
-            i += 1
-
-    if not symbols:
-        print("❌ 请指定至少一个股票代码")
-        sys.exit(1)
-
-    client = _connect_client()
-    from technical_analysis import analyze_symbols_batch, format_technical_summary
-    import dataclasses
-
-    print_cli(f"⏳ 正在并发分析 {len(symbols)} 只股票技术面...")
-    results = analyze_symbols_batch(client, symbols, period=period, bar_size=bar_size)
-    
-    if json_output:
-        json_results = {}
-        for sym, result in results.items():
-            if result:
-                json_results[sym] = dataclasses.asdict(result)
-            else:
-                json_results[sym] = {"error": "历史数据不足或无效代码"}
-        print_json_resp("analyze", json_results)
-    else:
-        for sym in symbols:
-            result = results.get(sym)
-            if result:
-                print_cli(format_technical_summary(result))
-            else:
-                print_cli(f"⚠️ {sym} 技术分析失败: 历史数据不足（至少需要 30 根 K 线）或股票代码无效")
-            print_cli()
-
-    _safe_disconnect(client)
-
-
-def cmd_fundamentals(args):
-    """基本面查询（IBKR + Finviz 双源合并）"""
-    if not args or (len(args) == 1 and args[0] in ("-h", "--help")):
-        print("用法: python ibkr_cli.py fundamentals SYMBOL [SYMBOL2 ...] [--json]")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    symbols = [a for a in args if a != "--json"]
-
-    client = _connect_client()
-    from finviz_data import get_finviz_fundamentals_batch, format_finviz_fundamentals
-
-    print_cli(f"⏳ 正在并发查询 {len(symbols)} 只股票基本面...")
-    finviz_results = get_finviz_fundamentals_batch(symbols, max_workers=5)
-
-    json_results = {}
-
-    for symbol in symbols:
-        symbol = symbol.upper()
-
-        # IBKR 基本面 (依旧使用串行获取，因为它目前依赖 XML 数据较为单一)
-        fund = client.get_fundamentals(symbol)
-        # Finviz 基本面从并发缓存直接读取
-        finviz_fund = finviz_results.get(symbol, {})
-
-        if json_output:
-            result = {}
-            if fund:
-                import dataclasses
-                result["ibkr"] = dataclasses.asdict(fund)
-            if finviz_fund:
-                result["finviz"] = finviz_fund
-            if not result:
-                result = {"error": "未找到基本面数据"}
-            json_results[symbol] = result
-        else:
-            if fund:
-                print(f"📊 {symbol} 基本面数据 (来源: IBKR)")
-                print("=" * 50)
-                print(f"  公司: {fund.company_name}")
-                print(f"  行业: {fund.industry} / {fund.category}")
-                if fund.sector:
-                    print(f"  板块: {fund.sector}")
-                print(f"  市值: {fund.market_cap}")
-                print(f"  P/E 市盈率: {fund.pe_ratio}")
-                print(f"  EPS: {fund.eps}")
-                print(f"  股息收益率: {fund.dividend_yield}")
-                print(f"  52周最高: {fund.high_52w}")
-                print(f"  52周最低: {fund.low_52w}")
-                print(f"  10日均量: {fund.avg_volume}")
-                print()
-
-            if finviz_fund:
-                print(format_finviz_fundamentals(finviz_fund, symbol))
-            elif not fund:
-                print_cli(f"⚠️ {symbol}: IBKR 和 Finviz 均未找到基本面数据")
-            print_cli()
-
-    if json_output:
-        print_json_resp("fundamentals", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_portfolio(args):
-    """组合分析"""
-    json_output = "--json" in args
-    args = [a for a in args if a != "--json"]
-    subcommand = args[0] if args else "all"
-    client = _connect_client()
-
-    from portfolio_analytics import (
-        get_portfolio_allocation, get_concentration_risk, get_portfolio_beta,
-        get_correlation_matrix, get_benchmark_comparison,
-        get_performance_attribution, get_max_drawdown, get_portfolio_drawdown,
-        format_allocation, format_concentration, format_benchmark,
-        format_attribution, format_drawdown, to_json_portfolio
-    )
-
-    json_results = {}
-
-    if subcommand in ("allocation", "all"):
-        if not json_output: print("⏳ 正在分析资产配置...")
-        alloc = get_portfolio_allocation(client)
-        if json_output:
-            json_results["allocation"] = alloc
-        else:
-            print(format_allocation(alloc))
-            print()
-
-    if subcommand in ("concentration", "all"):
-        if not json_output: print("⏳ 正在分析持仓集中度...")
-        conc = get_concentration_risk(client)
-        if json_output:
-            json_results["concentration"] = conc
-        else:
-            print(format_concentration(conc))
-            print()
-
-    if subcommand in ("beta", "all"):
-        if not json_output: print("⏳ 正在计算组合 Beta...")
-        beta = get_portfolio_beta(client, "SPY", "6 M")
-        if json_output:
-            json_results["beta"] = beta
-        else:
-            if beta:
-                print(f"📊 组合 Beta: {beta['portfolio_beta']} (vs {beta['benchmark']}, {beta['period']})")
-                for h in beta["holdings_beta"]:
-                    print(f"   {h['symbol']:8s} β={h['beta']:+.3f}  权重={h['weight']:.1f}%")
-            else:
-                print("⚠️ 无法计算 Beta: 股票持仓不足或历史数据不足")
-            print()
-
-    if subcommand in ("benchmark", "all"):
-        benchmark = args[1] if len(args) > 1 and subcommand == "benchmark" else "SPY"
-        period = args[2] if len(args) > 2 and subcommand == "benchmark" else "3 M"
-        if not json_output: print(f"⏳ 正在对比基准 ({benchmark}, {period})...")
-        comp = get_benchmark_comparison(client, benchmark, period)
-        if json_output:
-            json_results["benchmark_comparison"] = comp
-        else:
-            if comp:
-                print(format_benchmark(comp))
-            else:
-                print("⚠️ 无法计算基准对比: 股票持仓不足或历史数据不足")
-            print()
-
-    if subcommand in ("attribution", "all"):
-        if not json_output: print("⏳ 正在分析盈亏归因...")
-        attrs = get_performance_attribution(client)
-        if json_output:
-            json_results["attribution"] = attrs
-        else:
-            print(format_attribution(attrs))
-            print()
-
-    if subcommand in ("drawdown", "all"):
-        target = args[1] if len(args) > 1 and subcommand == "drawdown" else None
-        if not json_output: print("⏳ 正在计算最大回撤...")
-        dd = get_max_drawdown(client, target, "1 Y")
-        if json_output:
-            json_results["drawdown"] = dd
-        else:
-            if dd:
-                print(format_drawdown(dd))
-            else:
-                print("⚠️ 无法计算最大回撤: 历史数据不足")
-            print()
-
-        # 组合级加权回撤（仅在 drawdown 或 all 子命令时额外计算）
-        if target is None:  # 未指定个股时才跑组合回撤
-            if not json_output: print("⏳ 正在计算组合加权回撤...")
-            pdd = get_portfolio_drawdown(client, "1 Y")
-            if json_output:
-                json_results["portfolio_drawdown"] = pdd
-            else:
-                if pdd:
-                    print(format_drawdown(pdd))
-                else:
-                    print("⚠️ 无法计算组合回撤: 股票持仓不足或历史数据不足")
-                print()
-
-    if subcommand in ("correlation", "all"):
-        if not json_output: print("⏳ 正在计算相关性矩阵...")
-        corr = get_correlation_matrix(client, "3 M")
-        if json_output:
-            json_results["correlation"] = corr
-        else:
-            if corr:
-                print("📊 高相关性持仓对:")
-                for pair in corr.get("high_correlation_pairs", []):
-                    print(f"   {pair['pair']}: {pair['correlation']:+.3f} ({pair['warning']})")
-                if not corr.get("high_correlation_pairs"):
-                    print("   ✅ 未发现高度相关的持仓对")
-            else:
-                print("⚠️ 股票持仓不足两只，无法计算相关性")
-            print()
-
-    if json_output:
-        print_json_resp("portfolio", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_options(args):
-    """期权分析"""
-    json_output = "--json" in args
-    args = [a for a in args if a != "--json"]
-    subcommand = args[0] if args else "all"
-    client = _connect_client()
-
-    from options_analytics import (
-        get_expiration_calendar, get_portfolio_greeks_summary,
-        get_option_greeks, format_expiration_calendar,
-        format_greeks_summary, format_option_greeks, to_json_options,
-        screen_seller_options, format_seller_screener_results
-    )
-
-    json_results = {}
-
-    if subcommand in ("calendar", "all"):
-        if not json_output: print("⏳ 正在获取到期日日历...")
-        calendar = get_expiration_calendar(client)
-        if json_output:
-            json_results["calendar"] = calendar
-        else:
-            print(format_expiration_calendar(calendar))
-            print()
-
-    if subcommand in ("greeks", "all"):
-        positions = client.get_positions()
-        opt_positions = [p for p in positions if p.sec_type == "OPT"]
-        
-        greeks_list = []
-        for p in opt_positions:
-            g = get_option_greeks(client, p)
-            if g: greeks_list.append(g)
-
-        if json_output:
-            json_results["greeks"] = greeks_list
-        else:
-            if greeks_list:
-                print("📊 期权 Greeks 明细:")
-                print("=" * 60)
-                for g in greeks_list:
-                    print(format_option_greeks(g))
-                    print()
-            else:
-                print("ℹ️ 无期权持仓")
-
-    if subcommand in ("summary", "all"):
-        if not json_output: print("⏳ 正在计算组合 Greeks 汇总...")
-        summary = get_portfolio_greeks_summary(client)
-        if json_output:
-            json_results["summary"] = summary
-        else:
-            if summary:
-                print(format_greeks_summary(summary))
-            else:
-                print("ℹ️ 无期权持仓，跳过 Greeks 汇总")
-            print()
-
-    if subcommand == "seller":
-        if len(args) < 2:
-            print("用法: python ibkr_cli.py options seller SYMBOL [--type P/C] [--dte min-max] [--delta min-max]")
-            _safe_disconnect(client)
-            sys.exit(1)
-            
-        symbol = args[1].upper()
-        opt_type = "P"
-        min_dte = 7
-        max_dte = 45
-        min_delta = 0.1
-        max_delta = 0.35
-        
-        i = 2
-        while i < len(args):
-            if args[i] == "--type" and i + 1 < len(args):
-                opt_type = args[i+1].upper()
-                i += 2
-            elif args[i] == "--dte" and i + 1 < len(args):
-                parts = args[i+1].split("-")
-                min_dte = int(parts[0])
-                if len(parts) > 1:
-                    max_dte = int(parts[1])
-                else:
-                    max_dte = min_dte
-                i += 2
-            elif args[i] == "--delta" and i + 1 < len(args):
-                parts = args[i+1].split("-")
-                min_delta = float(parts[0])
-                if len(parts) > 1:
-                    max_delta = float(parts[1])
-                else:
-                    max_delta = min_delta
-                i += 2
-            else:
-                i += 1
-                
-        if not json_output: print(f"⏳ 正在扫描 {symbol} 期权卖方机会 (Type={opt_type}, DTE={min_dte}-{max_dte}, Delta={min_delta}-{max_delta})...")
-        screener_res = screen_seller_options(
-            client, symbol, opt_type=opt_type, 
-            min_dte=min_dte, max_dte=max_dte,
-            min_delta=min_delta, max_delta=max_delta
-        )
-        if json_output:
-            json_results["seller_screener"] = screener_res
-        else:
-            print(format_seller_screener_results(screener_res))
-            print()
-
-    if json_output:
-        print_json_resp("options", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_trades(args):
-    """交易复盘"""
-    json_output = "--json" in args
-    args = [a for a in args if a != "--json"]
-    subcommand = args[0] if args else "all"
-    client = _connect_client()
-
-    from trade_review import (
-        get_trade_history, get_trade_statistics,
-        format_trade_history, format_trade_statistics,
-        to_json_trades
-    )
-
-    json_results = {}
-
-    if subcommand in ("history", "all"):
-        if not json_output: print("⏳ 正在获取近期成交记录...")
-        history = get_trade_history(client)
-        if json_output:
-            json_results["history"] = history
-        else:
-            print(format_trade_history(history))
-            print()
-
-    if subcommand in ("stats", "all"):
-        if not json_output: print("⏳ 正在统计交易数据...")
-        stats = get_trade_statistics(client)
-        if json_output:
-            json_results["statistics"] = stats
-        else:
-            if stats:
-                print(format_trade_statistics(stats))
-            else:
-                print("ℹ️ 无成交记录，无法生成统计")
-            print()
-
-    if json_output:
-        print_json_resp("trades", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_scanner(args):
-    """市场扫描"""
-    from scanner_enhanced import (
-        run_enhanced_scanner, list_scan_presets,
-        format_scan_results, to_json_scan_results
-    )
-
-    if not args or args[0] == "list":
-        print("📋 可用扫描预设 (也可直接使用 --code 指定原生 API scanCode):")
-        for name, desc in list_scan_presets().items():
-            print(f"  • {name}: {desc}")
-        if not args:
-            return
-        return
-
-    preset_name = None
-    scan_code = None
-    size = 10
-    above_price = None
-    below_price = None
-    above_volume = None
-    market_cap_above = None
-    market_cap_below = None
-    json_output = False
-
-    i = 0
-    while i < len(args):
-        if args[i] == "--code" and i + 1 < len(args):
-            scan_code = args[i + 1]
-            i += 2
-        elif args[i] == "--size" and i + 1 < len(args):
-            size = int(args[i + 1])
-            i += 2
-        elif args[i] == "--price-above" and i + 1 < len(args):
-            above_price = float(args[i + 1])
-            i += 2
-        elif args[i] == "--price-below" and i + 1 < len(args):
-            below_price = float(args[i + 1])
-            i += 2
-        elif args[i] == "--cap-above" and i + 1 < len(args):
-            market_cap_above = float(args[i + 1])
-            i += 2
-        elif args[i] == "--cap-below" and i + 1 < len(args):
-            market_cap_below = float(args[i + 1])
-            i += 2
-        elif args[i] == "--vol-above" and i + 1 < len(args):
-            above_volume = int(args[i + 1])
-            i += 2
-        elif args[i] == "--json":
-            json_output = True
-            i += 1
-        else:
-            if not args[i].startswith("--") and preset_name is None and scan_code is None:
-                preset_name = args[i]
-            elif args[i].isdigit() and preset_name is not None:
-                size = int(args[i])
-            i += 1
-
-    client = _connect_client()
-    
-    scan_target = scan_code if scan_code else (preset_name if preset_name else "自定义条件")
-    if not json_output:
-        print(f"⏳ 正在扫描 [{scan_target}] (top {size})...")
-        
-    results = run_enhanced_scanner(
-        client, 
-        preset_name=preset_name,
-        scan_code=scan_code,
-        size=size,
-        above_price=above_price,
-        below_price=below_price,
-        above_volume=above_volume,
-        market_cap_above=market_cap_above,
-        market_cap_below=market_cap_below
-    )
-    
-    if json_output:
-        print_json_resp("scanner", results)
-    else:
-        print(format_scan_results(results, scan_target))
-        
-    _safe_disconnect(client)
-
-
-def cmd_watchlist(args):
-    """Watchlist 管理"""
-    from scanner_enhanced import (
-        add_to_watchlist, remove_from_watchlist,
-        get_watchlist_quotes, format_watchlist
-    )
-
-    subcommand = args[0] if args else "list"
-
-    if subcommand == "add":
-        if len(args) < 2:
-            print("用法: python ibkr_cli.py watchlist add SYMBOL [--buy PRICE] [--sell PRICE] [--notes TEXT]")
-            sys.exit(1)
-        symbol = args[1].upper()
-        target_buy = None
-        target_sell = None
-        notes = ""
-        i = 2
-        while i < len(args):
-            if args[i] == "--buy" and i + 1 < len(args):
-                target_buy = float(args[i + 1])
-                i += 2
-            elif args[i] == "--sell" and i + 1 < len(args):
-                target_sell = float(args[i + 1])
-                i += 2
-            elif args[i] == "--notes" and i + 1 < len(args):
-                notes = args[i + 1]
-                i += 2
-            else:
-                i += 1
-        add_to_watchlist(symbol, target_buy, target_sell, notes)
-
-    elif subcommand == "remove":
-        if len(args) < 2:
-            print("用法: python ibkr_cli.py watchlist remove SYMBOL")
-            sys.exit(1)
-        remove_from_watchlist(args[1].upper())
-
-    elif subcommand == "list":
-        client = _connect_client()
-        items = get_watchlist_quotes(client)
-        print(format_watchlist(items))
-        _safe_disconnect(client)
-
-    else:
-        print(f"未知子命令: {subcommand}")
-        print("可用: list, add, remove")
-
-
-def cmd_news(args):
-    """查询公司新闻（Yahoo RSS + Finviz 双源合并）"""
-    from finviz_data import get_finviz_news, get_finviz_market_news, format_news
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if not clean_args:
-        print("用法: python ibkr_cli.py news SYMBOL [limit] [--json]")
-        print("       python ibkr_cli.py news market [--json]")
-        sys.exit(1)
-
-    # 全市场新闻
-    if clean_args[0].lower() == "market":
-        market_news = get_finviz_market_news()
-        if json_output:
-            print_json_resp("news", market_news)
-        else:
-            print(format_news(market_news.get("news", []), "全市场新闻", limit=20))
-            print()
-            print(format_news(market_news.get("blogs", []), "财经博客", limit=10))
-        return
-
-    symbol = clean_args[0].upper()
-    limit = int(clean_args[1]) if len(clean_args) > 1 and clean_args[1].isdigit() else 10
-
-    # 双源获取
-    all_news = []
-
-    # 源1: Yahoo RSS（需要 IB Gateway 连接）
-    try:
-        client = _connect_client()
-        yahoo_news = client.get_company_news(symbol, limit=limit)
-        _safe_disconnect(client)
-        for item in yahoo_news:
-            all_news.append({
-                "Date": item.get("date", ""),
-                "Title": item.get("title", ""),
-                "Link": item.get("link", ""),
-                "Source": "Yahoo Finance",
-            })
-    except Exception:
-        pass
-
-    # 源2: Finviz
-    finviz_news = get_finviz_news(symbol)
-    for item in finviz_news:
-        all_news.append({
-            "Date": item.get("Date", ""),
-            "Title": item.get("Title", ""),
-            "Link": item.get("Link", ""),
-            "Source": item.get("Source", "Finviz"),
-        })
-
-    # 按标题去重
-    seen_titles = set()
-    unique_news = []
-    for item in all_news:
-        title = item.get("Title", "").strip()
-        if title and title not in seen_titles:
-            seen_titles.add(title)
-            unique_news.append(item)
-
-    if json_output:
-        print_json_resp("news", {
-            "symbol": symbol,
-            "count": len(unique_news[:limit]),
-            "news": unique_news[:limit]
-        })
-    elif unique_news:
-        print(f"📰 {symbol} 最新新闻 (Yahoo + Finviz, 共 {len(unique_news)} 条):")
-        print("=" * 65)
-        for idx, item in enumerate(unique_news[:limit], 1):
-            source_tag = f"[{item.get('Source', '')}]" if item.get('Source') else ""
-            print(f"  {idx:2d}. [{item['Date']}] {item['Title']}")
-            if source_tag:
-                print(f"      来源: {source_tag}")
-            if item.get('Link'):
-                print(f"      🔗 {item['Link']}")
-    else:
-        print(f"⚠️ {symbol}: Yahoo 和 Finviz 均未获取到新闻")
-
-
-def cmd_export(args):
-    """数据导出"""
-    subcommand = args[0] if args else "all"
-    client = _connect_client()
-
-    from export import export_portfolio_csv, export_allocation_csv, generate_investment_report
-
-    if subcommand in ("portfolio", "all"):
-        print("⏳ 正在导出持仓 CSV...")
-        path = export_portfolio_csv(client)
-        print(f"   → {path}")
-
-    if subcommand in ("allocation", "all"):
-        print("⏳ 正在导出资产配置 CSV...")
-        path = export_allocation_csv(client)
-        print(f"   → {path}")
-
-    if subcommand in ("report", "all"):
-        print("⏳ 正在生成综合报告...")
-        path = generate_investment_report(client)
-        print(f"   → {path}")
-
-    _safe_disconnect(client)
-    print("\n✅ 导出完成")
-
-
-def cmd_history(args):
-    """查询历史 K 线"""
-    if not args:
-        print("用法: python ibkr_cli.py history SYMBOL [--period '3 M'] [--bar '1 day'] [--json]")
-        sys.exit(1)
-
-    period = "3 M"
-    bar_size = "1 day"
-    json_output = False
-    symbols = []
-    i = 0
-    while i < len(args):
-        if args[i] == "--period" and i + 1 < len(args):
-            period = args[i + 1]
-            i += 2
-        elif args[i] == "--bar" and i + 1 < len(args):
-            bar_size = args[i + 1]
-            i += 2
-        elif args[i] == "--json":
-            json_output = True
-            i += 1
-        else:
-            symbols.append(args[i].upper())
-            i += 1
-
-    if not symbols:
-        print("❌ 请指定至少一个股票代码")
-        sys.exit(1)
-
-    client = _connect_client()
-    json_results = {}
-
-    for symbol in symbols:
-        bars = client.get_historical_data(symbol, duration=period, bar_size=bar_size)
-        if json_output:
-            if bars:
-                json_results[symbol] = {
-                    "period": period,
-                    "bar_size": bar_size,
-                    "count": len(bars),
-                    "bars": bars
-                }
-            else:
-                json_results[symbol] = {"error": "未获取到历史数据"}
-        else:
-            if bars:
-                print(f"📊 {symbol} 历史 K 线 ({period}, {bar_size})")
-                print("=" * 60)
-                print(f"{'日期':12s} {'开盘':>10s} {'最高':>10s} {'最低':>10s} {'收盘':>10s} {'成交量':>12s}")
-                for bar in bars[-20:]:  # 只显示最近 20 根
-                    print(f"{bar['date']:12s} ${bar['open']:>9,.2f} ${bar['high']:>9,.2f} "
-                          f"${bar['low']:>9,.2f} ${bar['close']:>9,.2f} {bar['volume']:>12,}")
-                if len(bars) > 20:
-                    print(f"\n  ...共 {len(bars)} 根 K 线，仅展示最近 20 根")
-            else:
-                print(f"⚠️ {symbol}: 未获取到历史数据（股票代码可能无效或数据源暂时不可用）")
-            print()
-
-    if json_output:
-        print_json_resp("history", json_results)
-
-    _safe_disconnect(client)
-
-
-# ─── Finviz 数据命令 ───────────────────────────────────────────
-
-def cmd_ratings(args):
-    """分析师评级（Finviz）"""
-    from finviz_data import get_finviz_ratings, format_ratings
-
-    if not args:
-        print("用法: python ibkr_cli.py ratings SYMBOL [--json]")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    symbols = [a.upper() for a in args if a != "--json"]
 
-    json_results = {}
-    for symbol in symbols:
-        ratings = get_finviz_ratings(symbol)
-        if json_output:
-            json_results[symbol] = ratings if ratings else {"error": "无评级数据"}
-        else:
-            print(format_ratings(ratings, symbol))
-            print()
+# ─── 命令注册表 ────────────────────────────────────────────────
+# 命令名 → (说明, "模块:函数")，执行时才导入对应模块
 
-    if json_output:
-        import json
-        print_json_resp("ratings", json_results)
-
-
-def cmd_insider(args):
-    """内部人交易（Finviz）"""
-    from finviz_data import (
-        get_finviz_insider, get_finviz_insider_market, format_insider
-    )
-
-    if not args:
-        print("用法: python ibkr_cli.py insider SYMBOL [--json]")
-        print("       python ibkr_cli.py insider market [latest|top week|top owner trade]")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if clean_args[0].lower() == "market":
-        option = " ".join(clean_args[1:]) if len(clean_args) > 1 else "latest"
-        records = get_finviz_insider_market(option)
-        if json_output:
-            import json
-            print_json_resp("insider", records)
-        else:
-            print(format_insider(records, f"全市场内部人交易 ({option})"))
-        return
-
-    json_results = {}
-    for symbol in clean_args:
-        symbol = symbol.upper()
-        records = get_finviz_insider(symbol)
-        if json_output:
-            json_results[symbol] = records if records else {"error": "无内部人交易数据"}
-        else:
-            print(format_insider(records, f"{symbol} 内部人交易"))
-            print()
-
-    if json_output:
-        import json
-        print_json_resp("insider", json_results)
-
-
-def cmd_peers(args):
-    """同行公司（Finviz），可选批量行情对比"""
-    from finviz_data import get_finviz_peers, format_peers
-
-    if not args:
-        print("用法: python ibkr_cli.py peers SYMBOL [--json] [--quote]")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    with_quote = "--quote" in args
-    symbol = [a for a in args if not a.startswith("--")][0].upper()
-
-    peers = get_finviz_peers(symbol)
-
-    if json_output:
-        import json
-        result = {"symbol": symbol, "peers": peers}
-
-        # 附加行情
-        if with_quote and peers:
-            try:
-                client = _connect_client()
-                quotes = client.get_quotes_batch(peers[:10])
-                import dataclasses
-                result["peer_quotes"] = {
-                    k: dataclasses.asdict(v) for k, v in quotes.items()
-                }
-                _safe_disconnect(client)
-            except Exception:
-                pass
-
-        print_json_resp("peers", result)
-    else:
-        print(format_peers(peers, symbol))
-
-        # 附加行情对比
-        if with_quote and peers:
-            try:
-                client = _connect_client()
-                quotes = client.get_quotes_batch(peers[:10])
-                if quotes:
-                    print(f"\n📈 同行实时行情:")
-                    for sym, q in quotes.items():
-                        emoji = "📈" if q.change_pct > 0 else "📉" if q.change_pct < 0 else "➖"
-                        print(f"  {emoji} {sym:8s} ${q.last_price:.2f} ({q.change_pct:+.2f}%)")
-                _safe_disconnect(client)
-            except Exception:
-                pass
-
-
-def cmd_screen(args):
-    """Finviz 多维条件选股"""
-    from finviz_screener import (
-        parse_screen_args, run_finviz_screen,
-        format_screen_results, to_json_screen_results,
-        list_available_filters, list_available_signals,
-        _get_filter_options,
-    )
-
-    if not args or args[0] in ("-h", "--help"):
-        print("用法: python ibkr_cli.py screen [OPTIONS]")
-        print("\n可用过滤参数:")
-        for cli_key, finviz_key in list_available_filters().items():
-            print(f"  {cli_key:18s} → {finviz_key}")
-        print("\n其他参数:")
-        print("  --signal NAME    交易信号 (如 Top Gainers, Oversold)")
-        print("  --size N         最大返回数量 (默认 20)")
-        print("  --json           JSON 输出")
-        print("\n示例:")
-        print('  ./ibkr screen --sector Technology --pe "Under 20" --json')
-        print('  ./ibkr screen --signal Oversold --size 10')
-        print('  ./ibkr screen list  # 列出可用信号')
-        return
-
-    if args[0] == "list":
-        print("📋 可用交易信号:")
-        for s in list_available_signals():
-            print(f"  • {s}")
-        print("\n📋 可用过滤参数 (每个参数用 --help 查看可选值):")
-        for cli_key, finviz_key in list_available_filters().items():
-            options = _get_filter_options(finviz_key)
-            preview = ", ".join(options[:5]) + ("..." if len(options) > 5 else "")
-            print(f"  {cli_key:18s} {finviz_key:22s} [{preview}]")
-        return
-
-    filters, signal, limit, json_output = parse_screen_args(args)
-    if filters is None:  # list 命令已处理
-        return
-
-    if not json_output:
-        filter_desc = ", ".join(f"{k}={v}" for k, v in (filters or {}).items())
-        if signal:
-            filter_desc += f", Signal={signal}"
-        print(f"⏳ Finviz 选股中 ({filter_desc or '默认'}, top {limit})...")
-
-    results = run_finviz_screen(
-        filters=filters, signal=signal, limit=limit
-    )
-
-    if json_output:
-        print_json_resp("screen", results)
-    else:
-        print(format_screen_results(results, filters, signal))
-
-# ─── 新功能命令 (v3) ───────────────────────────────────────────
-
-def cmd_earnings(args):
-    """财报日历"""
-    from earnings_calendar import (
-        get_earnings_date, get_portfolio_earnings, get_earnings_risk_summary,
-        format_earnings_single, format_portfolio_earnings, to_json_earnings
-    )
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if clean_args and clean_args[0].upper() != "PORTFOLIO":
-        # 个股模式
-        json_results = {}
-        for symbol in clean_args:
-            symbol = symbol.upper()
-            event = get_earnings_date(symbol)
-            if json_output:
-                json_results[symbol] = event
-            else:
-                if event:
-                    print(format_earnings_single(event))
-                else:
-                    print(f"⚠️ {symbol}: 无法获取财报日期")
-                print()
-
-        if json_output:
-            print_json_resp("earnings", json_results)
-    else:
-        # 组合模式
-        client = _connect_client()
-        if not json_output:
-            print("⏳ 正在获取持仓财报日历...")
-        events = get_portfolio_earnings(client)
-
-        if json_output:
-            risk = get_earnings_risk_summary(events)
-            print_json_resp("earnings", {"events": events, "risk_summary": risk})
-        else:
-            print(format_portfolio_earnings(events))
-
-        _safe_disconnect(client)
-
-
-def cmd_sizer(args):
-    """仓位计算器"""
-    from position_sizer import calc_position_size, format_position_size, to_json_sizer
-
-    if not args or args[0] in ("-h", "--help"):
-        print("用法: python ibkr_cli.py sizer SYMBOL [--risk 2] [--atr-mult 2] [--json]")
-        print("  --risk N      单笔风险比例 (%, 默认 2)")
-        print("  --atr-mult N  ATR 倍数作为止损距离 (默认 2)")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    risk_pct = 2.0
-    atr_mult = 2.0
-    symbols = []
-
-    i = 0
-    while i < len(args):
-        if args[i] == "--json":
-            i += 1
-        elif args[i] == "--risk" and i + 1 < len(args):
-            risk_pct = float(args[i + 1])
-            i += 2
-        elif args[i] == "--atr-mult" and i + 1 < len(args):
-            atr_mult = float(args[i + 1])
-            i += 2
-        else:
-            symbols.append(args[i].upper())
-            i += 1
-
-    if not symbols:
-        print("❌ 请指定至少一个股票代码")
-        sys.exit(1)
-
-    client = _connect_client()
-    json_results = {}
-
-    for symbol in symbols:
-        if not json_output:
-            print(f"⏳ 正在计算 {symbol} 仓位...")
-        result = calc_position_size(client, symbol, risk_pct=risk_pct, atr_multiplier=atr_mult)
-        if json_output:
-            json_results[symbol] = result
-        else:
-            if result:
-                print(format_position_size(result))
-            else:
-                print(f"⚠️ {symbol}: 无法计算仓位")
-            print()
-
-    if json_output:
-        def enc(o):
-            if dataclasses.is_dataclass(o):
-                return dataclasses.asdict(o)
-            return str(o)
-        print_json_resp("sizer", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_snapshot(args):
-    """组合快照"""
-    from snapshots import (
-        save_snapshot, load_recent_snapshots, calc_snapshot_performance,
-        format_snapshot_performance, format_snapshot_summary, to_json_snapshots
-    )
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-    subcommand = clean_args[0] if clean_args else "save"
-
-    if subcommand == "save":
-        client = _connect_client()
-        save_snapshot(client)
-        _safe_disconnect(client)
-
-    elif subcommand in ("history", "perf"):
-        days = 30
-        if len(clean_args) > 1:
-            try:
-                days = int(clean_args[1])
-            except ValueError:
-                pass
-
-        snapshots = load_recent_snapshots(days)
-        if not snapshots:
-            print("📸 无历史快照数据")
-            print("  使用 ./ibkr snapshot save 保存当日快照")
-            print("  建议配置 cron 每日自动存档")
-            return
-
-        perf = calc_snapshot_performance(snapshots)
-        if json_output:
-            print_json_resp("snapshot", perf or {"error": "数据不足"})
-        else:
-            print(format_snapshot_performance(perf))
-
-    elif subcommand == "latest":
-        snapshots = load_recent_snapshots(1)
-        if snapshots:
-            if json_output:
-                print_json_resp("snapshot", snapshots[-1])
-            else:
-                print(format_snapshot_summary(snapshots[-1]))
-        else:
-            print("📸 无快照数据")
-
-    else:
-        print("用法: python ibkr_cli.py snapshot [save|history|latest] [--json]")
-        print("  save       保存当日组合快照")
-        print("  history N  查看最近 N 天的表现 (默认 30)")
-        print("  latest     查看最新快照")
-
-
-def cmd_sectors(args):
-    """板块轮动"""
-    from sector_rotation import get_sector_rotation, format_sector_rotation, to_json_sectors
-
-    json_output = "--json" in args
-    period = "1 M"
-
-    for i, a in enumerate(args):
-        if a == "--period" and i + 1 < len(args):
-            period = args[i + 1]
-
-    client = _connect_client()
-    if not json_output:
-        print(f"⏳ 正在分析板块轮动 ({period})...")
-
-    report = get_sector_rotation(client, period)
-
-    if json_output:
-        if report:
-            print_json_resp("sectors", report)
-        else:
-            print_json_resp("sectors", {"error": "数据不足"})
-    else:
-        if report:
-            print(format_sector_rotation(report))
-        else:
-            print("⚠️ 板块轮动分析失败: 数据不足")
-
-    _safe_disconnect(client)
-
-
-def cmd_mtf(args):
-    """多周期共振分析"""
-    from technical_analysis import (
-        analyze_multi_timeframe, format_multi_timeframe, to_json_multi_timeframe
-    )
-
-    if not args:
-        print("用法: python ibkr_cli.py mtf SYMBOL [--json]")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    symbols = [a.upper() for a in args if not a.startswith("--")]
-
-    client = _connect_client()
-    json_results = {}
-
-    for symbol in symbols:
-        if not json_output:
-            print(f"⏳ 正在分析 {symbol} 多周期共振...")
-        mtf = analyze_multi_timeframe(client, symbol)
-        if json_output:
-            json_results[symbol] = mtf
-        else:
-            if mtf:
-                print(format_multi_timeframe(mtf))
-            else:
-                print(f"⚠️ {symbol}: 多周期分析失败")
-            print()
-
-    if json_output:
-        def enc(o):
-            if dataclasses.is_dataclass(o):
-                return dataclasses.asdict(o)
-            return str(o)
-        print_json_resp("mtf", json_results)
-
-    _safe_disconnect(client)
-
-
-def cmd_chain(args):
-    """期权链分析"""
-    if not args or args[0] in ("-h", "--help"):
-        print("用法: python ibkr_cli.py chain SYMBOL [--expiry YYYYMMDD] [--range N] [--json]")
-        print("  --expiry    到期日 (不指定则列出所有可用到期日)")
-        print("  --range N   取当前价上下各 N 个行权价 (默认 10)")
-        sys.exit(1)
-
-    json_output = "--json" in args
-    expiry = None
-    strike_range = 10
-    symbol = None
-
-    i = 0
-    while i < len(args):
-        if args[i] == "--json":
-            i += 1
-        elif args[i] == "--expiry" and i + 1 < len(args):
-            expiry = args[i + 1]
-            i += 2
-        elif args[i] == "--range" and i + 1 < len(args):
-            strike_range = int(args[i + 1])
-            i += 2
-        elif not args[i].startswith("--"):
-            symbol = args[i].upper()
-            i += 1
-        else:
-            i += 1
-
-    if not symbol:
-        print("❌ 请指定股票代码")
-        sys.exit(1)
-
-    client = _connect_client()
-    if not json_output:
-        if expiry:
-            print(f"⏳ 正在获取 {symbol} 期权链 (到期日: {expiry})...")
-        else:
-            print(f"⏳ 正在获取 {symbol} 可用期权到期日...")
-
-    data = client.get_option_chain_data(symbol, expiry=expiry, strike_range=strike_range)
-
-    if json_output:
-        print_json_resp("chain", data)
-    else:
-        if "error" in data:
-            print(f"⚠️ {data['error']}")
-        elif "chain" in data:
-            # 有具体期权链数据
-            print(f"🎯 {symbol} 期权链 (到期日: {data.get('expiry', 'N/A')})")
-            print(f"  当前价: ${data.get('current_price', 0):,.2f}")
-            print(f"  Put/Call Ratio: {data.get('put_call_ratio', 0):.2f}")
-            pcr = data.get("put_call_ratio", 0)
-            if pcr > 1.5:
-                print("  📉 情绪偏悲观 (高 Put 比例)")
-            elif pcr < 0.5:
-                print("  📈 情绪偏乐观 (高 Call 比例)")
-            print()
-
-            # Calls
-            calls = data["chain"].get("calls", [])
-            if calls:
-                print(f"  📈 CALL (看涨)")
-                print(f"  {'行权价':>8s} {'买价':>8s} {'卖价':>8s} {'Delta':>8s} {'IV':>8s} {'OI':>8s}")
-                for c in calls:
-                    print(f"  ${c['strike']:>7,.0f} ${c['bid']:>7.2f} ${c['ask']:>7.2f} "
-                          f"{c['delta']:>+7.4f} {c['implied_vol']:>7.2%} {c['open_interest']:>7,}")
-                print()
-
-            # Puts
-            puts = data["chain"].get("puts", [])
-            if puts:
-                print(f"  📉 PUT (看跌)")
-                print(f"  {'行权价':>8s} {'买价':>8s} {'卖价':>8s} {'Delta':>8s} {'IV':>8s} {'OI':>8s}")
-                for p in puts:
-                    print(f"  ${p['strike']:>7,.0f} ${p['bid']:>7.2f} ${p['ask']:>7.2f} "
-                          f"{p['delta']:>+7.4f} {p['implied_vol']:>7.2%} {p['open_interest']:>7,}")
-        else:
-            # 仅到期日列表
-            expirations = data.get("expirations", [])
-            print(f"📅 {symbol} 可用期权到期日 ({len(expirations)} 个)")
-            for exp in expirations[:20]:
-                print(f"  {exp}")
-            if len(expirations) > 20:
-                print(f"  ...共 {len(expirations)} 个到期日")
-            print(f"\n使用 --expiry YYYYMMDD 查看具体到期日的期权链")
-
-    _safe_disconnect(client)
-
-
-def cmd_vix(args):
-    """VIX 恐慌指数仪表盘"""
-    from vix_dashboard import analyze_vix, format_vix_dashboard
-
-    json_output = "--json" in args
-
-    client = _connect_client()
-    dashboard = analyze_vix(client)
-
-    if json_output:
-        if dashboard:
-            print_json_resp("vix", dashboard)
-        else:
-            print_json_resp("vix", {"error": "VIX 数据获取失败"})
-    else:
-        if dashboard:
-            print(format_vix_dashboard(dashboard))
-        else:
-            print("⚠️ 无法获取 VIX 数据")
-
-    _safe_disconnect(client)
-
-
-def cmd_exit(args):
-    """智能止盈止损建议"""
-    from exit_advisor import calc_exit_levels, format_exit_advice
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if not clean_args:
-        print("用法: python ibkr_cli.py exit SYMBOL [--json]")
-        print("示例: python ibkr_cli.py exit AAPL --json")
-        return
-
-    symbol = clean_args[0].upper()
-
-    client = _connect_client()
-    advice = calc_exit_levels(client, symbol)
-
-    if json_output:
-        if advice:
-            print_json_resp("exit", advice)
-        else:
-            print_json_resp("exit", {"error": f"{symbol} 数据不足"})
-    else:
-        if advice:
-            print(format_exit_advice(advice))
-        else:
-            print(f"⚠️ {symbol}: 历史数据不足，无法生成建议")
-
-    _safe_disconnect(client)
-
-
-def cmd_compare(args):
-    """股票对比分析"""
-    from stock_compare import compare_stocks, format_comparison
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if len(clean_args) < 2:
-        print("用法: python ibkr_cli.py compare AAPL MSFT NVDA [--json]")
-        print("  至少需要 2 只股票进行对比")
-        return
-
-    symbols = [s.upper() for s in clean_args]
-
-    client = _connect_client()
-    report = compare_stocks(client, symbols)
-
-    if json_output:
-        if report:
-            print_json_resp("compare", report)
-        else:
-            print_json_resp("compare", {"error": "对比分析失败"})
-    else:
-        if report:
-            print(format_comparison(report))
-        else:
-            print("⚠️ 对比分析失败：数据不足")
-
-    _safe_disconnect(client)
-
-
-def cmd_risk(args):
-    """风险预算计算器"""
-    from risk_budget import calc_risk_budget, format_risk_budget
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    # 支持 --tolerance 参数
-    tolerance = 20.0
-    for i, a in enumerate(clean_args):
-        if a == "--tolerance" and i + 1 < len(clean_args):
-            try:
-                tolerance = float(clean_args[i + 1])
-            except ValueError:
-                pass
-
-    client = _connect_client()
-    report = calc_risk_budget(client, max_risk_tolerance=tolerance)
-
-    if json_output:
-        if report:
-            print_json_resp("risk", report)
-        else:
-            print_json_resp("risk", {"error": "无持仓数据"})
-    else:
-        if report:
-            print(format_risk_budget(report))
-        else:
-            print("⚠️ 无持仓数据")
-
-    _safe_disconnect(client)
-
-
-def cmd_flow(args):
-    """期权异常活动扫描"""
-    from options_flow import scan_unusual_options, format_unusual_options
-
-    json_output = "--json" in args
-    clean_args = [a for a in args if a != "--json"]
-
-    if not clean_args:
-        print("用法: python ibkr_cli.py flow AAPL [--json]")
-        return
-
-    symbol = clean_args[0].upper()
-
-    client = _connect_client()
-    report = scan_unusual_options(client, symbol)
-
-    if json_output:
-        if report:
-            print_json_resp("flow", report)
-        else:
-            print_json_resp("flow", {"error": f"{symbol} 期权数据获取失败"})
-    else:
-        if report:
-            print(format_unusual_options(report))
-        else:
-            print(f"⚠️ {symbol}: 无法获取期权数据")
-
-    _safe_disconnect(client)
-
-
-def cmd_daily(args):
-    """持仓日报"""
-    from daily_report import generate_daily_report, format_daily_report
-
-    json_output = "--json" in args
-
-    client = _connect_client()
-    if not json_output:
-        print("⏳ 正在生成投资日报...")
-    report = generate_daily_report(client)
+COMMANDS = {
+    "status": ("检查 IB Gateway 连接状态", "ibkr_commands:cmd_status"),
+    "broker": ("常驻连接代理: broker [start|stop|status]", "ibkr_commands:cmd_broker"),
+    "contracts": ("合约缓存: contracts [stats|warm|purge|clear] [SYMBOL...]", "ibkr_commands:cmd_contracts"),
+    "fvcache": ("Finviz 缓存: fvcache [stats|purge|clear] [KIND]", "ibkr_commands:cmd_fvcache"),
+    "quote": ("查询实时行情: quote AAPL NVDA", "ibkr_commands:cmd_quote"),
+    "analyze": ("技术分析: analyze AAPL", "ibkr_commands:cmd_analyze"),
+    "mtf": ("多周期共振: mtf AAPL", "ibkr_commands:cmd_mtf"),
+    "fundamentals": ("基本面查询(IBKR+Finviz): fundamentals AAPL", "ibkr_commands:cmd_fundamentals"),
+    "ratings": ("分析师评级(Finviz): ratings AAPL", "ibkr_commands:cmd_ratings"),
+    "insider": ("内部人交易(Finviz): insider AAPL / insider market", "ibkr_commands:cmd_insider"),
+    "peers": ("同行公司(Finviz): peers AAPL [--quote]", "ibkr_commands:cmd_peers"),
+    "screen": ("Finviz多维选股: screen --sector Technology --pe 'Under 20'", "ibkr_commands:cmd_screen"),
+    "history": ("历史 K 线: history AAPL --period '3 M'", "ibkr_commands:cmd_history"),
+    "earnings": ("财报日历: earnings AAPL / earnings portfolio / earnings upcoming [--days 14]", "ibkr_commands:cmd_earnings"),
+    "sizer": ("仓位计算: sizer AAPL [--risk 2] [--atr-mult 2]", "ibkr_commands:cmd_sizer"),
+    "sectors": ("板块轮动: sectors [--period '1 M']", "ibkr_commands:cmd_sectors"),
+    "snapshot": ("组合快照: snapshot [save|history|latest]", "ibkr_commands:cmd_snapshot"),
+    "portfolio": ("组合分析: portfolio [all|allocation|...]", "ibkr_commands:cmd_portfolio"),
+    "options": ("期权分析: options [all|calendar|greeks|summary] [greeks --scenarios [--days 0,1,5] [--no-stocks]]", "ibkr_commands:cmd_options"),
+    "chain": ("期权链: chain AAPL [--expiry 20260620]", "ibkr_commands:cmd_chain"),
+    "trades": ("交易复盘: trades [all|history|stats]", "ibkr_commands:cmd_trades"),
+    "scanner": ("IBKR市场扫描: scanner --code TOP_PERC_GAIN", "ibkr_commands:cmd_scanner"),
+    "watchlist": ("Watchlist: watchlist [list|add|remove] SYMBOL", "ibkr_commands:cmd_watchlist"),
+    "alerts": ("价格告警: alerts [list|add|remove|log|status|watch]（price / pct / rsi / score 阈值）", "ibkr_commands:cmd_alerts"),
+    "news": ("公司新闻(Yahoo+Finviz): news AAPL / news market", "ibkr_commands:cmd_news"),
+    "export": ("数据导出: export [all|portfolio|allocation|report]", "ibkr_commands:cmd_export"),
+    "vix": ("VIX恐慌指数: vix [--json]", "ibkr_commands:cmd_vix"),
+    "exit": ("止盈止损建议: exit AAPL [--json]", "ibkr_commands:cmd_exit"),
+    "compare": ("股票对比: compare AAPL MSFT NVDA [--json]", "ibkr_commands:cmd_compare"),
+    "risk": ("风险预算: risk [--tolerance 20] [--paths 100000] [--no-var] [--json]", "ibkr_commands:cmd_risk"),
+    "flow": ("期权异常活动: flow AAPL [--json]", "ibkr_commands:cmd_flow"),
+    "daily": ("持仓日报: daily [--json]", "ibkr_commands:cmd_daily"),
+    "batch": ("批处理: batch [FILE|-] [--workers 4]（JSONL 命令，共享连接，逐条输出 JSON）", "ibkr_commands:cmd_batch"),
+    "serve": ("本地查询服务: serve [start|status] [--port 8765]（HTTP / JSON-RPC，合并相同请求）", "ibkr_commands:cmd_serve"),
+}
 
-    if json_output:
-        if report:
-            print_json_resp("daily", report)
-        else:
-            print_json_resp("daily", {"error": "无持仓数据"})
-    else:
-        if report:
-            print(format_daily_report(report))
-        else:
-            print("⚠️ 无持仓数据")
 
-    _safe_disconnect(client)
+def resolve_command(name: str) -> Callable:
+    """按注册表导入命令所在模块并返回命令函数"""
+    module_name, func_name = COMMANDS[name][1].split(":")
+    return getattr(importlib.import_module(module_name), func_name)
 
 
 # ─── 主入口 ────────────────────────────────────────────────────
 
-COMMANDS = {
-    "status": ("检查 IB Gateway 连接状态", cmd_status),
-    "quote": ("查询实时行情: quote AAPL NVDA", cmd_quote),
-    "analyze": ("技术分析: analyze AAPL", cmd_analyze),
-    "mtf": ("多周期共振: mtf AAPL", cmd_mtf),
-    "fundamentals": ("基本面查询(IBKR+Finviz): fundamentals AAPL", cmd_fundamentals),
-    "ratings": ("分析师评级(Finviz): ratings AAPL", cmd_ratings),
-    "insider": ("内部人交易(Finviz): insider AAPL / insider market", cmd_insider),
-    "peers": ("同行公司(Finviz): peers AAPL [--quote]", cmd_peers),
-    "screen": ("Finviz多维选股: screen --sector Technology --pe 'Under 20'", cmd_screen),
-    "history": ("历史 K 线: history AAPL --period '3 M'", cmd_history),
-    "earnings": ("财报日历: earnings AAPL / earnings portfolio", cmd_earnings),
-    "sizer": ("仓位计算: sizer AAPL [--risk 2] [--atr-mult 2]", cmd_sizer),
-    "sectors": ("板块轮动: sectors [--period '1 M']", cmd_sectors),
-    "snapshot": ("组合快照: snapshot [save|history|latest]", cmd_snapshot),
-    "portfolio": ("组合分析: portfolio [all|allocation|...]", cmd_portfolio),
-    "options": ("期权分析: options [all|calendar|greeks|summary]", cmd_options),
-    "chain": ("期权链: chain AAPL [--expiry 20260620]", cmd_chain),
-    "trades": ("交易复盘: trades [all|history|stats]", cmd_trades),
-    "scanner": ("IBKR市场扫描: scanner --code TOP_PERC_GAIN", cmd_scanner),
-    "watchlist": ("Watchlist: watchlist [list|add|remove] SYMBOL", cmd_watchlist),
-    "news": ("公司新闻(Yahoo+Finviz): news AAPL / news market", cmd_news),
-    "export": ("数据导出: export [all|portfolio|allocation|report]", cmd_export),
-    "vix": ("VIX恐慌指数: vix [--json]", cmd_vix),
-    "exit": ("止盈止损建议: exit AAPL [--json]", cmd_exit),
-    "compare": ("股票对比: compare AAPL MSFT NVDA [--json]", cmd_compare),
-    "risk": ("风险预算: risk [--tolerance 20] [--json]", cmd_risk),
-    "flow": ("期权异常活动: flow AAPL [--json]", cmd_flow),
-    "daily": ("持仓日报: daily [--json]", cmd_daily),
-}
-
-
 def main():
     if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help", "help"):
         print("🏦 IBKR 只读查询 CLI")
@@ -1592,12 +106,15 @@ def main():
     cmd_args = sys.argv[2:]
 
     if cmd_name not in COMMANDS:
-        print(f"❌ 未知命令: {cmd_name}")
-        print(f"可用命令: {', '.join(COMMANDS.keys())}")
-        print("使用 --help 查看帮助")
+        # JSON 模式下提示信息不进入 stdout
+        out = sys.stderr if "--json" in sys.argv else sys.stdout
+        print(f"❌ 未知命令: {cmd_name}", file=out)
+        print(f"可用命令: {', '.join(COMMANDS.keys())}", file=out)
+        print("使用 --help 查看帮助", file=out)
         sys.exit(1)
 
-    _, cmd_func = COMMANDS[cmd_name]
+    # 导入命令模块（JSON 模式的 stdout 劫持在 ibkr_commands 导入时完成）
+    cmd_func = resolve_command(cmd_name)
 
     try:
         cmd_func(cmd_args)
@@ -1609,6 +126,7 @@ def main():
         print(f"\n❌ 执行失败: {e}")
         print(f"   错误类型: {type(e).__name__}")
         print(f"   完整堆栈:")
+        import traceback
         traceback.print_exc()
         sys.exit(1)
 
@@ -9,16 +9,20 @@
 连接：IB Gateway 端口 4001 (live) 或 4002 (paper)
 """
 
+from __future__ import annotations
+
 import os
 import math
 import time
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, TYPE_CHECKING
 import random
 
-from ib_async import *
+# ib_async 导入约 250ms：只在创建客户端 / 构造合约时按需导入，报表格式化等轻量用途不受拖累
+if TYPE_CHECKING:
+    from ib_async import Contract
 
 
 def load_local_env():
@@ -53,6 +57,19 @@ else:
     IB_CLIENT_ID = int(_env_cid)
 
 
+def _symbol_contract(symbol: str, secType: str = 'STK', exchange: str = 'SMART', currency: str = 'USD') -> Contract:
+    """由代码构造未 qualify 的合约（VIX / SPX 等指数走 CBOE）"""
+    from ib_async import Index, Stock
+
+    if symbol == 'VIX':
+        return Index('VIX', 'CBOE', currency)
+    if symbol == 'SPX':
+        return Index('SPX', 'CBOE', currency)
+    if secType == 'IND':
+        return Index(symbol, exchange, currency)
+    return Stock(symbol, exchange, currency)
+
+
 @dataclass
 class Position:
     symbol: str
@@ -111,7 +128,13 @@ class IBKRReadOnlyClient:
         self.host = host
         self.port = port
         self.client_id = client_id
+        from ib_async import IB
+
         self.ib = IB()
+        # 常驻进程中由 enable_quote_stream() 建立的流式行情表（见 quote_stream.py）
+        self.quote_stream = None
+        # 挂在流式行情上的告警引擎（见 alert_engine.py）
+        self.alert_engine = None
         self._setup_reconnect()
 
     def _setup_reconnect(self):
@@ -141,6 +164,12 @@ class IBKRReadOnlyClient:
 
     def disconnect(self):
         """断开连接"""
+        if self.alert_engine is not None:
+            self.alert_engine.unbind()
+            self.alert_engine = None
+        if self.quote_stream is not None:
+            self.quote_stream.close()
+            self.quote_stream = None
         if self.ib.isConnected():
             # 移除重连 handler 避免断开后自动重连
             self.ib.disconnectedEvent.clear()
@@ -150,6 +179,55 @@ class IBKRReadOnlyClient:
         """检查连接状态"""
         return self.ib.isConnected()
 
+    def enable_quote_stream(self) -> bool:
+        """
+        常驻进程（broker / serve）调用：为持仓 + 自选股建立流式行情订阅，
+        之后 get_quote / get_quotes_batch 优先读内存行情表。返回是否已启用。
+        """
+        from quote_stream import QuoteStream, QUOTE_STREAM_DISABLED
+
+        if QUOTE_STREAM_DISABLED:
+            return False
+        if self.quote_stream is None:
+            self.quote_stream = QuoteStream(self)
+            self.quote_stream.sync_core()
+        return True
+
+    def quote_stream_stats(self) -> Optional[dict]:
+        """流式行情订阅统计（未启用时为 None）"""
+        if self.quote_stream is None:
+            return None
+        import dataclasses
+        return dataclasses.asdict(self.quote_stream.stats())
+
+    def enable_alert_engine(self) -> bool:
+        """
+        常驻进程调用：在流式行情上挂载告警引擎，逐笔评估 Watchlist 目标价与自定义告警规则。
+        需先 enable_quote_stream()；返回是否已启用。
+        """
+        if self.quote_stream is None:
+            return False
+        if self.alert_engine is None:
+            from alert_engine import AlertEngine
+            self.alert_engine = AlertEngine()
+            self.alert_engine.bind(self)
+        return True
+
+    def alert_engine_stats(self) -> Optional[dict]:
+        """告警引擎统计（未启用时为 None）"""
+        if self.alert_engine is None:
+            return None
+        import dataclasses
+        return dataclasses.asdict(self.alert_engine.stats())
+
+    def pump_events(self, seconds: float = 0):
+        """常驻进程空闲时调用：处理网关推送（流式行情写表），并按间隔同步常驻订阅与告警规则"""
+        self.ib.sleep(seconds)
+        if self.quote_stream is not None:
+            self.quote_stream.maybe_sync()
+        if self.alert_engine is not None:
+            self.alert_engine.maybe_reload()
+
     def get_accounts(self) -> List[str]:
         """获取账户列表"""
         return self.ib.managedAccounts()
@@ -203,6 +281,7 @@ class IBKRReadOnlyClient:
     def get_executions(self, client_id: int = None):
         """获取近期成交记录（通常仅包含当天/近几天的数据）"""
         try:
+            from ib_async import ExecutionFilter
             filt = ExecutionFilter()
             if client_id is not None:
                 filt.clientId = client_id
@@ -221,38 +300,84 @@ class IBKRReadOnlyClient:
             return []
 
     def get_option_ticker(self, contract):
-        """获取期权 ticker（含 modelGreeks）"""
+        """获取期权 ticker（含 modelGreeks），Greeks 到达即返回，最多等 2 秒"""
+        results = self.get_option_tickers_batch([contract], timeout=2)
+        return results[0][0] if results else None
+
+    def get_option_tickers_batch(self, contracts: list, timeout: float = 4.0) -> List[tuple]:
+        """
+        批量获取期权 ticker（含 modelGreeks）
+        按临时请求的行情线路额度分组订阅（见 pacing.py），每组事件驱动等待：Greeks 到齐立即返回并退订，
+        最迟 timeout 秒。返回与输入等长的 [(ticker, complete)]，complete 表示该合约 Greeks 是否完整。
+        """
+        if not contracts:
+            return []
+        from pacing import get_scheduler
+
+        size = get_scheduler(self.ib).adhoc_lines()
+        if len(contracts) > size:
+            return [r for i in range(0, len(contracts), size)
+                    for r in self.get_option_tickers_batch(contracts[i:i + size], timeout)]
+
+        def greeks_ready(ticker) -> bool:
+            g = ticker.modelGreeks
+            return (g is not None and g.delta is not None and not math.isnan(g.delta)
+                    and g.impliedVol is not None and not math.isnan(g.impliedVol))
+
+        tickers = []
         try:
             self.ib.reqMarketDataType(3)
-            ticker = self.ib.reqMktData(contract, genericTickList='106', snapshot=False)
-            self.ib.sleep(2)  # 等待 greeks 数据到达
-            self.ib.cancelMktData(contract)
-            return ticker
+            tickers = [self.ib.reqMktData(c, genericTickList='106', snapshot=False) for c in contracts]
+            deadline = time.time() + timeout
+            while not all(greeks_ready(t) for t in tickers):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.ib.waitOnUpdate(timeout=remaining)
         except Exception as e:
             print(f"❌ 获取期权 ticker 失败: {e}")
-            return None
+        finally:
+            for c in contracts[:len(tickers)]:
+                try:
+                    self.ib.cancelMktData(c)
+                except Exception:
+                    pass
+
+        results = [(t, greeks_ready(t)) for t in tickers]
+        return results + [(None, False)] * (len(contracts) - len(results))
+
+    def qualify_contracts(self, *contracts) -> List[Optional[Contract]]:
+        """
+        带本地缓存的合约验证（见 contract_cache.py）
+        返回与输入等长的列表，无法解析的位置为 None；仅未命中缓存的合约会请求网关。
+        """
+        from contract_cache import qualify_cached
+        return qualify_cached(self.ib, *contracts)
 
     def search_symbol(self, symbol: str, secType: str = 'STK', exchange: str = 'SMART', currency: str = 'USD') -> Optional[Contract]:
         """搜索股票/指数代码，返回 qualified Contract"""
-        if symbol == 'VIX':
-            contract = Index('VIX', 'CBOE', currency)
-        elif symbol == 'SPX':
-            contract = Index('SPX', 'CBOE', currency)
-        else:
-            if secType == 'IND':
-                contract = Index(symbol, exchange, currency)
-            else:
-                contract = Stock(symbol, exchange, currency)
-                
+        contract = _symbol_contract(symbol, secType, exchange, currency)
         try:
-            qualified = self.ib.qualifyContracts(contract)
-            if qualified:
-                return qualified[0]
+            [qualified] = self.qualify_contracts(contract)
+            return qualified
         except Exception:
             pass
         return None
 
     def get_quote(self, symbol: str) -> Optional[Quote]:
+        """获取实时行情（已启用流式订阅时直接读内存行情表，否则请求快照）"""
+        stream = self.quote_stream
+        if stream is None:
+            return self._snapshot_quote(symbol)
+
+        quote = stream.lookup(symbol)
+        if quote is None:
+            # 本次走快照，之后的查询由新建的订阅应答
+            quote = self._snapshot_quote(symbol)
+            stream.subscribe([symbol])
+        return quote
+
+    def _snapshot_quote(self, symbol: str) -> Optional[Quote]:
         """获取实时行情快照"""
         contract = self.search_symbol(symbol)
         if not contract:
@@ -290,9 +415,23 @@ class IBKRReadOnlyClient:
             return None
 
     def get_quotes_batch(self, symbols: List[str]) -> Dict[str, Quote]:
-        """批量获取行情快照（一次网络请求，比逐个 get_quote 快 N 倍）"""
+        """
+        批量获取行情：流式订阅命中的直接读表，其余请求快照。
+        批量查询多为一次性（扫描、对比），未命中的代码不补订阅，以免长期占用行情线路。
+        """
         if not symbols:
             return {}
+        stream = self.quote_stream
+        if stream is None:
+            return self._snapshot_quotes_batch(symbols)
+
+        results, missing = stream.get_quotes(symbols)
+        if missing:
+            results.update(self._snapshot_quotes_batch(missing))
+        return results
+
+    def _snapshot_quotes_batch(self, symbols: List[str]) -> Dict[str, Quote]:
+        """批量获取行情快照（一次批量请求，比逐个 get_quote 快 N 倍；超出行情线路额度时分组）"""
 
         def safe(val, default=0):
             if val is None or (isinstance(val, float) and math.isnan(val)):
@@ -302,10 +441,11 @@ class IBKRReadOnlyClient:
         # 1. 批量构建 + qualify 合约
         contracts = []
         symbol_map = {}  # conId -> symbol (用于回溯)
+        from ib_async import Stock
         raw_contracts = [Stock(s.upper(), 'SMART', 'USD') for s in symbols]
 
         try:
-            qualified = self.ib.qualifyContracts(*raw_contracts)
+            qualified = self.qualify_contracts(*raw_contracts)
         except Exception as e:
             print(f"❌ 批量合约验证失败: {e}")
             return {}
@@ -318,9 +458,11 @@ class IBKRReadOnlyClient:
         if not contracts:
             return {}
 
-        # 2. 一次性请求所有行情
+        # 2. 按临时请求的行情线路额度分组请求快照（未启用流式订阅时通常一组即可）
+        from pacing import get_scheduler
+        size = get_scheduler(self.ib).adhoc_lines()
         try:
-            tickers = self.ib.reqTickers(*contracts)
+            tickers = [t for i in range(0, len(contracts), size) for t in self.ib.reqTickers(*contracts[i:i + size])]
         except Exception as e:
             print(f"❌ 批量行情请求失败: {e}")
             return {}
@@ -373,7 +515,14 @@ class IBKRReadOnlyClient:
 
         # 尝试获取 fundamental data XML
         try:
-            xml_data = self.ib.reqFundamentalData(contract, 'ReportSnapshot')
+            from pacing import get_scheduler
+            xml_data = get_scheduler(self.ib).call(
+                "fundamental",
+                lambda: self.ib.reqFundamentalData(contract, 'ReportSnapshot'),
+                group=contract.conId,
+                label=f"{symbol} 基本面",
+                contracts=(contract,),
+            )
             if xml_data:
                 root = ET.fromstring(xml_data)
                 # 解析公司信息
@@ -451,30 +600,15 @@ class IBKRReadOnlyClient:
         duration: "1 D", "1 W", "1 M", "3 M", "6 M", "1 Y", "5 Y"
         bar_size: "1 min", "5 mins", "1 hour", "1 day", "1 week", "1 month"
         """
+        from bar_store import get_bars
+
         contract = self.search_symbol(symbol)
         if not contract:
             return []
 
         try:
-            bars = self.ib.reqHistoricalData(
-                contract,
-                endDateTime='',
-                durationStr=duration,
-                barSizeSetting=bar_size,
-                whatToShow='TRADES',
-                useRTH=True
-            )
-            return [
-                {
-                    "date": str(bar.date),
-                    "open": bar.open,
-                    "high": bar.high,
-                    "low": bar.low,
-                    "close": bar.close,
-                    "volume": bar.volume
-                }
-                for bar in bars
-            ]
+            # 经本地 K 线存储：窗口内已有数据直接读取，只补拉尾部
+            return get_bars(self.ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True)
         except Exception as e:
             print(f"❌ 获取历史数据失败: {e}")
             return []
@@ -484,52 +618,57 @@ class IBKRReadOnlyClient:
         批量并发获取历史 K 线数据
         利用 ib_async 的全异步能力加速批量分析
         """
+        return self.get_historical_data_multi({sym: (sym, duration, bar_size) for sym in symbols})
+
+    def get_historical_data_multi(self, requests: Dict[str, Tuple[str, str, str]]) -> Dict[str, List[dict]]:
+        """
+        一次并发拉取多条不同周期的 K 线序列
+        requests: {键: (symbol, duration, bar_size)}，返回 {键: bars}；同一 symbol 可出现多次
+        """
         import asyncio
+        from contract_cache import qualify_cached_async
+        from bar_store import get_bars_async
+        from pacing import get_scheduler, format_pacing_stats
         results = {}
-        
-        async def fetch_one(symbol):
-            # IBKR API 对单秒并发有限制(pacing violations)，稍微打散请求避免超时断连
-            await asyncio.sleep(random.uniform(0.01, 0.1))
-            contract = Stock(symbol, 'SMART', 'USD')
+
+        # IBKR 历史数据有限速规则 (pacing violations)，由 pacing 调度器统一排队，不再随机打散
+        scheduler = get_scheduler(self.ib)
+        wait_before = scheduler.wait_sec
+
+        async def fetch_one(key, contract, duration, bar_size):
+            if contract is None:
+                return key, []
             try:
-                qualified = await self.ib.qualifyContractsAsync(contract)
-                if not qualified:
-                    return symbol, []
-                bars = await self.ib.reqHistoricalDataAsync(
-                    qualified[0],
-                    endDateTime='',
-                    durationStr=duration,
-                    barSizeSetting=bar_size,
-                    whatToShow='TRADES',
-                    useRTH=True
+                bars = await get_bars_async(
+                    self.ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True
                 )
-                formatted = [
-                    {
-                        "date": str(bar.date),
-                        "open": bar.open,
-                        "high": bar.high,
-                        "low": bar.low,
-                        "close": bar.close,
-                        "volume": bar.volume
-                    }
-                    for bar in bars
-                ]
-                return symbol, formatted
+                return key, bars
             except Exception as e:
                 # 忽略因数据不存在引发的正常异常
-                return symbol, []
+                return key, []
 
-        async def fetch_all():
-            tasks = [fetch_one(sym) for sym in symbols]
+        async def fetch_all(keys, symbols):
+            # 先统一走合约缓存，未命中的合约一次批量 qualify
+            try:
+                qualified = await qualify_cached_async(self.ib, *[_symbol_contract(sym) for sym in symbols])
+            except Exception:
+                qualified = [None] * len(symbols)
+            contracts = dict(zip(symbols, qualified))
+            tasks = [fetch_one(key, contracts[requests[key][0]], *requests[key][1:]) for key in keys]
             return await asyncio.gather(*tasks)
 
-        if not symbols:
+        if not requests:
             return {}
 
-        batch_results = self.ib.run(fetch_all())
-        for sym, bars in batch_results:
-            results[sym] = bars
-            
+        keys = list(requests)
+        symbols = list(dict.fromkeys(requests[key][0] for key in keys))
+        batch_results = self.ib.run(fetch_all(keys, symbols))
+        for key, bars in batch_results:
+            results[key] = bars
+
+        if scheduler.wait_sec - wait_before >= 1:
+            print(f"⏳ 历史数据节流: {format_pacing_stats(scheduler.stats())}")
+
         return results
 
 
@@ -538,6 +677,8 @@ class IBKRReadOnlyClient:
         全市场智能扫描
         scan_type: TOP_PERC_GAIN, TOP_PERC_LOSE, MOST_ACTIVE, HIGH_VS_13W_HL
         """
+        from ib_async import ScannerSubscription, TagValue
+
         try:
             sub = ScannerSubscription(
                 instrument='STK',
@@ -549,7 +690,12 @@ class IBKRReadOnlyClient:
             tag_values = [
                 TagValue('marketCapAbove', '100000000')
             ]
-            results = self.ib.reqScannerData(sub, scannerSubscriptionFilterOptions=tag_values)
+            from pacing import get_scheduler
+            results = get_scheduler(self.ib).call(
+                "scanner",
+                lambda: self.ib.reqScannerData(sub, scannerSubscriptionFilterOptions=tag_values),
+                label=f"扫描 {scan_type}",
+            )
             return [
                 {
                     "rank": r.rank,
@@ -577,163 +723,64 @@ class IBKRReadOnlyClient:
         Returns:
             dict: {expirations, chain, put_call_ratio, ...}
         """
-        from ib_async import Stock, Option
-        import math
-
-        contract = self.search_symbol(symbol)
-        if not contract:
-            return {"error": f"{symbol}: 合约不存在"}
-
-        try:
-            # 获取可用期权参数
-            chains = self.ib.reqSecDefOptParams(
-                contract.symbol, '', contract.secType, contract.conId
-            )
-            if not chains:
-                return {"error": f"{symbol}: 无期权链数据"}
-
-            # 取 SMART 交易所的链（通常是最全的）
-            smart_chain = None
-            for c in chains:
-                if c.exchange == 'SMART':
-                    smart_chain = c
-                    break
-            if not smart_chain:
-                smart_chain = chains[0]
-
-            expirations = sorted(smart_chain.expirations)
-            all_strikes = sorted(smart_chain.strikes)
-
-            result = {
-                "symbol": symbol,
-                "exchange": smart_chain.exchange,
-                "expirations": expirations,
-                "total_strikes": len(all_strikes),
-            }
-
-            # 如果未指定到期日，仅返回到期日列表
-            if not expiry:
-                return result
-
-            # 获取当前价格以确定行权价范围
-            [ticker] = self.ib.reqTickers(contract)
-            current_price = ticker.last or ticker.close or 0
-            if current_price <= 0:
-                return {**result, "error": "无法获取当前价格"}
-
-            result["current_price"] = current_price
-
-            # 筛选附近的行权价
-            nearby_strikes = sorted(
-                all_strikes,
-                key=lambda s: abs(s - current_price)
-            )[:strike_range * 2]
-            nearby_strikes = sorted(nearby_strikes)
-
-            # 为 Call 和 Put 构建合约并获取数据
-            chain_data = {"calls": [], "puts": []}
-            total_call_oi = 0
-            total_put_oi = 0
-
-            for right in ["C", "P"]:
-                contracts = []
-                for strike in nearby_strikes:
-                    opt = Option(symbol, expiry, strike, right, 'SMART')
-                    contracts.append(opt)
-
-                # 批量 qualify
-                try:
-                    qualified = self.ib.qualifyContracts(*contracts)
-                except Exception:
-                    qualified = []
-
-                if not qualified:
-                    continue
-
-                # 批量获取行情快照
-                tickers = self.ib.reqTickers(*qualified)
-
-                for opt_contract, t in zip(qualified, tickers):
-                    delta = gamma = theta = vega = iv = 0.0
-                    if t.modelGreeks:
-                        def safe(v):
-                            return float(v) if v is not None and not (isinstance(v, float) and math.isnan(v)) else 0.0
-                        delta = safe(t.modelGreeks.delta)
-                        gamma = safe(t.modelGreeks.gamma)
-                        theta = safe(t.modelGreeks.theta)
-                        vega = safe(t.modelGreeks.vega)
-                        iv = safe(t.modelGreeks.impliedVol)
-
-                    bid = t.bid if t.bid and t.bid > 0 else 0
-                    ask = t.ask if t.ask and t.ask > 0 else 0
-                    last = t.last if t.last and t.last > 0 else 0
-                    volume = int(t.volume) if t.volume and t.volume > 0 else 0
-
-                    # OpenInterest 需要通过 generic tick
-                    oi = 0
-                    if hasattr(t, 'callOpenInterest') and right == "C":
-                        oi = int(t.callOpenInterest or 0)
-                    elif hasattr(t, 'putOpenInterest') and right == "P":
-                        oi = int(t.putOpenInterest or 0)
-
-                    entry = {
-                        "strike": opt_contract.strike,
-                        "bid": round(bid, 2),
-                        "ask": round(ask, 2),
-                        "last": round(last, 2),
-                        "volume": volume,
-                        "open_interest": oi,
-                        "delta": round(delta, 4),
-                        "gamma": round(gamma, 4),
-                        "theta": round(theta, 4),
-                        "vega": round(vega, 4),
-                        "implied_vol": round(iv, 4),
-                    }
-
-                    if right == "C":
-                        chain_data["calls"].append(entry)
-                        total_call_oi += oi
-                    else:
-                        chain_data["puts"].append(entry)
-                        total_put_oi += oi
-
-            # Put/Call Ratio
-            pcr = round(total_put_oi / total_call_oi, 2) if total_call_oi > 0 else 0
-
-            result["expiry"] = expiry
-            result["chain"] = chain_data
-            result["total_call_oi"] = total_call_oi
-            result["total_put_oi"] = total_put_oi
-            result["put_call_ratio"] = pcr
-
+        chain = self.get_option_chain_multi(
+            symbol, expirations=[expiry] if expiry else [], strike_range=strike_range
+        )
+        result = {
+            "symbol": symbol,
+            "exchange": chain.exchange,
+            "expirations": chain.expirations,
+            "total_strikes": chain.total_strikes,
+        }
+        if chain.error:
+            if not chain.expirations:
+                return {"error": chain.error}
+            return {**result, "error": chain.error}
+        if not expiry:
             return result
+        return chain.to_chain_dict(expiry)
 
-        except Exception as e:
-            print(f"❌ 获取期权链失败: {e}")
-            return {"error": str(e)}
+    def get_option_chain_multi(self, symbol: str, expirations: List[str] = None,
+                               min_dte: int = None, max_dte: int = None,
+                               strike_range: int = 10, rights=("C", "P")):
+        """
+        多到期日期权链（见 option_chain.py）
+        secdef 参数与现价只取一次，各到期日 × Call/Put 并发抓取，返回列式 OptionChain。
+        expirations 为 None 时按 min_dte / max_dte 筛选到期日。
+        """
+        from option_chain import fetch_option_chain
+        return fetch_option_chain(
+            self, symbol, expirations=expirations, min_dte=min_dte, max_dte=max_dte,
+            strike_range=strike_range, rights=tuple(rights)
+        )
 
     def get_company_news(self, symbol: str, limit: int = 5) -> List[dict]:
         """
         获取公司最新新闻 (Yahoo Finance RSS)
         IBKR News API 需要额外订阅，暂用免费源。
         """
-        import requests
-        try:
-            url = f"https://feeds.finance.yahoo.com/rss/2.0/headline?s={symbol}&region=US&lang=en-US"
-            headers = {"User-Agent": "Mozilla/5.0"}
-            r = requests.get(url, headers=headers, timeout=10)
-            if r.status_code == 200:
-                root = ET.fromstring(r.text)
-                news = []
-                for item in root.findall(".//item")[:limit]:
-                    title = item.find("title").text if item.find("title") is not None else ""
-                    pubDate = item.find("pubDate").text if item.find("pubDate") is not None else ""
-                    link = item.find("link").text if item.find("link") is not None else ""
-                    news.append({"title": title, "date": pubDate, "link": link})
-                return news
-        except Exception:
-            pass
-        return []
+        return get_yahoo_news(symbol, limit)
+
+
+def get_yahoo_news(symbol: str, limit: int = 5) -> List[dict]:
+    """Yahoo Finance RSS 公司新闻（不依赖网关连接）"""
+    import requests
+    try:
+        url = f"https://feeds.finance.yahoo.com/rss/2.0/headline?s={symbol}&region=US&lang=en-US"
+        headers = {"User-Agent": "Mozilla/5.0"}
+        r = requests.get(url, headers=headers, timeout=10)
+        if r.status_code == 200:
+            root = ET.fromstring(r.text)
+            news = []
+            for item in root.findall(".//item")[:limit]:
+                title = item.find("title").text if item.find("title") is not None else ""
+                pubDate = item.find("pubDate").text if item.find("pubDate") is not None else ""
+                link = item.find("link").text if item.find("link") is not None else ""
+                news.append({"title": title, "date": pubDate, "link": link})
+            return news
+    except Exception:
+        pass
+    return []
 
 
 def format_currency(value: float) -> str:
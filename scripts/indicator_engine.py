@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+向量化技术指标引擎 (NumPy)
+把 K 线一次性转成共享的 float64 OHLCV 数组，在同一组数组上以向量化方式计算
+均线 / RSI / MACD / 布林带 / 成交量 / ATR / VWAP，输出与 technical_analysis 中
+calc_* 函数完全相同的数据类（信号判定逻辑共用），供批量分析使用。
+
+用法:
+    python indicator_engine.py check    # 与纯 Python 实现做数值一致性校验 + 微基准测试
+    python indicator_engine.py sr       # 支撑/阻力检测：与逐窗口暴力法对比 + 5k / 50k 根 K 线基准
+
+⚠️ 纯计算模块，不访问网关。
+"""
+
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from technical_analysis import (
+    MovingAverages, RSIData, MACDData, BollingerBands, VolumeAnalysis, ATRData, VWAPData,
+    _ma_result, _rsi_result, _macd_result, _bollinger_result, _volume_result,
+    _atr_result, _vwap_result,
+)
+
+
+# 线性递推分块长度：块内用幂次闭式求解，块间串行传递，避免 (1-α)^-n 溢出
+_BLOCK = 64
+
+# 一致性校验的相对误差上限（纯相对误差，无绝对下限）
+PARITY_REL_TOL = 1e-9
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+class OHLCVArray:
+    """K 线的列式 float64 视图（一次转换，所有指标共用）"""
+
+    __slots__ = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, bars: List[dict]):
+        data = np.array(
+            [(b["open"], b["high"], b["low"], b["close"], b["volume"]) for b in bars],
+            dtype=np.float64,
+        ).reshape(-1, 5)
+        self.open, self.high, self.low, self.close, self.volume = data.T
+
+    def __len__(self):
+        return len(self.close)
+
+
+@dataclass
+class IndicatorSet:
+    """单只标的的一组指标结果"""
+    ma: MovingAverages
+    rsi: RSIData
+    macd: MACDData
+    bollinger: BollingerBands
+    volume: VolumeAnalysis
+    atr: ATRData
+    vwap: VWAPData
+
+
+# ─── 向量化基元 ───────────────────────────────────────────────
+
+def _recurrence(x: np.ndarray, a: float, b: float, y0: float) -> np.ndarray:
+    """
+    求解 y[t] = a·y[t-1] + b·x[t]（y[-1] = y0）的完整序列。
+    块内 y[k] = a^(k+1)·(y_prev + b·Σ a^-(i+1)·x[i])，整段只在块间循环。
+    """
+    out = np.empty(len(x), dtype=np.float64)
+    k = np.arange(1, _BLOCK + 1, dtype=np.float64)
+    pows = a ** k
+    inv_pows = 1.0 / pows
+    prev = y0
+    for start in range(0, len(x), _BLOCK):
+        chunk = x[start:start + _BLOCK]
+        n = len(chunk)
+        acc = np.cumsum(chunk * inv_pows[:n]) * b
+        block = pows[:n] * (prev + acc)
+        out[start:start + n] = block
+        prev = block[-1]
+    return out
+
+
+def _recurrence_last(x: np.ndarray, a: float, b: float, y0: float) -> float:
+    """只需要递推终值时：y[n-1] = a^n·y0 + b·Σ a^(n-1-i)·x[i]（幂次下溢为 0 无害）"""
+    n = len(x)
+    if n == 0:
+        return y0
+    weights = a ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    return float(a ** n * y0 + b * np.dot(weights, x))
+
+
+def ema_last(values: np.ndarray, period: int) -> Optional[float]:
+    """EMA 终值（以前 period 个值的 SMA 为种子，与 _ema 一致）"""
+    if len(values) < period:
+        return None
+    alpha = 2 / (period + 1)
+    return _recurrence_last(values[period:], 1 - alpha, alpha, values[:period].mean())
+
+
+def ema_series(values: np.ndarray, period: int) -> np.ndarray:
+    """EMA 序列（首个元素为种子 SMA，长度 len - period + 1，与 _ema_series 一致）"""
+    if len(values) < period:
+        return np.empty(0)
+    alpha = 2 / (period + 1)
+    seed = values[:period].mean()
+    return np.concatenate(([seed], _recurrence(values[period:], 1 - alpha, alpha, seed)))
+
+
+def wilder_last(values: np.ndarray, period: int) -> float:
+    """Wilder 平滑终值：avg = (avg·(p-1) + x) / p，种子为前 period 个值的均值"""
+    return _recurrence_last(values[period:], (period - 1) / period, 1 / period, values[:period].mean())
+
+
+# ─── 指标计算 ─────────────────────────────────────────────────
+
+def moving_averages(close: np.ndarray) -> MovingAverages:
+    def sma(p):
+        return float(close[-p:].mean()) if len(close) >= p else None
+
+    return _ma_result(MovingAverages(
+        sma_5=sma(5), sma_10=sma(10), sma_20=sma(20), sma_50=sma(50),
+        sma_120=sma(120), sma_250=sma(250),
+        ema_12=ema_last(close, 12), ema_26=ema_last(close, 26),
+    ))
+
+
+def rsi(close: np.ndarray, period: int = 14) -> RSIData:
+    if len(close) < period + 1:
+        return RSIData()
+    change = np.diff(close)
+    gains = np.where(change > 0, change, 0.0)
+    losses = np.where(change > 0, 0.0, -change)
+    return _rsi_result(wilder_last(gains, period), wilder_last(losses, period))
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> MACDData:
+    if len(close) < slow + signal:
+        return MACDData()
+    ema_fast = ema_series(close, fast)
+    ema_slow = ema_series(close, slow)
+    dif = ema_fast[slow - fast:] - ema_slow
+    dea = ema_series(dif, signal)
+    return _macd_result(float(dif[-1]), float(dea[-1]), float(dif[-2]), float(dea[-2]))
+
+
+def bollinger(close: np.ndarray, period: int = 20, std_dev: float = 2.0) -> BollingerBands:
+    if len(close) < period:
+        return BollingerBands()
+    recent = close[-period:]
+    middle = recent.mean()
+    std = np.sqrt(np.mean((recent - middle) ** 2))
+    return _bollinger_result(float(middle), float(std), float(close[-1]), std_dev)
+
+
+def volume_analysis(volume: np.ndarray) -> VolumeAnalysis:
+    if not len(volume):
+        return VolumeAnalysis()
+    return _volume_result(float(volume[-1]), float(volume[-10:].mean()), float(volume[-20:].mean()))
+
+
+def atr(arr: OHLCVArray, period: int = 14) -> ATRData:
+    if len(arr) < period + 1:
+        return ATRData()
+    prev_close = arr.close[:-1]
+    high, low = arr.high[1:], arr.low[1:]
+    tr = np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    return _atr_result(wilder_last(tr, period), float(arr.close[-1]))
+
+
+def vwap(arr: OHLCVArray) -> VWAPData:
+    if len(arr) < 5:
+        return VWAPData()
+    total_vol = arr.volume.sum()
+    if total_vol == 0:
+        return VWAPData()
+    tp = (arr.high + arr.low + arr.close) / 3
+    value = np.dot(tp, arr.volume) / total_vol
+    variance = np.dot((tp - value) ** 2, arr.volume) / total_vol
+    std = float(np.sqrt(variance)) if variance > 0 else 0
+    return _vwap_result(float(value), std, float(arr.close[-1]))
+
+
+def compute_indicators(bars: List[dict], include_vwap: bool = True) -> IndicatorSet:
+    """对一组 K 线一次性计算全部指标"""
+    arr = OHLCVArray(bars)
+    return IndicatorSet(
+        ma=moving_averages(arr.close),
+        rsi=rsi(arr.close),
+        macd=macd(arr.close),
+        bollinger=bollinger(arr.close),
+        volume=volume_analysis(arr.volume),
+        atr=atr(arr),
+        vwap=vwap(arr) if include_vwap else VWAPData(),
+    )
+
+
+# ─── 一致性校验 / 基准 ────────────────────────────────────────
+
+def _synthetic_bars(n: int, seed: int) -> List[dict]:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    return [
+        {"date": str(i), "open": float(c), "high": float(c + s), "low": float(c - s),
+         "close": float(c), "volume": float(v)}
+        for i, (c, s, v) in enumerate(zip(close, spread, rng.integers(1e5, 1e7, n)))
+    ]
+
+
+def _reference_indicators(bars: List[dict]) -> IndicatorSet:
+    from technical_analysis import (
+        calc_moving_averages, calc_rsi, calc_macd, calc_bollinger_bands,
+        calc_volume_analysis, calc_atr, calc_vwap,
+    )
+    closes = [b["close"] for b in bars]
+    return IndicatorSet(
+        ma=calc_moving_averages(closes), rsi=calc_rsi(closes), macd=calc_macd(closes),
+        bollinger=calc_bollinger_bands(closes), volume=calc_volume_analysis(bars),
+        atr=calc_atr(bars), vwap=calc_vwap(bars),
+    )
+
+
+def _diff_fields(ref, new, path: str, tol: float) -> List[str]:
+    """比较两个指标数据类：数值只允许相对误差 tol（无绝对误差下限），其余字段须完全相同"""
+    problems = []
+    for name, expected in vars(ref).items():
+        actual = getattr(new, name)
+        label = f"{path}.{name}"
+        if isinstance(expected, float) and isinstance(actual, float):
+            if not math.isclose(expected, actual, rel_tol=tol, abs_tol=0.0):
+                problems.append(f"{label}: {expected} != {actual}")
+        elif hasattr(expected, "__dataclass_fields__"):
+            problems += _diff_fields(expected, actual, label, tol)
+        elif expected != actual:
+            problems.append(f"{label}: {expected!r} != {actual!r}")
+    return problems
+
+
+def run_parity_check(samples: int = 200, tol: float = PARITY_REL_TOL) -> List[str]:
+    """随机 K 线上对比向量化引擎与纯 Python 实现，返回不一致项"""
+    problems = []
+    for seed in range(samples):
+        bars = _synthetic_bars(int(30 + seed * 7 % 700), seed)
+        problems += _diff_fields(_reference_indicators(bars), compute_indicators(bars), f"#{seed}", tol)
+    return problems
+
+
+def run_benchmark(symbols: int = 500, length: int = 252) -> dict:
+    """微基准：symbols 只标的 × length 根日线，分别用两种实现计算全部指标"""
+    universe = [_synthetic_bars(length, seed) for seed in range(symbols)]
+    t0 = time.perf_counter()
+    for bars in universe:
+        _reference_indicators(bars)
+    t1 = time.perf_counter()
+    for bars in universe:
+        compute_indicators(bars)
+    t2 = time.perf_counter()
+    return {"symbols": symbols, "bars": length,
+            "python_sec": round(t1 - t0, 3), "numpy_sec": round(t2 - t1, 3),
+            "speedup": round((t1 - t0) / (t2 - t1), 1) if t2 > t1 else 0}
+
+
+def _bruteforce_extrema(values: List[float], window: int, highs: bool) -> List[int]:
+    """原逐窗口 all(...) 判定，O(n·w)，仅作对照"""
+    out = []
+    for i in range(window, len(values) - window):
+        v = values[i]
+        neighbours = (values[j] for j in range(i - window, i + window + 1) if j != i)
+        if all(v >= x for x in neighbours) if highs else all(v <= x for x in neighbours):
+            out.append(i)
+    return out
+
+
+def run_sr_check(sizes=(5_000, 50_000), window: int = 5) -> List[dict]:
+    """支撑/阻力：单调队列极值与暴力法逐下标比对，并分别计时"""
+    from technical_analysis import _window_extrema, calc_support_resistance
+
+    results = []
+    for n in sizes:
+        bars = _synthetic_bars(n, n)
+        # 价格取两位小数，制造并列极值以覆盖 >= 的边界情况
+        highs = [round(b["high"], 2) for b in bars]
+        lows = [round(b["low"], 2) for b in bars]
+
+        t0 = time.perf_counter()
+        ref = (_bruteforce_extrema(highs, window, True), _bruteforce_extrema(lows, window, False))
+        t1 = time.perf_counter()
+        new = (_window_extrema(highs, window, True), _window_extrema(lows, window, False))
+        t2 = time.perf_counter()
+        calc_support_resistance(bars, window=window, volume_weighted=True)
+        t3 = time.perf_counter()
+        results.append({
+            "bars": n, "match": ref == new,
+            "bruteforce_sec": round(t1 - t0, 4), "deque_sec": round(t2 - t1, 4),
+            "full_sec": round(t3 - t2, 4),
+        })
+    return results
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if action == "sr":
+        print("🔬 支撑/阻力极值检测 (单调队列 vs 暴力法)...")
+        failed = False
+        for r in run_sr_check():
+            flag = "✅" if r["match"] else "❌"
+            failed |= not r["match"]
+            print(f"   {flag} {r['bars']:>6} 根: 暴力法 {r['bruteforce_sec']:.4f}s | 单调队列 {r['deque_sec']:.4f}s"
+                  f" | 含聚类整体 {r['full_sec']:.4f}s")
+        if failed:
+            sys.exit(1)
+        return
+    if action != "check":
+        print(__doc__)
+        return
+
+    print(f"🔬 指标一致性校验 (向量化 vs 纯 Python，相对误差 ≤ {PARITY_REL_TOL:g})...")
+    problems = run_parity_check()
+    if problems:
+        print(f"❌ 发现 {len(problems)} 处不一致:")
+        for p in problems[:20]:
+            print(f"   {p}")
+        sys.exit(1)
+    print("✅ 全部一致")
+
+    print("⏱️ 微基准测试 (500 只 × 252 根日线)...")
+    r = run_benchmark()
+    print(f"   纯 Python: {r['python_sec']:.3f}s  |  NumPy: {r['numpy_sec']:.3f}s  |  加速 {r['speedup']}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+增量技术指标状态
+每个状态对象逐根 K 线 O(1) 更新，公式与 technical_analysis 中的 calc_* 一致（信号判定共用），
+可序列化为 JSON 字典并恢复，供长期运行的盯盘进程为数百只标的实时维护技术评分。
+
+用法:
+    python indicator_state.py check    # 与全量重算结果做一致性校验 + 增量更新耗时
+
+⚠️ 纯计算模块，不访问网关。
+"""
+
+import os
+import sys
+import math
+import time
+import random
+from collections import deque
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from technical_analysis import (
+    MovingAverages, RSIData, MACDData, BollingerBands, VolumeAnalysis, ATRData, VWAPData,
+    TechnicalSummary, SupportResistance,
+    _ma_result, _rsi_result, _macd_result, _bollinger_result, _volume_result,
+    _atr_result, _vwap_result, calc_technical_score,
+)
+
+
+# ─── 序列化基类 ───────────────────────────────────────────────
+
+class _StreamState:
+    """
+    状态对象的通用序列化：构造参数字段 (init=True) 用于重建，
+    其余运行时字段原样写出；嵌套状态递归处理，deque 转为 list。
+    """
+
+    def to_dict(self) -> dict:
+        out = {}
+        for f in fields(self):
+            v = getattr(self, f.name)
+            if isinstance(v, _StreamState):
+                v = v.to_dict()
+            elif isinstance(v, deque):
+                v = list(v)
+            out[f.name] = v
+        return out
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        obj = cls(**{f.name: data[f.name] for f in fields(cls) if f.init and f.name in data})
+        for f in fields(cls):
+            if f.init or f.name not in data:
+                continue
+            current = getattr(obj, f.name)
+            v = data[f.name]
+            if isinstance(current, _StreamState):
+                v = type(current).from_dict(v)
+            elif isinstance(current, deque):
+                v = deque(v, maxlen=current.maxlen)
+            setattr(obj, f.name, v)
+        return obj
+
+
+# ─── 单指标状态 ───────────────────────────────────────────────
+
+@dataclass
+class EMAState(_StreamState):
+    """EMA：前 period 个值取 SMA 作种子，之后 ema = (x - ema)·k + ema"""
+    period: int
+    count: int = field(default=0, init=False)
+    seed_sum: float = field(default=0.0, init=False)
+    value: Optional[float] = field(default=None, init=False)
+
+    def update(self, x: float) -> Optional[float]:
+        self.count += 1
+        if self.count < self.period:
+            self.seed_sum += x
+        elif self.count == self.period:
+            self.value = (self.seed_sum + x) / self.period
+        else:
+            self.value = (x - self.value) * (2 / (self.period + 1)) + self.value
+        return self.value
+
+
+@dataclass
+class _WilderState(_StreamState):
+    """Wilder 平滑：前 period 个值取均值作种子，之后 avg = (avg·(p-1) + x) / p"""
+    period: int
+    count: int = field(default=0, init=False)
+    value: float = field(default=0.0, init=False)
+
+    def update(self, x: float) -> float:
+        self.count += 1
+        if self.count <= self.period:
+            self.value += x
+            if self.count == self.period:
+                self.value /= self.period
+        else:
+            self.value = (self.value * (self.period - 1) + x) / self.period
+        return self.value
+
+    def peek(self, x: float) -> float:
+        """假设下一个值为 x 时的平滑结果，不修改状态（未满 period 个值时返回种子部分和）"""
+        if self.count + 1 < self.period:
+            return self.value + x
+        if self.count + 1 == self.period:
+            return (self.value + x) / self.period
+        return (self.value * (self.period - 1) + x) / self.period
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.period
+
+
+@dataclass
+class RSIState(_StreamState):
+    """RSI（Wilder 平滑的平均涨幅 / 平均跌幅）"""
+    period: int = 14
+    prev_close: Optional[float] = field(default=None, init=False)
+    gain: _WilderState = field(init=False)
+    loss: _WilderState = field(init=False)
+
+    def __post_init__(self):
+        self.gain = _WilderState(self.period)
+        self.loss = _WilderState(self.period)
+
+    def update(self, close: float) -> RSIData:
+        if self.prev_close is not None:
+            change = close - self.prev_close
+            self.gain.update(change if change > 0 else 0)
+            self.loss.update(0 if change > 0 else -change)
+        self.prev_close = close
+        return self.result()
+
+    def result(self) -> RSIData:
+        if not self.gain.ready:
+            return RSIData()
+        return _rsi_result(self.gain.value, self.loss.value)
+
+    def peek(self, close: float) -> RSIData:
+        """假设下一根 K 线收于 close 时的 RSI（盘中用未收盘价格估算），不修改状态"""
+        if self.prev_close is None or self.gain.count + 1 < self.period:
+            return RSIData()
+        change = close - self.prev_close
+        return _rsi_result(self.gain.peek(change if change > 0 else 0),
+                           self.loss.peek(0 if change > 0 else -change))
+
+
+@dataclass
+class MACDState(_StreamState):
+    """MACD：DIF = EMA(fast) - EMA(slow)，DEA = DIF 的 EMA(signal)"""
+    fast: int = 12
+    slow: int = 26
+    signal: int = 9
+    ema_fast: EMAState = field(init=False)
+    ema_slow: EMAState = field(init=False)
+    ema_dea: EMAState = field(init=False)
+    dif: Optional[float] = field(default=None, init=False)
+    prev_dif: Optional[float] = field(default=None, init=False)
+    prev_dea: Optional[float] = field(default=None, init=False)
+
+    def __post_init__(self):
+        self.ema_fast = EMAState(self.fast)
+        self.ema_slow = EMAState(self.slow)
+        self.ema_dea = EMAState(self.signal)
+
+    def update(self, close: float) -> MACDData:
+        fast = self.ema_fast.update(close)
+        slow = self.ema_slow.update(close)
+        if slow is not None:
+            self.prev_dif, self.prev_dea = self.dif, self.ema_dea.value
+            self.dif = fast - slow
+            self.ema_dea.update(self.dif)
+        return self.result()
+
+    def result(self) -> MACDData:
+        # 与 calc_macd 一致：至少 slow + signal 根 K 线（DEA 已有前一值）才输出
+        if self.prev_dea is None:
+            return MACDData()
+        return _macd_result(self.dif, self.ema_dea.value, self.prev_dif, self.prev_dea)
+
+
+@dataclass
+class ATRState(_StreamState):
+    """ATR：True Range 的 Wilder 平滑"""
+    period: int = 14
+    prev_close: Optional[float] = field(default=None, init=False)
+    tr: _WilderState = field(init=False)
+
+    def __post_init__(self):
+        self.tr = _WilderState(self.period)
+
+    def update(self, high: float, low: float, close: float) -> ATRData:
+        if self.prev_close is not None:
+            self.tr.update(max(high - low, abs(high - self.prev_close), abs(low - self.prev_close)))
+        self.prev_close = close
+        return self.result()
+
+    def result(self) -> ATRData:
+        if not self.tr.ready:
+            return ATRData()
+        return _atr_result(self.tr.value, self.prev_close)
+
+
+@dataclass
+class BollingerState(_StreamState):
+    """布林带：定长窗口上的滑动均值 / 方差（增删一个元素的 Welford 更新）"""
+    period: int = 20
+    std_dev: float = 2.0
+    window: deque = field(init=False)
+    mean: float = field(default=0.0, init=False)
+    m2: float = field(default=0.0, init=False)
+
+    def __post_init__(self):
+        self.window = deque(maxlen=self.period)
+
+    def update(self, close: float) -> BollingerBands:
+        if len(self.window) < self.period:
+            self.window.append(close)
+            n = len(self.window)
+            delta = close - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (close - self.mean)
+        else:
+            old = self.window[0]
+            self.window.append(close)
+            old_mean = self.mean
+            self.mean += (close - old) / self.period
+            self.m2 += (close - old) * (close - self.mean + old - old_mean)
+        return self.result()
+
+    def result(self) -> BollingerBands:
+        if len(self.window) < self.period:
+            return BollingerBands()
+        std = math.sqrt(max(self.m2, 0.0) / self.period)
+        return _bollinger_result(self.mean, std, self.window[-1], self.std_dev)
+
+
+@dataclass
+class VWAPState(_StreamState):
+    """VWAP 及成交量加权标准差（加权 Welford 累积，自首根 K 线起算）"""
+    min_bars: int = 5
+    count: int = field(default=0, init=False)
+    total_volume: float = field(default=0.0, init=False)
+    vwap: float = field(default=0.0, init=False)
+    m2: float = field(default=0.0, init=False)
+    last_close: float = field(default=0.0, init=False)
+
+    def update(self, high: float, low: float, close: float, volume: float) -> VWAPData:
+        self.count += 1
+        self.last_close = close
+        if volume > 0:
+            tp = (high + low + close) / 3
+            self.total_volume += volume
+            delta = tp - self.vwap
+            self.vwap += delta * volume / self.total_volume
+            self.m2 += volume * delta * (tp - self.vwap)
+        return self.result()
+
+    def result(self) -> VWAPData:
+        if self.count < self.min_bars or self.total_volume == 0:
+            return VWAPData()
+        variance = self.m2 / self.total_volume
+        std = math.sqrt(variance) if variance > 0 else 0
+        return _vwap_result(self.vwap, std, self.last_close)
+
+
+# ─── 组合状态 ─────────────────────────────────────────────────
+
+_SMA_PERIODS = (5, 10, 20, 50, 120, 250)
+
+
+@dataclass
+class IndicatorState(_StreamState):
+    """
+    单只标的的全部增量指标，update(bar) 后 summary() 给出与 analyze_symbol 相同口径的评分
+    （支撑/阻力需要全量 K 线，不在增量范围内）。
+    """
+    symbol: str = ""
+    bars: int = field(default=0, init=False)
+    closes: deque = field(init=False)
+    sma_sums: Dict[str, float] = field(init=False)
+    volumes: deque = field(init=False)
+    ema_12: EMAState = field(init=False)
+    ema_26: EMAState = field(init=False)
+    rsi: RSIState = field(init=False)
+    macd: MACDState = field(init=False)
+    bollinger: BollingerState = field(init=False)
+    atr: ATRState = field(init=False)
+    vwap: VWAPState = field(init=False)
+
+    def __post_init__(self):
+        self.closes = deque(maxlen=max(_SMA_PERIODS) + 1)
+        self.sma_sums = {str(p): 0.0 for p in _SMA_PERIODS}
+        self.volumes = deque(maxlen=20)
+        self.ema_12 = EMAState(12)
+        self.ema_26 = EMAState(26)
+        self.rsi = RSIState()
+        self.macd = MACDState()
+        self.bollinger = BollingerState()
+        self.atr = ATRState()
+        self.vwap = VWAPState()
+
+    def update(self, bar: dict):
+        close, high, low = bar["close"], bar["high"], bar["low"]
+        volume = bar.get("volume", 0) or 0
+        self.bars += 1
+
+        self.closes.append(close)
+        n = len(self.closes)
+        for p in _SMA_PERIODS:
+            key = str(p)
+            self.sma_sums[key] += close
+            if n > p:
+                self.sma_sums[key] -= self.closes[-p - 1]
+        self.volumes.append(volume)
+
+        self.ema_12.update(close)
+        self.ema_26.update(close)
+        self.rsi.update(close)
+        self.macd.update(close)
+        self.bollinger.update(close)
+        self.atr.update(high, low, close)
+        self.vwap.update(high, low, close, volume)
+
+    def moving_averages(self) -> MovingAverages:
+        n = min(self.bars, len(self.closes))
+
+        def sma(p):
+            return self.sma_sums[str(p)] / p if n >= p else None
+
+        return _ma_result(MovingAverages(
+            sma_5=sma(5), sma_10=sma(10), sma_20=sma(20), sma_50=sma(50),
+            sma_120=sma(120), sma_250=sma(250),
+            ema_12=self.ema_12.value, ema_26=self.ema_26.value,
+        ))
+
+    def volume_analysis(self) -> VolumeAnalysis:
+        if not self.volumes:
+            return VolumeAnalysis()
+        recent = list(self.volumes)
+        return _volume_result(recent[-1], sum(recent[-10:]) / min(10, len(recent)),
+                              sum(recent) / len(recent))
+
+    def summary(self) -> Optional[TechnicalSummary]:
+        if not self.closes:
+            return None
+        current = self.closes[-1]
+        ma = self.moving_averages()
+        rsi = self.rsi.result()
+        macd = self.macd.result()
+        bb = self.bollinger.result()
+        vol = self.volume_analysis()
+        score, signal, observations = calc_technical_score(ma, rsi, macd, bb, vol, current)
+        return TechnicalSummary(
+            symbol=self.symbol,
+            current_price=current,
+            ma=ma,
+            rsi=rsi,
+            macd=macd,
+            bollinger=bb,
+            support_resistance=SupportResistance(current_price=current),
+            volume=vol,
+            atr=self.atr.result(),
+            vwap=self.vwap.result(),
+            overall_signal=signal,
+            score=score,
+            key_observations=observations,
+        )
+
+
+def warm_state(symbol: str, bars: List[dict]) -> IndicatorState:
+    """用历史 K 线预热一个增量状态"""
+    state = IndicatorState(symbol=symbol)
+    for bar in bars:
+        state.update(bar)
+    return state
+
+
+# ─── 一致性校验 ───────────────────────────────────────────────
+
+def _random_walk_bars(n: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    price = 100.0
+    bars = []
+    for i in range(n):
+        price *= math.exp(rng.gauss(0, 0.02))
+        spread = abs(rng.gauss(0, 0.01)) * price
+        bars.append({"date": str(i), "open": price, "high": price + spread, "low": price - spread,
+                     "close": price, "volume": rng.randint(100_000, 10_000_000)})
+    return bars
+
+
+def run_parity_check(samples: int = 50) -> List[str]:
+    """逐样本把增量状态（经过一次序列化往返）与全量 calc_* 的结果对比"""
+    import json
+    from technical_analysis import (
+        calc_moving_averages, calc_rsi, calc_macd, calc_bollinger_bands,
+        calc_volume_analysis, calc_atr, calc_vwap,
+    )
+
+    problems = []
+    for seed in range(samples):
+        bars = _random_walk_bars(20 + seed * 13 % 600, seed)
+        half = len(bars) // 2
+        state = warm_state("T", bars[:half])
+        state = IndicatorState.from_dict(json.loads(json.dumps(state.to_dict())))
+        for i, bar in enumerate(bars[half:], half):
+            peeked = state.rsi.peek(bar["close"])
+            state.update(bar)
+            if peeked != state.rsi.result():
+                problems.append(f"#{seed} rsi.peek@{i}: {peeked!r} != {state.rsi.result()!r}")
+
+        closes = [b["close"] for b in bars]
+        s = state.summary()
+        pairs = [
+            ("ma", calc_moving_averages(closes), s.ma),
+            ("rsi", calc_rsi(closes), s.rsi),
+            ("macd", calc_macd(closes), s.macd),
+            ("bollinger", calc_bollinger_bands(closes), s.bollinger),
+            ("volume", calc_volume_analysis(bars), s.volume),
+            ("atr", calc_atr(bars), s.atr),
+            ("vwap", calc_vwap(bars), s.vwap),
+        ]
+        for name, ref, new in pairs:
+            for f in fields(ref):
+                a, b = getattr(ref, f.name), getattr(new, f.name)
+                if isinstance(a, float) and isinstance(b, float):
+                    ok = abs(a - b) <= 1e-9 * max(1.0, abs(a)) + 1e-4
+                else:
+                    ok = a == b
+                if not ok:
+                    problems.append(f"#{seed} {name}.{f.name}: {a!r} != {b!r}")
+    return problems
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if action != "check":
+        print(__doc__)
+        return
+
+    print("🔬 增量状态一致性校验 (含 JSON 序列化往返)...")
+    problems = run_parity_check()
+    if problems:
+        print(f"❌ 发现 {len(problems)} 处不一致:")
+        for p in problems[:20]:
+            print(f"   {p}")
+        sys.exit(1)
+    print("✅ 全部一致")
+
+    symbols, history = 500, 252
+    states = [warm_state(f"S{i}", _random_walk_bars(history, i)) for i in range(symbols)]
+    new_bars = [_random_walk_bars(1, 10_000 + i)[0] for i in range(symbols)]
+    t0 = time.perf_counter()
+    for state, bar in zip(states, new_bars):
+        state.update(bar)
+        state.summary()
+    elapsed = time.perf_counter() - t0
+    print(f"⏱️ {symbols} 只标的各推进 1 根 K 线并重新评分: {elapsed * 1000:.1f}ms "
+          f"({elapsed / symbols * 1e6:.0f}µs/只)")
+
+
+if __name__ == "__main__":
+    main()
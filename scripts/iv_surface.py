@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+隐含波动率曲面
+由多到期日期权链构建 (对数价值度 × 期限) 曲面：每个到期日用 SVI 参数化拟合总方差
+w(k) = a + b·(ρ·(k − m) + √((k − m)² + σ²))，k = ln(K / F)，期限之间对总方差线性插值。
+曲面带时间戳存入 ~/trading/cache/iv_surfaces.db（SQLite），有效期内卖方筛选、期权异动、
+止盈止损等模块直接读本地曲面，单次插值查询为微秒级。
+
+用法:
+    python iv_surface.py build AAPL [--max-dte 120]   # 拉取期权链并拟合、保存曲面
+    python iv_surface.py show AAPL                      # 显示最近一次曲面（不连接网关）
+    python iv_surface.py stats                          # 已缓存曲面
+    python iv_surface.py bench                          # 合成曲面拟合误差 + 查询耗时
+
+设置 IBKR_SURFACE_TTL_MIN 调整曲面有效期（默认 30 分钟）。
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import json
+import math
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contract_cache import CACHE_DIR
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+SURFACE_DB = os.path.join(CACHE_DIR, "iv_surfaces.db")
+SURFACE_TTL_SEC = float(os.getenv("IBKR_SURFACE_TTL_MIN", "30")) * 60
+
+# 每个到期日至少需要的有效报价数
+_MIN_POINTS = 5
+# 切片可信需两翼各至少有的虚值报价数；整张曲面可直接覆盖保存所需的可信到期日数
+_MIN_WING_POINTS = 2
+_MIN_SURFACE_SLICES = 2
+# 曲面构建默认拉取的到期区间与行权价范围
+_BUILD_MIN_DTE = 3
+_BUILD_MAX_DTE = 120
+_BUILD_STRIKE_RANGE = 15
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS surfaces (
+    symbol   TEXT NOT NULL,
+    built_at REAL NOT NULL,
+    spot     REAL NOT NULL,
+    payload  TEXT NOT NULL,
+    PRIMARY KEY (symbol, built_at)
+)
+"""
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class SVISlice:
+    """单个到期日的 raw SVI 参数（总方差 w = σ_iv² · t）"""
+    expiry: str
+    tenor: float            # 年化剩余期限
+    forward: float
+    a: float
+    b: float
+    rho: float
+    m: float
+    sigma: float
+    rmse: float = 0.0       # 拟合隐含波动率的均方根误差（波动率单位）
+    points: int = 0
+    calls: int = 0          # 参与拟合的虚值 Call（右翼）/ Put（左翼）报价数
+    puts: int = 0
+
+    @property
+    def two_sided(self) -> bool:
+        """两翼都有报价：只有单翼时 SVI 的另一翼是外推，不可信"""
+        return self.calls >= _MIN_WING_POINTS and self.puts >= _MIN_WING_POINTS
+
+    def total_variance(self, k: float) -> float:
+        x = k - self.m
+        return self.a + self.b * (self.rho * x + math.sqrt(x * x + self.sigma * self.sigma))
+
+
+@dataclass
+class IVSurface:
+    symbol: str
+    spot: float
+    built_at: float
+    rate: float
+    slices: List[SVISlice] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.slices.sort(key=lambda s: s.tenor)
+        self._tenors = [s.tenor for s in self.slices]
+
+    @property
+    def age_sec(self) -> float:
+        return time.time() - self.built_at
+
+    def total_variance(self, k: float, tenor: float) -> float:
+        """固定对数价值度 k 下按期限对总方差线性插值；区间外按首 / 末切片的波动率外推"""
+        tenors = self._tenors
+        i = bisect_left(tenors, tenor)
+        if i == 0:
+            first = self.slices[0]
+            return first.total_variance(k) * tenor / first.tenor
+        if i == len(tenors):
+            last = self.slices[-1]
+            return last.total_variance(k) * tenor / last.tenor
+        lo, hi = self.slices[i - 1], self.slices[i]
+        wt = (tenor - lo.tenor) / (hi.tenor - lo.tenor)
+        return (1 - wt) * lo.total_variance(k) + wt * hi.total_variance(k)
+
+    def iv(self, strike: float, tenor: float) -> float:
+        """行权价 strike、剩余期限 tenor（年）处的隐含波动率；曲面为空或期限非正时返回 NaN"""
+        if not self.slices or tenor <= 0 or strike <= 0:
+            return float("nan")
+        k = math.log(strike / (self.spot * math.exp(self.rate * tenor)))
+        return math.sqrt(max(self.total_variance(k, tenor), 0.0) / tenor)
+
+    def iv_at(self, strike: float, expiry: str) -> float:
+        from option_pricing import years_to_expiry
+        return self.iv(strike, years_to_expiry(expiry))
+
+    def atm_iv(self, tenor: float) -> float:
+        """平值远期处的隐含波动率"""
+        return self.iv(self.spot * math.exp(self.rate * tenor), tenor)
+
+    def grid(self, moneyness: Sequence[float], tenors: Sequence[float]) -> np.ndarray:
+        """(len(tenors), len(moneyness)) 的隐含波动率网格，moneyness 为 K / S"""
+        return np.array([[self.iv(self.spot * m, t) for m in moneyness] for t in tenors])
+
+    def to_dict(self) -> dict:
+        return {"symbol": self.symbol, "spot": self.spot, "built_at": self.built_at, "rate": self.rate,
+                "slices": [asdict(s) for s in self.slices]}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "IVSurface":
+        return cls(d["symbol"], d["spot"], d["built_at"], d["rate"], [SVISlice(**s) for s in d["slices"]])
+
+
+# ─── SVI 拟合 ─────────────────────────────────────────────────
+
+def svi_total_variance(params, k: np.ndarray) -> np.ndarray:
+    a, b, rho, m, sigma = params
+    x = k - m
+    return a + b * (rho * x + np.sqrt(x * x + sigma * sigma))
+
+
+def _svi_inner(k: np.ndarray, w: np.ndarray, m: float, sigma: float) -> Tuple[float, Tuple[float, ...]]:
+    """
+    Zeliade 准显式法内层：固定 (m, σ) 后 w = a + d·y + c·√(y² + 1) 对 (a, d, c) 线性，
+    最小二乘求解后投影到 c ≥ 0、|d| ≤ c、最小总方差 ≥ 0 的可行域。返回 (SSE, raw 参数)
+    """
+    y = (k - m) / sigma
+    z = np.sqrt(y * y + 1)
+    X = np.column_stack([np.ones_like(y), y, z])
+    (a, d, c), *_ = np.linalg.lstsq(X, w, rcond=None)
+    c = max(c, 1e-10)
+    d = min(max(d, -0.999 * c), 0.999 * c)
+    a = float(np.mean(w - d * y - c * z))
+    a = max(a, -math.sqrt(c * c - d * d))
+    resid = a + d * y + c * z - w
+    return float(resid @ resid), (a, c / sigma, d / c, m, sigma)
+
+
+def _nelder_mead(f, x0: np.ndarray, step: np.ndarray, iters: int = 120, tol: float = 1e-12) -> np.ndarray:
+    """二维 Nelder-Mead（SVI 外层只有 m、log σ 两个变量）"""
+    simplex = [x0] + [x0 + np.eye(len(x0))[i] * step[i] for i in range(len(x0))]
+    values = [f(x) for x in simplex]
+    for _ in range(iters):
+        order = np.argsort(values)
+        simplex = [simplex[i] for i in order]
+        values = [values[i] for i in order]
+        if abs(values[-1] - values[0]) < tol:
+            break
+        centroid = np.mean(simplex[:-1], axis=0)
+        reflected = centroid + (centroid - simplex[-1])
+        fr = f(reflected)
+        if fr < values[0]:
+            expanded = centroid + 2 * (centroid - simplex[-1])
+            fe = f(expanded)
+            simplex[-1], values[-1] = (expanded, fe) if fe < fr else (reflected, fr)
+        elif fr < values[-2]:
+            simplex[-1], values[-1] = reflected, fr
+        else:
+            contracted = centroid + 0.5 * (simplex[-1] - centroid)
+            fc = f(contracted)
+            if fc < values[-1]:
+                simplex[-1], values[-1] = contracted, fc
+            else:
+                best = simplex[0]
+                simplex = [best + 0.5 * (x - best) for x in simplex]
+                values = [f(x) for x in simplex]
+    return simplex[int(np.argmin(values))]
+
+
+def fit_svi(k: Sequence[float], w: Sequence[float]) -> Tuple[float, float, float, float, float]:
+    """
+    单个到期日的 raw SVI 拟合：外层在 (m, log σ) 上先网格搜索再 Nelder-Mead 细化，内层线性最小二乘。
+    返回 (a, b, rho, m, sigma)
+    """
+    k = np.asarray(k, float)
+    w = np.asarray(w, float)
+    span = max(float(k.max() - k.min()), 0.05)
+
+    best = (math.inf, None)
+    for m in np.linspace(k.min(), k.max(), 9):
+        for sigma in np.geomspace(0.01, 1.0, 8) * span:
+            sse, _ = _svi_inner(k, w, m, sigma)
+            if sse < best[0]:
+                best = (sse, (m, math.log(sigma)))
+
+    def objective(x):
+        return _svi_inner(k, w, x[0], math.exp(x[1]))[0]
+
+    x = _nelder_mead(objective, np.array(best[1]), np.array([0.1 * span, 0.5]))
+    return _svi_inner(k, w, x[0], math.exp(x[1]))[1]
+
+
+def build_surface(chain, rate: Optional[float] = None, dividend: float = 0.0) -> Optional[IVSurface]:
+    """
+    由 OptionChain（option_chain.py）构建曲面：每个到期日只用虚值一侧（K ≥ F 的 Call、K < F 的 Put）
+    的有效隐含波动率拟合 SVI，报价不足的到期日跳过。
+    """
+    from option_pricing import DEFAULT_RATE, years_to_expiry
+
+    rate = DEFAULT_RATE if rate is None else rate
+    spot = chain.current_price
+    if spot <= 0 or not len(chain):
+        return None
+
+    by_expiry: Dict[str, List[Tuple[float, str, float]]] = {}
+    for i in range(len(chain)):
+        if chain.implied_vol[i] > 0:
+            by_expiry.setdefault(chain.expiry[i], []).append((chain.strike[i], chain.right[i], chain.implied_vol[i]))
+
+    slices = []
+    for expiry, quotes in sorted(by_expiry.items()):
+        t = years_to_expiry(expiry)
+        if t <= 0:
+            continue
+        forward = spot * math.exp((rate - dividend) * t)
+        otm = [(strike, iv, right) for strike, right, iv in quotes
+               if (right == "C" and strike >= forward) or (right == "P" and strike < forward)]
+        if len(otm) < _MIN_POINTS:
+            continue
+        calls = sum(1 for _, _, right in otm if right == "C")
+        strikes, ivs = np.array([(strike, iv) for strike, iv, _ in otm]).T
+        k = np.log(strikes / forward)
+        params = fit_svi(k, ivs * ivs * t)
+        fitted = np.sqrt(np.maximum(svi_total_variance(params, k), 0) / t)
+        a, b, rho, m, sigma = (float(p) for p in params)
+        slices.append(SVISlice(
+            expiry=expiry, tenor=t, forward=forward, a=a, b=b, rho=rho, m=m, sigma=sigma,
+            rmse=float(np.sqrt(np.mean((fitted - ivs) ** 2))), points=len(otm),
+            calls=calls, puts=len(otm) - calls,
+        ))
+
+    if not slices:
+        return None
+    return IVSurface(chain.symbol.upper(), spot, time.time(), rate - dividend, slices)
+
+
+# ─── 曲面存储 ─────────────────────────────────────────────────
+
+class SurfaceStore:
+    """
+    曲面持久化：内存最新值 + SQLite 历史（同一标的保留多次构建的时间序列）。
+    连接与内存最新值由 _lock 保护（batch 模式下各工作线程都会调用 record_chain）。
+    """
+
+    def __init__(self, db_path: str = SURFACE_DB):
+        self.db_path = db_path
+        self._latest: Dict[str, IVSurface] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """延迟打开数据库；磁盘不可写时退化为纯内存"""
+        with self._lock:
+            if self._conn is None:
+                try:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(_SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+                except (sqlite3.Error, OSError) as e:
+                    print(f"⚠️ 曲面缓存不可用，本次仅使用内存: {e}")
+                    self._conn = False
+            return self._conn or None
+
+    def save(self, surface: IVSurface):
+        with self._lock:
+            self._latest[surface.symbol] = surface
+            db = self._db()
+            if db:
+                try:
+                    db.execute("INSERT OR REPLACE INTO surfaces VALUES (?, ?, ?, ?)",
+                               (surface.symbol, surface.built_at, surface.spot, json.dumps(surface.to_dict())))
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ 曲面写入失败: {e}")
+
+    def merge_slices(self, symbol: str, slices: List[SVISlice]):
+        """把新切片按到期日并入已存曲面（保留其余到期日与原构建时间）；没有已存曲面时不做任何事"""
+        with self._lock:
+            existing = self.latest(symbol, max_age_sec=None)
+            if not existing or not slices:
+                return
+            merged = {s.expiry: s for s in existing.slices}
+            merged.update((s.expiry, s) for s in slices)
+            self.save(IVSurface(existing.symbol, existing.spot, existing.built_at, existing.rate,
+                                list(merged.values())))
+
+    def latest(self, symbol: str, max_age_sec: Optional[float] = SURFACE_TTL_SEC) -> Optional[IVSurface]:
+        """最近一次构建的曲面；超过 max_age_sec 视为过期（None 表示不限）"""
+        symbol = symbol.upper()
+        with self._lock:
+            surface = self._latest.get(symbol)
+            if surface is None:
+                db = self._db()
+                row = db.execute(
+                    "SELECT payload FROM surfaces WHERE symbol = ? ORDER BY built_at DESC LIMIT 1", (symbol,)
+                ).fetchone() if db else None
+                if row:
+                    surface = IVSurface.from_dict(json.loads(row[0]))
+                    self._latest[symbol] = surface
+        if surface is None or (max_age_sec is not None and surface.age_sec > max_age_sec):
+            return None
+        return surface
+
+    def history(self, symbol: str, limit: int = 20) -> List[IVSurface]:
+        with self._lock:
+            db = self._db()
+            if not db:
+                return [s for s in [self._latest.get(symbol.upper())] if s]
+            rows = db.execute(
+                "SELECT payload FROM surfaces WHERE symbol = ? ORDER BY built_at DESC LIMIT ?",
+                (symbol.upper(), limit)
+            ).fetchall()
+        return [IVSurface.from_dict(json.loads(r[0])) for r in rows]
+
+    def purge(self, keep_days: float = 30) -> int:
+        with self._lock:
+            db = self._db()
+            if not db:
+                return 0
+            cur = db.execute("DELETE FROM surfaces WHERE built_at < ?", (time.time() - keep_days * 86400,))
+            db.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Tuple[int, float]]:
+        """{symbol: (构建次数, 最近构建时间)}"""
+        with self._lock:
+            db = self._db()
+            if not db:
+                return {s: (1, v.built_at) for s, v in self._latest.items()}
+            return {sym: (n, ts) for sym, n, ts in db.execute(
+                "SELECT symbol, COUNT(*), MAX(built_at) FROM surfaces GROUP BY symbol ORDER BY symbol")}
+
+
+_default_store: Optional[SurfaceStore] = None
+
+
+def get_surface_store() -> SurfaceStore:
+    """进程级共享的曲面存储"""
+    global _default_store
+    if _default_store is None:
+        _default_store = SurfaceStore()
+    return _default_store
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def record_chain(chain) -> Optional[IVSurface]:
+    """
+    把其他模块已拉取的期权链顺带拟合为曲面并保存，返回该标的当前有效的曲面（没有时为 None）。
+    只有两翼齐全的到期日不少于 _MIN_SURFACE_SLICES 个时才整体覆盖；否则只把两翼齐全的新切片
+    合并进已存曲面（保留其余旧到期日与原构建时间），单翼切片（如只拉了 Put 的卖方筛选）一律丢弃。
+    """
+    try:
+        surface = build_surface(chain)
+    except Exception as e:
+        print(f"⚠️ 曲面拟合失败: {e}")
+        surface = None
+    store = get_surface_store()
+    symbol = chain.symbol.upper()
+    fresh = [s for s in surface.slices if s.two_sided] if surface else []
+
+    if len(fresh) >= _MIN_SURFACE_SLICES:
+        surface = IVSurface(symbol, surface.spot, surface.built_at, surface.rate, fresh)
+        store.save(surface)
+        return surface
+
+    store.merge_slices(symbol, fresh)
+    return store.latest(symbol)
+
+
+def cached_surface(symbol: str, max_age_sec: Optional[float] = SURFACE_TTL_SEC) -> Optional[IVSurface]:
+    """只读本地曲面，不连接网关"""
+    return get_surface_store().latest(symbol, max_age_sec)
+
+
+def get_surface(client, symbol: str, max_age_sec: Optional[float] = SURFACE_TTL_SEC,
+                min_dte: int = _BUILD_MIN_DTE, max_dte: int = _BUILD_MAX_DTE,
+                strike_range: int = _BUILD_STRIKE_RANGE) -> Optional[IVSurface]:
+    """有效期内的本地曲面优先；否则一次性并发拉取 DTE 区间内的期权链重新拟合"""
+    surface = cached_surface(symbol, max_age_sec)
+    if surface:
+        return surface
+    chain = client.get_option_chain_multi(symbol, min_dte=min_dte, max_dte=max_dte, strike_range=strike_range)
+    if chain.error and not len(chain):
+        print(f"⚠️ {symbol} 期权链获取失败: {chain.error}")
+        return None
+    return record_chain(chain)
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+_DISPLAY_MONEYNESS = (0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.2)
+
+
+def format_surface(surface: IVSurface) -> str:
+    from datetime import datetime
+
+    built = datetime.fromtimestamp(surface.built_at).strftime("%Y-%m-%d %H:%M")
+    lines = [
+        f"🌋 {surface.symbol} 隐含波动率曲面  |  现价 ${surface.spot:,.2f}  |  构建于 {built}",
+        "=" * 70,
+        "  到期日     DTE " + "".join(f"{m * 100:>7.0f}%" for m in _DISPLAY_MONEYNESS) + "   拟合误差",
+    ]
+    for s in surface.slices:
+        row = "".join(f"{surface.iv(surface.spot * m, s.tenor) * 100:>7.1f}%" for m in _DISPLAY_MONEYNESS)
+        lines.append(f"  {s.expiry}  {s.tenor * 365:>4.0f} {row}   {s.rmse * 100:.2f}vp ({s.points} 点)")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _synthetic_chain(symbol: str = "TEST", spot: float = 100.0):
+    """由已知 SVI 参数生成的期权链，用于校验拟合与查询耗时"""
+    from datetime import date, timedelta
+    from option_chain import OptionChain
+    from option_pricing import DEFAULT_RATE, years_to_expiry
+
+    chain = OptionChain(symbol=symbol, current_price=spot)
+    truth = {}
+    for days in (14, 30, 60, 90, 180):
+        expiry = (date.today() + timedelta(days=days)).strftime("%Y%m%d")
+        t = years_to_expiry(expiry)
+        params = (0.02 * t, 0.12 * math.sqrt(t), -0.4, 0.02, 0.15)
+        truth[expiry] = params
+        forward = spot * math.exp(DEFAULT_RATE * t)
+        for strike in np.arange(70, 131, 2.5):
+            k = math.log(strike / forward)
+            iv = math.sqrt(float(svi_total_variance(params, np.array(k))) / t)
+            right = "C" if strike >= forward else "P"
+            chain.append({"expiry": expiry, "right": right, "strike": float(strike), "bid": 1.0, "ask": 1.1,
+                          "last": 0.0, "volume": 0, "open_interest": 0, "delta": 0.0, "gamma": 0.0,
+                          "theta": 0.0, "vega": 0.0, "implied_vol": iv})
+    return chain, truth
+
+
+def run_bench() -> bool:
+    chain, _ = _synthetic_chain()
+    t0 = time.perf_counter()
+    surface = build_surface(chain)
+    fit_ms = (time.perf_counter() - t0) * 1000
+    worst = max(s.rmse for s in surface.slices)
+
+    n = 100_000
+    rng = np.random.default_rng(0)
+    strikes = rng.uniform(75, 125, n).tolist()
+    tenors = rng.uniform(0.03, 0.5, n).tolist()
+    t0 = time.perf_counter()
+    for k, t in zip(strikes, tenors):
+        surface.iv(k, t)
+    query_us = (time.perf_counter() - t0) / n * 1e6
+
+    restored = IVSurface.from_dict(json.loads(json.dumps(surface.to_dict())))
+    same = restored.iv(97.5, 0.2) == surface.iv(97.5, 0.2)
+
+    print(f"{'✅' if worst < 1e-3 else '❌'} {len(surface.slices)} 个到期日 SVI 拟合 {fit_ms:.0f}ms，最大 RMSE {worst * 100:.4f} vol 点")
+    print(f"{'✅' if query_us < 20 else '❌'} 单次插值查询 {query_us:.2f}µs（{n:,} 次）")
+    print(f"{'✅' if same else '❌'} 序列化往返一致")
+    print(format_surface(surface))
+    return worst < 1e-3 and same
+
+
+def main():
+    args = sys.argv[1:]
+    action = args[0] if args else "stats"
+
+    if action == "bench":
+        sys.exit(0 if run_bench() else 1)
+
+    if action == "stats":
+        from datetime import datetime
+        stats = get_surface_store().stats()
+        print(f"🗂️ 曲面缓存: {SURFACE_DB}")
+        if not stats:
+            print("   (空)")
+        for sym, (count, ts) in stats.items():
+            print(f"   {sym:<6} {count:>3} 次构建  最近 {datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M')}")
+        return
+
+    if action in ("build", "show") and len(args) > 1:
+        symbol = args[1].upper()
+        if action == "show":
+            surface = cached_surface(symbol, max_age_sec=None)
+            print(format_surface(surface) if surface else f"⚠️ 本地没有 {symbol} 的曲面，先运行 build")
+            return
+
+        max_dte = _BUILD_MAX_DTE
+        if "--max-dte" in args:
+            max_dte = int(args[args.index("--max-dte") + 1])
+        from ibkr_readonly import IBKRReadOnlyClient
+        client = IBKRReadOnlyClient()
+        if not client.connect():
+            print("❌ 无法连接 IB Gateway")
+            return
+        try:
+            surface = get_surface(client, symbol, max_age_sec=0, max_dte=max_dte)
+            print(format_surface(surface) if surface else f"⚠️ {symbol} 有效报价不足，无法构建曲面")
+        finally:
+            client.disconnect()
+        return
+
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
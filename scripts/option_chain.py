@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+期权链并发抓取引擎
+一次性获取标的 secdef 参数与现价，再在 pacing 限制内并发拉取多个到期日 × Call/Put 的行情与 Greeks，
+结果以列式 OptionChain 返回，供期权链查询、卖方筛选等模块共用。
+IBKR 未返回 modelGreeks 的合约由本地定价模型（option_pricing.py）按中间价一次性补齐。
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import math
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+
+# 每批快照行情的合约数上限；与 pacing 中 option_snapshot 的并发上限共同控制占用的行情线路，
+# 常驻流式订阅占用部分额度时按剩余额度收缩（见 PacingScheduler.adhoc_lines）
+_SNAPSHOT_BATCH = 30
+
+_COLUMNS = (
+    "expiry", "right", "strike", "bid", "ask", "last", "volume", "open_interest",
+    "delta", "gamma", "theta", "vega", "implied_vol",
+)
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class OptionChain:
+    """多到期日期权链（列式存储：每个字段一列，第 i 行为同一合约）"""
+    symbol: str
+    exchange: str = ""
+    current_price: float = 0.0
+    expirations: List[str] = field(default_factory=list)    # 全部可用到期日
+    total_strikes: int = 0
+    fetched_expirations: List[str] = field(default_factory=list)
+    expiry: List[str] = field(default_factory=list)
+    right: List[str] = field(default_factory=list)
+    strike: List[float] = field(default_factory=list)
+    bid: List[float] = field(default_factory=list)
+    ask: List[float] = field(default_factory=list)
+    last: List[float] = field(default_factory=list)
+    volume: List[int] = field(default_factory=list)
+    open_interest: List[int] = field(default_factory=list)
+    delta: List[float] = field(default_factory=list)
+    gamma: List[float] = field(default_factory=list)
+    theta: List[float] = field(default_factory=list)
+    vega: List[float] = field(default_factory=list)
+    implied_vol: List[float] = field(default_factory=list)
+    local_greeks: int = 0           # 由本地模型补齐 Greeks 的合约数
+    error: str = ""
+
+    def __len__(self):
+        return len(self.strike)
+
+    def append(self, row: dict):
+        for name in _COLUMNS:
+            getattr(self, name).append(row[name])
+
+    def rows(self, expiry: str = None, right: str = None) -> List[dict]:
+        """按到期日 / 方向筛选，返回行字典（按行权价升序）"""
+        out = []
+        for i in range(len(self)):
+            if expiry and self.expiry[i] != expiry:
+                continue
+            if right and self.right[i] != right:
+                continue
+            out.append({name: getattr(self, name)[i] for name in _COLUMNS})
+        out.sort(key=lambda r: (r["expiry"], r["right"], r["strike"]))
+        return out
+
+    def to_chain_dict(self, expiry: str) -> dict:
+        """单个到期日的兼容输出（与 get_option_chain_data 历史返回格式一致）"""
+        chain_data = {"calls": [], "puts": []}
+        for r in self.rows(expiry=expiry):
+            entry = {k: r[k] for k in _COLUMNS[2:]}
+            chain_data["calls" if r["right"] == "C" else "puts"].append(entry)
+
+        total_call_oi = sum(e["open_interest"] for e in chain_data["calls"])
+        total_put_oi = sum(e["open_interest"] for e in chain_data["puts"])
+        return {
+            "symbol": self.symbol,
+            "exchange": self.exchange,
+            "expirations": self.expirations,
+            "total_strikes": self.total_strikes,
+            "current_price": self.current_price,
+            "expiry": expiry,
+            "chain": chain_data,
+            "total_call_oi": total_call_oi,
+            "total_put_oi": total_put_oi,
+            "put_call_ratio": round(total_put_oi / total_call_oi, 2) if total_call_oi > 0 else 0,
+            "local_greeks": self.local_greeks,
+        }
+
+
+# ─── 工具函数 ─────────────────────────────────────────────────
+
+def _safe(v, default=0.0) -> float:
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return default
+    return float(v)
+
+
+def _positive(v) -> float:
+    v = _safe(v)
+    return v if v > 0 else 0.0
+
+
+def _dte(expiry: str) -> int:
+    try:
+        return max(0, (datetime.strptime(expiry[:8], "%Y%m%d") - datetime.now()).days)
+    except ValueError:
+        return -1
+
+
+def select_expirations(expirations: Sequence[str], min_dte: int = None, max_dte: int = None) -> List[str]:
+    """按剩余天数区间筛选到期日"""
+    selected = []
+    for exp in expirations:
+        dte = _dte(exp)
+        if dte < 0:
+            continue
+        if min_dte is not None and dte < min_dte:
+            continue
+        if max_dte is not None and dte > max_dte:
+            continue
+        selected.append(exp)
+    return selected
+
+
+def _ticker_row(contract, t) -> dict:
+    g = t.modelGreeks
+    right = contract.right
+    oi = t.callOpenInterest if right == "C" else t.putOpenInterest
+    return {
+        "expiry": contract.lastTradeDateOrContractMonth,
+        "right": right,
+        "strike": contract.strike,
+        "bid": round(_positive(t.bid), 2),
+        "ask": round(_positive(t.ask), 2),
+        "last": round(_positive(t.last), 2),
+        "volume": int(_positive(t.volume)),
+        "open_interest": int(_positive(oi)),
+        "delta": round(_safe(g.delta), 4) if g else 0.0,
+        "gamma": round(_safe(g.gamma), 4) if g else 0.0,
+        "theta": round(_safe(g.theta), 4) if g else 0.0,
+        "vega": round(_safe(g.vega), 4) if g else 0.0,
+        "implied_vol": round(_safe(g.impliedVol), 4) if g else 0.0,
+    }
+
+
+def fill_local_greeks(chain: OptionChain) -> int:
+    """
+    对 implied_vol 为 0（modelGreeks 缺失或为 NaN）且有报价的行，
+    用本地美式模型由 bid/ask 中间价（或 last）整批反解 IV 并补齐 Greeks，返回补齐的行数。
+    """
+    missing = [i for i in range(len(chain))
+               if chain.implied_vol[i] <= 0 and (chain.bid[i] > 0 or chain.last[i] > 0)]
+    if not missing or chain.current_price <= 0:
+        return 0
+
+    import numpy as np
+    from option_pricing import chain_greeks, years_to_expiry
+
+    years = {e: years_to_expiry(e) for e in {chain.expiry[i] for i in missing}}
+    local = chain_greeks(
+        chain.current_price,
+        [chain.strike[i] for i in missing],
+        np.array([years[chain.expiry[i]] for i in missing]),
+        np.array([chain.right[i] == "C" for i in missing]),
+        bid=[chain.bid[i] for i in missing],
+        ask=[chain.ask[i] for i in missing],
+        last=[chain.last[i] for i in missing],
+        american=True,
+    )
+    filled = 0
+    for k, i in enumerate(missing):
+        if not np.isfinite(local.implied_vol[k]):
+            continue
+        for name in ("delta", "gamma", "theta", "vega", "implied_vol"):
+            getattr(chain, name)[i] = round(float(getattr(local, name)[k]), 4)
+        filled += 1
+    chain.local_greeks += filled
+    return filled
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+async def fetch_option_chain_async(ib, underlying, symbol: str, expirations: Optional[Sequence[str]] = None,
+                                   min_dte: int = None, max_dte: int = None, strike_range: int = 10,
+                                   rights: Sequence[str] = ("C", "P")) -> OptionChain:
+    """
+    underlying: 已 qualify 的标的合约
+    expirations: 指定到期日列表；None 时按 min_dte / max_dte 从全部到期日中筛选；空列表则只返回到期日
+    """
+    from ib_async import Option
+    from contract_cache import qualify_cached_async
+    from pacing import PACING_LIMITS, get_scheduler
+
+    chain = OptionChain(symbol=symbol)
+
+    # 1. secdef 参数只取一次
+    params = await ib.reqSecDefOptParamsAsync(
+        underlying.symbol, '', underlying.secType, underlying.conId
+    )
+    if not params:
+        chain.error = f"{symbol}: 无期权链数据"
+        return chain
+    # 取 SMART 交易所的链（通常是最全的）
+    smart = next((p for p in params if p.exchange == 'SMART'), params[0])
+    chain.exchange = smart.exchange
+    chain.expirations = sorted(smart.expirations)
+    all_strikes = sorted(smart.strikes)
+    chain.total_strikes = len(all_strikes)
+
+    if expirations is None:
+        targets = select_expirations(chain.expirations, min_dte, max_dte)
+    else:
+        targets = [e for e in expirations if e in smart.expirations]
+    if not targets:
+        if expirations is None or expirations:
+            chain.error = "没有符合条件的到期日"
+        return chain
+
+    # 2. 标的现价只取一次
+    [spot] = await ib.reqTickersAsync(underlying)
+    current_price = _positive(spot.last) or _positive(spot.close)
+    if current_price <= 0:
+        chain.error = "无法获取当前价格"
+        return chain
+    chain.current_price = current_price
+
+    # 筛选附近的行权价
+    nearby = sorted(sorted(all_strikes, key=lambda s: abs(s - current_price))[:strike_range * 2])
+
+    # 3. 所有到期日 × 方向 × 行权价一次性走合约缓存 qualify（不存在的组合返回 None）
+    raw = [Option(symbol, exp, strike, right, 'SMART')
+           for exp in targets for right in rights for strike in nearby]
+    qualified = [c for c in await qualify_cached_async(ib, *raw) if c is not None]
+
+    # 4. 分批并发请求快照，受 pacing 并发上限约束
+    scheduler = get_scheduler(ib)
+
+    async def snapshot(batch):
+        tickers = await scheduler.call_async(
+            "option_snapshot", lambda: ib.reqTickersAsync(*batch), label=f"{symbol} 期权行情",
+            contracts=batch,
+        )
+        return list(zip(batch, tickers or []))
+
+    # 并发批次 × 每批合约数不超过临时请求的行情线路额度
+    concurrency = PACING_LIMITS["option_snapshot"].max_concurrent or 1
+    size = max(1, min(_SNAPSHOT_BATCH, scheduler.adhoc_lines() // concurrency))
+    batches = [qualified[i:i + size] for i in range(0, len(qualified), size)]
+    for pairs in await asyncio.gather(*[snapshot(b) for b in batches]):
+        for contract, ticker in pairs:
+            chain.append(_ticker_row(contract, ticker))
+
+    chain.fetched_expirations = sorted({e for e in chain.expiry})
+    fill_local_greeks(chain)
+    return chain
+
+
+def fetch_option_chain(client, symbol: str, expirations: Optional[Sequence[str]] = None,
+                       min_dte: int = None, max_dte: int = None, strike_range: int = 10,
+                       rights: Sequence[str] = ("C", "P")) -> OptionChain:
+    """同步入口：在持有 IB 连接的进程内运行异步引擎（broker 模式下由 broker 执行）"""
+    underlying = client.search_symbol(symbol)
+    if not underlying:
+        return OptionChain(symbol=symbol, error=f"{symbol}: 合约不存在")
+    try:
+        return client.ib.run(fetch_option_chain_async(
+            client.ib, underlying, symbol, expirations=expirations, min_dte=min_dte,
+            max_dte=max_dte, strike_range=strike_range, rights=rights
+        ))
+    except Exception as e:
+        print(f"❌ 获取期权链失败: {e}")
+        return OptionChain(symbol=symbol, error=str(e))
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+本地期权定价与隐含波动率求解 (NumPy 向量化)
+  • Black-Scholes-Merton（连续股息率 q）价格与 Greeks
+  • Bjerksund-Stensland (1993) 美式期权近似
+  • 隐含波动率：有界牛顿迭代 + 二分兜底，整条期权链一次求解
+IBKR modelGreeks 迟到、延迟行情下为 NaN 或缺少订阅时，由 options_analytics / option_chain 回退到本模块。
+Greeks 单位与 IBKR 一致：theta 为每日、vega 为每 1 个波动率点、rho 为每 1% 利率。
+
+用法:
+    python option_pricing.py check    # 与标量公式对照 + 隐含波动率往返 + 耗时
+
+⚠️ 纯计算，不访问网络，不包含任何交易功能。
+"""
+
+import os
+import sys
+import time
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+
+DEFAULT_RATE = float(os.getenv("IBKR_RISK_FREE_RATE", "0.045"))   # 无风险利率（年化，连续复利）
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+_IV_TOL = 1e-8
+_IV_MAX_ITER = 60
+_DAYS_PER_YEAR = 365.0
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class ChainGreeks:
+    """整条期权链的本地 Greeks（与输入等长的数组，无法求解的位置为 NaN）"""
+    implied_vol: np.ndarray
+    price: np.ndarray
+    delta: np.ndarray
+    gamma: np.ndarray
+    theta: np.ndarray
+    vega: np.ndarray
+    rho: np.ndarray
+
+    def row(self, i: int) -> Dict[str, float]:
+        return {name: float(getattr(self, name)[i]) for name in
+                ("implied_vol", "price", "delta", "gamma", "theta", "vega", "rho")}
+
+
+# ─── 正态分布 ─────────────────────────────────────────────────
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def norm_cdf(x):
+    """标准正态累积分布（Hart 1968 / West 2005 双精度近似，绝对误差 < 1e-14）"""
+    x = np.asarray(x, dtype=float)
+    a = np.abs(x)
+    e = np.exp(-0.5 * a * a)
+    num = ((((((0.0352624965998911 * a + 0.700383064443688) * a + 6.37396220353165) * a
+               + 33.912866078383) * a + 112.079291497871) * a + 221.213596169931) * a + 220.206867912376)
+    den = (((((((0.0883883476483184 * a + 1.75566716318264) * a + 16.064177579207) * a
+                + 86.7807322029461) * a + 296.564248779674) * a + 637.333633378831) * a
+            + 793.826512519948) * a + 440.413735824752)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tail = a + 1 / (a + 2 / (a + 3 / (a + 4 / (a + 0.65))))
+        c = np.where(a < 7.07106781186547, e * num / den, e / tail / 2.506628274631)
+    c = np.where(a > 37, 0.0, c)
+    return np.where(x > 0, 1 - c, c)
+
+
+# ─── Black-Scholes-Merton ─────────────────────────────────────
+
+def _d1_d2(S, K, T, r, q, sigma):
+    vt = sigma * np.sqrt(T)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(S / K) + (r - q + 0.5 * sigma * sigma) * T) / vt
+    return d1, d1 - vt
+
+
+def bsm_price(S, K, T, sigma, is_call, r: float = DEFAULT_RATE, q: float = 0.0) -> np.ndarray:
+    """欧式期权价格；T 为年化剩余期限，is_call 为布尔数组。T 或 sigma 为 0 时返回内在价值"""
+    S, K, T, sigma, is_call = np.broadcast_arrays(
+        np.asarray(S, float), np.asarray(K, float), np.asarray(T, float),
+        np.asarray(sigma, float), np.asarray(is_call, bool))
+    d1, d2 = _d1_d2(S, K, T, r, q, sigma)
+    df_q, df_r = np.exp(-q * T), np.exp(-r * T)
+    call = S * df_q * norm_cdf(d1) - K * df_r * norm_cdf(d2)
+    put = K * df_r * norm_cdf(-d2) - S * df_q * norm_cdf(-d1)
+    price = np.where(is_call, call, put)
+    intrinsic = np.where(is_call, np.maximum(S * df_q - K * df_r, 0), np.maximum(K * df_r - S * df_q, 0))
+    return np.where((T > 0) & (sigma > 0), price, intrinsic)
+
+
+def bsm_greeks(S, K, T, sigma, is_call, r: float = DEFAULT_RATE, q: float = 0.0) -> Dict[str, np.ndarray]:
+    """欧式期权 price / delta / gamma / theta(每日) / vega(每 1 vol 点) / rho(每 1%)"""
+    S, K, T, sigma, is_call = np.broadcast_arrays(
+        np.asarray(S, float), np.asarray(K, float), np.asarray(T, float),
+        np.asarray(sigma, float), np.asarray(is_call, bool))
+    live = (T > 0) & (sigma > 0)
+    T_ = np.where(live, T, 1.0)
+    s_ = np.where(live, sigma, 1.0)
+    d1, d2 = _d1_d2(S, K, T_, r, q, s_)
+    df_q, df_r = np.exp(-q * T_), np.exp(-r * T_)
+    pdf1 = norm_pdf(d1)
+    sqrt_t = np.sqrt(T_)
+    sign = np.where(is_call, 1.0, -1.0)
+    n1, n2 = norm_cdf(sign * d1), norm_cdf(sign * d2)
+
+    price = sign * (S * df_q * n1 - K * df_r * n2)
+    delta = sign * df_q * n1
+    gamma = df_q * pdf1 / (S * s_ * sqrt_t)
+    theta = (-S * df_q * pdf1 * s_ / (2 * sqrt_t)
+             - sign * r * K * df_r * n2 + sign * q * S * df_q * n1) / _DAYS_PER_YEAR
+    vega = S * df_q * pdf1 * sqrt_t / 100
+    rho = sign * K * T_ * df_r * n2 / 100
+
+    # 到期或零波动率：退化为内在价值，delta 为 0/±1
+    itm = np.where(is_call, S > K, S < K)
+    return {
+        "price": np.where(live, price, bsm_price(S, K, T, sigma, is_call, r, q)),
+        "delta": np.where(live, delta, np.where(itm, sign, 0.0)),
+        "gamma": np.where(live, gamma, 0.0),
+        "theta": np.where(live, theta, 0.0),
+        "vega": np.where(live, vega, 0.0),
+        "rho": np.where(live, rho, 0.0),
+    }
+
+
+# ─── 美式期权 (Bjerksund-Stensland 1993) ──────────────────────
+
+def _bs93_phi(S, T, gamma, H, I, r, b, sigma):
+    vt = sigma * np.sqrt(T)
+    lam = (-r + gamma * b + 0.5 * gamma * (gamma - 1) * sigma * sigma) * T
+    d = -(np.log(S / H) + (b + (gamma - 0.5) * sigma * sigma) * T) / vt
+    kappa = 2 * b / (sigma * sigma) + (2 * gamma - 1)
+    return np.exp(lam) * S ** gamma * (norm_cdf(d) - (I / S) ** kappa * norm_cdf(d - 2 * np.log(I / S) / vt))
+
+
+def _bs93_call(S, K, T, r, b, sigma):
+    """成本率 b = r - q 的美式看涨近似；b >= r 时不会提前行权，等于欧式价"""
+    s2 = sigma * sigma
+    beta = (0.5 - b / s2) + np.sqrt((b / s2 - 0.5) ** 2 + 2 * r / s2)
+    b_inf = beta / (beta - 1) * K
+    b_0 = np.maximum(K, np.where(r - b > 0, r / np.where(r - b > 0, r - b, 1.0), 1.0) * K)
+    ht = -(b * T + 2 * sigma * np.sqrt(T)) * b_0 / (b_inf - b_0)
+    I = b_0 + (b_inf - b_0) * (1 - np.exp(ht))
+    alpha = (I - K) * I ** (-beta)
+    value = (alpha * S ** beta - alpha * _bs93_phi(S, T, beta, I, I, r, b, sigma)
+             + _bs93_phi(S, T, 1, I, I, r, b, sigma) - _bs93_phi(S, T, 1, K, I, r, b, sigma)
+             - K * _bs93_phi(S, T, 0, I, I, r, b, sigma) + K * _bs93_phi(S, T, 0, K, I, r, b, sigma))
+    return np.where(S >= I, S - K, value)
+
+
+def american_price(S, K, T, sigma, is_call, r: float = DEFAULT_RATE, q: float = 0.0) -> np.ndarray:
+    """
+    Bjerksund-Stensland (1993) 美式期权价格。
+    看跌用对称变换 P(S, K, T, r, b) = C(K, S, T, r - b, -b)；结果不低于欧式价与内在价值。
+    """
+    S, K, T, sigma, is_call = np.broadcast_arrays(
+        np.asarray(S, float), np.asarray(K, float), np.asarray(T, float),
+        np.asarray(sigma, float), np.asarray(is_call, bool))
+    european = bsm_price(S, K, T, sigma, is_call, r, q)
+    live = (T > 0) & (sigma > 0)
+    T_ = np.where(live, T, 1.0)
+    s_ = np.where(live, sigma, 1.0)
+    b = r - q
+    with np.errstate(all="ignore"):
+        call = _bs93_call(S, K, T_, r, b, s_) if b < r else european
+        put = _bs93_call(K, S, T_, q, -b, s_) if -b < q else european
+    value = np.where(is_call, call, put)
+    value = np.where(np.isfinite(value), value, european)
+    intrinsic = np.where(is_call, np.maximum(S - K, 0), np.maximum(K - S, 0))
+    return np.maximum(np.where(live, value, intrinsic), np.maximum(european, intrinsic))
+
+
+def american_greeks(S, K, T, sigma, is_call, r: float = DEFAULT_RATE, q: float = 0.0) -> Dict[str, np.ndarray]:
+    """美式期权 Greeks：对 american_price 做中心差分（单位同 bsm_greeks）"""
+    S, K, T, sigma, is_call = np.broadcast_arrays(
+        np.asarray(S, float), np.asarray(K, float), np.asarray(T, float),
+        np.asarray(sigma, float), np.asarray(is_call, bool))
+
+    def p(s=S, t=T, v=sigma, rate=r):
+        return american_price(s, K, t, v, is_call, rate, q)
+
+    base = p()
+    h = S * 1e-3
+    up, down = p(s=S + h), p(s=S - h)
+    dt = np.minimum(1 / _DAYS_PER_YEAR, T)
+    return {
+        "price": base,
+        "delta": (up - down) / (2 * h),
+        "gamma": (up - 2 * base + down) / (h * h),
+        "theta": (p(t=T - dt) - base) / np.where(dt > 0, dt * _DAYS_PER_YEAR, 1.0),
+        "vega": (p(v=sigma + 0.005) - p(v=np.maximum(sigma - 0.005, MIN_VOL))) / (sigma + 0.005 - np.maximum(sigma - 0.005, MIN_VOL)) / 100,
+        "rho": (p(rate=r + 1e-4) - p(rate=r - 1e-4)) / 2e-4 / 100,
+    }
+
+
+# ─── 隐含波动率 ───────────────────────────────────────────────
+
+def implied_vol(price, S, K, T, is_call, r: float = DEFAULT_RATE, q: float = 0.0,
+                american: bool = False) -> np.ndarray:
+    """
+    向量化隐含波动率：每个合约维护 [lo, hi] 区间，牛顿步落在区间外或 vega 过小时改用二分。
+    价格低于无套利下界 / 高于上界、或期限为 0 的位置返回 NaN。
+    american=True 时按 Bjerksund-Stensland 价格求解（牛顿步仍用欧式 vega 近似斜率，由区间保证收敛）。
+    """
+    price, S, K, T, is_call = np.broadcast_arrays(
+        np.asarray(price, float), np.asarray(S, float), np.asarray(K, float),
+        np.asarray(T, float), np.asarray(is_call, bool))
+    pricer = american_price if american else bsm_price
+
+    lower = pricer(S, K, T, np.full(S.shape, MIN_VOL), is_call, r, q)
+    upper = pricer(S, K, T, np.full(S.shape, MAX_VOL), is_call, r, q)
+    valid = (T > 0) & (S > 0) & (K > 0) & np.isfinite(price) & (price > lower) & (price < upper)
+
+    # Brenner-Subrahmanyam 初值，裁剪到合法区间
+    with np.errstate(divide="ignore", invalid="ignore"):
+        guess = np.sqrt(2 * math.pi / np.where(T > 0, T, 1.0)) * price / S
+    sigma = np.clip(np.nan_to_num(guess, nan=0.3), 0.05, 2.0)
+    lo = np.full(S.shape, MIN_VOL)
+    hi = np.full(S.shape, MAX_VOL)
+    active = valid.copy()
+
+    for _ in range(_IV_MAX_ITER):
+        if not active.any():
+            break
+        s, k, t, c, px, v = (a[active] for a in (S, K, T, is_call, price, sigma))
+        model = pricer(s, k, t, v, c, r, q)
+        diff = model - px
+        vega = bsm_greeks(s, k, t, v, c, r, q)["vega"] * 100
+
+        a_lo, a_hi = lo[active], hi[active]
+        a_lo = np.where(diff < 0, v, a_lo)
+        a_hi = np.where(diff > 0, v, a_hi)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = v - diff / vega
+        bad = ~np.isfinite(step) | (step <= a_lo) | (step >= a_hi)
+        new = np.where(bad, 0.5 * (a_lo + a_hi), step)
+
+        # 收敛：价格精确命中、牛顿步足够小或区间已收窄
+        done = (diff == 0) | (np.abs(new - v) < _IV_TOL) | (a_hi - a_lo < _IV_TOL)
+        lo[active], hi[active] = a_lo, a_hi
+        sigma[active] = np.where(diff == 0, v, new)
+        active[active] = ~done
+
+    return np.where(valid, sigma, np.nan)
+
+
+def chain_greeks(spot, strikes, T, is_call, bid=None, ask=None, last=None, r: float = DEFAULT_RATE,
+                 q: float = 0.0, american: bool = False) -> ChainGreeks:
+    """
+    整条期权链一次求解：期权价格取 bid/ask 中间价（单边缺失时用 last），
+    反解隐含波动率后计算 Greeks。spot 可为标量或与 strikes 等长的数组。
+    """
+    strikes = np.asarray(strikes, float)
+    n = len(strikes)
+    bid = np.zeros(n) if bid is None else np.asarray(bid, float)
+    ask = np.zeros(n) if ask is None else np.asarray(ask, float)
+    last = np.zeros(n) if last is None else np.asarray(last, float)
+    price = np.where((bid > 0) & (ask >= bid), 0.5 * (bid + ask), np.where(last > 0, last, np.nan))
+
+    iv = implied_vol(price, spot, strikes, T, is_call, r, q, american)
+    vol = np.where(np.isfinite(iv), iv, 0.0)
+    g = (american_greeks if american else bsm_greeks)(spot, strikes, T, vol, is_call, r, q)
+    solved = np.isfinite(iv)
+    return ChainGreeks(
+        implied_vol=iv,
+        **{name: np.where(solved, g[name], np.nan) for name in ("price", "delta", "gamma", "theta", "vega", "rho")},
+    )
+
+
+def years_to_expiry(expiry: str, now: Optional[float] = None) -> float:
+    """YYYYMMDD 到期日 → 年化剩余期限（按到期日美东 16:00 收盘近似为 UTC 21:00）"""
+    from datetime import datetime, timezone
+    try:
+        exp = datetime.strptime(expiry[:8], "%Y%m%d").replace(hour=21, tzinfo=timezone.utc)
+    except ValueError:
+        return 0.0
+    seconds = exp.timestamp() - (time.time() if now is None else now)
+    return max(0.0, seconds / (_DAYS_PER_YEAR * 86400))
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _scalar_bsm(S, K, T, r, q, sigma, call):
+    """标准库版本的欧式公式，用于校验向量化实现"""
+    N = lambda x: 0.5 * (1 + math.erf(x / math.sqrt(2)))
+    d1 = (math.log(S / K) + (r - q + 0.5 * sigma ** 2) * T) / (sigma * math.sqrt(T))
+    d2 = d1 - sigma * math.sqrt(T)
+    if call:
+        return S * math.exp(-q * T) * N(d1) - K * math.exp(-r * T) * N(d2)
+    return K * math.exp(-r * T) * N(-d2) - S * math.exp(-q * T) * N(-d1)
+
+
+def run_check(n: int = 20_000) -> bool:
+    rng = np.random.default_rng(3)
+    x = np.linspace(-40, 40, 100_001)
+    cdf_err = float(np.max(np.abs(norm_cdf(x) - np.array([0.5 * math.erfc(-v / math.sqrt(2)) for v in x]))))
+
+    S = np.full(n, 100.0)
+    K = rng.uniform(60, 140, n)
+    T = rng.uniform(2 / 365, 2.0, n)
+    sig = rng.uniform(0.08, 1.2, n)
+    call = rng.random(n) < 0.5
+    q = 0.01
+
+    price = bsm_price(S, K, T, sig, call, q=q)
+    scalar = np.array([_scalar_bsm(100.0, k, t, DEFAULT_RATE, q, s, c) for k, t, s, c in zip(K, T, sig, call)])
+    price_err = float(np.max(np.abs(price - scalar)))
+
+    t0 = time.perf_counter()
+    iv = implied_vol(price, S, K, T, call, q=q)
+    iv_ms = (time.perf_counter() - t0) * 1000
+    # 时间价值低于最小报价单位的极深虚值 / 实值合约波动率不可辨识，不计入误差
+    quotable = price - bsm_price(S, K, T, MIN_VOL, call, q=q) >= 0.01
+    ok = np.isfinite(iv) & quotable
+    iv_err = float(np.max(np.abs(iv[ok] - sig[ok])))
+
+    am = american_price(S, K, T, sig, call, q=q)
+    am_ok = bool(np.all(am >= price - 1e-9))
+    t0 = time.perf_counter()
+    am_iv = implied_vol(am, S, K, T, call, q=q, american=True)
+    am_ms = (time.perf_counter() - t0) * 1000
+    am_quotable = am - american_price(S, K, T, MIN_VOL, call, q=q) >= 0.01
+    am_ok_iv = np.isfinite(am_iv) & am_quotable
+    am_err = float(np.max(np.abs(am_iv[am_ok_iv] - sig[am_ok_iv])))
+
+    print(f"{'✅' if cdf_err < 1e-12 else '❌'} norm_cdf 最大误差 {cdf_err:.2e}")
+    print(f"{'✅' if price_err < 1e-9 else '❌'} 欧式价格 vs 标量公式 最大误差 {price_err:.2e}")
+    print(f"{'✅' if iv_err < 1e-6 else '❌'} 欧式 IV 往返 {ok.sum()}/{quotable.sum()} 可解, 最大误差 {iv_err:.2e} ({iv_ms:.0f}ms)")
+    print(f"{'✅' if am_ok else '❌'} 美式价格 ≥ 欧式价格")
+    print(f"{'✅' if am_err < 1e-5 else '❌'} 美式 IV 往返 {am_ok_iv.sum()}/{am_quotable.sum()} 可解, 最大误差 {am_err:.2e} ({am_ms:.0f}ms)")
+    return cdf_err < 1e-12 and price_err < 1e-9 and iv_err < 1e-6 and am_ok and am_err < 1e-5
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if action == "check":
+        sys.exit(0 if run_check() else 1)
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
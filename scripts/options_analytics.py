@@ -2,6 +2,7 @@
 """
 期权分析模块
 提供：期权 Greeks 查询、到期日日历、组合级 Greeks 汇总。
+IBKR modelGreeks 缺失时回退到本地定价模型（option_pricing.py）。
 所有函数接收 IBKRReadOnlyClient 实例，纯只读操作。
 """
 
@@ -31,6 +32,8 @@ class OptionGreeks:
     implied_vol: float      # 隐含波动率
     market_value: float
     quantity: float
+    greeks_complete: bool = True    # Greeks 是否完整（IBKR 返回或本地求解成功）
+    greeks_source: str = "ibkr"     # "ibkr" / "local"（modelGreeks 缺失时本地 BSM 求解）/ ""（均不可用）
 
 
 @dataclass
@@ -56,6 +59,7 @@ class PortfolioGreeksSummary:
     net_delta_exposure: float   # Delta 等值股票暴露
     option_count: int
     net_direction: str      # "偏多" / "偏空" / "中性"
+    incomplete_count: int = 0   # 未能获取 Greeks 的期权数
 
 
 # ─── 分析函数 ─────────────────────────────────────────────────
@@ -86,81 +90,156 @@ def _safe_float(val, default=0.0):
     return float(val)
 
 
-def get_option_greeks(client, position) -> Optional[OptionGreeks]:
+def _underlying_symbol(position) -> str:
+    return position.symbol.split()[0] if ' ' in position.symbol else position.symbol
+
+
+def get_option_greeks_batch(client, positions: list, timeout: float = 4.0) -> List[OptionGreeks]:
     """
-    获取单个期权持仓的 Greeks
-    position: ibkr_readonly.Position (sec_type == 'OPT')
+    批量获取期权持仓的 Greeks
+    合约一次性 qualify、一次性订阅行情，全部 Greeks 到齐即返回（最迟 timeout 秒），
+    未能在期限内拿到 Greeks 的合约以 0 填充并标记 greeks_complete=False。
+    positions: ibkr_readonly.Position 列表（仅处理 sec_type == 'OPT'）
     """
-    if position.sec_type != "OPT":
-        return None
+    from ib_async import Option
 
-    days = _calc_days_to_expiry(position.expiry)
+    option_positions = [p for p in positions if p.sec_type == "OPT"]
+    if not option_positions:
+        return []
 
-    # 构造期权 Contract
-    from ib_async import Option
+    # 构造期权 Contract 并批量 qualify
     try:
-        contract = Option(
-            symbol=position.symbol.split()[0] if ' ' in position.symbol else position.symbol,
-            lastTradeDateOrContractMonth=position.expiry,
-            strike=position.strike,
-            right=position.right,
-            exchange='SMART'
-        )
-        qualified = client.ib.qualifyContracts(contract)
-        if not qualified:
-            # 如果无法 qualify，返回基础信息
-            return OptionGreeks(
-                symbol=position.symbol,
-                underlying=position.symbol.split()[0] if ' ' in position.symbol else position.symbol,
-                strike=position.strike,
-                right=position.right,
-                expiry=position.expiry,
-                days_to_expiry=days,
-                delta=0, gamma=0, theta=0, vega=0, implied_vol=0,
-                market_value=position.market_value,
-                quantity=position.quantity
+        qualified = client.qualify_contracts(*[
+            Option(
+                symbol=_underlying_symbol(p),
+                lastTradeDateOrContractMonth=p.expiry,
+                strike=p.strike,
+                right=p.right,
+                exchange='SMART'
             )
-        contract = qualified[0]
+            for p in option_positions
+        ])
     except Exception:
-        return OptionGreeks(
-            symbol=position.symbol,
-            underlying=position.symbol.split()[0] if ' ' in position.symbol else position.symbol,
-            strike=position.strike,
-            right=position.right,
-            expiry=position.expiry,
-            days_to_expiry=days,
-            delta=0, gamma=0, theta=0, vega=0, implied_vol=0,
-            market_value=position.market_value,
-            quantity=position.quantity
-        )
+        qualified = [None] * len(option_positions)
 
-    # 通过 ticker 获取 Greeks
-    ticker = client.get_option_ticker(contract)
-    delta = gamma = theta = vega = iv = 0.0
-
-    if ticker and ticker.modelGreeks:
-        greeks = ticker.modelGreeks
-        delta = _safe_float(greeks.delta)
-        gamma = _safe_float(greeks.gamma)
-        theta = _safe_float(greeks.theta)
-        vega = _safe_float(greeks.vega)
-        iv = _safe_float(greeks.impliedVol)
-
-    return OptionGreeks(
-        symbol=position.symbol,
-        underlying=position.symbol.split()[0] if ' ' in position.symbol else position.symbol,
-        strike=position.strike,
-        right=position.right,
-        expiry=position.expiry,
-        days_to_expiry=days,
-        delta=round(delta, 4),
-        gamma=round(gamma, 4),
-        theta=round(theta, 4),
-        vega=round(vega, 4),
-        implied_vol=round(iv, 4),
-        market_value=position.market_value,
-        quantity=position.quantity
+    # 通过 ticker 批量获取 Greeks
+    valid = [c for c in qualified if c is not None]
+    ticker_results = iter(client.get_option_tickers_batch(valid, timeout=timeout) if valid else [])
+
+    results = []
+    pending = []    # (结果下标, ticker) —— modelGreeks 缺失，待本地求解
+    for p, contract in zip(option_positions, qualified):
+        delta = gamma = theta = vega = iv = 0.0
+        complete = False
+        ticker = None
+        if contract is not None:
+            ticker, complete = next(ticker_results, (None, False))
+            if ticker and ticker.modelGreeks:
+                greeks = ticker.modelGreeks
+                delta = _safe_float(greeks.delta)
+                gamma = _safe_float(greeks.gamma)
+                theta = _safe_float(greeks.theta)
+                vega = _safe_float(greeks.vega)
+                iv = _safe_float(greeks.impliedVol)
+        if not complete:
+            pending.append((len(results), ticker))
+
+        results.append(OptionGreeks(
+            symbol=p.symbol,
+            underlying=_underlying_symbol(p),
+            strike=p.strike,
+            right=p.right,
+            expiry=p.expiry,
+            days_to_expiry=_calc_days_to_expiry(p.expiry),
+            delta=round(delta, 4),
+            gamma=round(gamma, 4),
+            theta=round(theta, 4),
+            vega=round(vega, 4),
+            implied_vol=round(iv, 4),
+            market_value=p.market_value,
+            quantity=p.quantity,
+            greeks_complete=complete,
+            greeks_source="ibkr" if complete else "",
+        ))
+
+    if pending:
+        _fill_local_greeks(client, results, pending)
+    return results
+
+
+def _option_mark(ticker, position) -> float:
+    """期权价格：bid/ask 中间价 → last → close → 持仓市值折算"""
+    if ticker is not None:
+        bid, ask = _safe_float(ticker.bid), _safe_float(ticker.ask)
+        if bid > 0 and ask >= bid:
+            return (bid + ask) / 2
+        for v in (ticker.last, ticker.close):
+            if _safe_float(v) > 0:
+                return _safe_float(v)
+    if position.quantity:
+        return abs(position.market_value / (position.quantity * 100))
+    return 0.0
+
+
+def _fill_local_greeks(client, results: List[OptionGreeks], pending: list):
+    """
+    modelGreeks 缺失（超时、延迟行情下为 NaN、无订阅）时用本地 Bjerksund-Stensland 模型
+    从期权价格反解隐含波动率并计算 Greeks（见 option_pricing.py），整批一次向量化求解。
+    标的价格优先取 modelGreeks.undPrice，缺失时一次批量查询行情。
+    """
+    import numpy as np
+    from option_pricing import chain_greeks, years_to_expiry
+
+    spots = {}
+    for i, ticker in pending:
+        und = _safe_float(getattr(ticker.modelGreeks, "undPrice", None)) if ticker and ticker.modelGreeks else 0.0
+        if und > 0:
+            spots[results[i].underlying] = und
+    missing = sorted({results[i].underlying for i, _ in pending} - set(spots))
+    if missing:
+        try:
+            quotes = client.get_quotes_batch(missing)
+        except Exception as e:
+            print(f"⚠️ 标的行情获取失败，无法本地计算 Greeks: {e}")
+            quotes = {}
+        for sym, q in quotes.items():
+            if q.last_price > 0:
+                spots[sym] = q.last_price
+
+    rows = [(i, ticker) for i, ticker in pending if results[i].underlying in spots]
+    if not rows:
+        return
+    items = [results[i] for i, _ in rows]
+    marks = [_option_mark(ticker, g) for (_, ticker), g in zip(rows, items)]
+    local = chain_greeks(
+        np.array([spots[g.underlying] for g in items]),
+        [g.strike for g in items],
+        np.array([years_to_expiry(g.expiry) for g in items]),
+        np.array([g.right == "C" for g in items]),
+        last=marks,
+        american=True,
     )
+    for k, g in enumerate(items):
+        if not np.isfinite(local.implied_vol[k]):
+            continue
+        g.delta = round(float(local.delta[k]), 4)
+        g.gamma = round(float(local.gamma[k]), 4)
+        g.theta = round(float(local.theta[k]), 4)
+        g.vega = round(float(local.vega[k]), 4)
+        g.implied_vol = round(float(local.implied_vol[k]), 4)
+        g.greeks_complete = True
+        g.greeks_source = "local"
+
+
+def get_option_greeks(client, position) -> Optional[OptionGreeks]:
+    """
+    获取单个期权持仓的 Greeks
+    position: ibkr_readonly.Position (sec_type == 'OPT')
+    """
+    if position.sec_type != "OPT":
+        return None
+    results = get_option_greeks_batch(client, [position], timeout=2)
+    return results[0] if results else None
 
 
 def get_expiration_calendar(client) -> List[ExpirationEntry]:
@@ -216,19 +295,20 @@ def get_portfolio_greeks_summary(client) -> Optional[PortfolioGreeksSummary]:
     total_theta = 0.0
     total_vega = 0.0
     count = 0
+    incomplete = 0
 
-    for p in option_positions:
-        greeks = get_option_greeks(client, p)
-        if greeks:
-            # 乘以持仓数量和合约乘数 (通常 100)
-            multiplier = abs(p.quantity) * 100
-            sign = 1 if p.quantity > 0 else -1
-
-            total_delta += greeks.delta * p.quantity * 100
-            total_gamma += greeks.gamma * multiplier * sign
-            total_theta += greeks.theta * multiplier * sign
-            total_vega += greeks.vega * multiplier * sign
-            count += 1
+    for p, greeks in zip(option_positions, get_option_greeks_batch(client, option_positions)):
+        if not greeks.greeks_complete:
+            incomplete += 1
+        # 乘以持仓数量和合约乘数 (通常 100)
+        multiplier = abs(p.quantity) * 100
+        sign = 1 if p.quantity > 0 else -1
+
+        total_delta += greeks.delta * p.quantity * 100
+        total_gamma += greeks.gamma * multiplier * sign
+        total_theta += greeks.theta * multiplier * sign
+        total_vega += greeks.vega * multiplier * sign
+        count += 1
 
     # 判断方向
     if abs(total_delta) < 10:
@@ -245,98 +325,92 @@ def get_portfolio_greeks_summary(client) -> Optional[PortfolioGreeksSummary]:
         total_vega=round(total_vega, 2),
         net_delta_exposure=round(total_delta, 2),
         option_count=count,
-        net_direction=direction
+        net_direction=direction,
+        incomplete_count=incomplete
     )
 
 def screen_seller_options(client, symbol: str, opt_type: str = "P", min_dte: int = 7, max_dte: int = 45, min_delta: float = 0.1, max_delta: float = 0.35) -> dict:
     """
     期权卖方高阶筛选 (Cash-Secured Puts / Covered Calls)
+    每个合约附带相对本地 IV 曲面（见 iv_surface.py）的 IV 溢价（iv_edge，波动率点），溢价为正说明权利金
+    相对同期限同价值度偏贵。只拉取单侧期权链，不足以拟合曲面，参照的是此前两翼齐全的曲面（没有有效曲面时为 None）。
     """
-    base_chain = client.get_option_chain_data(symbol)
-    if "error" in base_chain:
-        return base_chain
-        
-    expirations = base_chain.get("expirations", [])
-    if not expirations:
-        return {"error": "未找到期权日期数据"}
-        
-    current_price = 0
-    valid_expirations = []
-    
-    for exp in expirations:
-        dte = _calc_days_to_expiry(exp)
-        if min_dte <= dte <= max_dte:
-            valid_expirations.append((exp, dte))
-            
-    if not valid_expirations:
+    from option_chain import select_expirations
+    from iv_surface import record_chain
+
+    # DTE 区间内所有到期日一次性并发抓取（放大 strike range 获取 OTM 合约）
+    chain = client.get_option_chain_multi(
+        symbol, min_dte=min_dte, max_dte=max_dte, strike_range=30, rights=(opt_type,)
+    )
+    if not chain.expirations:
+        return {"error": chain.error or "未找到期权日期数据"}
+    if not select_expirations(chain.expirations, min_dte, max_dte):
         return {"error": f"没有在 DTE {min_dte}-{max_dte} 天数区间的期权链"}
-        
+    if chain.error:
+        return {"error": chain.error}
+
+    current_price = chain.current_price
+    surface = record_chain(chain)
     results = []
-    for exp, dte in valid_expirations:
-        # 获取整条链，放大 strike range 获取 OTM 合约
-        chain_data = client.get_option_chain_data(symbol, expiry=exp, strike_range=30)
-        if "error" in chain_data:
+    for opt in chain.rows(right=opt_type):
+        exp = opt["expiry"]
+        dte = _calc_days_to_expiry(exp)
+        delta = opt.get("delta", 0)
+        abs_delta = abs(delta)
+
+        # 卖方过滤 OTM + delta 范围
+        if opt_type == "P" and opt.get("strike", 0) >= current_price:
             continue
-            
-        current_price = chain_data.get("current_price", 0)
-        if current_price <= 0:
+        if opt_type == "C" and opt.get("strike", 0) <= current_price:
             continue
             
-        chain_inner = chain_data.get("chain", {})
-        target_list = chain_inner.get("puts" if opt_type == "P" else "calls", [])
-        
-        for opt in target_list:
-            delta = opt.get("delta", 0)
-            abs_delta = abs(delta)
-            
-            # 卖方过滤 OTM + delta 范围
-            if opt_type == "P" and opt.get("strike", 0) >= current_price:
+        if min_delta <= abs_delta <= max_delta:
+            bid = opt.get("bid", 0)
+            if bid <= 0.05:  # 过滤毫无流动性的深度 OTM
                 continue
-            if opt_type == "C" and opt.get("strike", 0) <= current_price:
+            
+            strike = opt.get("strike", 0)
+            margin = strike if opt_type == "P" else current_price
+            if margin <= 0:
                 continue
                 
-            if min_delta <= abs_delta <= max_delta:
-                bid = opt.get("bid", 0)
-                if bid <= 0.05:  # 过滤毫无流动性的深度 OTM
-                    continue
-                
-                strike = opt.get("strike", 0)
-                margin = strike if opt_type == "P" else current_price
-                if margin <= 0:
-                    continue
-                    
-                yield_pct = (bid / margin) * 100
-                ann_yield = yield_pct * (365 / dte) if dte > 0 else 0
-                theta = opt.get("theta", 0)
-                theta_decay_usd = abs(theta) * 100
-                
-                if opt_type == "P":
-                    cushion = ((current_price - strike) / current_price) * 100
-                else:
-                    cushion = ((strike - current_price) / current_price) * 100
-                    
-                results.append({
-                    "symbol": symbol,
-                    "strike": strike,
-                    "expiry": exp,
-                    "dte": dte,
-                    "type": opt_type,
-                    "bid": bid,
-                    "ask": opt.get("ask", 0),
-                    "volume": opt.get("volume", 0),
-                    "oi": opt.get("open_interest", 0),
-                    "iv": opt.get("implied_vol", 0),
-                    "delta": delta,
-                    "gamma": opt.get("gamma", 0),
-                    "theta": theta,
-                    "theta_decay": theta_decay_usd,
-                    "yield_pct": yield_pct,
-                    "annualized_yield": ann_yield,
-                    "cushion": cushion,
-                    "itm_prob": abs_delta * 100,
-                    "margin": margin
-                })
+            yield_pct = (bid / margin) * 100
+            ann_yield = yield_pct * (365 / dte) if dte > 0 else 0
+            theta = opt.get("theta", 0)
+            theta_decay_usd = abs(theta) * 100
+            
+            if opt_type == "P":
+                cushion = ((current_price - strike) / current_price) * 100
+            else:
+                cushion = ((strike - current_price) / current_price) * 100
+
+            iv = opt.get("implied_vol", 0)
+            surface_iv = surface.iv_at(strike, exp) if surface else float("nan")
+            iv_edge = round((iv - surface_iv) * 100, 2) if iv > 0 and math.isfinite(surface_iv) else None
                 
+            results.append({
+                "symbol": symbol,
+                "strike": strike,
+                "expiry": exp,
+                "dte": dte,
+                "type": opt_type,
+                "bid": bid,
+                "ask": opt.get("ask", 0),
+                "volume": opt.get("volume", 0),
+                "oi": opt.get("open_interest", 0),
+                "iv": iv,
+                "iv_edge": iv_edge,
+                "delta": delta,
+                "gamma": opt.get("gamma", 0),
+                "theta": theta,
+                "theta_decay": theta_decay_usd,
+                "yield_pct": yield_pct,
+                "annualized_yield": ann_yield,
+                "cushion": cushion,
+                "itm_prob": abs_delta * 100,
+                "margin": margin
+            })
+            
     results.sort(key=lambda x: x["annualized_yield"], reverse=True)
     return {
         "symbol": symbol,
@@ -363,6 +437,8 @@ def format_option_greeks(greeks: OptionGreeks) -> str:
         f"    到期: {greeks.expiry} ({greeks.days_to_expiry}天)\n"
         f"    Δ={greeks.delta:+.4f}  Γ={greeks.gamma:.4f}  "
         f"Θ={greeks.theta:.4f}  ν={greeks.vega:.4f}  IV={greeks.implied_vol:.2%}"
+        + ("" if greeks.greeks_complete else "\n    ⚠️ Greeks 未在期限内返回，数值不完整")
+        + ("\n    ℹ️ IBKR 未返回 Greeks，已按本地 BSM/美式模型由期权价格反解" if greeks.greeks_source == "local" else "")
     )
 
 
@@ -394,6 +470,8 @@ def format_greeks_summary(summary: PortfolioGreeksSummary) -> str:
         f"  总 Gamma:  {summary.total_gamma:+.4f}\n"
         f"  总 Theta:  {summary.total_theta:+.2f}/天 (每天时间价值{'损耗' if summary.total_theta < 0 else '收益'}: ${abs(summary.total_theta):.2f})\n"
         f"  总 Vega:   {summary.total_vega:+.2f}"
+        + (f"\n  ⚠️ {summary.incomplete_count} 个期权未取得 Greeks，汇总可能偏小"
+           if summary.incomplete_count else "")
     )
 
 
@@ -410,16 +488,17 @@ def format_seller_screener_results(data: dict, top_n: int = 15) -> str:
         
     lines = [
         f"🎯 {symbol} 期权卖方机会扫描 (现价: ${current_price:.2f})",
-        "=" * 110,
-        f"{'到期日':<10s} {'天数':>4s} {'类型':<4s} {'行权价':>8s} | {'权利金':>7s} {'年化收益':>8s} | {'安全垫':>8s} {'胜率估算':>8s} | {'日Theta':>8s} {'IV':>6s}"
+        "=" * 118,
+        f"{'到期日':<10s} {'天数':>4s} {'类型':<4s} {'行权价':>8s} | {'权利金':>7s} {'年化收益':>8s} | {'安全垫':>8s} {'胜率估算':>8s} | {'日Theta':>8s} {'IV':>6s} {'IV溢价':>7s}"
     ]
     
     for r in results[:top_n]:
+        edge = f"{r['iv_edge']:>+6.1f}v" if r.get("iv_edge") is not None else f"{'-':>7s}"
         lines.append(
             f"{r['expiry']:<10s} {r['dte']:>4d} {r['type']:<4s} ${r['strike']:>7.2f} | "
             f"${r['bid']:>6.2f} {r['annualized_yield']:>7.1f}% | "
             f"{r['cushion']:>7.1f}% {r['itm_prob']:>7.1f}% | "
-            f"${r['theta_decay']:>7.2f} {r['iv']:>5.0%}"
+            f"${r['theta_decay']:>7.2f} {r['iv']:>5.0%} {edge}"
         )
         
     if len(results) > top_n:
@@ -457,11 +536,9 @@ def main():
     if opt_positions:
         print("\n📊 期权 Greeks 明细:")
         print("=" * 60)
-        for p in opt_positions:
-            greeks = get_option_greeks(client, p)
-            if greeks:
-                print(format_option_greeks(greeks))
-                print()
+        for greeks in get_option_greeks_batch(client, opt_positions):
+            print(format_option_greeks(greeks))
+            print()
 
     # 3. 组合级汇总
     print("⏳ 正在计算组合 Greeks 汇总...")
@@ -2,10 +2,12 @@
 """
 期权异常活动扫描模块
 检测：异常高成交量期权合约、Put/Call 比率异动、大额扫单信号。
+近月期权链一次并发拉取，异常合约标注相对此前已存 IV 曲面（见 iv_surface.py）的 IV 偏离，本次的链再顺带拟合入库。
 所有函数接收 IBKRReadOnlyClient 实例，纯只读操作。
 """
 
 import json
+import math
 import dataclasses
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict
@@ -28,6 +30,7 @@ class UnusualOption:
     last_price: float
     signal: str              # "📈 看涨大单" / "📉 看跌大单" / "⚠️ 异常活跃"
     score: int               # 异常度评分 0-100
+    iv_vs_surface: Optional[float] = None   # 合约 IV 减同期限同价值度曲面 IV（波动率点，正=偏贵；无已存曲面为 None）
 
 
 @dataclass
@@ -45,89 +48,87 @@ class OptionsFlowReport:
 
 # ─── 核心函数 ─────────────────────────────────────────────────
 
-def scan_unusual_options(client, symbol: str, min_vol_oi_ratio: float = 2.0) -> Optional[OptionsFlowReport]:
+def scan_unusual_options(client, symbol: str, min_vol_oi_ratio: float = 2.0,
+                         max_dte: int = 60) -> Optional[OptionsFlowReport]:
     """
     扫描指定股票的异常期权活动
     min_vol_oi_ratio: 最低成交量/未平仓量比 (高比率 = 异常活跃)
+    max_dte: 扫描的最远到期天数
     """
-    current_price = 0
-    try:
-        bars = client.get_historical_data(symbol, duration="5 D", bar_size="1 day")
-        if bars:
-            current_price = bars[-1]["close"]
-    except Exception:
-        pass
-
-    if current_price <= 0:
-        return None
+    from iv_surface import cached_surface, record_chain
 
-    # 获取多个到期日的期权链
-    chain_data = client.get_option_chain_data(symbol)
-    if not chain_data:
+    # 一次并发获取 max_dte 内全部到期日的期权链
+    chain = client.get_option_chain_multi(symbol, min_dte=0, max_dte=max_dte, strike_range=15)
+    current_price = chain.current_price
+    if current_price <= 0 or not len(chain):
         return None
 
-    chain_inner = chain_data.get("chain", {})
-    calls = chain_inner.get("calls", [])
-    puts = chain_inner.get("puts", [])
+    # 偏离以此前已存的曲面为参照：用本条链自己拟合的曲面衡量，异常合约会被拟合吸收；没有有效曲面时不标注
+    surface = cached_surface(symbol)
+    record_chain(chain)
 
     total_call_vol = 0
     total_put_vol = 0
     unusual = []
 
-    for opt_list, opt_type in [(calls, "C"), (puts, "P")]:
-        for opt in opt_list:
-            vol = opt.get("volume", 0)
-            oi = opt.get("openInterest", 0)
-
-            if opt_type == "C":
-                total_call_vol += vol
-            else:
-                total_put_vol += vol
-
-            # 异常检测: 成交量/OI 比率
-            if oi > 0 and vol > 0:
-                vol_oi = vol / oi
-            elif vol > 100 and oi == 0:
-                vol_oi = vol  # 全新合约大量成交
-            else:
-                continue
-
-            if vol_oi < min_vol_oi_ratio and vol < 500:
-                continue
-
-            iv = opt.get("impliedVol", 0)
-            delta = opt.get("delta", 0)
-            strike = opt.get("strike", 0)
-            expiry = opt.get("expiry", "")
-            last = opt.get("lastPrice", 0)
-
-            # 分类信号
-            if opt_type == "C" and vol_oi >= 5:
-                signal = "📈 看涨大单"
-            elif opt_type == "P" and vol_oi >= 5:
-                signal = "📉 看跌大单"
-            elif vol_oi >= 3:
-                signal = "⚠️ 异常活跃"
-            else:
-                signal = "📊 偏活跃"
-
-            # 异常度评分 (基于 vol/oi 和绝对成交量)
-            score = min(100, int(vol_oi * 10 + min(vol / 100, 50)))
-
-            unusual.append(UnusualOption(
-                symbol=symbol,
-                expiry=expiry,
-                strike=strike,
-                opt_type=opt_type,
-                volume=vol,
-                open_interest=oi,
-                vol_oi_ratio=round(vol_oi, 2),
-                implied_vol=round(iv * 100 if iv < 5 else iv, 2),
-                delta=round(delta, 3),
-                last_price=round(last, 2),
-                signal=signal,
-                score=score
-            ))
+    for opt in chain.rows():
+        opt_type = opt["right"]
+        vol = opt.get("volume", 0)
+        oi = opt.get("open_interest", 0)
+
+        if opt_type == "C":
+            total_call_vol += vol
+        else:
+            total_put_vol += vol
+
+        # 异常检测: 成交量/OI 比率
+        if oi > 0 and vol > 0:
+            vol_oi = vol / oi
+        elif vol > 100 and oi == 0:
+            vol_oi = vol  # 全新合约大量成交
+        else:
+            continue
+
+        if vol_oi < min_vol_oi_ratio and vol < 500:
+            continue
+
+        iv = opt.get("implied_vol", 0)
+        delta = opt.get("delta", 0)
+        strike = opt.get("strike", 0)
+        expiry = opt.get("expiry", "")
+        last = opt.get("last", 0)
+
+        surface_iv = surface.iv_at(strike, expiry) if surface else float("nan")
+        iv_gap = round((iv - surface_iv) * 100, 2) if iv > 0 and math.isfinite(surface_iv) else None
+
+        # 分类信号
+        if opt_type == "C" and vol_oi >= 5:
+            signal = "📈 看涨大单"
+        elif opt_type == "P" and vol_oi >= 5:
+            signal = "📉 看跌大单"
+        elif vol_oi >= 3:
+            signal = "⚠️ 异常活跃"
+        else:
+            signal = "📊 偏活跃"
+
+        # 异常度评分 (基于 vol/oi 和绝对成交量)
+        score = min(100, int(vol_oi * 10 + min(vol / 100, 50)))
+
+        unusual.append(UnusualOption(
+            symbol=symbol,
+            expiry=expiry,
+            strike=strike,
+            opt_type=opt_type,
+            volume=vol,
+            open_interest=oi,
+            vol_oi_ratio=round(vol_oi, 2),
+            implied_vol=round(iv * 100 if iv < 5 else iv, 2),
+            delta=round(delta, 3),
+            last_price=round(last, 2),
+            signal=signal,
+            score=score,
+            iv_vs_surface=iv_gap,
+        ))
 
     # 排序: 异常度最高在前
     unusual.sort(key=lambda x: x.score, reverse=True)
@@ -172,6 +173,8 @@ def scan_unusual_options(client, symbol: str, min_vol_oi_ratio: float = 2.0) ->
             type_cn = "看涨" if u.opt_type == "C" else "看跌"
             observations.append(f"🔥 高度异常: {u.expiry} ${u.strike} {type_cn}，"
                               f"成交量/OI={u.vol_oi_ratio:.1f}x，成交={u.volume:,}")
+            if u.iv_vs_surface is not None and u.iv_vs_surface >= 3:
+                observations.append(f"   该合约 IV 高于曲面 {u.iv_vs_surface:.1f} 个波动率点，买方愿付溢价，信号更强")
 
     return OptionsFlowReport(
         symbol=symbol,
@@ -193,7 +196,7 @@ def format_unusual_options(report: OptionsFlowReport) -> str:
 
     lines = [
         f"🔍 {report.symbol} 期权异常活动扫描  |  股价: ${report.current_price:,.2f}",
-        "=" * 70,
+        "=" * 78,
         f"  📊 Call 成交量: {report.total_call_volume:,}  |  Put 成交量: {report.total_put_volume:,}",
         f"  📊 Put/Call Ratio: {report.put_call_ratio:.3f}  {report.pc_ratio_signal}",
         "",
@@ -201,13 +204,14 @@ def format_unusual_options(report: OptionsFlowReport) -> str:
 
     if report.unusual_activities:
         lines.append(f"  ⚡ 异常活动 Top {min(len(report.unusual_activities), 15)}:")
-        lines.append(f"  {'到期':<10s} {'行权价':>8s} {'类型':>4s} {'成交量':>8s} {'OI':>8s} {'Vol/OI':>7s} {'IV%':>6s} {'评分':>4s} 信号")
-        lines.append("  " + "─" * 68)
+        lines.append(f"  {'到期':<10s} {'行权价':>8s} {'类型':>4s} {'成交量':>8s} {'OI':>8s} {'Vol/OI':>7s} {'IV%':>6s} {'vs曲面':>7s} {'评分':>4s} 信号")
+        lines.append("  " + "─" * 76)
 
         for u in report.unusual_activities[:15]:
             t = "Call" if u.opt_type == "C" else "Put"
+            gap = f"{u.iv_vs_surface:>+6.1f}v" if u.iv_vs_surface is not None else f"{'-':>7s}"
             lines.append(f"  {u.expiry:<10s} ${u.strike:>7.1f} {t:>4s} {u.volume:>8,} {u.open_interest:>8,} "
-                        f"{u.vol_oi_ratio:>6.1f}x {u.implied_vol:>5.1f}% {u.score:>4d}  {u.signal}")
+                        f"{u.vol_oi_ratio:>6.1f}x {u.implied_vol:>5.1f}% {gap} {u.score:>4d}  {u.signal}")
     else:
         lines.append("  ✅ 未检测到显著异常活动")
 
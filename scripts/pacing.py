@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+IBKR 请求节流调度器 (Pacing)
+按 IBKR 文档中的历史数据限速规则统一排队 reqHistoricalData / reqFundamentalData / reqScannerData：
+  • 15 秒内不得重复完全相同的历史数据请求
+  • 2 秒内同一合约同一数据类型不超过 6 次请求
+  • 小周期 K 线（≤30 秒）任意 10 分钟内不超过 60 次请求
+  • 同时在途的历史数据请求不超过 50 个；扫描订阅不超过 10 个
+  • 行情线路额度由流式订阅与临时请求（期权快照、期权 Greeks、批量报价快照）共用，临时请求按剩余额度分批
+收到 pacing violation 且结果为空时按指数退避自动重试，并统计排队深度与等待时间。
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import time
+import asyncio
+import threading
+from bisect import bisect_right, insort
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+@dataclass
+class PacingLimits:
+    max_concurrent: int = 0          # 同时在途请求上限（0 = 不限）
+    window_sec: float = 0            # 滑动窗口长度
+    max_per_window: int = 0          # 窗口内请求上限
+    identical_cooldown: float = 0    # 相同请求的最小间隔
+    burst_sec: float = 0             # 同合约突发窗口
+    max_per_burst: int = 0           # 突发窗口内同合约请求上限
+
+
+# 同合约 2 秒 6 次为违规阈值，这里留 1 次余量
+PACING_LIMITS: Dict[str, PacingLimits] = {
+    "historical": PacingLimits(
+        max_concurrent=int(os.getenv("IBKR_HIST_MAX_CONCURRENT", "50")),
+        identical_cooldown=15, burst_sec=2, max_per_burst=5,
+    ),
+    "historical_small": PacingLimits(
+        max_concurrent=int(os.getenv("IBKR_HIST_MAX_CONCURRENT", "50")),
+        window_sec=600, max_per_window=60,
+        identical_cooldown=15, burst_sec=2, max_per_burst=5,
+    ),
+    "fundamental": PacingLimits(max_concurrent=5, burst_sec=2, max_per_burst=5),
+    "scanner": PacingLimits(max_concurrent=10),
+    # 期权快照并发批次；每批合约数按临时请求的行情线路额度收缩（见 adhoc_lines）
+    "option_snapshot": PacingLimits(max_concurrent=int(os.getenv("IBKR_CHAIN_MAX_CONCURRENT", "3"))),
+}
+
+# 账户行情线上限（IBKR 默认 100，可随佣金 / 订阅增加）；常驻流式订阅先占一部分，其余留给临时请求
+MAX_MARKET_DATA_LINES = int(os.getenv("IBKR_MAX_MKT_LINES", "100"))
+
+PACING_MAX_RETRIES = 3
+PACING_BACKOFF_SEC = 10.0
+
+_SMALL_BAR_SIZES = ("1 secs", "5 secs", "10 secs", "15 secs", "30 secs")
+
+
+def historical_kind(bar_size: str) -> str:
+    """小周期 K 线额外受 10 分钟 60 次的限制"""
+    return "historical_small" if bar_size in _SMALL_BAR_SIZES else "historical"
+
+
+# ─── 调度器 ───────────────────────────────────────────────────
+
+@dataclass
+class _Flight:
+    """一次在途请求；pacing violation 按合约归属到具体请求"""
+    conids: FrozenSet[int] = field(default_factory=frozenset)
+    pacing_error: bool = False
+
+
+class PacingScheduler:
+    """
+    为单个 IB 连接预约请求时间片。
+    reserve() 只计算并登记"最早可发送时刻"，实际等待由同步/异步调用方完成，
+    因此同一个调度器可以同时服务 ib.reqXxx 与 ib.reqXxxAsync。
+    """
+
+    def __init__(self, ib=None):
+        self.ib = ib
+        self._starts: Dict[str, List[float]] = defaultdict(list)
+        self._identical: Dict[tuple, float] = {}
+        self._bursts: Dict[tuple, List[float]] = defaultdict(list)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._thread_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._inflight: List[_Flight] = []
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_sec = 0.0
+        self.retries = 0
+        self.pacing_errors = 0
+        # 常驻流式订阅占用的行情线路（由 QuoteStream 登记）
+        self.streaming_lines = 0
+
+        error_event = getattr(ib, "errorEvent", None) if ib is not None else None
+        if error_event is not None:
+            error_event += self._on_error
+
+    def _on_error(self, req_id, error_code, error_string, *args):
+        if "pacing violation" not in str(error_string).lower():
+            return
+        self.pacing_errors += 1
+        # ib_async 在 errorEvent 里带上请求对应的合约；扫描等无合约请求只归到无合约的在途请求
+        conid = getattr(args[0], "conId", 0) if args else 0
+        with self._lock:
+            for flight in self._inflight:
+                if (conid in flight.conids) if conid else not flight.conids:
+                    flight.pacing_error = True
+
+    def _begin(self, contracts) -> _Flight:
+        flight = _Flight(frozenset(c.conId for c in contracts if getattr(c, "conId", 0)))
+        with self._lock:
+            self._inflight.append(flight)
+        return flight
+
+    def _end(self, flight: _Flight):
+        with self._lock:
+            self._inflight.remove(flight)
+
+    def _prune(self, now: float):
+        horizon = now - max(600.0, max(l.window_sec for l in PACING_LIMITS.values()))
+        for kind, starts in self._starts.items():
+            while starts and starts[0] < horizon:
+                starts.pop(0)
+        for group in [g for g, ts in self._bursts.items() if not ts or ts[-1] < now - 60]:
+            del self._bursts[group]
+        for key in [k for k, t in self._identical.items() if t < now - 60]:
+            del self._identical[key]
+
+    def reserve(self, kind: str, key=None, group=None) -> float:
+        """
+        登记一次请求并返回需要等待的秒数。
+        key: 完全相同请求的判重键；group: 同合约同数据类型的分组键
+        """
+        with self._lock:
+            return self._reserve_locked(kind, key, group)
+
+    def _reserve_locked(self, kind: str, key, group) -> float:
+        limits = PACING_LIMITS.get(kind, PacingLimits())
+        now = time.time()
+        self._prune(now)
+        t = now
+
+        if key is not None and limits.identical_cooldown:
+            last = self._identical.get((kind, key))
+            if last is not None:
+                t = max(t, last + limits.identical_cooldown)
+
+        if group is not None and limits.max_per_burst:
+            t = _earliest_slot(self._bursts[(kind, group)], t, limits.burst_sec, limits.max_per_burst)
+
+        if limits.max_per_window:
+            t = _earliest_slot(self._starts[kind], t, limits.window_sec, limits.max_per_window)
+
+        insort(self._starts[kind], t)
+        if group is not None:
+            insort(self._bursts[(kind, group)], t)
+        if key is not None:
+            self._identical[(kind, key)] = t
+        self.requests += 1
+        return max(0.0, t - now)
+
+    def _enter_queue(self):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def _leave_queue(self):
+        with self._lock:
+            self.queued -= 1
+
+    def _sleep(self, seconds: float):
+        if seconds <= 0:
+            return
+        self.wait_sec += seconds
+        # 真实 IB 对象用 ib.sleep 保持事件循环运转；broker 代理对象用本地 sleep
+        from ib_async import IB
+        if isinstance(self.ib, IB):
+            self.ib.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _thread_semaphore(self, kind: str):
+        limits = PACING_LIMITS.get(kind, PacingLimits())
+        if not limits.max_concurrent:
+            return None
+        with self._lock:
+            semaphore = self._thread_semaphores.get(kind)
+            if semaphore is None:
+                semaphore = self._thread_semaphores[kind] = threading.BoundedSemaphore(limits.max_concurrent)
+        return semaphore
+
+    def call(self, kind: str, fn: Callable, key=None, group=None, label: str = "", contracts=()):
+        """
+        同步执行一次受限请求；结果为空且该请求本身收到 pacing violation 时退避重试。
+        contracts: 请求涉及的合约，用于把网关的限速错误归属到本次请求；
+        多个工作线程共用调度器时同样受并发上限约束。
+        """
+        semaphore = self._thread_semaphore(kind)
+        result = None
+        for attempt in range(PACING_MAX_RETRIES + 1):
+            self._enter_queue()
+            flight = None
+            try:
+                if semaphore is not None:
+                    queued_at = time.time()
+                    semaphore.acquire()
+                    self.wait_sec += time.time() - queued_at
+                try:
+                    self._sleep(self.reserve(kind, key, group))
+                    flight = self._begin(contracts)
+                    result = fn()
+                finally:
+                    if flight is not None:
+                        self._end(flight)
+                    if semaphore is not None:
+                        semaphore.release()
+            finally:
+                self._leave_queue()
+            if result or not flight.pacing_error or attempt == PACING_MAX_RETRIES:
+                return result
+            backoff = PACING_BACKOFF_SEC * 2 ** attempt
+            self.retries += 1
+            print(f"⏳ {label or kind} 触发 IBKR 限速，{backoff:.0f} 秒后重试 ({attempt + 1}/{PACING_MAX_RETRIES})")
+            self._sleep(backoff)
+        return result
+
+    async def call_async(self, kind: str, factory: Callable, key=None, group=None, label: str = "",
+                         contracts=()):
+        """异步版本：factory 返回待等待的协程；同时受并发上限约束"""
+        limits = PACING_LIMITS.get(kind, PacingLimits())
+        semaphore = None
+        if limits.max_concurrent:
+            semaphore = self._semaphores.get(kind)
+            if semaphore is None:
+                semaphore = self._semaphores[kind] = asyncio.Semaphore(limits.max_concurrent)
+
+        result = None
+        for attempt in range(PACING_MAX_RETRIES + 1):
+            self._enter_queue()
+            queued_at = time.time()
+            flight = None
+            try:
+                if semaphore is not None:
+                    await semaphore.acquire()
+                try:
+                    wait = self.reserve(kind, key, group)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    self.wait_sec += time.time() - queued_at
+                    flight = self._begin(contracts)
+                    result = await factory()
+                finally:
+                    if flight is not None:
+                        self._end(flight)
+                    if semaphore is not None:
+                        semaphore.release()
+            finally:
+                self._leave_queue()
+            if result or not flight.pacing_error or attempt == PACING_MAX_RETRIES:
+                return result
+            backoff = PACING_BACKOFF_SEC * 2 ** attempt
+            self.retries += 1
+            print(f"⏳ {label or kind} 触发 IBKR 限速，{backoff:.0f} 秒后重试 ({attempt + 1}/{PACING_MAX_RETRIES})")
+            self.wait_sec += backoff
+            await asyncio.sleep(backoff)
+        return result
+
+    def adhoc_lines(self) -> int:
+        """临时请求同时可占用的行情线路数：账户额度减去流式订阅常驻占用的部分"""
+        return max(1, MAX_MARKET_DATA_LINES - self.streaming_lines)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "wait_sec": round(self.wait_sec, 2),
+            "retries": self.retries,
+            "pacing_errors": self.pacing_errors,
+        }
+
+
+def _earliest_slot(starts: List[float], t: float, window: float, limit: int) -> float:
+    """
+    在已登记时刻 starts（升序，可能含未来的预约）中找出 ≥t 的最早时刻，
+    使插入后任意长度为 window 的区间内都不超过 limit 次。
+    可行时刻只可能是 t 本身或某个已登记时刻 + window，按升序逐一检查。
+    """
+    candidates = [t] + sorted(s + window for s in starts if s + window > t)
+    for c in candidates:
+        if _slot_fits(starts, c, window, limit):
+            return c
+    return candidates[-1]
+
+
+def _slot_fits(starts: List[float], t: float, window: float, limit: int) -> bool:
+    """t 插入后，包含 t 的每组连续 limit+1 个时刻跨度都不小于 window"""
+    pos = bisect_right(starts, t)
+    merged = starts[max(0, pos - limit):pos] + [t] + starts[pos:pos + limit]
+    at = min(pos, limit)
+    for i in range(max(0, at - limit), at + 1):
+        run = merged[i:i + limit + 1]
+        if len(run) == limit + 1 and run[-1] - run[0] < window - 1e-9:
+            return False
+    return True
+
+
+def get_scheduler(ib) -> PacingScheduler:
+    """每个 IB 连接共享一个调度器（挂在 ib 对象上）"""
+    scheduler = getattr(ib, "_pacing_scheduler", None)
+    if scheduler is None:
+        scheduler = PacingScheduler(ib)
+        try:
+            ib._pacing_scheduler = scheduler
+        except AttributeError:
+            pass
+    return scheduler
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_pacing_stats(stats: dict) -> str:
+    line = (f"请求 {stats['requests']} 次 | 当前排队 {stats['queued']} (峰值 {stats['max_queued']}) | "
+            f"累计等待 {stats['wait_sec']:.1f}s")
+    if stats["retries"] or stats["pacing_errors"]:
+        line += f" | 限速重试 {stats['retries']} 次 / 违规 {stats['pacing_errors']} 次"
+    return line
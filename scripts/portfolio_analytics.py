@@ -5,13 +5,15 @@
 所有函数接收 IBKRReadOnlyClient 实例，纯只读操作。
 """
 
-import math
-import statistics
 import json
 import dataclasses
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Tuple
 
+import numpy as np
+
+from return_matrix import ReturnMatrix, load_return_matrix, longest_period, matrix_for
+
 
 # ─── 数据类 ───────────────────────────────────────────────────
 
@@ -187,73 +189,39 @@ def get_concentration_risk(client) -> ConcentrationReport:
     )
 
 
-def _calc_daily_returns(bars: List[dict]) -> List[float]:
-    """从 K 线数据计算日收益率"""
-    returns = []
-    for i in range(1, len(bars)):
-        prev_close = bars[i - 1]["close"]
-        curr_close = bars[i]["close"]
-        if prev_close and prev_close != 0:
-            returns.append((curr_close - prev_close) / prev_close)
-    return returns
-
-
-def get_portfolio_beta(client, benchmark: str = "SPY", period: str = "6 M") -> Optional[dict]:
+def get_portfolio_beta(client, benchmark: str = "SPY", period: str = "6 M",
+                       matrix: Optional[ReturnMatrix] = None) -> Optional[dict]:
     """
     计算组合 Beta（相对基准）
-    Beta = Cov(Rp, Rm) / Var(Rm)
+    Beta = Cov(Rp, Rm) / Var(Rm)，个股与基准按日期对齐，只用双方都有收益率的交易日
     """
-    positions = client.get_positions()
-    stock_positions = [p for p in positions if p.sec_type == "STK"]
-    if not stock_positions:
-        return None
-
-    total_value = sum(abs(p.market_value) for p in stock_positions)
-    if total_value == 0:
-        return None
-
-    # 获取基准历史数据
-    benchmark_bars = client.get_historical_data(benchmark, duration=period, bar_size="1 day")
-    if len(benchmark_bars) < 20:
+    m = matrix_for(client, matrix, period, benchmark)
+    if m is None or benchmark not in m or m.bar_count(benchmark) < 20:
         return None
-    bench_returns = _calc_daily_returns(benchmark_bars)
+    bench_returns = m.column_returns(benchmark)
 
     # 加权 Beta
     portfolio_beta = 0.0
     processed = []
 
-    # 批量并发获取所有持仓的历史数据
-    symbols = [p.symbol for p in stock_positions]
-    batch_fetch = getattr(client, "get_historical_data_batch", None)
-    if batch_fetch:
-        all_bars = client.get_historical_data_batch(symbols, duration=period, bar_size="1 day")
-    else:
-        all_bars = {sym: client.get_historical_data(sym, duration=period, bar_size="1 day") for sym in symbols}
-
-    for p in stock_positions:
-        weight = abs(p.market_value) / total_value
-        bars = all_bars.get(p.symbol, [])
-        if len(bars) < 20:
+    for symbol in m.holdings:
+        weight = m.weights[symbol]
+        if m.bar_count(symbol) < 20:
             continue
-        try:
-            stock_returns = _calc_daily_returns(bars)
-
-            # 对齐长度
-            min_len = min(len(stock_returns), len(bench_returns))
-            sr = stock_returns[-min_len:]
-            br = bench_returns[-min_len:]
-
-            # 计算 Beta
-            mean_s = statistics.mean(sr)
-            mean_b = statistics.mean(br)
-            cov = sum((s - mean_s) * (b - mean_b) for s, b in zip(sr, br)) / (min_len - 1)
-            var_b = statistics.variance(br)
-            beta = cov / var_b if var_b != 0 else 1.0
-
-            portfolio_beta += weight * beta
-            processed.append({"symbol": p.symbol, "beta": round(beta, 3), "weight": round(weight * 100, 2)})
-        except Exception:
+        stock_returns = m.column_returns(symbol)
+        both = ~np.isnan(stock_returns) & ~np.isnan(bench_returns)
+        if np.count_nonzero(both) < 2:
             continue
+        sr = stock_returns[both]
+        br = bench_returns[both]
+
+        # 计算 Beta
+        cov = np.dot(sr - sr.mean(), br - br.mean()) / (len(sr) - 1)
+        var_b = br.var(ddof=1)
+        beta = float(cov / var_b) if var_b != 0 else 1.0
+
+        portfolio_beta += weight * beta
+        processed.append({"symbol": symbol, "beta": round(beta, 3), "weight": round(weight * 100, 2)})
 
     return {
         "portfolio_beta": round(portfolio_beta, 3),
@@ -263,109 +231,69 @@ def get_portfolio_beta(client, benchmark: str = "SPY", period: str = "6 M") -> O
     }
 
 
-def get_correlation_matrix(client, period: str = "3 M") -> Optional[dict]:
+def get_correlation_matrix(client, period: str = "3 M", matrix: Optional[ReturnMatrix] = None,
+                           method: str = "sample", shrinkage: bool = False,
+                           halflife: float = None) -> Optional[dict]:
     """
-    计算持仓间的 Pearson 相关性矩阵（仅股票类）
+    计算全部股票持仓间的相关性矩阵（不限持仓数量）
+    method: "sample" 成对样本相关 / "ewma" 指数加权；shrinkage: 是否做 Ledoit-Wolf 收缩
+    同时对相关性矩阵做层次聚类，给出高度相关的拥挤持仓组
     """
-    positions = client.get_positions()
-    stock_positions = [p for p in positions if p.sec_type == "STK"]
+    from covariance import estimate_covariance, high_correlation_pairs, DEFAULT_HALFLIFE
 
-    if len(stock_positions) < 2:
+    m = matrix_for(client, matrix, period)
+    if m is None or len(m.weights) < 2:
         return None
 
-    # 获取每只股票的日收益率
-    symbols = []
-    returns_map = {}
-
-    # 批量并发获取历史数据
-    target_symbols = [p.symbol for p in stock_positions[:15]]
-    batch_fetch = getattr(client, "get_historical_data_batch", None)
-    if batch_fetch:
-        all_bars = client.get_historical_data_batch(target_symbols, duration=period, bar_size="1 day")
-    else:
-        all_bars = {sym: client.get_historical_data(sym, duration=period, bar_size="1 day") for sym in target_symbols}
-
-    for sym in target_symbols:
-        bars = all_bars.get(sym, [])
-        if len(bars) >= 20:
-            returns_map[sym] = _calc_daily_returns(bars)
-            symbols.append(sym)
+    # 每只股票的日收益率（按日期对齐）
+    symbols = [sym for sym in m.holdings if m.bar_count(sym) >= 20]
 
     if len(symbols) < 2:
         return None
 
-    # 计算相关性矩阵
-    matrix = {}
-    for i, sym_a in enumerate(symbols):
-        matrix[sym_a] = {}
-        for j, sym_b in enumerate(symbols):
-            if i == j:
-                matrix[sym_a][sym_b] = 1.0
-                continue
-
-            ra = returns_map[sym_a]
-            rb = returns_map[sym_b]
-            min_len = min(len(ra), len(rb))
-            ra_aligned = ra[-min_len:]
-            rb_aligned = rb[-min_len:]
-
-            try:
-                corr = statistics.correlation(ra_aligned, rb_aligned)
-                matrix[sym_a][sym_b] = round(corr, 3)
-            except Exception:
-                matrix[sym_a][sym_b] = None
-
-    # 找出高度相关的持仓对
-    high_corr_pairs = []
-    for i, sym_a in enumerate(symbols):
-        for j, sym_b in enumerate(symbols):
-            if j <= i:
-                continue
-            corr_val = matrix[sym_a].get(sym_b)
-            if corr_val is not None and abs(corr_val) >= 0.7:
-                high_corr_pairs.append({
-                    "pair": f"{sym_a} - {sym_b}",
-                    "correlation": corr_val,
-                    "warning": "高度正相关" if corr_val > 0 else "高度负相关"
-                })
+    est = estimate_covariance(m.returns_for(symbols), symbols, method=method, shrinkage=shrinkage,
+                              halflife=halflife or DEFAULT_HALFLIFE, weights=m.weights)
+    corr = est.correlation
+    matrix_dict = {
+        sym_a: {sym_b: None if np.isnan(corr[i, j]) else round(float(corr[i, j]), 3)
+                for j, sym_b in enumerate(symbols)}
+        for i, sym_a in enumerate(symbols)
+    }
 
     return {
         "symbols": symbols,
-        "matrix": matrix,
-        "high_correlation_pairs": high_corr_pairs
+        "matrix": matrix_dict,
+        "high_correlation_pairs": high_correlation_pairs(corr, symbols, 0.7),
+        "method": est.method,
+        "shrinkage": est.shrinkage,
+        "observations": est.observations,
+        "clusters": [dataclasses.asdict(c) for c in est.clusters],
     }
 
 
-def get_benchmark_comparison(client, benchmark: str = "SPY", period: str = "3 M") -> Optional[BenchmarkComparison]:
+def _period_return_pct(prices: np.ndarray) -> float:
+    """窗口内首个有效收盘价到最新收盘价的涨跌幅 (%)"""
+    valid = prices[~np.isnan(prices)]
+    return float((valid[-1] - valid[0]) / valid[0] * 100)
+
+
+def get_benchmark_comparison(client, benchmark: str = "SPY", period: str = "3 M",
+                             matrix: Optional[ReturnMatrix] = None) -> Optional[BenchmarkComparison]:
     """
     对比组合加权收益率 vs 基准同期收益率
     """
-    positions = client.get_positions()
-    stock_positions = [p for p in positions if p.sec_type == "STK"]
-    if not stock_positions:
-        return None
-
-    total_value = sum(abs(p.market_value) for p in stock_positions)
-    if total_value == 0:
+    m = matrix_for(client, matrix, period, benchmark)
+    if m is None or benchmark not in m or m.bar_count(benchmark) < 5:
         return None
 
     # 基准收益
-    bench_bars = client.get_historical_data(benchmark, duration=period, bar_size="1 day")
-    if len(bench_bars) < 5:
-        return None
-    bench_return = (bench_bars[-1]["close"] - bench_bars[0]["close"]) / bench_bars[0]["close"] * 100
+    bench_return = _period_return_pct(m.column_prices(benchmark))
 
     # 组合加权收益
     portfolio_return = 0.0
-    for p in stock_positions:
-        weight = abs(p.market_value) / total_value
-        try:
-            bars = client.get_historical_data(p.symbol, duration=period, bar_size="1 day")
-            if len(bars) >= 5:
-                stock_return = (bars[-1]["close"] - bars[0]["close"]) / bars[0]["close"] * 100
-                portfolio_return += weight * stock_return
-        except Exception:
-            continue
+    for symbol in m.holdings:
+        if m.bar_count(symbol) >= 5:
+            portfolio_return += m.weights[symbol] * _period_return_pct(m.column_prices(symbol))
 
     return BenchmarkComparison(
         portfolio_return_pct=round(portfolio_return, 2),
@@ -402,128 +330,84 @@ def get_performance_attribution(client) -> List[PerformanceAttribution]:
     return result
 
 
-def get_max_drawdown(client, symbol: str = None, period: str = "1 Y") -> Optional[DrawdownInfo]:
+def _max_drawdown(values: np.ndarray) -> Tuple[float, int, int]:
+    """净值 / 价格序列的最大回撤 (%)，返回 (回撤, 峰值下标, 谷底下标)"""
+    running_peak = np.maximum.accumulate(values)
+    drawdowns = (running_peak - values) / running_peak * 100
+    trough = int(np.argmax(drawdowns))
+    if drawdowns[trough] <= 0:
+        return 0.0, 0, 0
+    peak = int(np.argmax(values[:trough + 1]))
+    return float(drawdowns[trough]), peak, trough
+
+
+def get_max_drawdown(client, symbol: str = None, period: str = "1 Y",
+                     matrix: Optional[ReturnMatrix] = None) -> Optional[DrawdownInfo]:
     """
     计算最大回撤
     - 如果指定 symbol，计算该股票的最大回撤
     - 如果不指定，使用 SPY 作为市场基准
+    传入的收益率矩阵已包含该标的且回溯足够时直接复用，不再拉取
     """
     target = symbol or "SPY"
-    bars = client.get_historical_data(target, duration=period, bar_size="1 day")
-    if not bars or len(bars) < 5:
+    if matrix is not None and target in matrix and longest_period(matrix.period, period) == matrix.period:
+        m = matrix.window(period)
+        prices = m.column_prices(target)
+        valid = ~np.isnan(prices)
+        closes = prices[valid]
+        dates = [d for d, ok in zip(m.dates, valid) if ok]
+    else:
+        bars = client.get_historical_data(target, duration=period, bar_size="1 day")
+        closes = np.array([b["close"] for b in bars], dtype=np.float64)
+        dates = [b["date"] for b in bars]
+    if len(closes) < 5:
         return None
 
-    peak = bars[0]["close"]
-    peak_date = bars[0]["date"]
-    max_dd = 0.0
-    dd_peak_date = peak_date
-    dd_trough_date = bars[0]["date"]
-    dd_peak_val = peak
-    dd_trough_val = peak
-
-    for bar in bars:
-        price = bar["close"]
-        if price > peak:
-            peak = price
-            peak_date = bar["date"]
-        drawdown = (peak - price) / peak * 100
-        if drawdown > max_dd:
-            max_dd = drawdown
-            dd_peak_date = peak_date
-            dd_trough_date = bar["date"]
-            dd_peak_val = peak
-            dd_trough_val = price
+    max_dd, peak_idx, trough_idx = _max_drawdown(closes)
 
     return DrawdownInfo(
         max_drawdown_pct=round(max_dd, 2),
-        peak_date=dd_peak_date,
-        trough_date=dd_trough_date,
-        peak_value=dd_peak_val,
-        trough_value=dd_trough_val,
+        peak_date=dates[peak_idx],
+        trough_date=dates[trough_idx],
+        peak_value=float(closes[peak_idx]),
+        trough_value=float(closes[trough_idx]),
         symbol_or_label=target
     )
 
 
-def get_portfolio_drawdown(client, period: str = "1 Y") -> Optional[DrawdownInfo]:
+def get_portfolio_drawdown(client, period: str = "1 Y", matrix: Optional[ReturnMatrix] = None) -> Optional[DrawdownInfo]:
     """
     计算组合级加权最大回撤
     按持仓市值权重合成历史净值曲线，再计算其最大回撤。
     比单看 SPY 或单只股票更能反映用户实际组合的风险。
+    收益率按日期对齐：尚未上市的持仓在此之前按现金处理（当日收益为 0）。
     """
-    positions = client.get_positions()
-    stock_positions = [p for p in positions if p.sec_type == "STK"]
-    if not stock_positions:
+    m = matrix_for(client, matrix, period)
+    if m is None:
         return None
 
-    total_value = sum(abs(p.market_value) for p in stock_positions)
-    if total_value == 0:
+    included = [sym for sym in m.holdings if m.bar_count(sym) >= 5]
+    if not included or len(m.dates) < 6:
         return None
 
-    # 收集每只股票的日收益率序列，按权重加总构建组合净值
-    weight_returns = {}  # symbol -> (weight, daily_returns_list)
-    min_length = None
+    # 按权重合成组合日收益率（首行无前值，从第二个交易日起算）
+    weights = np.array([m.weights[sym] for sym in included])
+    returns = np.column_stack([m.column_returns(sym) for sym in included])[1:]
+    portfolio_returns = np.nan_to_num(returns, nan=0.0) @ weights
 
-    for p in stock_positions:
-        weight = abs(p.market_value) / total_value
-        try:
-            bars = client.get_historical_data(p.symbol, duration=period, bar_size="1 day")
-            if not bars or len(bars) < 5:
-                continue
-            returns = _calc_daily_returns(bars)
-            dates = [b["date"] for b in bars[1:]]  # 对齐日收益率
-            weight_returns[p.symbol] = (weight, returns, dates)
-            if min_length is None or len(returns) < min_length:
-                min_length = len(returns)
-        except Exception:
-            continue
-
-    if not weight_returns or min_length is None or min_length < 5:
-        return None
-
-    # 对齐到最短序列长度，并按权重合成组合日收益率
-    portfolio_returns = [0.0] * min_length
-    dates = None
-    for symbol, (weight, returns, d) in weight_returns.items():
-        aligned = returns[-min_length:]
-        if dates is None:
-            dates = d[-min_length:]
-        for i in range(min_length):
-            portfolio_returns[i] += weight * aligned[i]
-
-    # 从组合日收益率构建净值曲线（以 100 为基准）
-    nav = [100.0]
-    for r in portfolio_returns:
-        nav.append(nav[-1] * (1 + r))
+    # 从组合日收益率构建净值曲线（以 100 为基准，nav[0] 对应窗口首个交易日）
+    nav = 100.0 * np.concatenate(([1.0], np.cumprod(1 + portfolio_returns)))
 
     # 计算最大回撤
-    peak = nav[0]
-    peak_idx = 0
-    max_dd = 0.0
-    dd_peak_idx = 0
-    dd_trough_idx = 0
-
-    for i, value in enumerate(nav):
-        if value > peak:
-            peak = value
-            peak_idx = i
-        drawdown = (peak - value) / peak * 100
-        if drawdown > max_dd:
-            max_dd = drawdown
-            dd_peak_idx = peak_idx
-            dd_trough_idx = i
-
-    # 映射回日期（nav 有 min_length+1 个点，dates 有 min_length 个点）
-    all_dates = ["(start)"] + (dates if dates else [])
-    peak_date = all_dates[dd_peak_idx] if dd_peak_idx < len(all_dates) else "N/A"
-    trough_date = all_dates[dd_trough_idx] if dd_trough_idx < len(all_dates) else "N/A"
+    max_dd, dd_peak_idx, dd_trough_idx = _max_drawdown(nav)
 
     return DrawdownInfo(
         max_drawdown_pct=round(max_dd, 2),
-        peak_date=peak_date,
-        trough_date=trough_date,
-        peak_value=round(nav[dd_peak_idx], 2),
-        trough_value=round(nav[dd_trough_idx], 2),
-        symbol_or_label=f"组合({len(weight_returns)}只股票加权)"
+        peak_date=m.dates[dd_peak_idx],
+        trough_date=m.dates[dd_trough_idx],
+        peak_value=round(float(nav[dd_peak_idx]), 2),
+        trough_value=round(float(nav[dd_trough_idx]), 2),
+        symbol_or_label=f"组合({len(included)}只股票加权)"
     )
 
 
@@ -630,6 +514,9 @@ def main():
     print("=" * 60)
     print()
 
+    # 收益率矩阵一次批量拉取，供基准对比 / Beta / 回撤 / 相关性共用
+    matrix = load_return_matrix(client, "1 Y", "SPY")
+
     # 1. 资产配置
     print("⏳ 正在分析资产配置...")
     alloc = get_portfolio_allocation(client)
@@ -650,7 +537,7 @@ def main():
 
     # 4. 基准对比
     print("⏳ 正在对比基准 (SPY, 3M)...")
-    comp = get_benchmark_comparison(client, "SPY", "3 M")
+    comp = get_benchmark_comparison(client, "SPY", "3 M", matrix=matrix)
     if comp:
         print(format_benchmark(comp))
     else:
@@ -659,7 +546,7 @@ def main():
 
     # 5. 组合 Beta
     print("⏳ 正在计算组合 Beta...")
-    beta = get_portfolio_beta(client, "SPY", "6 M")
+    beta = get_portfolio_beta(client, "SPY", "6 M", matrix=matrix)
     if beta:
         print(f"📊 组合 Beta: {beta['portfolio_beta']} (vs {beta['benchmark']}, {beta['period']})")
         for h in beta["holdings_beta"]:
@@ -668,14 +555,14 @@ def main():
 
     # 6. 最大回撤
     print("⏳ 正在计算 SPY 最大回撤...")
-    dd = get_max_drawdown(client, "SPY", "1 Y")
+    dd = get_max_drawdown(client, "SPY", "1 Y", matrix=matrix)
     if dd:
         print(format_drawdown(dd))
     print()
 
     # 7. 相关性矩阵
     print("⏳ 正在计算相关性矩阵...")
-    corr = get_correlation_matrix(client, "3 M")
+    corr = get_correlation_matrix(client, "3 M", matrix=matrix)
     if corr:
         print("📊 高相关性持仓对:")
         for pair in corr.get("high_correlation_pairs", []):
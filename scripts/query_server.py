@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+本地查询服务（HTTP / JSON-RPC）
+常驻进程内以 JSON 接口提供 ibkr_cli 的全部命令，多个 Agent 可并发调用：
+  • 网关连接、K 线存储、合约 / Finviz 缓存常驻进程内，请求之间保持热状态；
+    直连网关时持仓与自选股保持流式行情订阅（见 quote_stream.py）
+  • asyncio 处理 HTTP 连接，命令在线程池中执行；网关调用经 MainThreadRelay 转交主线程（同 batch）
+  • 请求合并：相同命令 + 参数正在计算时，后到的请求直接等待同一结果，不重复计算
+  • 有副作用的命令（watchlist add、snapshot save 等）独占执行，等进行中的命令完成后单独运行
+  • 仅监听 127.0.0.1，并拒绝 Host / Origin 不是 127.0.0.1 / localhost 的请求（防 DNS rebinding / 跨站请求）
+  • 有副作用的命令只接受 POST + Authorization: Bearer <token>；令牌取 IBKR_SERVER_TOKEN，
+    未设置时启动时生成并写入 ~/trading/cache/serve.token（权限 0600）。
+    设置了 IBKR_SERVER_TOKEN 时所有请求都须携带令牌
+
+接口:
+    GET  /health                          服务状态与计数
+    GET  /commands                        可用命令列表
+    GET  /analyze/NVDA                    路径段即参数，查询串 ?period=1%20M 转为 --period "1 M"
+    POST /watchlist/add/NVDA              有副作用的命令须 POST 并携带令牌
+    POST /rpc                             JSON-RPC 2.0：{"jsonrpc": "2.0", "id": 1, "method": "analyze", "params": ["NVDA"]}
+                                          支持批量数组；params 也可为 {"args": [...]}
+返回与 ibkr_cli --json 相同的信封 {status, command, timestamp, data, error}。
+
+用法:
+    python ibkr_cli.py serve [--port 8765] [--workers 8]
+    curl -s localhost:8765/quote/AAPL
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import secrets
+import asyncio
+import threading
+import concurrent.futures
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, unquote, parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_runner import (
+    BatchItem, MainThreadRelay, ThreadOutputRouter, FORBIDDEN_COMMANDS, make_envelope, run_captured,
+)
+from contract_cache import CACHE_DIR
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+SERVER_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("IBKR_SERVER_PORT", "8765"))
+DEFAULT_WORKERS = 8
+SERVER_TOKEN = os.getenv("IBKR_SERVER_TOKEN", "")
+# 未设置 IBKR_SERVER_TOKEN 时，启动生成的副作用命令令牌写入此文件（仅本用户可读）
+TOKEN_FILE = os.path.join(CACHE_DIR, "serve.token")
+# 允许的 Host / Origin 主机名（不含端口）
+ALLOWED_HOSTS = frozenset({"127.0.0.1", "localhost"})
+
+# 单个请求最长等待秒数（超时后计算仍在后台完成，结果可被后续相同请求合并）
+REQUEST_TIMEOUT_SEC = float(os.getenv("IBKR_SERVER_TIMEOUT", "300"))
+# 网关连接失败后，间隔多久允许下一次请求重新连接
+RECONNECT_RETRY_SEC = 30.0
+
+_MAX_BODY = 1 << 20
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+            504: "Gateway Timeout"}
+
+# JSON-RPC 2.0 错误码
+_RPC_PARSE_ERROR = -32700
+_RPC_INVALID_REQUEST = -32600
+_RPC_METHOD_NOT_FOUND = -32601
+_RPC_COMMAND_FAILED = -32000
+_RPC_UNAUTHORIZED = -32001
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class ServerStats:
+    host: str
+    port: int
+    workers: int
+    uptime_sec: float
+    requests: int
+    computations: int
+    coalesced: int
+    failed: int
+    inflight: int
+    gateway_connected: bool
+
+
+# ─── 独占闸门 ─────────────────────────────────────────────────
+
+class ExclusiveGate:
+    """读写闸门：普通命令共享执行，有副作用的命令等待全部进行中的命令结束后独占执行"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            # 有独占命令排队时新命令让行，避免独占命令饿死
+            while self._exclusive or self._waiting_exclusive:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting_exclusive += 1
+            while self._exclusive or self._active:
+                self._cond.wait()
+            self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+# ─── 请求解析 ─────────────────────────────────────────────────
+
+def args_from_path(target: str) -> Tuple[str, List[str]]:
+    """/chain/AAPL?expiry=20260620&json → ("chain", ["AAPL", "--expiry", "20260620"])"""
+    parts = urlsplit(target)
+    segments = [unquote(s) for s in parts.path.split("/") if s]
+    if not segments:
+        return "", []
+    args = segments[1:]
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        args.append(f"--{key}")
+        if value:
+            args.append(value)
+    return segments[0], args
+
+
+def coalesce_key(command: str, args: List[str]) -> Tuple[str, Tuple[str, ...]]:
+    """合并键：服务端总以 JSON 模式执行，--json 不影响结果"""
+    return command, tuple(a for a in args if a != "--json")
+
+
+def _is_local_host(value: str) -> bool:
+    """Host 头 / Origin 是否指向本机（去掉协议与端口后比较主机名）"""
+    if "://" in value:
+        value = urlsplit(value).netloc
+    host = value.rsplit("@", 1)[-1]
+    host = host[1:host.index("]")] if host.startswith("[") else host.rsplit(":", 1)[0]
+    return host.lower() in ALLOWED_HOSTS
+
+
+def load_or_create_token(path: str = TOKEN_FILE) -> str:
+    """副作用命令的令牌：优先 IBKR_SERVER_TOKEN，否则生成新令牌并以 0600 权限写入 path"""
+    if SERVER_TOKEN:
+        return SERVER_TOKEN
+    token = secrets.token_urlsafe(24)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    os.replace(tmp, path)
+    return token
+
+
+def read_token(path: str = TOKEN_FILE) -> str:
+    """客户端读取令牌（IBKR_SERVER_TOKEN 或服务启动时写入的令牌文件），不存在时返回空串"""
+    if SERVER_TOKEN:
+        return SERVER_TOKEN
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+# ─── 服务端 ───────────────────────────────────────────────────
+
+class QueryServer:
+    """
+    execute(item, emit) 与 batch 相同：在工作线程中执行单条命令，JSON 信封经 emit 交回。
+    serve_forever() 必须在主线程调用：主线程负责执行网关调用，HTTP 服务运行在后台线程的事件循环中。
+    token 非空时所有请求都须携带；admin_token（默认同 token）用于有副作用的命令，为空时这类命令一律拒绝。
+    """
+
+    def __init__(self, execute: Callable[[BatchItem, Callable[[dict], None]], None],
+                 commands: Dict[str, tuple], router: ThreadOutputRouter, relay: MainThreadRelay,
+                 port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS,
+                 token: str = SERVER_TOKEN, admin_token: Optional[str] = None,
+                 gateway_status: Callable[[], bool] = lambda: False):
+        self.execute = execute
+        self.commands = commands
+        self.router = router
+        self.relay = relay
+        self.port = port
+        self.workers = max(1, workers)
+        self.token = token
+        self.admin_token = admin_token if admin_token is not None else token
+        self.gateway_status = gateway_status
+        self.gate = ExclusiveGate()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                           thread_name_prefix="serve")
+        self._inflight: Dict[Tuple[str, Tuple[str, ...]], asyncio.Future] = {}
+        self._started = time.time()
+        self._seq = 0
+        self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+        self.requests = 0
+        self.computations = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    # ─── 命令执行 ───
+
+    def _compute(self, item: BatchItem) -> List[dict]:
+        """工作线程：按是否有副作用进入闸门，执行命令并收集全部信封"""
+        envelopes = []
+        gate = self.gate.exclusive() if item.exclusive else self.gate.shared()
+        with gate:
+            run_captured(item, self.execute, self.router, envelopes.append)
+        return envelopes
+
+    @staticmethod
+    def _combine(command: str, envelopes: List[dict]) -> dict:
+        """多数命令只输出一个信封；输出多个时合并为一个"""
+        envelopes = [{k: v for k, v in e.items() if k != "id"} for e in envelopes]
+        if len(envelopes) == 1:
+            return envelopes[0]
+        ok = all(e["status"] == "success" for e in envelopes)
+        return make_envelope(command, {"envelopes": envelopes}, "success" if ok else "error")
+
+    async def run_command(self, command: str, args: List[str]) -> dict:
+        """执行（或合并到进行中的相同请求）并返回信封"""
+        self.requests += 1
+        if command not in self.commands:
+            self.failed += 1
+            return make_envelope(command, {"message": f"未知命令: {command}"}, "error")
+        if command in FORBIDDEN_COMMANDS:
+            self.failed += 1
+            return make_envelope(command, {"message": f"查询服务中不支持 {command} 命令"}, "error")
+
+        key = coalesce_key(command, args)
+        item = BatchItem(id="", command=command, args=list(args))
+        future = self._inflight.get(key)
+        if future is not None and not item.exclusive:
+            self.coalesced += 1
+        else:
+            self._seq += 1
+            item.id = str(self._seq)
+            self.computations += 1
+            future = asyncio.ensure_future(
+                asyncio.get_running_loop().run_in_executor(self._pool, self._compute, item))
+            if not item.exclusive:
+                self._inflight[key] = future
+                future.add_done_callback(lambda _f, k=key: self._inflight.pop(k, None))
+
+        try:
+            envelopes = await asyncio.wait_for(asyncio.shield(future), REQUEST_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            self.failed += 1
+            return make_envelope(command, {"message": f"执行超过 {REQUEST_TIMEOUT_SEC:.0f} 秒",
+                                           "type": "Timeout"}, "error")
+        envelope = self._combine(command, envelopes)
+        if envelope["status"] != "success":
+            self.failed += 1
+        return envelope
+
+    def stats(self) -> ServerStats:
+        return ServerStats(
+            host=SERVER_HOST,
+            port=self.port,
+            workers=self.workers,
+            uptime_sec=round(time.time() - self._started, 1),
+            requests=self.requests,
+            computations=self.computations,
+            coalesced=self.coalesced,
+            failed=self.failed,
+            inflight=len(self._inflight),
+            gateway_connected=self.gateway_status(),
+        )
+
+    # ─── JSON-RPC ───
+
+    def _authorized(self, headers: Dict[str, str]) -> bool:
+        return bool(self.admin_token) and secrets.compare_digest(
+            headers.get("authorization", ""), f"Bearer {self.admin_token}")
+
+    async def _rpc_one(self, request, authorized: bool) -> Optional[dict]:
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" \
+                or not isinstance(request.get("method"), str):
+            return {"jsonrpc": "2.0", "id": None,
+                    "error": {"code": _RPC_INVALID_REQUEST, "message": "Invalid Request"}}
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params", [])
+        if isinstance(params, dict):
+            params = params.get("args", [])
+        if not isinstance(params, list):
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": {"code": _RPC_INVALID_REQUEST, "message": "params 须为数组或 {\"args\": [...]}"}}
+
+        if method == "health":
+            envelope = make_envelope("health", asdict(self.stats()))
+        elif method not in self.commands or method in FORBIDDEN_COMMANDS:
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": {"code": _RPC_METHOD_NOT_FOUND, "message": f"未知命令: {method}"}}
+        elif BatchItem("", method, [str(p) for p in params]).exclusive and not authorized:
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": {"code": _RPC_UNAUTHORIZED, "message": f"{method} 有副作用，须携带访问令牌"}}
+        else:
+            envelope = await self.run_command(method, [str(p) for p in params])
+
+        if "id" not in request:
+            return None  # 通知：不返回结果
+        if envelope["status"] == "success":
+            return {"jsonrpc": "2.0", "id": request_id, "result": envelope}
+        error = envelope.get("error") or {}
+        return {"jsonrpc": "2.0", "id": request_id,
+                "error": {"code": _RPC_COMMAND_FAILED, "message": str(error.get("message", "命令执行失败")),
+                          "data": envelope}}
+
+    async def _rpc(self, body: bytes, authorized: bool) -> Tuple[int, object]:
+        try:
+            payload = json.loads(body.decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            return 200, {"jsonrpc": "2.0", "id": None,
+                         "error": {"code": _RPC_PARSE_ERROR, "message": "Parse error"}}
+        if isinstance(payload, list):
+            if not payload:
+                return 200, {"jsonrpc": "2.0", "id": None,
+                             "error": {"code": _RPC_INVALID_REQUEST, "message": "Invalid Request"}}
+            responses = await asyncio.gather(*(self._rpc_one(r, authorized) for r in payload))
+            return 200, [r for r in responses if r is not None]
+        response = await self._rpc_one(payload, authorized)
+        return 200, response if response is not None else ""
+
+    # ─── HTTP ───
+
+    async def _route(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, object]:
+        # DNS rebinding：恶意域名解析到 127.0.0.1 后 Host 为该域名；跨站页面发起的请求带 Origin
+        if not _is_local_host(headers.get("host", "")) or \
+                ("origin" in headers and not _is_local_host(headers["origin"])):
+            return 403, make_envelope("http", {"message": "仅接受 Host / Origin 为 127.0.0.1 或 localhost 的请求"},
+                                      "error")
+        if self.token and not secrets.compare_digest(headers.get("authorization", ""), f"Bearer {self.token}"):
+            return 401, make_envelope("auth", {"message": "缺少或错误的访问令牌"}, "error")
+        authorized = self._authorized(headers)
+
+        path = urlsplit(target).path.rstrip("/")
+        if path == "/rpc":
+            if method != "POST":
+                return 405, make_envelope("rpc", {"message": "JSON-RPC 仅支持 POST"}, "error")
+            return await self._rpc(body, authorized)
+        if method not in ("GET", "POST"):
+            return 405, make_envelope("http", {"message": f"不支持的方法: {method}"}, "error")
+        if path in ("", "/health"):
+            return 200, make_envelope("health", asdict(self.stats()))
+        if path == "/commands":
+            return 200, make_envelope("commands", [
+                {"name": name, "description": spec[0]}
+                for name, spec in self.commands.items() if name not in FORBIDDEN_COMMANDS
+            ])
+
+        command, args = args_from_path(target)
+        if command not in self.commands or command in FORBIDDEN_COMMANDS:
+            return 404, make_envelope(command, {"message": f"未知命令: {command}"}, "error")
+        if BatchItem("", command, args).exclusive:
+            if method != "POST":
+                return 405, make_envelope(command, {"message": f"{command} 有副作用，须使用 POST"}, "error")
+            if not authorized:
+                return 401, make_envelope(command, {"message": f"{command} 有副作用，须携带访问令牌"}, "error")
+        envelope = await self.run_command(command, args)
+        if envelope["status"] == "success":
+            return 200, envelope
+        error = envelope.get("error") or {}
+        return (504 if error.get("type") == "Timeout" else 500), envelope
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status, payload = 400, make_envelope("http", {"message": "无法解析请求"}, "error")
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            method, target, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length > _MAX_BODY:
+                status, payload = 413, make_envelope("http", {"message": "请求体过大"}, "error")
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._route(method.upper(), target, headers, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            status, payload = 500, make_envelope("http", {"message": str(e), "type": type(e).__name__}, "error")
+
+        data = b"" if payload == "" else json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n").encode("latin-1")
+        try:
+            writer.write(head + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, SERVER_HOST, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            while not self._stop.is_set():
+                await asyncio.sleep(0.2)
+
+    def _serve_thread(self):
+        try:
+            asyncio.run(self._serve())
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._ready.set()
+            self._stop.set()
+
+    # ─── 生命周期 ───
+
+    def start(self) -> int:
+        """启动后台 HTTP 线程，返回实际监听端口（port=0 时由系统分配）"""
+        threading.Thread(target=self._serve_thread, name="serve-http", daemon=True).start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self.port
+
+    def shutdown(self):
+        self._stop.set()
+
+    def serve_forever(self, on_idle: Optional[Callable[[], None]] = None):
+        """在主线程调用：执行转交的网关调用，空闲时调用 on_idle，直到收到 SIGTERM / Ctrl-C"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        try:
+            self.relay.serve_until(self._stop, on_idle=on_idle)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._error is not None:
+            raise self._error
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_server_stats(stats: ServerStats) -> str:
+    lines = [
+        f"🛰️ 查询服务 http://{stats.host}:{stats.port}",
+        f"  运行时长: {stats.uptime_sec:.0f}s    工作线程: {stats.workers}    "
+        f"网关: {'✅ 已连接' if stats.gateway_connected else '⚪ 未连接'}",
+        f"  请求: {stats.requests}    实际计算: {stats.computations}    "
+        f"合并: {stats.coalesced}    失败: {stats.failed}    进行中: {stats.inflight}",
+    ]
+    return "\n".join(lines)
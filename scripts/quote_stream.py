@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+流式行情订阅表
+常驻进程（broker / serve）为持仓 + 自选股的并集保持 reqMktData 流式订阅（实时或延迟，取决于 reqMarketDataType），
+网关推送直接写入内存中的列式行情表，报价查询只读内存，不再每次等待 reqTickers 快照：
+  • 行情表为 struct-of-arrays：last / bid / ask / volume / close / updated 各占一列 array('d')，按槽位索引
+  • 订阅数受行情线上限约束（默认 100 条，预留 30 条给期权快照 / Greeks 等临时请求，临时请求按预留额度分批，见 pacing.py）
+  • 持仓与自选股常驻；其余按需订阅的代码按最近使用排序，满额时淘汰空闲最久的订阅（LRU）
+  • 断线后清空行情表（查询回退快照），重连后下一次同步重新订阅
+  • 每次写表后通知 listeners（告警引擎逐笔评估，见 alert_engine.py）
+设置 IBKR_NO_QUOTE_STREAM=1 可关闭流式订阅。
+
+用法:
+    python quote_stream.py bench      # 行情表查询耗时基准（离线）
+    python ibkr_cli.py broker status  # 查看 broker 中的订阅状态
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import math
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ibkr_readonly import Quote, _symbol_contract
+from pacing import MAX_MARKET_DATA_LINES, get_scheduler
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+QUOTE_STREAM_DISABLED = os.getenv("IBKR_NO_QUOTE_STREAM", "") == "1"
+
+# 预留给临时请求的行情线路（账户上限见 pacing.MAX_MARKET_DATA_LINES），默认可容纳一整批期权快照
+RESERVED_LINES = int(os.getenv("IBKR_RESERVED_MKT_LINES", "30"))
+
+# 最近这段时间内被查询过的订阅不会被淘汰
+IDLE_EVICT_SEC = 60.0
+# 持仓 + 自选股并集的重新同步间隔
+CORE_SYNC_SEC = 300.0
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class StreamStats:
+    capacity: int
+    subscriptions: int
+    core: int
+    hits: int
+    misses: int
+    updates: int
+    evictions: int
+    rejected: int
+    last_sync_age_sec: Optional[float]
+
+
+# ─── 行情表 ───────────────────────────────────────────────────
+
+def _num(value) -> float:
+    """ib_async 未到达的字段为 nan / None，统一记为 0"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 0.0
+    return float(value)
+
+
+class QuoteTable:
+    """定长列式行情表：每个字段一列，代码通过 slot_of 映射到槽位"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        zeros = [0.0] * capacity
+        self.last = array("d", zeros)
+        self.bid = array("d", zeros)
+        self.ask = array("d", zeros)
+        self.volume = array("d", zeros)
+        self.close = array("d", zeros)
+        self.updated = array("d", zeros)
+        self.conid = array("q", [0] * capacity)
+        self.slot_of: Dict[str, int] = {}
+        self.symbol_at: List[Optional[str]] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    @property
+    def full(self) -> bool:
+        return not self._free
+
+    def allocate(self, symbol: str, conid: int) -> Optional[int]:
+        if symbol in self.slot_of:
+            return self.slot_of[symbol]
+        if not self._free:
+            return None
+        slot = self._free.pop()
+        self.slot_of[symbol] = slot
+        self.symbol_at[slot] = symbol
+        self.conid[slot] = conid
+        self.update(slot, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        return slot
+
+    def release(self, symbol: str):
+        slot = self.slot_of.pop(symbol, None)
+        if slot is not None:
+            self.symbol_at[slot] = None
+            self.conid[slot] = 0
+            self.updated[slot] = 0.0
+            self._free.append(slot)
+
+    def update(self, slot: int, last: float, bid: float, ask: float,
+               volume: float, close: float, ts: float):
+        self.last[slot] = last
+        self.bid[slot] = bid
+        self.ask[slot] = ask
+        self.volume[slot] = volume
+        self.close[slot] = close
+        self.updated[slot] = ts
+
+    def quote(self, symbol: str) -> Optional[Quote]:
+        """
+        与 get_quote 快照相同口径的 Quote。
+        尚未收到首笔推送，或推送只带了买卖价而没有 last / close 时返回 None，由调用方回退到快照。
+        """
+        slot = self.slot_of.get(symbol)
+        if slot is None or not self.updated[slot]:
+            return None
+        if not self.last[slot] and not self.close[slot]:
+            return None
+        close = self.close[slot]
+        last = self.last[slot] or close
+        change = (last - close) if last and close else 0
+        change_pct = (change / close * 100) if close else 0
+        return Quote(
+            conid=self.conid[slot],
+            symbol=symbol,
+            last_price=last,
+            bid=self.bid[slot],
+            ask=self.ask[slot],
+            volume=int(self.volume[slot]),
+            change=round(change, 2),
+            change_pct=round(change_pct, 2),
+        )
+
+
+# ─── 订阅管理 ─────────────────────────────────────────────────
+
+class QuoteStream:
+    """
+    绑定在已连接的 IBKRReadOnlyClient 上；所有方法都须在 ib_async 事件循环所在的线程调用
+    （broker 的服务循环 / serve 的主线程），推送回调与查询因此无需加锁。
+    """
+
+    def __init__(self, client, max_lines: int = MAX_MARKET_DATA_LINES, reserved: int = RESERVED_LINES):
+        self.client = client
+        self.ib = client.ib
+        self.table = QuoteTable(max(1, max_lines - reserved))
+        # 登记常驻占用，期权快照等临时请求只在剩余额度内分批
+        self.scheduler = get_scheduler(self.ib)
+        self.scheduler.streaming_lines = self.table.capacity
+        self._tickers: Dict[str, object] = {}
+        self._slot_by_conid: Dict[int, int] = {}
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        self._core: Set[str] = set()
+        self._last_sync = 0.0
+        # 额外常驻的代码（如告警规则涉及的标的），同步时与持仓 + 自选股合并
+        self.pinned: Set[str] = set()
+        # 每次写表后调用 listener(symbol, table, slot)，供告警引擎等逐笔评估
+        self.listeners: List[Callable[[str, QuoteTable, int], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.evictions = 0
+        self.rejected = 0
+        self.ib.pendingTickersEvent += self._on_tickers
+        self.ib.disconnectedEvent += self._on_disconnect
+
+    # ─── 推送 ───
+
+    def _on_tickers(self, tickers):
+        now = time.time()
+        for t in tickers:
+            slot = self._slot_by_conid.get(t.contract.conId)
+            if slot is None:
+                continue  # 期权 Greeks 等其他请求的推送
+            self.table.update(slot, _num(t.last), _num(t.bid), _num(t.ask),
+                              _num(t.volume), _num(t.close), now)
+            self.updates += 1
+            for listener in self.listeners:
+                listener(self.table.symbol_at[slot], self.table, slot)
+
+    def _on_disconnect(self):
+        """网关断开后订阅全部失效：清空行情表，查询回退快照，重连后由 maybe_sync 重新订阅"""
+        for symbol in list(self.table.slot_of):
+            self.table.release(symbol)
+        self._tickers.clear()
+        self._slot_by_conid.clear()
+        self._lru.clear()
+        self._last_sync = 0.0
+
+    # ─── 查询 ───
+
+    def lookup(self, symbol: str) -> Optional[Quote]:
+        symbol = symbol.upper()
+        quote = self.table.quote(symbol)
+        if quote is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._lru[symbol] = time.time()
+        self._lru.move_to_end(symbol)
+        return quote
+
+    def get_quotes(self, symbols: Iterable[str]) -> Tuple[Dict[str, Quote], List[str]]:
+        """返回 (命中的行情, 未订阅或尚无推送的代码)"""
+        found, missing = {}, []
+        for symbol in symbols:
+            quote = self.lookup(symbol)
+            if quote is None:
+                missing.append(symbol.upper())
+            else:
+                found[symbol.upper()] = quote
+        return found, missing
+
+    # ─── 订阅 ───
+
+    def _evict_one(self) -> bool:
+        """淘汰空闲最久的非常驻订阅；没有可淘汰的返回 False"""
+        now = time.time()
+        for symbol, last_used in self._lru.items():
+            if now - last_used < IDLE_EVICT_SEC:
+                return False  # 之后的都更新
+            if symbol in self._core:
+                continue
+            self._unsubscribe(symbol)
+            self.evictions += 1
+            return True
+        return False
+
+    def _unsubscribe(self, symbol: str):
+        ticker = self._tickers.pop(symbol, None)
+        if ticker is not None:
+            try:
+                self.ib.cancelMktData(ticker.contract)
+            except Exception:
+                pass
+            self._slot_by_conid.pop(ticker.contract.conId, None)
+        self._lru.pop(symbol, None)
+        self.table.release(symbol)
+
+    def subscribe(self, symbols: Iterable[str]) -> int:
+        """为尚未订阅的代码建立流式订阅（合约走本地缓存解析），返回新增订阅数"""
+        need = [s.upper() for s in dict.fromkeys(symbols) if s.upper() not in self.table.slot_of]
+        if not need:
+            return 0
+        try:
+            qualified = self.client.qualify_contracts(*[_symbol_contract(s) for s in need])
+        except Exception as e:
+            print(f"⚠️ 流式订阅合约解析失败: {e}")
+            return 0
+
+        added = 0
+        now = time.time()
+        for symbol, contract in zip(need, qualified):
+            if not contract or not contract.conId:
+                continue
+            if self.table.full and not self._evict_one():
+                self.rejected += 1
+                continue
+            slot = self.table.allocate(symbol, contract.conId)
+            self._slot_by_conid[contract.conId] = slot
+            self._tickers[symbol] = self.ib.reqMktData(contract, "", False, False)
+            self._lru[symbol] = now
+            added += 1
+        return added
+
+    def sync_core(self) -> int:
+        """重新读取持仓 + 自选股（+ pinned）并订阅；超出容量时持仓优先，其次自选股"""
+        from scanner_enhanced import load_watchlist
+
+        try:
+            held = [p.symbol for p in self.client.get_positions() if p.sec_type == "STK"]
+        except Exception:
+            held = []
+        watched = [item["symbol"].upper() for item in load_watchlist().get("items", [])]
+        pinned = sorted(self.pinned)
+        core = list(dict.fromkeys(s.upper() for s in held + watched + pinned))[:self.table.capacity]
+
+        self._core = set(core)
+        self._last_sync = time.time()
+        return self.subscribe(core)
+
+    def maybe_sync(self):
+        """空闲时调用：到达同步间隔且连接正常时重新同步常驻订阅"""
+        if time.time() - self._last_sync >= CORE_SYNC_SEC and self.ib.isConnected():
+            self.sync_core()
+
+    def close(self):
+        self.listeners.clear()
+        for symbol in list(self._tickers):
+            self._unsubscribe(symbol)
+        self.ib.pendingTickersEvent -= self._on_tickers
+        self.ib.disconnectedEvent -= self._on_disconnect
+        self.scheduler.streaming_lines = 0
+
+    def stats(self) -> StreamStats:
+        return StreamStats(
+            capacity=self.table.capacity,
+            subscriptions=len(self.table),
+            core=len(self._core),
+            hits=self.hits,
+            misses=self.misses,
+            updates=self.updates,
+            evictions=self.evictions,
+            rejected=self.rejected,
+            last_sync_age_sec=round(time.time() - self._last_sync, 1) if self._last_sync else None,
+        )
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_stream_stats(stats: dict) -> str:
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = f"{stats['hits'] / lookups * 100:.0f}%" if lookups else "-"
+    sync = f"{stats['last_sync_age_sec']:.0f}s 前" if stats.get("last_sync_age_sec") is not None else "未同步"
+    return (f"订阅 {stats['subscriptions']}/{stats['capacity']}（常驻 {stats['core']}）  "
+            f"命中率 {hit_rate}  推送 {stats['updates']}  淘汰 {stats['evictions']}  "
+            f"超额拒绝 {stats['rejected']}  同步 {sync}")
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _bench(n: int = 80, lookups: int = 200000):
+    import random
+
+    table = QuoteTable(n)
+    symbols = [f"S{i:03d}" for i in range(n)]
+    for i, symbol in enumerate(symbols):
+        slot = table.allocate(symbol, 1000 + i)
+        price = random.uniform(10, 500)
+        table.update(slot, price, price - 0.01, price + 0.01, random.randint(1, 10 ** 7), price * 0.99, time.time())
+    queries = [random.choice(symbols) for _ in range(lookups)]
+
+    t0 = time.perf_counter()
+    for symbol in queries:
+        table.quote(symbol)
+    elapsed = time.perf_counter() - t0
+
+    print(f"🧪 {n} 个订阅，{lookups} 次查询")
+    print(f"   内存行情表: {elapsed / lookups * 1e6:8.2f} µs/次（reqTickers 快照通常需数百毫秒）")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if action == "bench":
+        _bench()
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
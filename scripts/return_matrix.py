@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+组合收益率矩阵
+一次批量拉取全部股票持仓与基准的日线，按交易日历对齐为 NumPy 价格 / 收益率矩阵，
+供组合 Beta、相关性、基准对比、组合回撤等分析共用，避免各函数重复拉取和按长度截断对齐。
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# 所有组合分析里最长的回溯窗口（组合回撤 1 Y）
+DEFAULT_MATRIX_PERIOD = "1 Y"
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class ReturnMatrix:
+    """
+    按日期对齐的价格 / 收益率矩阵。
+    prices[t, i] 为第 i 个标的在 dates[t] 的收盘价：上市前为 NaN，停牌缺口沿用前值；
+    returns[t, i] 为 dates[t] 相对前一交易日的收益率（首行 NaN）。
+    """
+    dates: List[str]
+    symbols: List[str]
+    prices: np.ndarray
+    weights: Dict[str, float] = field(default_factory=dict)   # 股票持仓市值权重（基准不在其中）
+    benchmark: str = ""
+    period: str = DEFAULT_MATRIX_PERIOD
+
+    def __post_init__(self):
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = self.prices[1:] / self.prices[:-1] - 1
+        self.returns = np.vstack([np.full((1, len(self.symbols)), np.nan), ratio]) if len(self.dates) else \
+            np.empty((0, len(self.symbols)))
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._index
+
+    @property
+    def holdings(self) -> List[str]:
+        """矩阵中有数据的股票持仓（不含基准，除非基准本身也是持仓）"""
+        return [s for s in self.weights if s in self._index]
+
+    def window(self, period: str) -> "ReturnMatrix":
+        """截取最近 period 的子矩阵（D / W 按交易日数，与网关一致；M / Y 按日期）"""
+        from bar_store import duration_start, session_count
+
+        sessions = session_count(period, "1 day")
+        if sessions is not None:
+            first = max(0, len(self.dates) - sessions)  # "N D" 与网关一致按交易日计
+        else:
+            start = datetime.fromtimestamp(duration_start(period, "1 day")).strftime("%Y-%m-%d")
+            first = next((t for t, d in enumerate(self.dates) if d[:10] >= start), len(self.dates))
+        return ReturnMatrix(self.dates[first:], self.symbols, self.prices[first:],
+                            weights=self.weights, benchmark=self.benchmark, period=period)
+
+    def column_prices(self, symbol: str) -> np.ndarray:
+        return self.prices[:, self._index[symbol]]
+
+    def column_returns(self, symbol: str) -> np.ndarray:
+        return self.returns[:, self._index[symbol]]
+
+    def bar_count(self, symbol: str) -> int:
+        """窗口内该标的的有效 K 线根数"""
+        return int(np.count_nonzero(~np.isnan(self.column_prices(symbol))))
+
+    def pairwise_correlation(self, symbols: List[str]) -> np.ndarray:
+        """成对完整观测下的 Pearson 相关系数矩阵（两列都有收益率的日期参与计算）"""
+        from covariance import pairwise_correlation
+        return pairwise_correlation(self.returns[:, [self._index[s] for s in symbols]])
+
+    def returns_for(self, symbols: List[str]) -> np.ndarray:
+        """指定列的 (T-1, N) 收益率（去掉无前值的首行）"""
+        return self.returns[1:, [self._index[s] for s in symbols]]
+
+
+# ─── 构建 ─────────────────────────────────────────────────────
+
+def build_return_matrix(bars_by_symbol: Dict[str, List[dict]], weights: Optional[Dict[str, float]] = None,
+                        benchmark: str = "", period: str = DEFAULT_MATRIX_PERIOD) -> ReturnMatrix:
+    """
+    把多只标的的日线合并到统一日历（所有序列日期的并集）。
+    各列在首根 K 线之前为 NaN，之后的缺口用前一收盘价填充（缺口当日收益为 0，复牌日承担累计涨跌）。
+    """
+    series = {s: bars for s, bars in bars_by_symbol.items() if bars}
+    symbols = list(series)
+    dates = sorted({b["date"] for bars in series.values() for b in bars})
+    row = {d: t for t, d in enumerate(dates)}
+
+    prices = np.full((len(dates), len(symbols)), np.nan)
+    for i, s in enumerate(symbols):
+        for b in series[s]:
+            close = b["close"]
+            if close and close > 0:
+                prices[row[b["date"]], i] = close
+
+    # 前值填充（只填首个有效值之后的缺口）
+    for i in range(len(symbols)):
+        col = prices[:, i]
+        valid = ~np.isnan(col)
+        if not valid.any():
+            continue
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(col)), -1))
+        filled = last_valid >= 0
+        col[filled] = col[last_valid[filled]]
+
+    return ReturnMatrix(dates, symbols, prices, weights=dict(weights or {}), benchmark=benchmark, period=period)
+
+
+def load_return_matrix(client, period: str = DEFAULT_MATRIX_PERIOD, benchmark: str = "SPY",
+                       positions=None, extra_symbols: Optional[List[str]] = None) -> Optional[ReturnMatrix]:
+    """
+    对当前股票持仓 + 基准做一次批量历史数据拉取并构建收益率矩阵。
+    extra_symbols: 需要一并拉取的非持仓标的（如期权标的），不计入权重。
+    无股票持仓（且无 extra_symbols）或持仓总市值为零时返回 None。
+    """
+    if positions is None:
+        positions = client.get_positions()
+    stock_positions = [p for p in positions if p.sec_type == "STK"]
+    total_value = sum(abs(p.market_value) for p in stock_positions)
+    if not extra_symbols and (not stock_positions or total_value == 0):
+        return None
+
+    weights: Dict[str, float] = {}
+    for p in stock_positions:
+        if total_value > 0:
+            weights[p.symbol] = weights.get(p.symbol, 0.0) + abs(p.market_value) / total_value
+
+    symbols = list(weights)
+    for sym in [benchmark] + list(extra_symbols or []):
+        if sym and sym not in symbols:
+            symbols.append(sym)
+
+    batch_fetch = getattr(client, "get_historical_data_batch", None)
+    if batch_fetch:
+        all_bars = batch_fetch(symbols, duration=period, bar_size="1 day")
+    else:
+        all_bars = {sym: client.get_historical_data(sym, duration=period, bar_size="1 day") for sym in symbols}
+
+    return build_return_matrix(all_bars, weights=weights, benchmark=benchmark, period=period)
+
+
+def longest_period(*periods: str) -> str:
+    """多个 durationStr 中回溯最长的一个"""
+    from bar_store import duration_start
+    return min(periods, key=lambda p: duration_start(p, "1 day"))
+
+
+def matrix_for(client, matrix: Optional[ReturnMatrix], period: str, benchmark: str = "") -> Optional[ReturnMatrix]:
+    """
+    复用调用方传入的矩阵并截取 period 窗口；
+    未传入、缺少所需基准或回溯不足时才重新拉取
+    """
+    if (matrix is None or (benchmark and benchmark not in matrix)
+            or longest_period(matrix.period, period) != matrix.period):
+        matrix = load_return_matrix(client, period, benchmark or "SPY")
+    return matrix.window(period) if matrix is not None else None
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 风险预算计算器
-基于当前组合状态（Beta、集中度、现金比例、波动率），评估剩余可承受风险额度。
+基于当前组合状态（Beta、集中度、现金比例、波动率），评估剩余可承受风险额度，
+并附带历史模拟 / 蒙特卡洛 VaR、CVaR（见 var_engine.py）。
 所有函数接收 IBKRReadOnlyClient 实例，纯只读操作。
 """
 
@@ -11,6 +12,8 @@ import dataclasses
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict
 
+from var_engine import VaRReport, calc_var, format_var
+
 
 # ─── 数据类 ───────────────────────────────────────────────────
 
@@ -42,17 +45,19 @@ class RiskBudgetReport:
     risk_score: int                 # 0-100，越高越危险
     observations: List[str] = field(default_factory=list)
     recommendations: List[str] = field(default_factory=list)
+    var: Optional[VaRReport] = None   # 组合 VaR / CVaR（历史数据不足时为 None）
 
 
 # ─── 核心函数 ─────────────────────────────────────────────────
 
-def calc_risk_budget(client, max_risk_tolerance: float = 20.0) -> Optional[RiskBudgetReport]:
+def calc_risk_budget(client, max_risk_tolerance: float = 20.0, include_var: bool = True,
+                     var_paths: int = 100_000) -> Optional[RiskBudgetReport]:
     """
     计算风险预算
     max_risk_tolerance: 用户可接受的最大总亏损百分比 (默认 20%)
+    include_var: 是否计算 1 日 VaR / CVaR（需拉取持仓一年日线）
+    var_paths: 蒙特卡洛路径数
     """
-    from portfolio_analytics import _calc_daily_returns
-
     positions = client.get_positions()
     if not positions:
         return None
@@ -192,10 +197,29 @@ def calc_risk_budget(client, max_risk_tolerance: float = 20.0) -> Optional[RiskB
     else:
         risk_level = "🔴🔴 超限"
 
+    # ── VaR / CVaR ──
+    var_report = None
+    if include_var:
+        try:
+            var_report = calc_var(client, positions=positions, nav=total_nav, paths=var_paths)
+        except Exception as e:
+            print(f"⚠️ VaR 计算失败: {e}")
+
     # ── 建议 ──
     observations = []
     recommendations = []
 
+    if var_report and var_report.levels:
+        worst = var_report.levels[-1]
+        observations.append(
+            f"{worst.confidence * 100:.0f}% 单日 VaR ${worst.hist_var:,.0f}（净值 {worst.hist_var_pct:.1f}%），"
+            f"尾部平均亏损 CVaR ${worst.hist_cvar:,.0f}"
+        )
+        if worst.hist_var_pct > max_risk_tolerance / 4:
+            recommendations.append(
+                f"单日 {worst.confidence * 100:.0f}% VaR 已超过风险容忍度的 1/4，考虑降低整体敞口或对冲"
+            )
+
     if cash_pct < 5:
         observations.append(f"现金比例仅 {cash_pct:.1f}%，几乎满仓")
         recommendations.append("建议保留至少 10% 现金作为安全缓冲")
@@ -245,7 +269,8 @@ def calc_risk_budget(client, max_risk_tolerance: float = 20.0) -> Optional[RiskB
         risk_level=risk_level,
         risk_score=risk_score,
         observations=observations,
-        recommendations=recommendations
+        recommendations=recommendations,
+        var=var_report,
     )
 
 
@@ -283,6 +308,10 @@ def format_risk_budget(r: RiskBudgetReport) -> str:
         f"     建议最大持仓数: {r.suggested_max_stocks}",
     ]
 
+    if r.var:
+        lines.append("")
+        lines.extend(format_var(r.var))
+
     if r.observations:
         lines.append("")
         lines.append("  📋 风险观察:")
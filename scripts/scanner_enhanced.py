@@ -209,7 +209,12 @@ def run_enhanced_scanner(
 
         sub = ScannerSubscription(**sub_kwargs)
 
-        results = client.ib.reqScannerData(sub, scannerSubscriptionFilterOptions=tag_values)
+        from pacing import get_scheduler
+        results = get_scheduler(client.ib).call(
+            "scanner",
+            lambda: client.ib.reqScannerData(sub, scannerSubscriptionFilterOptions=tag_values),
+            label=f"扫描 {code}",
+        )
     except Exception as e:
         print(f"❌ 扫描失败: {e}")
         return []
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+组合情景损益网格（标的涨跌 × 隐含波动率冲击 × 持有天数）
+每个期权腿在整张网格上用本地 Black-Scholes-Merton 模型全量重定价（见 option_pricing.py），
+股票腿按线性市值变动计入；整张网格一次向量化计算，输出损益曲面与最差情景。
+默认网格 41 (±20%) × 21 (±10 vol 点) × 5 (0/1/5/10/21 天)。
+
+用法:
+    python scenario_grid.py bench    # 100 个期权腿的计算耗时 + 小幅冲击下与 Delta/Gamma 近似对照
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+OPTION_MULTIPLIER = 100
+DEFAULT_SPOT_RANGE = 0.20       # 标的涨跌 ±20%
+DEFAULT_SPOT_STEPS = 41
+DEFAULT_VOL_RANGE = 0.10        # 隐含波动率 ±10 个波动率点（绝对值）
+DEFAULT_VOL_STEPS = 21
+DEFAULT_DAYS = (0, 1, 5, 10, 21)
+_WORST_CELLS = 5
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class ScenarioLegs:
+    """参与重定价的持仓腿（列式数组，股票腿 strike / tenor / iv 为 0）"""
+    symbols: List[str]
+    underlyings: List[str]
+    is_option: np.ndarray
+    units: np.ndarray           # 股数或 张数 × 合约乘数（空头为负）
+    spot: np.ndarray
+    strike: np.ndarray
+    tenor: np.ndarray           # 年化剩余期限
+    iv: np.ndarray
+    is_call: np.ndarray
+
+
+@dataclass
+class ScenarioGrid:
+    spot_shocks: List[float]    # 相对涨跌幅
+    vol_shocks: List[float]     # 隐含波动率绝对变化
+    days: List[int]
+    pnl: np.ndarray             # (天数, 波动率冲击, 标的冲击) 组合损益 ($)
+    base_value: float           # 当前模型价值（股票市值 + 期权理论价值）
+    option_legs: int
+    stock_legs: int
+    elapsed_ms: float
+    worst: List[dict] = field(default_factory=list)
+    unmodeled: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "axes": {"spot_shock_pct": [round(s * 100, 2) for s in self.spot_shocks],
+                     "vol_shock_pts": [round(v * 100, 2) for v in self.vol_shocks],
+                     "days_forward": self.days},
+            "pnl": np.round(self.pnl, 2).tolist(),
+            "base_value": round(self.base_value, 2),
+            "worst": self.worst,
+            "option_legs": self.option_legs,
+            "stock_legs": self.stock_legs,
+            "unmodeled": self.unmodeled,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+        }
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def revalue(legs: ScenarioLegs, spot_shocks: Sequence[float], vol_shocks: Sequence[float],
+            days: Sequence[int], american: bool = False) -> np.ndarray:
+    """
+    全网格重定价，返回 (D, V, P) 的组合价值。
+    期权腿广播为 (D, V, P, L) 一次定价；股票腿价值与波动率、时间无关，按标的冲击线性计入。
+    """
+    from option_pricing import MIN_VOL, bsm_price, american_price
+
+    ds = np.asarray(spot_shocks, float)[None, None, :]
+    dv = np.asarray(vol_shocks, float)[None, :, None]
+    dt = np.asarray(days, float)[:, None, None] / 365.0
+    shape = (len(days), len(vol_shocks), len(spot_shocks))
+
+    stock = ~legs.is_option
+    stock_value = float((legs.units[stock] * legs.spot[stock]).sum())
+    value = np.broadcast_to(stock_value * (1 + ds), shape).copy()
+
+    opt = legs.is_option
+    if opt.any():
+        S = legs.spot[opt] * (1 + ds[..., None])
+        sigma = np.maximum(legs.iv[opt] + dv[..., None], MIN_VOL)
+        T = np.maximum(legs.tenor[opt] - dt[..., None], 0.0)
+        pricer = american_price if american else bsm_price
+        prices = pricer(S, legs.strike[opt], T, sigma, legs.is_call[opt])
+        value += prices @ legs.units[opt]
+    return value
+
+
+def scenario_grid(legs: ScenarioLegs, spot_range: float = DEFAULT_SPOT_RANGE, spot_steps: int = DEFAULT_SPOT_STEPS,
+                  vol_range: float = DEFAULT_VOL_RANGE, vol_steps: int = DEFAULT_VOL_STEPS,
+                  days: Sequence[int] = DEFAULT_DAYS, american: bool = False) -> ScenarioGrid:
+    """以当前状态（零冲击、第 0 天）的模型价值为基准，计算整张网格的损益"""
+    from option_pricing import bsm_price, american_price
+
+    spot_shocks = np.linspace(-spot_range, spot_range, spot_steps)
+    vol_shocks = np.linspace(-vol_range, vol_range, vol_steps)
+    days = sorted(set(int(d) for d in days))
+
+    t0 = time.perf_counter()
+    value = revalue(legs, spot_shocks, vol_shocks, days, american)
+    opt = legs.is_option
+    pricer = american_price if american else bsm_price
+    base = float((legs.units[~opt] * legs.spot[~opt]).sum())
+    if opt.any():
+        base += float(pricer(legs.spot[opt], legs.strike[opt], legs.tenor[opt], legs.iv[opt], legs.is_call[opt]) @ legs.units[opt])
+    pnl = value - base
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    worst = []
+    for flat in np.argsort(pnl, axis=None)[:_WORST_CELLS]:
+        d, v, s = np.unravel_index(flat, pnl.shape)
+        worst.append({
+            "spot_shock_pct": round(float(spot_shocks[s]) * 100, 2),
+            "vol_shock_pts": round(float(vol_shocks[v]) * 100, 2),
+            "days_forward": days[d],
+            "pnl": round(float(pnl[d, v, s]), 2),
+        })
+
+    return ScenarioGrid(
+        spot_shocks=spot_shocks.tolist(), vol_shocks=vol_shocks.tolist(), days=days,
+        pnl=pnl, base_value=base, option_legs=int(opt.sum()), stock_legs=int((~opt).sum()),
+        elapsed_ms=elapsed_ms, worst=worst,
+    )
+
+
+def collect_legs(client, positions=None, include_stocks: bool = True,
+                 option_greeks=None) -> Tuple[ScenarioLegs, List[str]]:
+    """
+    从持仓构建腿：期权 IV 取自批量 Greeks（IBKR 或本地反解，调用方已获取时可经 option_greeks 传入），
+    缺失时查本地 IV 曲面；标的现价一次批量查询。返回 (legs, 无法建模的持仓)
+    """
+    from options_analytics import get_option_greeks_batch
+    from option_pricing import years_to_expiry
+    from iv_surface import cached_surface
+
+    if positions is None:
+        positions = client.get_positions()
+    stocks = [p for p in positions if p.sec_type == "STK"] if include_stocks else []
+    greeks = option_greeks if option_greeks is not None else get_option_greeks_batch(client, positions)
+
+    symbols = sorted({p.symbol for p in stocks} | {g.underlying for g in greeks})
+    quotes = client.get_quotes_batch(symbols) if symbols else {}
+    spots = {s: q.last_price for s, q in quotes.items() if q.last_price > 0}
+
+    rows, unmodeled = [], []
+    for p in stocks:
+        spot = spots.get(p.symbol) or (p.market_value / p.quantity if p.quantity else 0)
+        if spot <= 0:
+            unmodeled.append(p.symbol)
+            continue
+        rows.append((p.symbol, p.symbol, False, p.quantity, spot, 0.0, 0.0, 0.0, False))
+    for g in greeks:
+        spot = spots.get(g.underlying, 0)
+        iv = g.implied_vol
+        if iv <= 0 and spot > 0:
+            surface = cached_surface(g.underlying)
+            iv = surface.iv_at(g.strike, g.expiry) if surface else 0.0
+        if spot <= 0 or not iv > 0:
+            unmodeled.append(g.symbol)
+            continue
+        rows.append((g.symbol, g.underlying, True, g.quantity * OPTION_MULTIPLIER, spot,
+                     g.strike, years_to_expiry(g.expiry), iv, g.right == "C"))
+
+    columns = list(zip(*rows)) if rows else [[]] * 9
+    legs = ScenarioLegs(
+        symbols=list(columns[0]), underlyings=list(columns[1]),
+        is_option=np.array(columns[2], bool), units=np.array(columns[3], float),
+        spot=np.array(columns[4], float), strike=np.array(columns[5], float),
+        tenor=np.array(columns[6], float), iv=np.array(columns[7], float),
+        is_call=np.array(columns[8], bool),
+    )
+    return legs, unmodeled
+
+
+def get_scenario_grid(client, positions=None, include_stocks: bool = True, days: Sequence[int] = DEFAULT_DAYS,
+                      spot_range: float = DEFAULT_SPOT_RANGE, vol_range: float = DEFAULT_VOL_RANGE,
+                      option_greeks=None) -> Optional[ScenarioGrid]:
+    """组合情景网格入口：无可建模持仓时返回 None"""
+    legs, unmodeled = collect_legs(client, positions, include_stocks, option_greeks)
+    if not len(legs.symbols):
+        return None
+    grid = scenario_grid(legs, spot_range=spot_range, vol_range=vol_range, days=days)
+    grid.unmodeled = unmodeled
+    return grid
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_scenario_grid(grid: ScenarioGrid, spot_every: int = 5, vol_every: int = 5) -> str:
+    """每个持有天数一张 (IV 冲击 × 标的涨跌) 损益表，按步长抽样显示"""
+    if not grid:
+        return "ℹ️ 无可建模的持仓，跳过情景分析"
+
+    spot_idx = list(range(0, len(grid.spot_shocks), spot_every))
+    vol_idx = list(range(0, len(grid.vol_shocks), vol_every))
+    lines = [
+        f"🧮 组合情景损益网格  |  {grid.option_legs} 个期权 + {grid.stock_legs} 只股票  |  "
+        f"{grid.pnl.size:,} 个情景 {grid.elapsed_ms:.0f}ms",
+        "=" * 90,
+    ]
+    for d, day in enumerate(grid.days):
+        lines.append(f"\n  📅 持有 {day} 天后   (行: IV 冲击 vol 点，列: 标的涨跌)")
+        lines.append("  " + " " * 8 + "".join(f"{grid.spot_shocks[s] * 100:>+9.0f}%" for s in spot_idx))
+        for v in vol_idx:
+            row = "".join(f"{grid.pnl[d, v, s]:>10,.0f}" for s in spot_idx)
+            lines.append(f"  {grid.vol_shocks[v] * 100:>+6.0f}  {row}")
+
+    lines.append("\n  🔻 最差情景:")
+    for w in grid.worst:
+        lines.append(f"     标的 {w['spot_shock_pct']:+.0f}%  IV {w['vol_shock_pts']:+.0f} 点  "
+                     f"第 {w['days_forward']} 天  →  ${w['pnl']:,.0f}")
+    if grid.unmodeled:
+        lines.append(f"  ⚠️ 缺少现价或 IV 未纳入: {', '.join(grid.unmodeled)}")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _synthetic_legs(n: int = 100, seed: int = 11) -> ScenarioLegs:
+    rng = np.random.default_rng(seed)
+    spot = rng.choice([50.0, 120.0, 300.0, 450.0], n)
+    return ScenarioLegs(
+        symbols=[f"OPT{i}" for i in range(n)], underlyings=[f"U{i % 4}" for i in range(n)],
+        is_option=np.ones(n, bool), units=rng.choice([-5, -2, -1, 1, 2, 5], n) * 100.0,
+        spot=spot, strike=spot * rng.uniform(0.8, 1.2, n), tenor=rng.uniform(7, 365, n) / 365,
+        iv=rng.uniform(0.15, 0.8, n), is_call=rng.random(n) < 0.5,
+    )
+
+
+def run_bench() -> bool:
+    from option_pricing import bsm_greeks
+
+    legs = _synthetic_legs()
+    scenario_grid(legs)     # 预热
+    grid = scenario_grid(legs)
+    print(f"⏱️ {grid.option_legs} 个期权腿 × {grid.pnl.size:,} 个情景: {grid.elapsed_ms:.0f}ms")
+
+    # 零冲击第 0 天损益应为 0；±1% 冲击下应接近 Delta-Gamma 近似
+    center = grid.pnl[0, len(grid.vol_shocks) // 2, len(grid.spot_shocks) // 2]
+    g = bsm_greeks(legs.spot, legs.strike, legs.tenor, legs.iv, legs.is_call)
+    small = scenario_grid(legs, spot_range=0.01, spot_steps=3, vol_range=0.0, vol_steps=1, days=(0,))
+    approx = [float(((g["delta"] * legs.spot * s + 0.5 * g["gamma"] * (legs.spot * s) ** 2) * legs.units).sum())
+              for s in (-0.01, 0.01)]
+    full = [float(small.pnl[0, 0, 0]), float(small.pnl[0, 0, 2])]
+    err = max(abs(a - f) / max(abs(f), 1) for a, f in zip(approx, full))
+
+    ok = abs(center) < 1e-6 and err < 0.02 and grid.elapsed_ms < 1000
+    print(f"{'✅' if abs(center) < 1e-6 else '❌'} 零冲击损益 {center:.2e}")
+    print(f"{'✅' if err < 0.02 else '❌'} ±1% 全量重定价 {full[0]:,.0f} / {full[1]:,.0f} vs Delta-Gamma "
+          f"{approx[0]:,.0f} / {approx[1]:,.0f}")
+    print(format_scenario_grid(grid))
+    return ok
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if action == "bench":
+        sys.exit(0 if run_bench() else 1)
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
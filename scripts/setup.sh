@@ -59,16 +59,29 @@ copy_runtime_scripts() {
   cp "$REPO_ROOT/scripts/ibkr_readonly.py" "$TRADING_DIR/ibkr_readonly.py"
   cp "$REPO_ROOT/scripts/keepalive.py" "$TRADING_DIR/keepalive.py"
   cp "$REPO_ROOT/scripts/portfolio_analytics.py" "$TRADING_DIR/portfolio_analytics.py"
+  cp "$REPO_ROOT/scripts/return_matrix.py" "$TRADING_DIR/return_matrix.py"
+  cp "$REPO_ROOT/scripts/covariance.py" "$TRADING_DIR/covariance.py"
+  cp "$REPO_ROOT/scripts/var_engine.py" "$TRADING_DIR/var_engine.py"
   cp "$REPO_ROOT/scripts/options_analytics.py" "$TRADING_DIR/options_analytics.py"
+  cp "$REPO_ROOT/scripts/option_chain.py" "$TRADING_DIR/option_chain.py"
+  cp "$REPO_ROOT/scripts/option_pricing.py" "$TRADING_DIR/option_pricing.py"
+  cp "$REPO_ROOT/scripts/iv_surface.py" "$TRADING_DIR/iv_surface.py"
+  cp "$REPO_ROOT/scripts/scenario_grid.py" "$TRADING_DIR/scenario_grid.py"
+  cp "$REPO_ROOT/scripts/indicator_engine.py" "$TRADING_DIR/indicator_engine.py"
+  cp "$REPO_ROOT/scripts/indicator_state.py" "$TRADING_DIR/indicator_state.py"
   cp "$REPO_ROOT/scripts/trade_review.py" "$TRADING_DIR/trade_review.py"
   cp "$REPO_ROOT/scripts/scanner_enhanced.py" "$TRADING_DIR/scanner_enhanced.py"
   cp "$REPO_ROOT/scripts/export.py" "$TRADING_DIR/export.py"
   cp "$REPO_ROOT/scripts/technical_analysis.py" "$TRADING_DIR/technical_analysis.py"
   cp "$REPO_ROOT/scripts/finviz_data.py" "$TRADING_DIR/finviz_data.py"
+  cp "$REPO_ROOT/scripts/finviz_cache.py" "$TRADING_DIR/finviz_cache.py"
+  cp "$REPO_ROOT/scripts/finviz_limiter.py" "$TRADING_DIR/finviz_limiter.py"
   cp "$REPO_ROOT/scripts/finviz_screener.py" "$TRADING_DIR/finviz_screener.py"
   cp "$REPO_ROOT/scripts/earnings_calendar.py" "$TRADING_DIR/earnings_calendar.py"
+  cp "$REPO_ROOT/scripts/earnings_index.py" "$TRADING_DIR/earnings_index.py"
   cp "$REPO_ROOT/scripts/position_sizer.py" "$TRADING_DIR/position_sizer.py"
   cp "$REPO_ROOT/scripts/snapshots.py" "$TRADING_DIR/snapshots.py"
+  cp "$REPO_ROOT/scripts/snapshot_store.py" "$TRADING_DIR/snapshot_store.py"
   cp "$REPO_ROOT/scripts/sector_rotation.py" "$TRADING_DIR/sector_rotation.py"
   cp "$REPO_ROOT/scripts/vix_dashboard.py" "$TRADING_DIR/vix_dashboard.py"
   cp "$REPO_ROOT/scripts/exit_advisor.py" "$TRADING_DIR/exit_advisor.py"
@@ -77,7 +90,18 @@ copy_runtime_scripts() {
   cp "$REPO_ROOT/scripts/options_flow.py" "$TRADING_DIR/options_flow.py"
   cp "$REPO_ROOT/scripts/daily_report.py" "$TRADING_DIR/daily_report.py"
   cp "$REPO_ROOT/scripts/ibkr_cli.py" "$TRADING_DIR/ibkr_cli.py"
-  chmod +x "$TRADING_DIR/ibkr_readonly.py" "$TRADING_DIR/keepalive.py" "$TRADING_DIR/ibkr_cli.py"
+  cp "$REPO_ROOT/scripts/ibkr_commands.py" "$TRADING_DIR/ibkr_commands.py"
+  cp "$REPO_ROOT/scripts/startup_bench.py" "$TRADING_DIR/startup_bench.py"
+  cp "$REPO_ROOT/scripts/batch_runner.py" "$TRADING_DIR/batch_runner.py"
+  cp "$REPO_ROOT/scripts/query_server.py" "$TRADING_DIR/query_server.py"
+  cp "$REPO_ROOT/scripts/ibkr_broker.py" "$TRADING_DIR/ibkr_broker.py"
+  cp "$REPO_ROOT/scripts/quote_stream.py" "$TRADING_DIR/quote_stream.py"
+  cp "$REPO_ROOT/scripts/alert_engine.py" "$TRADING_DIR/alert_engine.py"
+  cp "$REPO_ROOT/scripts/contract_cache.py" "$TRADING_DIR/contract_cache.py"
+  cp "$REPO_ROOT/scripts/bar_store.py" "$TRADING_DIR/bar_store.py"
+  cp "$REPO_ROOT/scripts/pacing.py" "$TRADING_DIR/pacing.py"
+  chmod +x "$TRADING_DIR/ibkr_readonly.py" "$TRADING_DIR/keepalive.py" "$TRADING_DIR/ibkr_cli.py" \
+           "$TRADING_DIR/ibkr_broker.py"
 }
 
 create_env_if_missing() {
@@ -141,10 +165,20 @@ set -euo pipefail
 cd "$(dirname "$0")"
 source venv/bin/activate
 python snapshots.py
+EOF
+
+  # 常驻网关连接代理：./ibkr 命令自动复用其连接，未运行时回退直连
+  cat > "$TRADING_DIR/run-broker.sh" <<'EOF'
+#!/usr/bin/env bash
+set -euo pipefail
+cd "$(dirname "$0")"
+source venv/bin/activate
+python ibkr_broker.py
 EOF
 
   chmod +x "$TRADING_DIR/run-readonly.sh" "$TRADING_DIR/run-keepalive.sh" \
-           "$TRADING_DIR/run-report.sh" "$TRADING_DIR/run-snapshot.sh" "$TRADING_DIR/ibkr"
+           "$TRADING_DIR/run-report.sh" "$TRADING_DIR/run-snapshot.sh" \
+           "$TRADING_DIR/run-broker.sh" "$TRADING_DIR/ibkr"
 }
 
 main() {
@@ -178,7 +212,7 @@ main() {
   source venv/bin/activate
   log "Installing Python dependencies (ib_async, requests)"
   pip install --upgrade pip >/dev/null
-  pip install ib_async requests finvizfinance >/dev/null
+  pip install ib_async requests finvizfinance numpy >/dev/null
 
   copy_runtime_scripts
   create_env_if_missing
@@ -201,6 +235,8 @@ Next steps:
    */5 * * * * cd $TRADING_DIR && ./run-keepalive.sh >> $TRADING_DIR/keepalive.log 2>&1
 5) Generate investment report:
    cd "$TRADING_DIR" && ./run-report.sh
+6) Optional: keep one gateway connection warm for fast ./ibkr commands:
+   cd "$TRADING_DIR" && nohup ./run-broker.sh >> $TRADING_DIR/broker.log 2>&1 &
 ========================================
 EOF
 }
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+组合快照存储引擎
+把每日快照写入 ~/trading/snapshots/snapshots.db（SQLite），取代一天一个 JSON 文件：
+  • nav 表：每日一行净值 / 现金 / 持仓市值等汇总字段，按日期主键
+  • holdings 表：每日每个持仓一行，按 (日期) 与 (代码, 日期) 建索引
+  • 按日期追加写入；同一天重复保存只替换当天的行
+  • 区间查询只读取所需列（净值曲线只读 date, nav 两列），不再逐个解析 JSON 文件
+首次打开空库时自动导入 SNAPSHOT_DIR 下已有的 JSON 快照（原文件保留不动）。
+
+用法:
+    python snapshot_store.py stats            # 库内天数、持仓行数、日期范围
+    python snapshot_store.py migrate [DIR]    # 导入 JSON 快照（已存在的日期跳过）
+    python snapshot_store.py bench            # 对比 JSON 逐文件加载与数据库列查询
+
+⚠️ 纯只读操作，不包含任何交易功能。
+"""
+
+import os
+import sys
+import glob
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), "trading", "snapshots")
+SNAPSHOT_DB = os.path.join(SNAPSHOT_DIR, "snapshots.db")
+
+SCHEMA_VERSION = 1
+
+_NAV_FIELDS = ("timestamp", "nav", "cash", "total_positions_value",
+               "total_unrealized_pnl", "holding_count")
+_HOLDING_FIELDS = ("symbol", "sec_type", "quantity", "avg_cost", "market_value",
+                   "unrealized_pnl", "pnl_percent")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nav (
+    date                  TEXT PRIMARY KEY,
+    timestamp             TEXT,
+    nav                   REAL,
+    cash                  REAL,
+    total_positions_value REAL,
+    total_unrealized_pnl  REAL,
+    holding_count         INTEGER
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    date           TEXT NOT NULL,
+    seq            INTEGER NOT NULL,
+    symbol         TEXT NOT NULL,
+    sec_type       TEXT,
+    quantity       REAL,
+    avg_cost       REAL,
+    market_value   REAL,
+    unrealized_pnl REAL,
+    pnl_percent    REAL,
+    PRIMARY KEY (date, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_holdings_symbol ON holdings (symbol, date);
+"""
+
+
+def _number(value):
+    """旧快照中余额缺失时可能存成字符串，统一落为 NULL"""
+    return value if isinstance(value, (int, float)) else None
+
+
+# ─── 存储 ─────────────────────────────────────────────────────
+
+class SnapshotStore:
+    """
+    SQLite 快照库；每次写入一天的数据在同一个事务内完成。
+    共享连接的所有读写都持有 _lock（batch 模式下多线程共用）。
+    """
+
+    def __init__(self, db_path: str = SNAPSHOT_DB, json_dir: Optional[str] = SNAPSHOT_DIR):
+        self.db_path = db_path
+        self.json_dir = json_dir
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _db(self) -> sqlite3.Connection:
+        """打开数据库并按需建表；空库首次打开时导入已有 JSON 快照。返回的连接只能在持有 _lock 时使用"""
+        with self._lock:
+            return self._open_locked()
+
+    def _open_locked(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                conn.executescript(_SCHEMA)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                conn.commit()
+            self._conn = conn
+            if version == 0 and self.json_dir:
+                imported = self.migrate_json(self.json_dir)
+                if imported:
+                    print(f"📦 已从 JSON 导入 {imported} 天历史快照 → {self.db_path}")
+        return self._conn
+
+    # ── 写入 ──
+
+    def _write(self, conn: sqlite3.Connection, snapshot: Dict):
+        day = snapshot["date"]
+        conn.execute(
+            f"INSERT OR REPLACE INTO nav (date, {', '.join(_NAV_FIELDS)}) VALUES (?{', ?' * len(_NAV_FIELDS)})",
+            (day, snapshot.get("timestamp"), _number(snapshot.get("nav")), _number(snapshot.get("cash")),
+             _number(snapshot.get("total_positions_value")), _number(snapshot.get("total_unrealized_pnl")),
+             snapshot.get("holding_count", len(snapshot.get("holdings", [])))),
+        )
+        conn.execute("DELETE FROM holdings WHERE date = ?", (day,))
+        conn.executemany(
+            f"INSERT INTO holdings (date, seq, {', '.join(_HOLDING_FIELDS)}) "
+            f"VALUES (?, ?{', ?' * len(_HOLDING_FIELDS)})",
+            [(day, i, *(h.get(f) for f in _HOLDING_FIELDS))
+             for i, h in enumerate(snapshot.get("holdings", []))],
+        )
+
+    def append(self, snapshot: Dict):
+        """写入一天的快照（同一天再次写入时替换当天的行）"""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                self._write(conn, snapshot)
+
+    def migrate_json(self, json_dir: str = SNAPSHOT_DIR, force: bool = False) -> int:
+        """导入 JSON 快照文件，返回导入天数；默认跳过库中已有的日期"""
+        with self._lock:
+            return self._migrate_locked(json_dir, force)
+
+    def _migrate_locked(self, json_dir: str, force: bool) -> int:
+        conn = self._db()
+        existing = set() if force else {row[0] for row in conn.execute("SELECT date FROM nav")}
+        imported = 0
+        with conn:
+            for fp in sorted(glob.glob(os.path.join(json_dir, "*.json"))):
+                try:
+                    with open(fp, "r", encoding="utf-8") as f:
+                        snapshot = json.load(f)
+                except (json.JSONDecodeError, IOError):
+                    continue
+                if not isinstance(snapshot, dict) or "date" not in snapshot:
+                    continue
+                if snapshot["date"] in existing:
+                    continue
+                self._write(conn, snapshot)
+                imported += 1
+        return imported
+
+    # ── 查询 ──
+
+    def nav_series(self, start: Optional[str] = None, end: Optional[str] = None,
+                   last: Optional[int] = None, columns: Sequence[str] = ("nav",)) -> List[Tuple]:
+        """
+        按日期升序返回 (date, *columns)。
+        start/end 为闭区间日期（YYYY-MM-DD）；last 只取区间内最近的 N 天。
+        """
+        cols = [c for c in columns if c in _NAV_FIELDS]
+        where, params = [], []
+        if start:
+            where.append("date >= ?")
+            params.append(start)
+        if end:
+            where.append("date <= ?")
+            params.append(end)
+        sql = f"SELECT {', '.join(['date', *cols])} FROM nav"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            if last:
+                rows = self._db().execute(sql + " ORDER BY date DESC LIMIT ?", (*params, last)).fetchall()
+                return rows[::-1]
+            return self._db().execute(sql + " ORDER BY date", params).fetchall()
+
+    def holdings_history(self, symbol: str, start: Optional[str] = None, end: Optional[str] = None,
+                         columns: Sequence[str] = ("quantity", "market_value")) -> List[Tuple]:
+        """单个代码的持仓历史 (date, sec_type, *columns)，走 (symbol, date) 索引"""
+        cols = [c for c in columns if c in _HOLDING_FIELDS]
+        sql = f"SELECT date, sec_type, {', '.join(cols)} FROM holdings WHERE symbol = ?"
+        params: list = [symbol.upper()]
+        if start:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end:
+            sql += " AND date <= ?"
+            params.append(end)
+        with self._lock:
+            return self._db().execute(sql + " ORDER BY date, seq", params).fetchall()
+
+    def load(self, date_str: str) -> Optional[Dict]:
+        """还原某一天的完整快照（与原 JSON 结构一致）"""
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                f"SELECT date, {', '.join(_NAV_FIELDS)} FROM nav WHERE date = ?", (date_str,)
+            ).fetchone()
+            if row is None:
+                return None
+            snapshot = dict(zip(("date",) + _NAV_FIELDS, row))
+            snapshot["holdings"] = [
+                dict(zip(_HOLDING_FIELDS, h)) for h in conn.execute(
+                    f"SELECT {', '.join(_HOLDING_FIELDS)} FROM holdings WHERE date = ? ORDER BY seq",
+                    (date_str,),
+                )
+            ]
+        return snapshot
+
+    def dates(self, last: Optional[int] = None) -> List[str]:
+        return [row[0] for row in self.nav_series(last=last, columns=())]
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._db()
+            days, first, last = conn.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM nav").fetchone()
+            rows, symbols = conn.execute("SELECT COUNT(*), COUNT(DISTINCT symbol) FROM holdings").fetchone()
+        return {
+            "db_path": self.db_path,
+            "days": days,
+            "first_date": first,
+            "last_date": last,
+            "holding_rows": rows,
+            "symbols": symbols,
+            "size_kb": round(os.path.getsize(self.db_path) / 1024, 1) if os.path.exists(self.db_path) else 0,
+        }
+
+
+_default_store: Optional[SnapshotStore] = None
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """进程级共享的快照库实例"""
+    global _default_store
+    if _default_store is None:
+        _default_store = SnapshotStore()
+    return _default_store
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_store_stats(stats: dict) -> str:
+    lines = [f"🗄️ 快照库: {stats['db_path']}"]
+    if not stats["days"]:
+        lines.append("   (空)")
+        return "\n".join(lines)
+    lines.append(f"   {stats['days']} 天 ({stats['first_date']} → {stats['last_date']})，"
+                 f"持仓记录 {stats['holding_rows']} 行 / {stats['symbols']} 个代码，"
+                 f"{stats['size_kb']:.0f} KB")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def _bench(days: int = 1500, holdings: int = 25):
+    import random
+    import tempfile
+    from datetime import date, timedelta
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = date.today() - timedelta(days=days)
+        nav = 100_000.0
+        for i in range(days):
+            nav *= 1 + random.gauss(0.0004, 0.01)
+            snap = {
+                "date": (start + timedelta(days=i)).isoformat(), "timestamp": "", "nav": round(nav, 2),
+                "cash": 5000.0, "total_positions_value": nav - 5000, "total_unrealized_pnl": 0.0,
+                "holding_count": holdings,
+                "holdings": [{"symbol": f"S{j:02d}", "sec_type": "STK", "quantity": 10, "avg_cost": 100,
+                              "market_value": 1000, "unrealized_pnl": 0, "pnl_percent": 0}
+                             for j in range(holdings)],
+            }
+            with open(os.path.join(tmp, f"{snap['date']}.json"), "w") as f:
+                json.dump(snap, f, indent=2)
+
+        t0 = time.perf_counter()
+        store = SnapshotStore(db_path=os.path.join(tmp, "db", "snapshots.db"), json_dir=tmp)
+        store._db()
+        t_migrate = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        files = sorted(glob.glob(os.path.join(tmp, "*.json")))
+        from_json = []
+        for fp in files:
+            with open(fp) as f:
+                s = json.load(f)
+            from_json.append((s["date"], s["nav"]))
+        t_json = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        from_db = store.nav_series()
+        t_db = time.perf_counter() - t0
+
+        print(f"🧪 {days} 天快照，每天 {holdings} 个持仓")
+        print(f"   JSON 导入:       {t_migrate * 1000:8.1f} ms（一次性）")
+        print(f"   JSON 逐文件加载: {t_json * 1000:8.1f} ms")
+        print(f"   数据库净值列:    {t_db * 1000:8.1f} ms")
+        print(f"   结果一致: {'✅' if from_json == [tuple(r) for r in from_db] else '❌'}")
+
+
+def main():
+    action = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = get_snapshot_store()
+
+    if action == "stats":
+        print(format_store_stats(store.stats()))
+    elif action == "migrate":
+        json_dir = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_DIR
+        print(f"📦 已导入 {store.migrate_json(json_dir)} 天快照")
+    elif action == "bench":
+        _bench()
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 组合历史快照模块
 提供：每日组合快照存档、历史净值回溯、收益率计算。
 设计为通过 cron 每日运行一次存档，CLI 可随时查阅历史。
+快照写入 SQLite 快照库（见 snapshot_store.py），历史 JSON 文件在首次使用时自动导入。
 
 Crontab 建议（每日收盘后存档）:
 30 16 * * 1-5 cd ~/trading && ./run-snapshot.sh >> ~/trading/snapshots.log 2>&1
@@ -11,32 +12,24 @@ Crontab 建议（每日收盘后存档）:
 """
 
 import os
+import sys
 import json
-import glob
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Optional, Dict
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# ─── 配置 ─────────────────────────────────────────────────────
-
-SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), "trading", "snapshots")
-
-
-def _ensure_snapshot_dir():
-    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+from snapshot_store import get_snapshot_store
 
 
 # ─── 快照存储 ─────────────────────────────────────────────────
 
 def save_snapshot(client) -> str:
     """
-    保存当日组合快照到 JSON 文件。
-    返回保存的文件路径。
+    保存当日组合快照到快照库（同一天重复保存会覆盖当天记录）。
+    返回快照库路径。
     """
-    _ensure_snapshot_dir()
-
     today = datetime.now().strftime("%Y-%m-%d")
-    filepath = os.path.join(SNAPSHOT_DIR, f"{today}.json")
 
     # 账户余额
     balance = client.get_balance()
@@ -73,42 +66,27 @@ def save_snapshot(client) -> str:
         "holdings": holdings,
     }
 
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(snapshot, f, ensure_ascii=False, indent=2)
+    store = get_snapshot_store()
+    store.append(snapshot)
 
-    print(f"✅ 快照已保存: {filepath}")
-    return filepath
+    print(f"✅ 快照已保存: {today} → {store.db_path}")
+    return store.db_path
 
 
 def load_snapshot(date_str: str) -> Optional[Dict]:
     """加载指定日期的快照"""
-    filepath = os.path.join(SNAPSHOT_DIR, f"{date_str}.json")
-    if not os.path.exists(filepath):
-        return None
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return None
+    return get_snapshot_store().load(date_str)
 
 
 def load_recent_snapshots(days: int = 30) -> List[Dict]:
-    """加载最近 N 天的快照"""
-    _ensure_snapshot_dir()
-    files = sorted(glob.glob(os.path.join(SNAPSHOT_DIR, "*.json")))
-    if not files:
-        return []
+    """加载最近 N 天的完整快照（含持仓明细）"""
+    store = get_snapshot_store()
+    return [s for s in (store.load(d) for d in store.dates(last=days)) if s]
 
-    snapshots = []
-    for fp in files[-days:]:
-        try:
-            with open(fp, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                snapshots.append(data)
-        except (json.JSONDecodeError, IOError):
-            continue
 
-    return snapshots
+def load_nav_history(days: int = 30) -> List[Dict]:
+    """只读取最近 N 天的日期与净值两列，供 calc_snapshot_performance 使用"""
+    return [{"date": d, "nav": nav} for d, nav in get_snapshot_store().nav_series(last=days)]
 
 
 # ─── 收益率计算 ───────────────────────────────────────────────
@@ -237,8 +215,6 @@ def format_snapshot_summary(snapshot: Dict) -> str:
 
 def main():
     """独立运行：保存当日快照"""
-    import sys
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
     from ibkr_readonly import IBKRReadOnlyClient
 
     client = IBKRReadOnlyClient()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+CLI 启动耗时基准
+在隔离的临时缓存目录中写入固定的 Finviz 缓存条目，逐条以子进程运行纯 Finviz 命令（缓存命中路径），
+统计墙钟耗时并用 `python -X importtime` 检查导入链：
+  • 每条命令中位耗时须低于预算（默认 100ms，含解释器自身启动）
+  • 不得导入重依赖（ib_async / pandas / numpy / requests / bs4 / finvizfinance.util）
+任一命令超出预算或导入了重依赖时以退出码 1 结束，可直接作为回归检查。
+news SYMBOL 需实时请求 Yahoo RSS、条件选股（screen --sector ...）每次实时抓取 Finviz，均不在基准范围内。
+
+用法:
+    python startup_bench.py                   # 默认每条命令运行 5 次
+    python startup_bench.py --runs 10 --budget 120
+    python startup_bench.py --json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# ─── 配置 ─────────────────────────────────────────────────────
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ibkr_cli.py")
+
+DEFAULT_RUNS = 5
+DEFAULT_BUDGET_MS = float(os.getenv("IBKR_STARTUP_BUDGET_MS", "100"))
+
+# 纯 Finviz / 本地命令：缓存命中时不应触碰网关或重依赖
+BENCH_COMMANDS: List[List[str]] = [
+    ["--help"],
+    ["ratings", "AAPL"],
+    ["insider", "AAPL"],
+    ["insider", "market"],
+    ["news", "market"],
+    ["peers", "AAPL"],
+    ["screen", "list"],
+    ["earnings", "AAPL"],
+    ["fvcache", "stats"],
+]
+
+# 启动路径上禁止出现的模块（含子模块）
+HEAVY_MODULES = ("ib_async", "eventkit", "pandas", "numpy", "requests", "bs4", "finvizfinance.util")
+
+# 缓存种子：(类型, 位置参数, 结果)
+_SEED_ENTRIES: List[Tuple[str, Tuple, object]] = [
+    ("fundamentals", ("AAPL",), {"Earnings": "Jan 29 AMC", "P/E": "30.12", "Market Cap": "3.5T"}),
+    ("ratings", ("AAPL",), [{"Date": "2026-10-01", "Status": "Upgrade", "Outer": "Example Securities",
+                             "Rating": "Buy", "Price": "250"}]),
+    ("insider", ("AAPL",), [{"Insider Trading": "Example Officer", "Relationship": "CFO", "Date": "Oct 01",
+                             "Transaction": "Sale", "Cost": "230.5", "#Shares": "10000",
+                             "Value ($)": "2305000"}]),
+    ("insider_market", ("latest",), [{"Ticker": "AAPL", "Insider Trading": "Example Officer",
+                                      "Transaction": "Buy", "Value ($)": "100000"}]),
+    ("market_news", (), {"news": [{"Date": "08:00AM", "Title": "Markets open", "Link": "", "Source": "Example"}],
+                         "blogs": []}),
+    ("peers", ("AAPL",), ["MSFT", "GOOGL", "AMZN"]),
+]
+
+
+# ─── 数据类 ───────────────────────────────────────────────────
+
+@dataclass
+class StartupResult:
+    command: str
+    median_ms: float
+    min_ms: float
+    overhead_ms: float              # 相对裸解释器启动的额外耗时
+    heavy_imports: List[str] = field(default_factory=list)
+    top_imports: List[Tuple[str, float]] = field(default_factory=list)  # (模块, 累计 ms)
+    exit_code: int = 0
+    ok: bool = True
+
+
+# ─── 核心函数 ─────────────────────────────────────────────────
+
+def seed_cache(cache_dir: str):
+    """在隔离目录中写入基准所需的 Finviz 缓存条目（与真实抓取结果同形态）"""
+    from finviz_cache import FinvizCache, cache_key
+
+    cache = FinvizCache(os.path.join(cache_dir, "finviz.db"))
+    for kind, args, value in _SEED_ENTRIES:
+        cache.put(kind, cache_key(*args), value)
+
+
+def _bench_env(root: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.pop("IBKR_NO_FINVIZ_CACHE", None)
+    # 预热时写入 .pyc，与实际安装后的运行方式一致（否则每次都重新编译改动过的模块）
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["IBKR_CACHE_DIR"] = os.path.join(root, "cache")
+    env["HOME"] = os.path.join(root, "home")
+    return env
+
+
+def _timed_run(argv: List[str], env: Dict[str, str]) -> Tuple[float, int]:
+    t0 = time.perf_counter()
+    proc = subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000, proc.returncode
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """解析 -X importtime 输出，返回 {模块: 累计 ms}（仅顶层导入条目保留累计值）"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # 名称前的缩进表示嵌套层级（分隔符后固定有一个空格）
+            modules[name[1:].rstrip()] = int(cumulative) / 1000
+        except ValueError:
+            continue
+    return modules
+
+
+def _heavy_root(module: str) -> Optional[str]:
+    """模块属于哪个重依赖（不属于返回 None）"""
+    name = module.strip()
+    return next((h for h in HEAVY_MODULES if name == h or name.startswith(h + ".")), None)
+
+
+def profile_imports(argv: List[str], env: Dict[str, str]) -> Tuple[List[str], List[Tuple[str, float]]]:
+    """返回 (导入的重依赖, 耗时最多的顶层导入)"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", CLI_PATH, *argv], env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = parse_importtime(proc.stderr)
+    heavy = sorted({_heavy_root(m) for m in modules} - {None})
+    top_level = [(m, ms) for m, ms in modules.items() if not m.startswith(" ")]
+    top_level.sort(key=lambda x: -x[1])
+    return heavy, [(m, round(ms, 1)) for m, ms in top_level[:3]]
+
+
+def run_startup_bench(runs: int = DEFAULT_RUNS, budget_ms: float = DEFAULT_BUDGET_MS,
+                      commands: Optional[List[List[str]]] = None) -> Tuple[float, List[StartupResult]]:
+    """返回 (裸解释器中位耗时, 各命令结果)"""
+    commands = commands or BENCH_COMMANDS
+    root = tempfile.mkdtemp(prefix="ibkr_startup_")
+    try:
+        env = _bench_env(root)
+        os.makedirs(env["HOME"], exist_ok=True)
+        seed_cache(env["IBKR_CACHE_DIR"])
+
+        baseline = statistics.median(
+            _timed_run([sys.executable, "-c", "pass"], env)[0] for _ in range(runs)
+        )
+
+        results = []
+        for argv in commands:
+            # 预热一次：写入 .pyc、建立财报索引等一次性开销不计入
+            _timed_run([sys.executable, CLI_PATH, *argv], env)
+            samples, exit_code = [], 0
+            for _ in range(runs):
+                ms, code = _timed_run([sys.executable, CLI_PATH, *argv], env)
+                samples.append(ms)
+                exit_code = exit_code or code
+            heavy, top = profile_imports(argv, env)
+            median_ms = statistics.median(samples)
+            results.append(StartupResult(
+                command=" ".join(argv),
+                median_ms=round(median_ms, 1),
+                min_ms=round(min(samples), 1),
+                overhead_ms=round(median_ms - baseline, 1),
+                heavy_imports=heavy,
+                top_imports=top,
+                exit_code=exit_code,
+                ok=median_ms <= budget_ms and not heavy and exit_code == 0,
+            ))
+        return round(baseline, 1), results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ─── 格式化输出 ───────────────────────────────────────────────
+
+def format_startup_results(baseline_ms: float, results: List[StartupResult], budget_ms: float) -> str:
+    lines = [
+        f"⏱️ CLI 启动耗时（缓存命中路径，预算 {budget_ms:.0f}ms，裸解释器 {baseline_ms:.1f}ms）",
+        "=" * 72,
+        f"{'命令':32s} {'中位':>8s} {'最快':>8s} {'额外':>8s}  结果",
+    ]
+    for r in results:
+        mark = "✅" if r.ok else "❌"
+        lines.append(f"{r.command:32s} {r.median_ms:7.1f}ms {r.min_ms:7.1f}ms {r.overhead_ms:7.1f}ms  {mark}")
+        if r.heavy_imports:
+            lines.append(f"    ⚠️ 导入了重依赖: {', '.join(r.heavy_imports)}")
+        if r.exit_code:
+            lines.append(f"    ⚠️ 退出码 {r.exit_code}")
+        if not r.ok and r.top_imports:
+            lines.append("    耗时最多的导入: " + ", ".join(f"{m} {ms:.1f}ms" for m, ms in r.top_imports))
+    failed = [r for r in results if not r.ok]
+    lines.append("")
+    lines.append(f"{'❌' if failed else '✅'} {len(results) - len(failed)}/{len(results)} 条命令达标")
+    return "\n".join(lines)
+
+
+# ─── 独立运行入口 ─────────────────────────────────────────────
+
+def main():
+    args = sys.argv[1:]
+    runs, budget = DEFAULT_RUNS, DEFAULT_BUDGET_MS
+    if "--runs" in args:
+        runs = int(args[args.index("--runs") + 1])
+    if "--budget" in args:
+        budget = float(args[args.index("--budget") + 1])
+
+    baseline, results = run_startup_bench(runs=runs, budget_ms=budget)
+    if "--json" in args:
+        print(json.dumps({"budget_ms": budget, "baseline_ms": baseline,
+                          "results": [asdict(r) for r in results]}, ensure_ascii=False, indent=2))
+    else:
+        print(format_startup_results(baseline, results, budget))
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
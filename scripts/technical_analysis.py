@@ -8,6 +8,7 @@
 import math
 import json
 import dataclasses
+from collections import deque
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Tuple
 
@@ -142,7 +143,7 @@ def _ema_series(prices: List[float], period: int) -> List[float]:
 
 def calc_moving_averages(closes: List[float]) -> MovingAverages:
     """计算均线系统"""
-    ma = MovingAverages(
+    return _ma_result(MovingAverages(
         sma_5=_sma(closes, 5),
         sma_10=_sma(closes, 10),
         sma_20=_sma(closes, 20),
@@ -151,9 +152,11 @@ def calc_moving_averages(closes: List[float]) -> MovingAverages:
         sma_250=_sma(closes, 250),
         ema_12=_ema(closes, 12),
         ema_26=_ema(closes, 26),
-    )
+    ))
+
 
-    # 判断多空排列
+def _ma_result(ma: MovingAverages) -> MovingAverages:
+    """根据均线数值判断多空排列"""
     short_mas = [v for v in [ma.sma_5, ma.sma_10, ma.sma_20] if v is not None]
     if len(short_mas) >= 3:
         if short_mas[0] > short_mas[1] > short_mas[2]:
@@ -190,6 +193,11 @@ def calc_rsi(closes: List[float], period: int = 14) -> RSIData:
         avg_gain = (avg_gain * (period - 1) + gains[i]) / period
         avg_loss = (avg_loss * (period - 1) + losses[i]) / period
 
+    return _rsi_result(avg_gain, avg_loss)
+
+
+def _rsi_result(avg_gain: float, avg_loss: float) -> RSIData:
+    """由 Wilder 平滑后的平均涨跌幅生成 RSI 结果"""
     if avg_loss == 0:
         rsi_value = 100.0
     else:
@@ -235,15 +243,19 @@ def calc_macd(closes: List[float], fast: int = 12, slow: int = 26, signal: int =
     dea_series = _ema_series(dif_series, signal)
     offset2 = len(dif_series) - len(dea_series)
 
-    dif = dif_series[-1]
-    dea = dea_series[-1]
+    if len(dea_series) >= 2 and len(dif_series) >= 2:
+        return _macd_result(dif_series[-1], dea_series[-1], dif_series[-2], dea_series[-2])
+    return _macd_result(dif_series[-1], dea_series[-1])
+
+
+def _macd_result(dif: float, dea: float, prev_dif: Optional[float] = None,
+                 prev_dea: Optional[float] = None) -> MACDData:
+    """由最新（及前一根）DIF/DEA 生成 MACD 结果"""
     histogram = 2 * (dif - dea)  # MACD 柱 (×2 是国内标准)
 
     # 金叉/死叉判断
     cross = ""
-    if len(dea_series) >= 2 and len(dif_series) >= 2:
-        prev_dif = dif_series[-2]
-        prev_dea = dea_series[-2]
+    if prev_dif is not None and prev_dea is not None:
         if prev_dif <= prev_dea and dif > dea:
             cross = "🟢 金叉"
         elif prev_dif >= prev_dea and dif < dea:
@@ -268,11 +280,15 @@ def calc_bollinger_bands(closes: List[float], period: int = 20, std_dev: float =
     variance = sum((x - middle) ** 2 for x in recent) / period
     std = math.sqrt(variance)
 
+    return _bollinger_result(middle, std, closes[-1], std_dev)
+
+
+def _bollinger_result(middle: float, std: float, current: float, std_dev: float = 2.0) -> BollingerBands:
+    """由中轨与标准差生成布林带结果"""
     upper = middle + std_dev * std
     lower = middle - std_dev * std
     bandwidth = (upper - lower) / middle * 100 if middle else 0
 
-    current = closes[-1]
     if current > upper:
         pos = "🔴 上轨之上 (超买)"
     elif current > middle + (upper - middle) * 0.7:
@@ -293,10 +309,69 @@ def calc_bollinger_bands(closes: List[float], period: int = 20, std_dev: float =
     )
 
 
-def calc_support_resistance(bars: List[dict], levels: int = 3) -> SupportResistance:
+def _window_extrema(values: List[float], window: int, highs: bool = True) -> List[int]:
+    """
+    单调队列求局部极值：返回满足 values[i] 为 [i-window, i+window] 内最大（或最小）值的下标。
+    每个元素最多入队 / 出队一次，整体 O(n)。
+    """
+    n = len(values)
+    span = 2 * window + 1
+    if n < span:
+        return []
+    dq = deque()     # 存下标，对应值单调不增（求最小值时单调不减）
+    out = []
+    for j, v in enumerate(values):
+        if highs:
+            while dq and values[dq[-1]] <= v:
+                dq.pop()
+        else:
+            while dq and values[dq[-1]] >= v:
+                dq.pop()
+        dq.append(j)
+        if dq[0] <= j - span:
+            dq.popleft()
+        i = j - window
+        if i >= window and values[i] == values[dq[0]]:
+            out.append(i)
+    return out
+
+
+def _cluster_levels(points: List[Tuple[float, float]], threshold_pct: float = 1.5,
+                    volume_weighted: bool = False) -> List[float]:
+    """
+    聚类合并相近价位：points 为 (价格, 成交量)，相邻价位差 < threshold_pct% 归为一簇。
+    volume_weighted=True 时簇价位按成交量加权，否则为簇内去重价格的简单平均。
+    """
+    if not points:
+        return []
+    volume_at: Dict[float, float] = {}
+    for price, vol in points:
+        volume_at[price] = volume_at.get(price, 0.0) + (vol or 0.0)
+    prices = sorted(volume_at)
+
+    clusters = [[prices[0]]]
+    for p in prices[1:]:
+        if (p - clusters[-1][-1]) / clusters[-1][-1] * 100 < threshold_pct:
+            clusters[-1].append(p)
+        else:
+            clusters.append([p])
+
+    levels = []
+    for c in clusters:
+        total_vol = sum(volume_at[p] for p in c)
+        if volume_weighted and total_vol > 0:
+            levels.append(round(sum(p * volume_at[p] for p in c) / total_vol, 2))
+        else:
+            levels.append(round(sum(c) / len(c), 2))
+    return levels
+
+
+def calc_support_resistance(bars: List[dict], levels: int = 3, window: int = 5,
+                            threshold_pct: float = 1.5, volume_weighted: bool = False) -> SupportResistance:
     """
     计算支撑与阻力位
-    基于近期的高低点聚类
+    基于近期的高低点聚类：window 为局部极值的左右窗口，threshold_pct 为聚类误差(%)，
+    volume_weighted 为 True 时按极值 K 线成交量加权得到价位
     """
     if not bars:
         return SupportResistance()
@@ -306,34 +381,12 @@ def calc_support_resistance(bars: List[dict], levels: int = 3) -> SupportResista
     lows = [b["low"] for b in bars]
 
     # 寻找局部高点/低点
-    local_highs = []
-    local_lows = []
-    window = 5
-
-    for i in range(window, len(bars) - window):
-        h = bars[i]["high"]
-        if all(h >= bars[j]["high"] for j in range(i - window, i + window + 1) if j != i):
-            local_highs.append(h)
-
-        l = bars[i]["low"]
-        if all(l <= bars[j]["low"] for j in range(i - window, i + window + 1) if j != i):
-            local_lows.append(l)
-
-    # 聚类合并相近的价位 (误差 1.5%)
-    def cluster(prices, threshold_pct=1.5):
-        if not prices:
-            return []
-        prices = sorted(set(prices))
-        clusters = [[prices[0]]]
-        for p in prices[1:]:
-            if (p - clusters[-1][-1]) / clusters[-1][-1] * 100 < threshold_pct:
-                clusters[-1].append(p)
-            else:
-                clusters.append([p])
-        return [round(sum(c) / len(c), 2) for c in clusters]
+    local_highs = [(highs[i], bars[i].get("volume", 0)) for i in _window_extrema(highs, window, highs=True)]
+    local_lows = [(lows[i], bars[i].get("volume", 0)) for i in _window_extrema(lows, window, highs=False)]
 
-    resistance = sorted([p for p in cluster(local_highs) if p > current], reverse=False)[:levels]
-    support = sorted([p for p in cluster(local_lows) if p < current], reverse=True)[:levels]
+    resistance = sorted(p for p in _cluster_levels(local_highs, threshold_pct, volume_weighted) if p > current)[:levels]
+    support = sorted((p for p in _cluster_levels(local_lows, threshold_pct, volume_weighted) if p < current),
+                     reverse=True)[:levels]
 
     return SupportResistance(
         support_levels=support,
@@ -352,6 +405,11 @@ def calc_volume_analysis(bars: List[dict]) -> VolumeAnalysis:
 
     avg_10 = sum(volumes[-10:]) / min(10, len(volumes)) if volumes else 0
     avg_20 = sum(volumes[-20:]) / min(20, len(volumes)) if volumes else 0
+    return _volume_result(current_vol, avg_10, avg_20)
+
+
+def _volume_result(current_vol, avg_10: float, avg_20: float) -> VolumeAnalysis:
+    """由当日量与均量生成成交量分析结果"""
     ratio = current_vol / avg_10 if avg_10 > 0 else 0
 
     if ratio >= 2.0:
@@ -396,7 +454,11 @@ def calc_atr(bars: List[dict], period: int = 14) -> ATRData:
     for tr in true_ranges[period:]:
         atr = (atr * (period - 1) + tr) / period
 
-    current_price = bars[-1]["close"]
+    return _atr_result(atr, bars[-1]["close"])
+
+
+def _atr_result(atr: float, current_price: float) -> ATRData:
+    """由 ATR 数值生成波动性结果"""
     atr_pct = (atr / current_price * 100) if current_price > 0 else 0
 
     # 波动性判断
@@ -443,10 +505,14 @@ def calc_vwap(bars: List[dict]) -> VWAPData:
     # 标准差带
     variance = sum((tp - vwap) ** 2 * b["volume"] for tp, b in zip(tp_list, bars)) / cum_vol
     std = math.sqrt(variance) if variance > 0 else 0
+    return _vwap_result(vwap, std, bars[-1]["close"])
+
+
+def _vwap_result(vwap: float, std: float, current: float) -> VWAPData:
+    """由 VWAP 与成交量加权标准差生成结果"""
     upper = vwap + std
     lower = vwap - std
 
-    current = bars[-1]["close"]
     dist_pct = (current - vwap) / vwap * 100 if vwap > 0 else 0
 
     if dist_pct > 2:
@@ -570,6 +636,24 @@ def calc_technical_score(ma: MovingAverages, rsi: RSIData, macd: MACDData,
     return score, signal, observations
 
 
+def _compute_indicators(bars: List[dict], include_vwap: bool = True):
+    """
+    一次性计算常规指标，返回 (ma, rsi, macd, bb, vol, atr, vwap)。
+    优先使用 NumPy 向量化引擎；未安装 numpy 时回退到本模块的纯 Python 实现。
+    """
+    try:
+        from indicator_engine import compute_indicators
+    except ImportError:
+        closes = [b["close"] for b in bars]
+        return (
+            calc_moving_averages(closes), calc_rsi(closes), calc_macd(closes),
+            calc_bollinger_bands(closes), calc_volume_analysis(bars), calc_atr(bars),
+            calc_vwap(bars) if include_vwap else VWAPData(),
+        )
+    s = compute_indicators(bars, include_vwap=include_vwap)
+    return s.ma, s.rsi, s.macd, s.bollinger, s.volume, s.atr, s.vwap
+
+
 def analyze_symbol(client, symbol: str, period: str = "1 Y", bar_size: str = "1 day") -> Optional[TechnicalSummary]:
     """
     对单只股票执行完整技术分析
@@ -581,14 +665,8 @@ def analyze_symbol(client, symbol: str, period: str = "1 Y", bar_size: str = "1
     closes = [b["close"] for b in bars]
     current = closes[-1]
 
-    ma = calc_moving_averages(closes)
-    rsi = calc_rsi(closes)
-    macd = calc_macd(closes)
-    bb = calc_bollinger_bands(closes)
+    ma, rsi, macd, bb, vol, atr, vwap = _compute_indicators(bars)
     sr = calc_support_resistance(bars)
-    vol = calc_volume_analysis(bars)
-    atr = calc_atr(bars)
-    vwap = calc_vwap(bars)
 
     score, signal, observations = calc_technical_score(ma, rsi, macd, bb, vol, current)
 
@@ -609,16 +687,20 @@ def analyze_symbol(client, symbol: str, period: str = "1 Y", bar_size: str = "1
     )
 
 
-def analyze_symbols_batch(client, symbols: List[str], period: str = "1 Y", bar_size: str = "1 day") -> Dict[str, Optional[TechnicalSummary]]:
+def analyze_symbols_batch(client, symbols: List[str], period: str = "1 Y", bar_size: str = "1 day",
+                          prefetched: Optional[Dict[str, List[dict]]] = None) -> Dict[str, Optional[TechnicalSummary]]:
     """
     批量并发执行技术分析
-    直接利用 client.get_historical_data_batch 以发挥异步效能
+    直接利用 client.get_historical_data_batch 以发挥异步效能；
+    prefetched 为调用方已批量拉取的 {symbol: bars} 时直接复用，不再请求
     """
     if not symbols:
         return {}
         
     batch_bars = getattr(client, "get_historical_data_batch", None)
-    if batch_bars:
+    if prefetched is not None:
+        all_bars = prefetched
+    elif batch_bars:
         all_bars = client.get_historical_data_batch(symbols, duration=period, bar_size=bar_size)
     else:
         # Fallback to sequential if client is outdated
@@ -634,13 +716,8 @@ def analyze_symbols_batch(client, symbols: List[str], period: str = "1 Y", bar_s
         closes = [b["close"] for b in bars]
         current = closes[-1]
 
-        ma = calc_moving_averages(closes)
-        rsi = calc_rsi(closes)
-        macd = calc_macd(closes)
-        bb = calc_bollinger_bands(closes)
+        ma, rsi, macd, bb, vol, atr, _ = _compute_indicators(bars, include_vwap=False)
         sr = calc_support_resistance(bars)
-        vol = calc_volume_analysis(bars)
-        atr = calc_atr(bars)
 
         score, signal, observations = calc_technical_score(ma, rsi, macd, bb, vol, current)
 
@@ -702,11 +779,7 @@ def analyze_multi_timeframe(client, symbol: str) -> Optional[MultiTimeframeSumma
             bars = client.get_historical_data(symbol, duration=duration, bar_size=bar_size)
             if bars and len(bars) >= 20:
                 closes = [b["close"] for b in bars]
-                ma = calc_moving_averages(closes)
-                rsi = calc_rsi(closes)
-                macd = calc_macd(closes)
-                bb = calc_bollinger_bands(closes)
-                vol = calc_volume_analysis(bars)
+                ma, rsi, macd, bb, vol, _, _ = _compute_indicators(bars, include_vwap=False)
                 current = closes[-1]
                 score, signal, _ = calc_technical_score(ma, rsi, macd, bb, vol, current)
                 results[tf_name] = {
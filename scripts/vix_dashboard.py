@@ -37,12 +37,14 @@ class VIXDashboard:
 
 # ─── 分析函数 ─────────────────────────────────────────────────
 
-def analyze_vix(client) -> Optional[VIXDashboard]:
+def analyze_vix(client, bars: Optional[List[dict]] = None) -> Optional[VIXDashboard]:
     """
     VIX 恐慌指数仪表盘分析
+    bars: 已预取的 VIX 1 年日线（如日报的批量拉取），为空时自行获取
     """
     # 获取 VIX 1 年日线数据
-    bars = client.get_historical_data("VIX", duration="1 Y", bar_size="1 day")
+    if bars is None:
+        bars = client.get_historical_data("VIX", duration="1 Y", bar_size="1 day")
     if not bars or len(bars) < 20:
         return None
 